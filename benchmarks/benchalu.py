@@ -0,0 +1,130 @@
+"""Microbenchmark comparing the table-driven ALU in core/alu.py against the
+   ctypes arithmetic the CPU used to do. Run with:
+
+       python benchmarks/benchalu.py
+"""
+
+import os
+import sys
+import timeit
+from ctypes import c_uint8
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "core"))
+
+import constants as const
+import cpu as CPU
+
+# Iterations per timing run, and runs per op (the best run is reported)
+NUMBER = 200000
+REPEAT = 5
+
+
+class LegacyALU(object):
+    """The ctypes based flag and arithmetic helpers, as they were before
+       the lookup tables, kept here as the benchmark baseline."""
+
+    def __init__(self):
+        self.a = 0x00
+        self.x = 0x00
+        self.p = 0b00110100
+
+    def set_z(self, value):
+        self.p &= ~(const.FLAG_ZERO)
+        self.p |= const.FLAG_ZERO if value == 0b0 else 0b0
+
+    def set_n(self, value):
+        self.p &= ~(const.FLAG_NEGATIVE)
+        self.p |= const.FLAG_NEGATIVE if value >= 0x80 else 0b0
+
+    def set_zn(self, value):
+        self.set_z(value)
+        self.set_n(value)
+
+    def adc(self, arg):
+        result = self.a + arg + (self.p & const.FLAG_CARRY)
+        uint_result = c_uint8(result).value
+
+        self.p &= ~(const.FLAG_CARRY | const.FLAG_OVERFLOW)
+        self.p |= result > 0xff
+
+        sign_flipped = ~(self.a ^ arg) & (self.a ^ result) & 0x80 == 0x80
+        self.p |= const.FLAG_OVERFLOW if sign_flipped else 0b0
+
+        self.set_zn(uint_result)
+        self.a = uint_result
+
+    def sbc(self, arg):
+        self.adc(arg ^ 0xff)
+
+    def _cmp(self, arg):
+        result = self.a - arg
+        uint_result = c_uint8(result).value
+
+        self.p &= ~(const.FLAG_CARRY)
+        self.p |= result >= 0
+
+        self.p &= ~(const.FLAG_ZERO)
+        self.p |= const.FLAG_ZERO if not result else 0b0
+
+        self.p &= ~(const.FLAG_NEGATIVE)
+        self.p |= const.FLAG_NEGATIVE if uint_result >= 0x80 else 0b0
+
+    def inx(self):
+        result = self.x + 1
+        uint_result = c_uint8(result).value
+
+        self.set_zn(uint_result)
+        self.x = uint_result
+
+    def asl(self):
+        arg = self.a
+        result = arg << 1
+        uint_result = c_uint8(result).value
+
+        self.p &= ~(const.FLAG_CARRY)
+        self.p |= 0b10000000 & arg > 0
+
+        self.set_zn(uint_result)
+        self.a = uint_result
+
+    def lda(self, arg):
+        self.a = arg
+        self.set_zn(self.a)
+
+
+# name, statement run against each implementation
+OPS = [
+    ("adc", "alu.adc(0x5a)"),
+    ("sbc", "alu.sbc(0x5a)"),
+    ("cmp", "alu._cmp(0x5a)"),
+    ("inx", "alu.inx()"),
+    ("asl", "alu.asl()"),
+    ("lda", "alu.lda(0x80)")
+]
+
+
+def best(statement, alu):
+    """Nanoseconds per call for the fastest of REPEAT runs"""
+
+    runs = timeit.repeat(statement, globals={"alu": alu},
+                         number=NUMBER, repeat=REPEAT)
+
+    return min(runs) / NUMBER * 1e9
+
+
+def main():
+    legacy = LegacyALU()
+    table = CPU.create_cpu()
+
+    print("%-6s %12s %12s %9s" % ("op", "ctypes ns", "table ns", "speedup"))
+
+    for name, statement in OPS:
+        before = best(statement, legacy)
+        after = best(statement, table)
+
+        print("%-6s %12.1f %12.1f %8.2fx" % (name, before, after,
+                                             before / after))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,430 @@
+"""Benchmark suite for catching performance regressions. It times every
+   documented opcode, every addressing mode, memory reads and writes across
+   the bus's different kinds of pages, and whole-console instructions and
+   frames per second on a couple of generated homebrew workloads (plus any
+   ROMs given with --rom). Run with:
+
+       python benchmarks/benchsuite.py --output results.json
+       python benchmarks/benchsuite.py --baseline results.json
+
+   The second form reruns the suite and flags every benchmark that got
+   slower than the baseline by more than --threshold, exiting non-zero if
+   any did. --input compares an existing results file instead of rerunning.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "core"))
+
+import cpu as CPU
+import nes
+import rom as cart
+from instructions import INSTRUCTIONS, MODE_BYTES
+
+# Version of the results file layout
+FORMAT = 1
+
+# Units, and whether a bigger number is better for each
+UNIT_NS = "ns"
+UNIT_IPS = "instructions/s"
+UNIT_FPS = "frames/s"
+HIGHER_IS_BETTER = {UNIT_NS: False, UNIT_IPS: True, UNIT_FPS: True}
+
+# Calls per timing run, runs per benchmark (the best run is kept), and
+# frames per end-to-end run; --quick divides them all by QUICK
+NUMBER = 20000
+REPEAT = 5
+FRAMES = 30
+QUICK = 10
+
+# Where opcode benchmarks execute from, and the operand bytes they get:
+# zero page $10, absolute $0310, with the pointer at $10 aimed at $0300
+ORIGIN = 0x0200
+OPERANDS = (0x10, 0x03)
+
+# Bus accesses timed, as (name, address)
+READS = [
+    ("ram", 0x0010), ("ram_mirror", 0x1810), ("io", 0x2002),
+    ("io_mirror", 0x3ffa), ("apu_io", 0x4015), ("prg_ram", 0x6000),
+    ("prg_rom", 0x8000)
+]
+
+WRITES = [
+    ("ram", 0x0010), ("ram_mirror", 0x1810), ("io", 0x2003),
+    ("io_mirror", 0x3ffb), ("apu_io", 0x4015), ("prg_ram", 0x6000),
+    ("prg_rom", 0x8000)
+]
+
+### Workloads ###
+
+# A checksum loop over RAM that touches indirect, indexed and zero page
+# modes and a subroutine, with rendering and NMIs on
+CPU_LOOP = [
+    0x78, 0xd8, 0xa2, 0xff, 0x9a,         # SEI, CLD, LDX #$ff, TXS
+    0xa9, 0x80, 0x8d, 0x00, 0x20,         # LDA #$80, STA $2000
+    0xa9, 0x1e, 0x8d, 0x01, 0x20,         # LDA #$1e, STA $2001
+    0xa9, 0x00, 0x85, 0x20,               # LDA #$00, STA $20
+    0xa9, 0x03, 0x85, 0x21,               # LDA #$03, STA $21
+    0xa0, 0x00,                           # main: LDY #$00
+    0xb1, 0x20,                           # loop: LDA ($20),Y
+    0x18, 0x65, 0x30, 0x85, 0x30,         # CLC, ADC $30, STA $30
+    0xb9, 0x00, 0x04,                     # LDA $0400,Y
+    0x49, 0x5a,                           # EOR #$5a
+    0x99, 0x00, 0x04,                     # STA $0400,Y
+    0x20, 0x33, 0x80,                     # JSR sub
+    0xc8, 0xd0, 0xeb,                     # INY, BNE loop
+    0xe6, 0x31,                           # INC $31
+    0x4c, 0x17, 0x80,                     # JMP main
+    0xa6, 0x31, 0xe8, 0x86, 0x32,         # sub: LDX $31, INX, STX $32
+    0x26, 0x33, 0x60,                     # ROL $33, RTS
+    0x48, 0xe6, 0x10, 0x68, 0x40          # nmi: PHA, INC $10, PLA, RTI
+]
+
+# The classic wait for vblank: polls $2002 with rendering on, so most of
+# the time goes on I/O reads and the PPU catching up
+VBLANK_POLL = [
+    0x78, 0xd8, 0xa2, 0xff, 0x9a,         # SEI, CLD, LDX #$ff, TXS
+    0xa9, 0x1e, 0x8d, 0x01, 0x20,         # LDA #$1e, STA $2001
+    0x2c, 0x02, 0x20,                     # wait: BIT $2002
+    0x10, 0xfb,                           # BPL wait
+    0xe6, 0x12,                           # INC $12
+    0x4c, 0x0a, 0x80,                     # JMP wait
+    0x40                                  # nmi: RTI
+]
+
+# name: (program, NMI handler offset)
+WORKLOADS = {
+    "cpu_loop": (CPU_LOOP, 0x3b),
+    "vblank_poll": (VBLANK_POLL, 0x14)
+}
+
+
+def workload_image(program, nmi):
+    """An NROM image running program from 0x8000, with busy CHR so that
+       rendering has pixels to draw"""
+
+    prg = bytearray(cart.PRG_BANK_SIZE)
+    prg[0:len(program)] = bytes(program)
+    prg[0x3ffa:0x3ffe] = bytes([nmi, 0x80, 0x00, 0x80])
+
+    chr_rom = bytes(range(256)) * (cart.CHR_BANK_SIZE // 256)
+
+    return cart.build_ines(prg, chr_rom)
+
+
+def workload_images(paths):
+    """name: iNES image for every built-in workload and ROM path given"""
+
+    images = {name: workload_image(*workload)
+              for name, workload in WORKLOADS.items()}
+
+    for path in paths:
+        with open(path, "rb") as rom_file:
+            images[os.path.basename(path)] = rom_file.read()
+
+    return images
+
+
+def console(image, block_cache=False, idle_skipping=False):
+    """A console with image inserted"""
+
+    machine = nes.create_nes()
+    machine.insert_rom(cart.load_image(image))
+
+    if block_cache:
+        machine.cpu.enable_block_cache()
+
+    if idle_skipping:
+        machine.enable_idle_skipping()
+
+    return machine
+
+### Timing ###
+
+
+def best(statement, namespace, number, repeat):
+    """Nanoseconds per run of statement, for the fastest of repeat runs"""
+
+    runs = timeit.repeat(statement, globals=namespace,
+                         number=number, repeat=repeat)
+
+    return min(runs) / number * 1e9
+
+
+def opcode_cpu():
+    """A bare CPU with RAM set up for the opcode benchmarks"""
+
+    cpu = CPU.create_cpu()
+    cpu.memory.store(0x10, 0x00)
+    cpu.memory.store(0x11, 0x03)
+
+    return cpu
+
+
+def bench_opcodes(results, number, repeat):
+    """Nanoseconds per execution of each documented opcode, including
+       resetting the PC before it"""
+
+    cpu = opcode_cpu()
+
+    for opcode in sorted(INSTRUCTIONS):
+        mode = INSTRUCTIONS[opcode][0]
+        cpu.memory.store(ORIGIN, opcode)
+
+        for offset, operand in enumerate(OPERANDS[:MODE_BYTES[mode] - 1]):
+            cpu.memory.store(ORIGIN + 1 + offset, operand)
+
+        name = "opcode/%02x %s %s" % (opcode, cpu.opcodes[opcode].__name__
+                                      .strip("_").upper(), mode)
+        namespace = {"cpu": cpu, "execute": cpu.dispatch[opcode],
+                     "origin": ORIGIN}
+
+        results[name] = (best("cpu.pc = origin; execute()", namespace,
+                              number, repeat), UNIT_NS)
+
+
+def bench_modes(results, number, repeat):
+    """Nanoseconds per effective address resolved in each addressing mode
+       that has a resolver"""
+
+    cpu = opcode_cpu()
+
+    for offset, operand in enumerate(OPERANDS):
+        cpu.memory.store(ORIGIN + 1 + offset, operand)
+
+    for mode, resolve in sorted(cpu.addressing.items()):
+        namespace = {"resolve": resolve, "operand": ORIGIN + 1}
+        results["mode/" + mode] = (best("resolve(operand)", namespace,
+                                        number, repeat), UNIT_NS)
+
+
+def bench_memory(results, number, repeat):
+    """Nanoseconds per bus access for the checked and unchecked paths
+       through each kind of page, on a console with a cartridge in"""
+
+    memory = console(workload_image(*WORKLOADS["cpu_loop"])).memory
+
+    for name, address in READS:
+        namespace = {"memory": memory, "loc": address}
+
+        for method in ("read", "load"):
+            results["memory/%s/%s" % (method, name)] = (best(
+                "memory.%s(loc)" % method, namespace, number, repeat),
+                UNIT_NS)
+
+    for name, address in WRITES:
+        namespace = {"memory": memory, "loc": address}
+
+        for method in ("write", "store"):
+            results["memory/%s/%s" % (method, name)] = (best(
+                "memory.%s(loc, 0)" % method, namespace, number, repeat),
+                UNIT_NS)
+
+
+def count_instructions(image, frames):
+    """The instructions a console executes over its first frames, counted
+       by wrapping every dispatch entry"""
+
+    machine = console(image)
+    dispatch = machine.cpu.dispatch
+    count = [0]
+
+    def counted(execute):
+        def wrapper():
+            count[0] += 1
+            execute()
+
+        return wrapper
+
+    dispatch[:] = [counted(execute) for execute in dispatch]
+
+    for frame in range(frames):
+        machine.run_frame()
+
+    return count[0]
+
+
+def time_frames(image, frames, repeat, block_cache, idle_skipping):
+    """Seconds taken by the fastest of repeat runs over a console's first
+       frames"""
+
+    runs = []
+
+    for run in range(repeat):
+        machine = console(image, block_cache, idle_skipping)
+        start = time.perf_counter()
+
+        for frame in range(frames):
+            machine.run_frame()
+
+        runs.append(time.perf_counter() - start)
+
+    return min(runs)
+
+
+def bench_workloads(results, images, frames, repeat):
+    """Instructions and frames per second for every workload, interpreted,
+       through the block cache and with idle loops skipped. Emulation is
+       deterministic, so the instructions counted in one pass are the ones
+       timed in the others; with idle loops skipped that makes ips the rate
+       of instructions emulated, not executed."""
+
+    for name, image in sorted(images.items()):
+        instructions = count_instructions(image, frames)
+
+        for runner, block_cache, idle_skipping in (
+                ("interpreter", False, False), ("block_cache", True, False),
+                ("idle_skipping", False, True)):
+            seconds = time_frames(image, frames, repeat, block_cache,
+                                  idle_skipping)
+            prefix = "workload/%s/%s/" % (name, runner)
+
+            results[prefix + "ips"] = (instructions / seconds, UNIT_IPS)
+            results[prefix + "fps"] = (frames / seconds, UNIT_FPS)
+
+### Results ###
+
+
+def run_suite(roms=(), quick=False, only=None):
+    """Runs every benchmark whose name starts with only (all of them by
+       default), returning {name: (value, unit)}"""
+
+    scale = QUICK if quick else 1
+    number, frames = NUMBER // scale, max(FRAMES // scale, 1)
+    repeat = max(REPEAT // scale, 1)
+    groups = [
+        ("opcode/", lambda results: bench_opcodes(results, number, repeat)),
+        ("mode/", lambda results: bench_modes(results, number, repeat)),
+        ("memory/", lambda results: bench_memory(results, number, repeat)),
+        ("workload/", lambda results: bench_workloads(
+            results, workload_images(roms), frames, repeat))
+    ]
+    results = {}
+
+    for prefix, bench in groups:
+        if only is None or prefix.startswith(only) or only.startswith(prefix):
+            bench(results)
+
+    if only is not None:
+        results = {name: result for name, result in results.items()
+                   if name.startswith(only)}
+
+    return results
+
+
+def save_results(path, results):
+
+    document = {
+        "format": FORMAT,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": {name: {"value": value, "unit": unit}
+                    for name, (value, unit) in results.items()}
+    }
+
+    with open(path, "w") as results_file:
+        json.dump(document, results_file, indent=1, sort_keys=True)
+
+
+def load_results(path):
+
+    with open(path) as results_file:
+        document = json.load(results_file)
+
+    if document.get("format") != FORMAT:
+        raise ValueError("%s is not a version %d results file"
+                         % (path, FORMAT))
+
+    return {name: (result["value"], result["unit"])
+            for name, result in document["results"].items()}
+
+
+def slowdown(baseline, current, unit):
+    """How much slower current is than baseline, as a fraction: 0.1 is 10%
+       slower, negative is faster"""
+
+    if HIGHER_IS_BETTER[unit]:
+        return baseline / current - 1
+
+    return current / baseline - 1
+
+
+def compare(baseline, results, threshold):
+    """Returns [(name, baseline, current, unit, slowdown)] for every
+       benchmark in both that slowed down by more than threshold"""
+
+    regressions = []
+
+    for name in sorted(set(baseline) & set(results)):
+        value, unit = results[name]
+        change = slowdown(baseline[name][0], value, unit)
+
+        if change > threshold:
+            regressions.append((name, baseline[name][0], value, unit,
+                                change))
+
+    return regressions
+
+
+def print_results(results, baseline=None):
+
+    for name in sorted(results):
+        value, unit = results[name]
+        line = "%-48s %14.1f %-14s" % (name, value, unit)
+
+        if baseline is not None and name in baseline:
+            line += " %+7.1f%%" % (slowdown(baseline[name][0], value,
+                                            unit) * 100)
+
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--input", help="compare this results file instead "
+                        "of running the suite")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="slowdown that counts as a regression "
+                        "(default 0.25, i.e. 25%%)")
+    parser.add_argument("--rom", action="append", default=[],
+                        help="also run this ROM as a workload")
+    parser.add_argument("--only", help="only run benchmarks whose names "
+                        "start with this, e.g. memory/ or opcode/69")
+    parser.add_argument("--quick", action="store_true",
+                        help="fewer iterations, for smoke testing")
+    args = parser.parse_args(argv)
+
+    if args.input:
+        results = load_results(args.input)
+    else:
+        results = run_suite(args.rom, args.quick, args.only)
+
+    if args.output:
+        save_results(args.output, results)
+
+    baseline = load_results(args.baseline) if args.baseline else None
+    print_results(results, baseline)
+
+    if baseline is None:
+        return 0
+
+    regressions = compare(baseline, results, args.threshold)
+
+    for name, before, after, unit, change in regressions:
+        print("REGRESSION %s: %.1f -> %.1f %s (%.1f%% slower)"
+              % (name, before, after, unit, change * 100))
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
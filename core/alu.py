@@ -0,0 +1,74 @@
+"""This module precomputes the results and status flags of the 6502's
+   arithmetic so that the CPU can look them up instead of working them out
+   (and allocating ctypes integers) on every instruction."""
+
+import constants as const
+
+# Status bits that ZN_TABLE and the ADC/SBC tables produce
+MASK_ZN = const.FLAG_ZERO | const.FLAG_NEGATIVE
+MASK_CZVN = const.FLAG_CARRY | const.FLAG_ZERO | const.FLAG_OVERFLOW | \
+    const.FLAG_NEGATIVE
+
+# Status with the above bits cleared, for use as "p & KEEP_..."
+KEEP_ZN = 0xff & ~MASK_ZN
+KEEP_CZVN = 0xff & ~MASK_CZVN
+
+# As left by shifts and compares, and by BIT, respectively
+KEEP_CZN = KEEP_ZN & ~(const.FLAG_CARRY)
+KEEP_ZVN = KEEP_ZN & ~(const.FLAG_OVERFLOW)
+
+
+def build_zn_table():
+    """Zero and negative flags for every byte value"""
+
+    table = bytearray(0x100)
+
+    for value in range(0x100):
+        table[value] = (const.FLAG_ZERO if value == 0 else 0) | \
+            (value & const.FLAG_NEGATIVE)
+
+    return table
+
+
+def build_adc_tables(zn):
+    """Result and flags of A + M + C for every A, M and carry. Both tables
+       are indexed by A << 9 | M << 1 | C."""
+
+    results = bytearray(0x20000)
+    flags = bytearray(0x20000)
+
+    for a in range(0x100):
+        for carry in (0, 1):
+            totals = [a + arg + carry for arg in range(0x100)]
+            row = slice(a << 9 | carry, (a + 1) << 9, 2)
+
+            results[row] = bytes(total & 0xff for total in totals)
+            flags[row] = bytes(
+                zn[total & 0xff] | (total > 0xff) |
+                # overflow when both inputs share a sign the result lacks
+                (~(a ^ arg) & (a ^ total) & 0x80) >> 1
+                for arg, total in enumerate(totals))
+
+    return results, flags
+
+
+def build_sbc_tables(adc_results, adc_flags):
+    """Result and flags of A - M - (1 - C), indexed like the ADC tables.
+       Subtraction is addition of the inverted operand, so each row is the
+       matching ADC row with M running backwards."""
+
+    results = bytearray(0x20000)
+    flags = bytearray(0x20000)
+
+    for a in range(0x100):
+        for carry in (0, 1):
+            row = slice(a << 9 | carry, (a + 1) << 9, 2)
+            results[row] = adc_results[row][::-1]
+            flags[row] = adc_flags[row][::-1]
+
+    return results, flags
+
+
+ZN_TABLE = build_zn_table()
+ADC_RESULT, ADC_FLAGS = build_adc_tables(ZN_TABLE)
+SBC_RESULT, SBC_FLAGS = build_sbc_tables(ADC_RESULT, ADC_FLAGS)
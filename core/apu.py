@@ -0,0 +1,965 @@
+"""This module defines the NES Audio Processing Unit: two pulse channels, a
+   triangle, noise and delta modulation (DMC) channel, and the frame counter
+   that clocks their envelopes, sweeps and length counters.
+
+   Like the PPU, the APU runs behind the CPU. Writes to the pulse, triangle
+   and noise registers aren't applied when they happen; they are logged
+   with the CPU cycle they happened on, and replayed in order when the APU
+   is caught up. Between one write or frame counter step and the next
+   every channel holds still, so each stretch is synthesized as one block
+   with NumPy: the sample times are an array, and each channel's output is
+   a vectorized function of them. Only things the CPU can see sooner --
+   $4015, $4017 and the DMC registers -- sync the APU on the spot.
+
+   Nothing is synthesized while nothing is listening; the channels' timers
+   are just moved on, so $4015 and the frame and DMC IRQs stay exact at
+   next to no cost. Output is point sampled from the channels and mixed
+   through the nonlinear mixer's lookup tables, without the console's
+   filters, and handed to an AudioStream in fixed-size blocks.
+
+   DMC sample fetches read memory with peek() and don't stall the CPU."""
+
+import queue
+import struct
+import threading
+import wave
+import numpy as np
+import constants as const
+import scheduler
+
+# Length counter loads, indexed by the top five bits of $4003/7/B/F
+LENGTHS = (
+    10, 254, 20, 2, 40, 4, 80, 6, 160, 8, 60, 10, 14, 12, 26, 14,
+    12, 16, 24, 18, 48, 20, 96, 22, 192, 24, 72, 26, 16, 28, 32, 30
+)
+
+# Pulse waveforms, one row per duty setting
+DUTY_CYCLES = np.array([
+    (0, 1, 0, 0, 0, 0, 0, 0),
+    (0, 1, 1, 0, 0, 0, 0, 0),
+    (0, 1, 1, 1, 1, 0, 0, 0),
+    (1, 0, 0, 1, 1, 1, 1, 1)
+], dtype=np.intp)
+
+# Triangle output for each of its 32 steps
+TRIANGLE_STEPS = np.array(list(range(15, -1, -1)) + list(range(16)),
+                          dtype=np.intp)
+
+# Noise and DMC timer periods, in CPU cycles
+NOISE_PERIODS = (
+    4, 8, 16, 32, 64, 96, 128, 160, 202, 254, 380, 508, 762, 1016, 2034, 4068
+)
+DMC_PERIODS = (
+    428, 380, 340, 320, 286, 254, 226, 214, 190, 160, 142, 128, 106, 84, 72,
+    54
+)
+
+# Frame counter steps for each mode, as (CPU cycle into the sequence,
+# clocks half frame units, raises IRQ), and each sequence's length
+FRAME_STEPS = (
+    ((7457, False, False), (14913, True, False), (22371, False, False),
+     (29829, True, True)),
+    ((7457, False, False), (14913, True, False), (22371, False, False),
+     (37281, True, False))
+)
+FRAME_LENGTHS = (29830, 37282)
+
+# The mixer's output for each pulse sum, and for each 3 * triangle +
+# 2 * noise + DMC
+PULSE_MIX = np.array([0.0] + [95.52 / (8128.0 / total + 100)
+                              for total in range(1, 31)])
+TND_MIX = np.array([0.0] + [163.67 / (24329.0 / total + 100)
+                            for total in range(1, 203)])
+
+# Samples per block handed to the output, and blocks the stream can hold
+BLOCK_SAMPLES = 1024
+STREAM_BLOCKS = 16
+
+# Noise LFSR tap for each mode: {mode: (orbit of each state, position of
+# each state in its orbit, [orbits as arrays of states])}, built on demand
+NOISE_TAPS = (1, 6)
+NOISE_ORBITS = {}
+
+
+def create_apu():
+    """Returns a new instance of an APU for use outside of this module."""
+    return APU()
+
+
+def noise_orbits(mode):
+    """The cycles the noise shift register goes through in a mode. Each
+       step can be undone, so every state lies on exactly one cycle, and
+       n steps on is just n places along it."""
+
+    if mode not in NOISE_ORBITS:
+        tap = NOISE_TAPS[mode]
+        orbit_of = [0] * 0x8000
+        positions = [0] * 0x8000
+        orbits = [np.zeros(1, dtype=np.intp)]
+
+        for start in range(1, 0x8000):
+            if orbit_of[start]:
+                continue
+
+            states = []
+            state = start
+
+            while True:
+                orbit_of[state] = len(orbits)
+                positions[state] = len(states)
+                states.append(state)
+                state = state >> 1 | ((state ^ state >> tap) & 1) << 14
+
+                if state == start:
+                    break
+
+            orbits.append(np.array(states, dtype=np.intp))
+
+        NOISE_ORBITS[mode] = (orbit_of, positions, orbits)
+
+    return NOISE_ORBITS[mode]
+
+
+def pack_state(parts):
+    """Packs the state_fields of each object with its state_layout"""
+
+    return b"".join(part.state_layout.pack(*[
+        getattr(part, name) for name in part.state_fields])
+        for part in parts)
+
+
+def unpack_state(parts, state):
+    """Reverses pack_state(), returning the bytes used"""
+
+    offset = 0
+
+    for part in parts:
+        values = part.state_layout.unpack_from(state, offset)
+        offset += part.state_layout.size
+
+        for name, value in zip(part.state_fields, values):
+            setattr(part, name, value)
+
+    return offset
+
+
+def timer_clocks(countdown, period, offsets):
+    """How many times a timer due in countdown cycles has clocked by each
+       offset, inclusive"""
+
+    return np.where(offsets < countdown, 0,
+                    (offsets - countdown) // period + 1).astype(np.intp)
+
+
+def advance_timer(countdown, period, cycles):
+    """Runs a timer for some cycles, returning (clocks, new countdown)"""
+
+    if cycles <= countdown:
+        return 0, countdown - cycles
+
+    clocks = (cycles - 1 - countdown) // period + 1
+
+    return clocks, countdown + clocks * period - cycles
+
+
+class Channel(object):
+    """The length counter and envelope the tone channels share."""
+
+    state_fields = ("enabled", "length", "halt", "constant",
+                    "volume_setting", "envelope_start", "envelope_divider",
+                    "decay", "countdown")
+    state_layout = struct.Struct("<?B??B?BBI")
+
+    def __init__(self):
+        self.enabled = False
+        self.length = 0
+
+        # $4000 bit 5 both loops the envelope and halts the length counter
+        self.halt = False
+        self.constant = False
+        self.volume_setting = 0
+
+        self.envelope_start = False
+        self.envelope_divider = 0
+        self.decay = 0
+
+        # Cycles until the timer next clocks
+        self.countdown = 0
+
+    def load_length(self, data):
+        """Loads the length counter from the top bits of a register"""
+
+        if self.enabled:
+            self.length = LENGTHS[data >> 3]
+
+    def playing(self):
+        """Whether the length counter is still running, for $4015"""
+
+        return bool(self.length)
+
+    def set_enabled(self, enabled):
+        """$4015: disabling a channel silences it at once"""
+
+        self.enabled = enabled
+
+        if not enabled:
+            self.length = 0
+
+    def write_envelope(self, data):
+        """$4000/4/C: length halt, constant volume and volume or period"""
+
+        self.halt = bool(data & 0x20)
+        self.constant = bool(data & 0x10)
+        self.volume_setting = data & 0x0f
+
+    def quarter_frame(self):
+        """Clocks the envelope"""
+
+        if self.envelope_start:
+            self.envelope_start = False
+            self.decay = 15
+            self.envelope_divider = self.volume_setting
+        elif self.envelope_divider == 0:
+            self.envelope_divider = self.volume_setting
+
+            if self.decay:
+                self.decay -= 1
+            elif self.halt:
+                self.decay = 15
+        else:
+            self.envelope_divider -= 1
+
+    def half_frame(self):
+        """Clocks the length counter"""
+
+        if self.length and not self.halt:
+            self.length -= 1
+
+    def volume(self):
+        """The envelope's output"""
+
+        return self.volume_setting if self.constant else self.decay
+
+
+class Pulse(Channel):
+    """A square wave with four duty cycles and a frequency sweep."""
+
+    state_fields = Channel.state_fields + (
+        "duty", "timer", "step", "sweep_enabled", "sweep_period",
+        "sweep_negate", "sweep_shift", "sweep_reload", "sweep_divider")
+    state_layout = struct.Struct("<?B??B?BBIBHB?B?B?B")
+
+    def __init__(self, ones_complement):
+        super().__init__()
+
+        # The first pulse channel's sweep subtracts one more when negating
+        self.ones_complement = ones_complement
+
+        self.duty = 0
+        self.timer = 0
+        self.step = 0
+
+        self.sweep_enabled = False
+        self.sweep_period = 0
+        self.sweep_negate = False
+        self.sweep_shift = 0
+        self.sweep_reload = False
+        self.sweep_divider = 0
+
+    def write(self, register, data):
+        if register == 0:
+            self.duty = data >> 6
+            self.write_envelope(data)
+        elif register == 1:
+            self.sweep_enabled = bool(data & 0x80)
+            self.sweep_period = data >> 4 & 0x07
+            self.sweep_negate = bool(data & 0x08)
+            self.sweep_shift = data & 0x07
+            self.sweep_reload = True
+        elif register == 2:
+            self.timer = self.timer & 0x700 | data
+        else:
+            self.timer = self.timer & 0xff | (data & 0x07) << 8
+            self.load_length(data)
+            self.step = 0
+            self.envelope_start = True
+
+    def sweep_target(self):
+        """The period the sweep unit would move the timer to"""
+
+        change = self.timer >> self.sweep_shift
+
+        if self.sweep_negate:
+            return self.timer - change - self.ones_complement
+
+        return self.timer + change
+
+    def half_frame(self):
+        """Clocks the length counter and the sweep"""
+
+        super().half_frame()
+
+        if self.sweep_divider == 0 and self.sweep_enabled and \
+                self.sweep_shift and not self.muted():
+            self.timer = max(0, self.sweep_target())
+
+        if self.sweep_divider == 0 or self.sweep_reload:
+            self.sweep_divider = self.sweep_period
+            self.sweep_reload = False
+        else:
+            self.sweep_divider -= 1
+
+    def muted(self):
+        """Whether the timer is too short, or the sweep would overflow it"""
+
+        return self.timer < 8 or self.sweep_target() > 0x7ff
+
+    def run(self, cycles, offsets):
+        period = 2 * (self.timer + 1)
+        output = None
+
+        if offsets is not None:
+            volume = 0 if not self.length or self.muted() else self.volume()
+
+            if volume:
+                steps = self.step + timer_clocks(self.countdown, period,
+                                                 offsets)
+                output = DUTY_CYCLES[self.duty][steps & 7] * volume
+            else:
+                output = np.zeros(len(offsets), dtype=np.intp)
+
+        clocks, self.countdown = advance_timer(self.countdown, period,
+                                               cycles)
+        self.step = (self.step + clocks) & 7
+
+        return output
+
+
+class Triangle(Channel):
+    """A 32-step triangle wave gated by a linear counter."""
+
+    state_fields = Channel.state_fields + (
+        "timer", "step", "linear", "linear_setting", "linear_reload")
+    state_layout = struct.Struct("<?B??B?BBIHBBB?")
+
+    def __init__(self):
+        super().__init__()
+
+        self.timer = 0
+        self.step = 0
+
+        self.linear = 0
+        self.linear_setting = 0
+        self.linear_reload = False
+
+    def write(self, register, data):
+        if register == 0:
+            # the control bit doubles as the length counter halt
+            self.halt = bool(data & 0x80)
+            self.linear_setting = data & 0x7f
+        elif register == 2:
+            self.timer = self.timer & 0x700 | data
+        elif register == 3:
+            self.timer = self.timer & 0xff | (data & 0x07) << 8
+            self.load_length(data)
+            self.linear_reload = True
+
+    def quarter_frame(self):
+        """Clocks the linear counter"""
+
+        if self.linear_reload:
+            self.linear = self.linear_setting
+        elif self.linear:
+            self.linear -= 1
+
+        if not self.halt:
+            self.linear_reload = False
+
+    def run(self, cycles, offsets):
+        period = self.timer + 1
+
+        # periods this short are ultrasonic, and only add a pop if played
+        if not self.length or not self.linear or self.timer < 2:
+            if offsets is None:
+                return None
+
+            return np.full(len(offsets), TRIANGLE_STEPS[self.step],
+                           dtype=np.intp)
+
+        output = None
+
+        if offsets is not None:
+            steps = self.step + timer_clocks(self.countdown, period, offsets)
+            output = TRIANGLE_STEPS[steps & 31]
+
+        clocks, self.countdown = advance_timer(self.countdown, period,
+                                               cycles)
+        self.step = (self.step + clocks) & 31
+
+        return output
+
+
+class Noise(Channel):
+    """Pseudo-random noise from a 15-bit shift register."""
+
+    state_fields = Channel.state_fields + ("mode", "period", "shift")
+    state_layout = struct.Struct("<?B??B?BBIBHH")
+
+    def __init__(self):
+        super().__init__()
+
+        self.mode = 0
+        self.period = NOISE_PERIODS[0]
+        self.shift = 1
+
+    def write(self, register, data):
+        if register == 0:
+            self.write_envelope(data)
+        elif register == 2:
+            self.mode = data >> 7
+            self.period = NOISE_PERIODS[data & 0x0f]
+        elif register == 3:
+            self.load_length(data)
+            self.envelope_start = True
+
+    def run(self, cycles, offsets):
+        orbit_of, positions, orbits = noise_orbits(self.mode)
+        orbit = orbits[orbit_of[self.shift]]
+        position = positions[self.shift]
+        output = None
+
+        if offsets is not None:
+            volume = self.volume() if self.length else 0
+
+            if volume:
+                steps = position + timer_clocks(self.countdown, self.period,
+                                                offsets)
+                output = (~orbit[steps % len(orbit)] & 1) * volume
+            else:
+                output = np.zeros(len(offsets), dtype=np.intp)
+
+        clocks, self.countdown = advance_timer(self.countdown, self.period,
+                                               cycles)
+        self.shift = int(orbit[(position + clocks) % len(orbit)])
+
+        return output
+
+
+class DMC(object):
+    """Plays 1-bit delta encoded samples from PRG-ROM."""
+
+    state_fields = ("irq_enabled", "loop", "period", "level",
+                    "sample_address", "sample_length", "address",
+                    "remaining", "shift", "bits", "countdown", "irq")
+    state_layout = struct.Struct("<??HBHHHHBBI?")
+
+    def __init__(self, memory):
+        self.memory = memory
+
+        self.irq_enabled = False
+        self.loop = False
+        self.period = DMC_PERIODS[0]
+        self.level = 0
+
+        self.sample_address = 0xc000
+        self.sample_length = 1
+
+        # Where the next byte comes from, bytes left to fetch, and the byte
+        # being played with how many of its bits are left
+        self.address = 0xc000
+        self.remaining = 0
+        self.shift = 0
+        self.bits = 0
+
+        self.countdown = 0
+
+        # Set when a sample finishes with IRQ enabled, until acknowledged
+        self.irq = False
+
+    def write(self, register, data):
+        if register == 0:
+            self.irq_enabled = bool(data & 0x80)
+            self.loop = bool(data & 0x40)
+            self.period = DMC_PERIODS[data & 0x0f]
+
+            if not self.irq_enabled:
+                self.irq = False
+        elif register == 1:
+            self.level = data & 0x7f
+        elif register == 2:
+            self.sample_address = 0xc000 | data << 6
+        else:
+            self.sample_length = data << 4 | 1
+
+    def set_enabled(self, enabled):
+        """$4015: starts the sample if it isn't playing, or stops it"""
+
+        if not enabled:
+            self.remaining = 0
+        elif not self.remaining:
+            self.restart()
+
+    def restart(self):
+        self.address = self.sample_address
+        self.remaining = self.sample_length
+
+    def playing(self):
+        return bool(self.bits or self.remaining)
+
+    def irq_due(self):
+        """Cycles from now until the clock that fetches the sample's last
+           byte, if that will raise an IRQ, otherwise None"""
+
+        if not self.irq_enabled or self.loop or not self.remaining:
+            return None
+
+        clocks = self.bits + 8 * (self.remaining - 1) + 1
+
+        return self.countdown + (clocks - 1) * self.period
+
+    def clock(self):
+        """One output unit clock: fetches a byte when the last one is used
+           up, then moves the level by the next bit"""
+
+        if not self.bits:
+            if not self.remaining:
+                return
+
+            self.shift = self.memory.peek(self.address)
+            self.address = (self.address + 1) & 0xffff | 0x8000
+            self.remaining -= 1
+            self.bits = 8
+
+            if not self.remaining:
+                if self.loop:
+                    self.restart()
+                elif self.irq_enabled:
+                    self.irq = True
+
+        if self.shift & 1:
+            if self.level <= 125:
+                self.level += 2
+        elif self.level >= 2:
+            self.level -= 2
+
+        self.shift >>= 1
+        self.bits -= 1
+
+    def run(self, cycles, offsets):
+        start = self.level
+        clocks, countdown = advance_timer(self.countdown, self.period,
+                                          cycles)
+        levels = [start]
+
+        for clock in range(clocks):
+            if not self.playing():
+                break
+
+            self.clock()
+            levels.append(self.level)
+
+        output = None
+
+        if offsets is not None:
+            if len(levels) == 1:
+                output = np.full(len(offsets), start, dtype=np.intp)
+            else:
+                steps = timer_clocks(self.countdown, self.period, offsets)
+                output = np.array(levels, dtype=np.intp)[
+                    np.minimum(steps, len(levels) - 1)]
+
+        self.countdown = countdown
+
+        return output
+
+
+class AudioStream(threading.Thread):
+    """Takes blocks of samples from the APU and writes them to a WAV file
+       or hands them to a callback, on a thread of its own. The queue is
+       bounded, so a consumer that can't keep up holds the emulator back
+       instead of letting samples pile up."""
+
+    def __init__(self, target, sample_rate, capacity=STREAM_BLOCKS):
+        super().__init__(daemon=True)
+
+        self.blocks = queue.Queue(capacity)
+        self.wav = None
+        self.callback = target
+
+        if not callable(target):
+            self.wav = wave.open(target, "wb")
+            self.wav.setnchannels(1)
+            self.wav.setsampwidth(2)
+            self.wav.setframerate(sample_rate)
+            self.callback = self.wav.writeframes
+
+        ### Statistics ###
+
+        self.samples = 0
+
+        # Blocks that had to wait for room in the queue
+        self.stalls = 0
+
+        self.start()
+
+    def put(self, block):
+        """Queues a block of 16-bit samples, waiting if the queue is full"""
+
+        if self.blocks.full():
+            self.stalls += 1
+
+        self.blocks.put(block)
+
+    def finish(self):
+        """Writes out everything queued and closes the file"""
+
+        self.blocks.put(None)
+        self.join()
+
+    def run(self):
+        while True:
+            block = self.blocks.get()
+
+            if block is None:
+                break
+
+            self.callback(block)
+            self.samples += len(block)
+
+        if self.wav is not None:
+            self.wav.close()
+
+
+class APU(scheduler.Component):
+    """This class defines the 2A03's sound hardware."""
+
+    state_fields = ("five_step", "irq_inhibit", "frame_irq",
+                    "sequence_start", "step", "cycles")
+    state_layout = struct.Struct("<B??QBQ")
+
+    def __init__(self):
+        super().__init__()
+
+        # Set by connect()
+        self.memory = None
+        self.cpu = None
+
+        self.pulse1 = Pulse(1)
+        self.pulse2 = Pulse(0)
+        self.triangle = Triangle()
+        self.noise = Noise()
+        self.dmc = None
+
+        # The channels behind $4000 - $400F, four registers each
+        self.channels = (self.pulse1, self.pulse2, self.triangle, self.noise)
+
+        # (CPU cycle, address, data) for channel writes not yet applied
+        self.writes = []
+
+        ### Frame Counter ###
+
+        self.five_step = 0
+        self.irq_inhibit = False
+        self.frame_irq = False
+
+        # The cycle the current sequence started on, and the next step
+        self.sequence_start = 0
+        self.step = 0
+
+        ### Output ###
+
+        # Where finished blocks go, or None when nothing is listening
+        self.output = None
+        self.sample_rate = const.AUDIO_SAMPLE_RATE
+
+        # Sample n falls on CPU cycle origin + n * clock rate / sample rate
+        self.origin = 0
+        self.samples = 0
+
+        self.block = np.zeros(BLOCK_SAMPLES, dtype=np.int16)
+        self.block_fill = 0
+
+    def connect(self, memory):
+        """Maps the registers into the CPU's memory bus. Tone channel
+           writes are only logged; the rest sync first."""
+
+        self.memory = memory
+        self.cpu = self.scheduler.cpu
+        self.dmc = DMC(memory)
+        sync = self.scheduler
+
+        for register in range(0x4000, 0x4010):
+            memory.map_register(register, write=self.log_write)
+
+        for register in range(0x4010, 0x4014):
+            memory.map_register(register, write=sync.synced_writer(
+                self, self.write_dmc))
+
+        memory.map_register(0x4015,
+                            read=sync.synced_reader(self, self.read_status),
+                            write=sync.synced_writer(self, self.write_status))
+        memory.map_register(0x4017, write=sync.synced_writer(
+            self, self.write_frame_counter))
+
+    def state_parts(self):
+        return (self,) + self.channels + (self.dmc,)
+
+    def state_size(self):
+        """Bytes save_state() returns"""
+
+        return sum(part.state_layout.size for part in self.state_parts())
+
+    def save_state(self):
+        """Packs the APU's state into bytes, catching up first so no
+           logged write is left out"""
+
+        self.scheduler.sync(self)
+
+        return pack_state(self.state_parts())
+
+    def load_state(self, state):
+        """Unpacks state from save_state()"""
+
+        unpack_state(self.state_parts(), state)
+        self.writes = []
+
+        # samples carry on from the restored cycle
+        self.origin = self.cycles
+        self.samples = 0
+
+    ### Registers ###
+
+    def log_write(self, loc, data):
+        """$4000 - $400F: remembers the write for the next catch up"""
+
+        cycles = self.cpu.cycles
+
+        # with nothing to run before it, it can be applied straight away
+        if cycles <= self.cycles:
+            self.channels[loc >> 2 & 0x03].write(loc & 0x03, data)
+        else:
+            self.writes.append((cycles, loc, data))
+
+    def write_dmc(self, loc, data):
+        """$4010 - $4013"""
+
+        self.dmc.write(loc & 0x03, data)
+        self.update_dmc_irq()
+        self.scheduler.reschedule(self)
+
+    def read_status(self, loc):
+        """$4015: which channels are playing and which IRQs are raised.
+           Reading acknowledges the frame IRQ."""
+
+        status = 0
+
+        for channel, bit in zip(self.channels + (self.dmc,), (
+                const.STATUS_PULSE_1, const.STATUS_PULSE_2,
+                const.STATUS_TRIANGLE, const.STATUS_NOISE,
+                const.STATUS_DMC)):
+            if channel.playing():
+                status |= bit
+
+        if self.frame_irq:
+            status |= const.STATUS_FRAME_IRQ
+
+        if self.dmc.irq:
+            status |= const.STATUS_DMC_IRQ
+
+        self.frame_irq = False
+        self.scheduler.interrupts.release_irq(const.IRQ_FRAME_COUNTER)
+
+        return status
+
+    def write_status(self, loc, data):
+        """$4015: enables channels, acknowledging the DMC IRQ"""
+
+        for index, channel in enumerate(self.channels):
+            channel.set_enabled(bool(data & 1 << index))
+
+        self.dmc.set_enabled(bool(data & const.STATUS_DMC))
+        self.dmc.irq = False
+        self.update_dmc_irq()
+        self.scheduler.reschedule(self)
+
+    def write_frame_counter(self, loc, data):
+        """$4017: picks the sequence and restarts it"""
+
+        self.five_step = 1 if data & const.FRAME_FIVE_STEP else 0
+        self.irq_inhibit = bool(data & const.FRAME_IRQ_INHIBIT)
+
+        if self.irq_inhibit:
+            self.frame_irq = False
+            self.scheduler.interrupts.release_irq(const.IRQ_FRAME_COUNTER)
+
+        self.sequence_start = self.cycles
+        self.step = 0
+
+        # the five step sequence clocks everything straight away
+        if self.five_step:
+            self.clock_units(True)
+
+        self.scheduler.reschedule(self)
+
+    ### Timing ###
+
+    def next_sync(self):
+        """The CPU cycle of the frame counter's last step, or of the DMC
+           raising its IRQ if that comes first. The steps before the last
+           can't raise an IRQ, so they are left for whenever the APU is
+           next caught up."""
+
+        deadline = self.sequence_start + FRAME_STEPS[self.five_step][-1][0]
+
+        if self.dmc is not None:
+            due = self.dmc.irq_due()
+
+            # the clock at cycle n is run by catching up to n + 1
+            if due is not None:
+                deadline = min(deadline, self.cycles + due + 1)
+
+        return deadline
+
+    def catch_up(self, cycles):
+        """Replays logged writes and frame counter steps up to the given
+           CPU cycle, running the channels in between"""
+
+        writes = self.writes
+        index = 0
+
+        while True:
+            step = self.sequence_start + \
+                FRAME_STEPS[self.five_step][self.step][0]
+
+            if index < len(writes) and writes[index][0] <= min(step, cycles):
+                when, loc, data = writes[index]
+                self.run_channels(when)
+                self.channels[loc >> 2 & 0x03].write(loc & 0x03, data)
+                index += 1
+            elif step <= cycles:
+                self.run_channels(step)
+                self.clock_frame()
+            else:
+                break
+
+        del writes[:index]
+        self.run_channels(cycles)
+
+    def clock_frame(self):
+        """Runs the frame counter step that is due"""
+
+        when, half, irq = FRAME_STEPS[self.five_step][self.step]
+        self.clock_units(half)
+
+        if irq and not self.irq_inhibit:
+            self.frame_irq = True
+            self.scheduler.interrupts.assert_irq(const.IRQ_FRAME_COUNTER)
+
+        self.step += 1
+
+        if self.step == len(FRAME_STEPS[self.five_step]):
+            self.step = 0
+            self.sequence_start += FRAME_LENGTHS[self.five_step]
+
+    def clock_units(self, half):
+        """Clocks the envelopes and linear counter, and on half frames the
+           length counters and sweeps"""
+
+        for channel in self.channels:
+            channel.quarter_frame()
+
+            if half:
+                channel.half_frame()
+
+    def update_dmc_irq(self):
+        """Puts the DMC's IRQ flag on the IRQ line"""
+
+        if self.dmc.irq:
+            self.scheduler.interrupts.assert_irq(const.IRQ_DMC)
+        else:
+            self.scheduler.interrupts.release_irq(const.IRQ_DMC)
+
+    ### Synthesis ###
+
+    def run_channels(self, until):
+        """Runs every channel from where the APU is up to a CPU cycle,
+           synthesizing the samples that fall in between if anything is
+           listening"""
+
+        cycles = until - self.cycles
+
+        if cycles <= 0:
+            return
+
+        offsets = None
+
+        if self.output is not None:
+            # the samples before until, as offsets from the current cycle
+            elapsed = until - self.origin
+            end = -(-elapsed * self.sample_rate // const.CPU_CLOCK_RATE)
+            offsets = np.arange(self.samples, end) * \
+                (const.CPU_CLOCK_RATE / self.sample_rate) + \
+                (self.origin - self.cycles)
+            self.samples = end
+
+        irq = self.dmc.irq
+        outputs = [channel.run(cycles, offsets)
+                   for channel in self.channels + (self.dmc,)]
+        self.cycles = until
+
+        if self.dmc.irq != irq:
+            self.update_dmc_irq()
+
+        if offsets is not None and len(offsets):
+            pulse1, pulse2, triangle, noise, dmc = outputs
+            mixed = PULSE_MIX[pulse1 + pulse2] + \
+                TND_MIX[3 * triangle + 2 * noise + dmc]
+            self.emit((mixed * 32767).astype(np.int16))
+
+    def emit(self, samples):
+        """Copies samples into the current block, sending each block on as
+           it fills"""
+
+        while len(samples):
+            count = min(len(samples), BLOCK_SAMPLES - self.block_fill)
+            self.block[self.block_fill:self.block_fill + count] = \
+                samples[:count]
+            self.block_fill += count
+            samples = samples[count:]
+
+            if self.block_fill == BLOCK_SAMPLES:
+                self.output.put(self.block.copy())
+                self.block_fill = 0
+
+    def start_output(self, target, sample_rate=const.AUDIO_SAMPLE_RATE,
+                     capacity=STREAM_BLOCKS):
+        """Starts synthesizing, to a WAV file if target is a path or to a
+           callback taking arrays of 16-bit samples. Returns the stream."""
+
+        self.stop_output()
+        self.scheduler.sync(self)
+
+        self.sample_rate = sample_rate
+        self.origin = self.cycles
+        self.samples = 0
+        self.block_fill = 0
+        self.output = AudioStream(target, sample_rate, capacity)
+
+        return self.output
+
+    def stop_output(self):
+        """Synthesizes up to the CPU, sends the last partial block, and
+           waits for the stream to finish. Returns the stream."""
+
+        stream = self.output
+
+        if stream is not None:
+            self.scheduler.sync(self)
+
+            if self.block_fill:
+                stream.put(self.block[:self.block_fill].copy())
+
+            self.output = None
+            stream.finish()
+
+        return stream
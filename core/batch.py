@@ -0,0 +1,190 @@
+"""This module runs headless emulation jobs across a pool of worker
+   processes. A job is a ROM, an optional FM2 input movie to play, a number
+   of frames and the outputs wanted back.
+
+   Each distinct ROM is read once by the parent into a shared memory
+   segment. Workers attach to the segment, the first time they need it,
+   and build their cartridges over it read-only, so a ROM's PRG and CHR
+   banks are mapped into every worker's memory bus without being copied
+   or reread from disk. Results are yielded as workers finish them, in
+   whatever order that is.
+
+   A job that fails, whether its ROM or movie can't be read or the core
+   raises, gets its error in its result and the rest of the batch carries
+   on."""
+
+import gc
+import hashlib
+import multiprocessing
+import traceback
+import zlib
+from collections import namedtuple
+from multiprocessing import shared_memory, util
+import constants as const
+import movie
+import nes
+import rom as cart
+from exceptions.cpuexceptions import Error as CpuError
+from exceptions.movieexceptions import Error as MovieError
+from exceptions.romexceptions import Error as RomError
+
+OUTPUTS = (const.OUTPUT_RAM_HASH, const.OUTPUT_FRAME_CHECKSUMS,
+           const.OUTPUT_SCREENSHOT)
+
+Job = namedtuple("Job", ["rom", "frames", "movie", "outputs"])
+Job.__new__.__defaults__ = (None, (const.OUTPUT_RAM_HASH,))
+
+# In each worker: ROM path: (segment name, size), and the segments it has
+# attached to so far
+shared_roms = {}
+attached = {}
+
+
+def share_roms(jobs):
+    """Copies every distinct ROM the jobs use into its own shared memory
+       segment, returning {path: segment}. ROMs that can't be read are left
+       out, for their jobs to report."""
+
+    segments = {}
+
+    try:
+        for job in jobs:
+            if job.rom in segments:
+                continue
+
+            try:
+                with open(job.rom, "rb") as rom_file:
+                    image = rom_file.read()
+            except OSError:
+                continue
+
+            segment = shared_memory.SharedMemory(create=True,
+                                                 size=max(len(image), 1))
+            segment.buf[:len(image)] = image
+            segments[job.rom] = (segment, len(image))
+    except BaseException:
+        release_roms(segments)
+        raise
+
+    return segments
+
+
+def release_roms(segments):
+    """Frees the segments made by share_roms()"""
+
+    for segment, size in segments.values():
+        segment.close()
+        segment.unlink()
+
+
+def init_worker(roms):
+    """Pool initializer: records where each ROM's segment is, and has the
+       worker let go of the segments it attaches to when it exits"""
+
+    shared_roms.clear()
+    shared_roms.update(roms)
+    attached.clear()
+
+    util.Finalize(None, detach_roms, exitpriority=0)
+
+
+def detach_roms():
+    """Closes every segment this worker attached to"""
+
+    # cartridges still holding views of a segment would keep it open
+    gc.collect()
+
+    for segment, view in attached.values():
+        view.release()
+        segment.close()
+
+    attached.clear()
+
+
+def attach_rom(path):
+    """A read-only view of a ROM's shared segment, attaching on first use"""
+
+    if path not in attached:
+        name, size = shared_roms[path]
+        segment = shared_memory.SharedMemory(name=name)
+        attached[path] = (segment, segment.buf[:size].toreadonly())
+
+    return attached[path][1]
+
+
+def run_job(numbered):
+    """Runs one job in a worker, returning its result dict"""
+
+    index, job = numbered
+    result = {"index": index, "rom": job.rom, "frames": job.frames,
+              "error": None}
+
+    try:
+        if job.rom in shared_roms:
+            image = cart.load_image(attach_rom(job.rom), job.rom)
+        else:
+            image = cart.load_rom(job.rom)
+
+        console = nes.create_nes()
+        console.insert_rom(image)
+        checksums = []
+
+        if job.movie is not None:
+            inputs = movie.load_movie(job.movie)
+            inputs.check_rom(image)
+        else:
+            inputs = movie.Movie([])
+
+        # only draw the frames something is going to look at
+        every_frame = const.OUTPUT_FRAME_CHECKSUMS in job.outputs
+
+        if not every_frame:
+            console.ppu.set_render_interval(0)
+
+        for frame, pixels in movie.play(console, inputs, job.frames):
+            if every_frame:
+                checksums.append(zlib.crc32(pixels))
+    except (CpuError, MovieError, RomError) as error:
+        result["error"] = error.message
+        return result
+    except OSError as error:
+        result["error"] = str(error)
+        return result
+    except Exception:
+        result["error"] = traceback.format_exc().rstrip()
+        return result
+
+    if const.OUTPUT_RAM_HASH in job.outputs:
+        result[const.OUTPUT_RAM_HASH] = hashlib.sha1(
+            console.memory.mem_bank[0:0x800]).hexdigest()
+
+    if const.OUTPUT_FRAME_CHECKSUMS in job.outputs:
+        result[const.OUTPUT_FRAME_CHECKSUMS] = checksums
+
+    if const.OUTPUT_SCREENSHOT in job.outputs:
+        result[const.OUTPUT_SCREENSHOT] = console.frame_rgb().tobytes()
+
+    return result
+
+
+def run_batch(jobs, processes=None):
+    """Runs jobs across processes workers (one per core by default),
+       yielding each result as soon as it is ready. Results carry the
+       index of their job."""
+
+    jobs = list(jobs)
+    segments = share_roms(jobs)
+    roms = {path: (segment.name, size)
+            for path, (segment, size) in segments.items()}
+
+    try:
+        with multiprocessing.Pool(processes, initializer=init_worker,
+                                  initargs=(roms,)) as pool:
+            for result in pool.imap_unordered(run_job, enumerate(jobs)):
+                yield result
+
+            # let the workers exit on their own, so they detach cleanly
+            pool.close()
+            pool.join()
+    finally:
+        release_roms(segments)
@@ -0,0 +1,578 @@
+"""This module runs many independent copies of the CPU at once. Their
+   registers and RAM are held as NumPy struct-of-arrays (a[n], pc[n],
+   ram[n, 2048] and so on), and every instance executes one instruction per
+   step in lockstep.
+
+   Each step groups the instances by the opcode they are about to execute,
+   and runs every group with vector operations, so interpreter overhead is
+   paid once per group rather than once per instance. Instances running the
+   same program mostly agree, which keeps the groups few and large.
+
+   There is no second copy of the instruction set. A group runs the CPU's
+   own opcode handlers and addressing mode resolvers, rebuilt to see the
+   ALU tables as arrays, on a Lanes object: a stand-in for the CPU whose
+   registers are arrays holding the group's values and whose bus reads and
+   writes every instance's memory. Instructions are fused from the same
+   timing table CPU.bind_instruction() uses. Only which flag each branch
+   tests is spelled out here, since a branch's if can't take an array.
+
+   Anything the vector paths don't cover -- a group too small to be worth
+   it, JMP indirect, or an access to the I/O registers -- falls back to
+   running that instance through a real CPU. Only the bytes of RAM and
+   PRG-RAM the instruction can touch are copied into the real CPU and
+   back.
+
+   Instances are headless: they have CPU RAM, 8KB of PRG-RAM and a shared,
+   read-only NROM cartridge, but no PPU or APU. I/O registers behave as the
+   bare memory bus's latches, shared between instances."""
+
+import dis
+import types
+import numpy as np
+import constants as const
+from alu import ZN_TABLE, ADC_RESULT, ADC_FLAGS, SBC_RESULT, SBC_FLAGS
+import cpu as CPU
+import rom as cart
+from exceptions.cpuexceptions import InvalidOpcodeError
+from exceptions.romexceptions import UnsupportedMapperError
+from instructions import MODE_BYTES, INSTRUCTIONS, ADDRESS_OPERANDS
+
+# The ALU tables as arrays, so they can be fancy indexed
+ZN = np.frombuffer(ZN_TABLE, dtype=np.uint8).astype(np.intp)
+ADC = np.frombuffer(ADC_RESULT, dtype=np.uint8).astype(np.intp)
+ADC_P = np.frombuffer(ADC_FLAGS, dtype=np.uint8).astype(np.intp)
+SBC = np.frombuffer(SBC_RESULT, dtype=np.uint8).astype(np.intp)
+SBC_P = np.frombuffer(SBC_FLAGS, dtype=np.uint8).astype(np.intp)
+
+# The CPU module's globals with the ALU tables swapped for the arrays, for
+# the CPU's methods to be rebuilt over
+VECTOR_GLOBALS = dict(vars(CPU), ZN_TABLE=ZN, ADC_RESULT=ADC,
+                      ADC_FLAGS=ADC_P, SBC_RESULT=SBC, SBC_FLAGS=SBC_P)
+
+# Registers a Lanes can gather from the batch, and the ones every fused
+# instruction reads and sets
+REGISTERS = ("pc", "sp", "a", "x", "y", "p", "cycles")
+FUSED_REGISTERS = ("pc", "cycles")
+
+# Bytecode that reads an attribute, or a method to call
+ATTRIBUTE_LOADS = ("LOAD_ATTR", "LOAD_METHOD")
+
+# Groups smaller than this are run one instance at a time, where a vector
+# operation's fixed cost outweighs the per-instance savings
+VECTOR_THRESHOLD = 8
+
+# Branch: (flag tested, whether it branches when the flag is set), which
+# must agree with the CPU's branch handlers
+BRANCHES = {
+    "bcc": (const.FLAG_CARRY, False), "bcs": (const.FLAG_CARRY, True),
+    "bne": (const.FLAG_ZERO, False), "beq": (const.FLAG_ZERO, True),
+    "bpl": (const.FLAG_NEGATIVE, False), "bmi": (const.FLAG_NEGATIVE, True),
+    "bvc": (const.FLAG_OVERFLOW, False), "bvs": (const.FLAG_OVERFLOW, True)
+}
+
+# Instructions that push or pull, touching the bytes around the stack
+# pointer: from two below it, for BRK's three pushes, to three above, for
+# RTI's three pulls
+STACK_USERS = ("brk", "jsr", "pha", "php", "pla", "plp", "rti", "rts")
+STACK_REACH = range(-2, 4)
+
+# Modes that read a pointer from memory before reaching their operand
+POINTER_MODES = (const.ADDR_INDIRECT, const.ADDR_INDEXED_INDIRECT,
+                 const.ADDR_INDIRECT_INDEXED)
+
+
+def create_batch_cpu(count):
+    """Returns a new batch of count CPUs for use outside of this module."""
+    return BatchCPU(count)
+
+
+def vectorize(method):
+    """Rebuilds a CPU method over VECTOR_GLOBALS, so that called on a Lanes
+       it works on every instance in the group at once"""
+
+    return types.FunctionType(method.__code__, VECTOR_GLOBALS,
+                              method.__name__, method.__defaults__,
+                              method.__closure__)
+
+
+def registers_used(*names):
+    """The registers an instruction fused from the named CPU methods, and
+       every CPU method they call, uses at all and the ones it sets, read
+       off their bytecode"""
+
+    methods = vars(CPU.CPU)
+    used = set(FUSED_REGISTERS)
+    written = set(FUSED_REGISTERS)
+    pending = list(names)
+    seen = set()
+
+    while pending:
+        name = pending.pop()
+
+        if name in seen:
+            continue
+
+        seen.add(name)
+
+        for instruction in dis.get_instructions(methods[name]):
+            attribute = instruction.argval
+
+            if instruction.opname == "STORE_ATTR" and attribute in REGISTERS:
+                written.add(attribute)
+            elif instruction.opname in ATTRIBUTE_LOADS:
+                if attribute in REGISTERS:
+                    used.add(attribute)
+                elif isinstance(methods.get(attribute), types.FunctionType):
+                    pending.append(attribute)
+
+    return tuple(used | written), tuple(written)
+
+
+class Lanes(object):
+    """Stands in for a CPU over a group of a batch's instances: registers
+       are arrays of the group's values, and the bus is the lanes
+       themselves. Every other method is the CPU's own, vectorized."""
+
+    # There is no interrupt controller, so unmasked() has nothing to do
+    irq_held = False
+
+    def __init__(self, batch, members, registers):
+        self.batch = batch
+        self.members = members
+        self.memory = self
+
+        for name in registers:
+            setattr(self, name, getattr(batch, name)[members])
+
+    def commit(self, registers):
+        """Writes registers back to the batch"""
+
+        for name in registers:
+            getattr(self.batch, name)[self.members] = getattr(self, name)
+
+    def load(self, loc):
+        """Reads a byte for each instance, from one address for all of them
+           or one each"""
+
+        if not isinstance(loc, np.ndarray):
+            loc = np.full(len(self.members), loc)
+
+        return self.batch.read(self.members, loc)
+
+    def store(self, loc, data):
+        """Writes a byte for each instance"""
+
+        if not isinstance(data, np.ndarray):
+            data = np.full(len(self.members), data)
+
+        self.batch.write(self.members, loc, data)
+
+
+for name, method in vars(CPU.CPU).items():
+    if isinstance(method, types.FunctionType) and name not in vars(Lanes):
+        setattr(Lanes, name, vectorize(method))
+
+
+class BatchCPU(object):
+    """count copies of the Ricoh 2A03, stepped together."""
+
+    def __init__(self, count):
+        self.count = count
+
+        ### Registers ###
+
+        self.pc = np.zeros(count, dtype=np.intp)
+        self.sp = np.full(count, 0xff, dtype=np.intp)
+        self.a = np.zeros(count, dtype=np.intp)
+        self.x = np.zeros(count, dtype=np.intp)
+        self.y = np.zeros(count, dtype=np.intp)
+        self.p = np.full(count, 0b00110100, dtype=np.intp)
+        self.cycles = np.zeros(count, dtype=np.intp)
+
+        # Instances that hit an invalid opcode stop where they are
+        self.halted = np.zeros(count, dtype=bool)
+
+        ### Memory ###
+
+        self.ram = np.zeros((count, 0x800), dtype=np.uint8)
+        self.prg_ram = np.zeros((count, 0x2000), dtype=np.uint8)
+
+        # The registers and each instance's rows of memory as memoryviews,
+        # which read and write single values as plain ints
+        self.register_views = [memoryview(register) for register in (
+            self.pc, self.sp, self.a, self.x, self.y, self.p, self.cycles)]
+        self.ram_rows = [memoryview(row) for row in self.ram]
+        self.prg_ram_rows = [memoryview(row) for row in self.prg_ram]
+
+        # Shared cartridge PRG-ROM at 0x8000, mirrored if it is only 16KB
+        self.prg = np.zeros(0x8000, dtype=np.uint8)
+        self.prg_mask = 0x7fff
+
+        ### Scalar Fallback ###
+
+        # A real CPU that an instance is copied into to run one instruction
+        self.scalar = CPU.create_cpu()
+
+        # Opcode: (addressing mode, whether it uses the stack), or None for
+        # invalid opcodes
+        self.fallback_shapes = [
+            (INSTRUCTIONS[opcode][0],
+             self.scalar.opcodes[opcode].__name__ in STACK_USERS)
+            if opcode in self.scalar.opcodes else None
+            for opcode in range(0x100)]
+
+        # Opcode: vector implementation, or None to run it scalar
+        self.vector_dispatch = [self.bind_vector(op) for op in range(0x100)]
+
+        ### Statistics ###
+
+        self.vector_steps = 0
+        self.scalar_steps = 0
+
+    ### Loading ###
+
+    def load_prg(self, prg):
+        """Inserts 16KB or 32KB of PRG-ROM into every instance and resets
+           them"""
+
+        prg = np.frombuffer(bytes(prg), dtype=np.uint8)
+        self.prg[:len(prg)] = prg
+        self.prg_mask = len(prg) - 1
+
+        self.scalar.memory.map_buffer(0x8000, 0xffff, memoryview(
+            self.prg[:len(prg)].tobytes()), writable=False)
+
+        self.reset()
+
+    def load_rom(self, path):
+        """Inserts an NROM cartridge into every instance and resets them"""
+
+        image = cart.load_rom(path)
+
+        try:
+            if image.mapper != 0:
+                raise UnsupportedMapperError(
+                    image.mapper, const.EXCEPTION_UNSUPPORTED_MAPPER)
+
+            self.load_prg(image.prg_rom)
+        finally:
+            image.close()
+
+    def reset(self):
+        """Puts every instance at the reset vector, as CPU.initialize_cpu()
+           does"""
+
+        vector = int(self.prg[0xfffc & self.prg_mask]) | \
+            int(self.prg[0xfffd & self.prg_mask]) << 8
+
+        self.pc[:] = vector
+        self.cycles += 7
+        self.halted[:] = False
+
+    ### Execution ###
+
+    def run(self, cycles):
+        """Steps every instance until each has run at least the given number
+           of cycles"""
+
+        target = self.cycles + cycles
+
+        while True:
+            members = np.flatnonzero((self.cycles < target) & ~self.halted)
+
+            if not len(members):
+                break
+
+            self.step(members)
+
+    def step(self, members=None):
+        """Executes one instruction on each of the given instances, or on
+           every instance that isn't halted"""
+
+        if members is None:
+            members = np.flatnonzero(~self.halted)
+
+        pc = self.pc[members]
+
+        # code in the I/O area is fetched through the scalar CPU
+        io = (pc >= 0x2000) & (pc < 0x6000)
+
+        if io.any():
+            self.fall_back(members[io])
+            members = members[~io]
+            pc = pc[~io]
+
+        if not len(members):
+            return
+
+        opcodes = self.read(members, pc)
+
+        # sort by opcode, then split wherever it changes
+        order = np.argsort(opcodes, kind="stable")
+        ordered = opcodes[order]
+        bounds = np.concatenate(
+            ([0], np.flatnonzero(np.diff(ordered)) + 1, [len(ordered)]))
+
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            group = members[order[start:end]]
+            vector = self.vector_dispatch[ordered[start]]
+
+            if vector is None or len(group) < VECTOR_THRESHOLD:
+                self.fall_back(group)
+            else:
+                self.vector_steps += len(group)
+                vector(group)
+
+    def fall_back(self, members):
+        """Runs one instruction on each instance through the scalar CPU"""
+
+        cpu = self.scalar
+        dispatch = cpu.dispatch
+        load = cpu.memory.load
+        bank = cpu.memory.mem_bank
+        pc, sp, a, x, y, p, cycles = self.register_views
+        self.scalar_steps += len(members)
+
+        for index in members.tolist():
+            cpu.pc = pc[index]
+            cpu.sp = sp[index]
+            cpu.a = a[index]
+            cpu.x = x[index]
+            cpu.y = y[index]
+            cpu.p = p[index]
+            cpu.cycles = cycles[index]
+
+            ram = self.ram_rows[index]
+            prg_ram = self.prg_ram_rows[index]
+            touched = self.copy_in(ram, prg_ram)
+
+            try:
+                dispatch[load(cpu.pc)]()
+            except InvalidOpcodeError:
+                self.halted[index] = True
+                continue
+
+            pc[index] = cpu.pc
+            sp[index] = cpu.sp
+            a[index] = cpu.a
+            x[index] = cpu.x
+            y[index] = cpu.y
+            p[index] = cpu.p
+            cycles[index] = cpu.cycles
+
+            for address in touched:
+                if address < 0x2000:
+                    ram[address & 0x7ff] = bank[address & 0x7ff]
+                elif 0x6000 <= address < 0x8000:
+                    prg_ram[address - 0x6000] = bank[address]
+
+    def copy_in(self, ram, prg_ram):
+        """Copies whatever the scalar CPU's next instruction can touch in
+           from an instance's rows of RAM and PRG-RAM, returning its
+           addresses: the instruction, the stack, any pointer it reads and
+           its operand. PRG-ROM and the registers are shared."""
+
+        cpu = self.scalar
+        load = cpu.memory.load
+        pc = cpu.pc
+        touched = []
+
+        # code outside PRG-ROM has to be in place before it can be decoded
+        if pc < 0x8000:
+            touched += [pc, (pc + 1) & 0xffff, (pc + 2) & 0xffff]
+            self.copy(touched, ram, prg_ram)
+
+        shape = self.fallback_shapes[load(pc)]
+
+        if shape is None:
+            return touched
+
+        mode, stack = shape
+        operand = (pc + 1) & 0xffff
+        first = len(touched)
+
+        if stack:
+            touched += [0x100 | (cpu.sp + offset) & 0xff
+                        for offset in STACK_REACH]
+
+        if mode == const.ADDR_INDIRECT:
+            pointer = load(operand) | load((operand + 1) & 0xffff) << 8
+            touched += [pointer, pointer & 0xff00 | (pointer + 1) & 0xff]
+        elif mode in POINTER_MODES:
+            pointer = load(operand)
+
+            if mode == const.ADDR_INDEXED_INDIRECT:
+                pointer = (pointer + cpu.x) & 0xff
+
+            touched += [pointer, (pointer + 1) & 0xff]
+
+        if len(touched) > first:
+            self.copy(touched[first:], ram, prg_ram)
+            first = len(touched)
+
+        # with any pointer in place, the CPU's own resolver finds the
+        # operand; JMP ($nnnn) only reads its pointer
+        resolve = cpu.addressing.get(mode)
+
+        if resolve is not None and mode != const.ADDR_INDIRECT:
+            touched.append(resolve(operand)[0])
+            self.copy(touched[first:], ram, prg_ram)
+
+        return touched
+
+    def copy(self, addresses, ram, prg_ram):
+        """Copies the bytes at CPU addresses from an instance's rows into
+           the scalar CPU, skipping any outside RAM and PRG-RAM"""
+
+        bank = self.scalar.memory.mem_bank
+
+        for address in addresses:
+            if address < 0x2000:
+                bank[address & 0x7ff] = ram[address & 0x7ff]
+            elif 0x6000 <= address < 0x8000:
+                bank[address] = prg_ram[address - 0x6000]
+
+    ### Memory ###
+
+    def read(self, members, address):
+        """Reads a byte for each instance. None of the addresses may be in
+           the I/O area."""
+
+        if address.min() >= 0x8000:
+            return self.prg[address & self.prg_mask].astype(np.intp)
+
+        if address.max() < 0x2000:
+            return self.ram[members, address & 0x7ff].astype(np.intp)
+
+        result = np.zeros(len(address), dtype=np.intp)
+
+        ram = address < 0x2000
+        result[ram] = self.ram[members[ram], address[ram] & 0x7ff]
+
+        rom = address >= 0x8000
+        result[rom] = self.prg[address[rom] & self.prg_mask]
+
+        sram = (address >= 0x6000) & ~rom
+        result[sram] = self.prg_ram[members[sram], address[sram] - 0x6000]
+
+        return result
+
+    def write(self, members, address, data):
+        """Writes a byte for each instance. Writes to PRG-ROM are dropped,
+           and none of the addresses may be in the I/O area."""
+
+        if address.max() < 0x2000:
+            self.ram[members, address & 0x7ff] = data
+            return
+
+        ram = address < 0x2000
+        self.ram[members[ram], address[ram] & 0x7ff] = data[ram]
+
+        sram = (address >= 0x6000) & (address < 0x8000)
+        self.prg_ram[members[sram], address[sram] - 0x6000] = data[sram]
+
+    ### Dispatch ###
+
+    def bind_vector(self, opcode):
+        """Fuses an opcode's handler, addressing mode, length and timing into
+           a vector implementation, as CPU.bind_instruction() does for a
+           single instance"""
+
+        handler = self.scalar.opcodes.get(opcode)
+
+        if handler is None:
+            return None
+
+        name = handler.__name__
+        mode, cycles, penalty = INSTRUCTIONS[opcode]
+        length = MODE_BYTES[mode]
+
+        if mode == const.ADDR_INDIRECT:
+            # its pointer could be anywhere, the I/O area included
+            return None
+
+        operation = getattr(Lanes, name)
+
+        if mode in (const.ADDR_IMPLICIT, const.ADDR_ACCUMULATOR):
+            used, written = registers_used(name)
+
+            def execute(members):
+                cpu = Lanes(self, members, used)
+                cpu.pc = (cpu.pc + 1) & 0xffff
+                cpu.cycles += cycles
+                operation(cpu)
+                cpu.commit(written)
+
+            return execute
+
+        if mode == const.ADDR_RELATIVE:
+            flag, when_set = BRANCHES[name]
+            used, written = registers_used("branch")
+
+            def execute(members):
+                pc = self.pc[members]
+                offset = self.read(members, (pc + 1) & 0xffff)
+                self.pc[members] = (pc + 2) & 0xffff
+                self.cycles[members] += cycles
+
+                taken = (self.p[members] & flag).astype(bool) == when_set
+
+                if taken.any():
+                    cpu = Lanes(self, members[taken], used)
+                    offset = offset[taken]
+                    cpu.branch(offset - (offset & 0x80) * 2)
+                    cpu.commit(written)
+
+            return execute
+
+        resolve = None
+        takes_address = name in ADDRESS_OPERANDS
+
+        if mode == const.ADDR_IMMEDIATE:
+            used, written = registers_used(name)
+        else:
+            resolver = self.scalar.addressing[mode].__name__
+            resolve = getattr(Lanes, resolver)
+            used, written = registers_used(name, resolver)
+
+        def execute(members):
+            cpu = Lanes(self, members, used)
+            pc = cpu.pc
+
+            if resolve is None:
+                address, crossed = (pc + 1) & 0xffff, 0
+            else:
+                address, crossed = resolve(cpu, (pc + 1) & 0xffff)
+
+                # anything touching the I/O area goes through the bus
+                io = (address >= 0x2000) & (address < 0x6000)
+
+                if io.any():
+                    self.fall_back(members[io])
+                    keep = ~io
+                    members, pc, address = members[keep], pc[keep], \
+                        address[keep]
+
+                    if penalty:
+                        crossed = crossed[keep]
+
+                    if not len(members):
+                        return
+
+                    cpu = Lanes(self, members, used)
+
+            cpu.pc = (pc + length) & 0xffff
+
+            if penalty and not takes_address:
+                cpu.cycles += cycles + crossed
+            else:
+                cpu.cycles += cycles
+
+            if takes_address:
+                operation(cpu, address)
+            else:
+                operation(cpu, cpu.load(address))
+
+            cpu.commit(written)
+
+        return execute
@@ -0,0 +1,413 @@
+"""This module translates straight-line runs of 6502 code into Python
+   functions and caches them. A block runs from its entry PC up to and
+   including the next branch or jump, and never crosses a 256-byte page, so
+   it can be keyed by the page's current mapping. Operands, addresses and
+   cycle counts are baked into the generated source, which removes the
+   per-instruction fetch and dispatch the interpreter pays for.
+
+   Running blocks is exact. A block is only entered when even its slowest
+   path finishes by the CPU's deadline, and single instructions are
+   interpreted up to it otherwise. The deadline only moves when the CPU
+   touches a register or changes its interrupt disable flag, so a block
+   ends after any instruction that might.
+
+   Blocks are kept per mapped page slice, so switching a bank away and back
+   reuses what was compiled before. Blocks in RAM are dropped as soon as
+   their page is written to, and a block ends after any store that might
+   reach its own page, so code that patches itself runs the new bytes."""
+
+import constants as const
+from instructions import MODE_BYTES, INSTRUCTIONS, ADDRESS_OPERANDS, \
+    CONTROL_FLOW, MNEMONICS
+
+# Longest straight-line run compiled into a single block
+MAX_BLOCK_INSTRUCTIONS = 64
+
+# Modes that can't reach an I/O register, so cycles can be added up and
+# applied later instead of before the access
+DEFERRED_CYCLE_MODES = (
+    const.ADDR_IMPLICIT, const.ADDR_ACCUMULATOR, const.ADDR_IMMEDIATE,
+    const.ADDR_ZERO_PAGE, const.ADDR_ZERO_PAGE_X, const.ADDR_ZERO_PAGE_Y
+)
+
+# Most cycles any instruction can take, for opcodes without a handler
+MAX_INSTRUCTION_CYCLES = 7
+
+# Instructions that change the interrupt disable flag, which may let a held
+# IRQ pull the deadline in
+MASK_CHANGES = ("CLI", "SEI", "PLP")
+
+# Modes that only ever reach the 2KB of internal RAM
+ZERO_PAGE_MODES = (
+    const.ADDR_ZERO_PAGE, const.ADDR_ZERO_PAGE_X, const.ADDR_ZERO_PAGE_Y
+)
+
+# Instructions that write to the stack page without taking an address
+STACK_PUSHES = ("PHA", "PHP")
+STACK_PAGE = 0x01
+
+# The PPU, APU, controller and expansion registers, which may be read or
+# written, and the start of the mapper registers, which may be written
+REGISTERS_START = 0x2000
+REGISTERS_END = 0x6000
+MAPPER_REGISTERS_START = 0x8000
+
+# Effective address expressions for the modes that can be computed inline,
+# filled in with the operand and the register it is indexed by
+INLINE_ADDRESSES = {
+    const.ADDR_ZERO_PAGE: "0x%02x",
+    const.ADDR_ZERO_PAGE_X: "(0x%02x + cpu.x) & 0xff",
+    const.ADDR_ZERO_PAGE_Y: "(0x%02x + cpu.y) & 0xff",
+    const.ADDR_ABSOLUTE: "0x%04x",
+    const.ADDR_ABSOLUTE_X: "(0x%04x + cpu.x) & 0xffff",
+    const.ADDR_ABSOLUTE_Y: "(0x%04x + cpu.y) & 0xffff"
+}
+
+# Index register for the indexed absolute modes, used for page-cross checks
+INDEX_REGISTERS = {
+    const.ADDR_ABSOLUTE_X: "cpu.x",
+    const.ADDR_ABSOLUTE_Y: "cpu.y"
+}
+
+
+class BlockCache(object):
+    """Compiles, caches and runs blocks for a CPU."""
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.memory = cpu.memory
+
+        # id of a mapped page slice: {entry PC: block}, plus the slices
+        # themselves so an id can't be reused by a new slice while cached
+        self.banks = {}
+        self.bank_pages = {}
+
+        # The block dict for whatever is mapped at each page right now
+        self.page_blocks = [self.bank_blocks(page) for page in range(0x100)]
+
+        # Writable pages that have a hook to drop their blocks on write
+        self.watched = set()
+
+        ### Statistics ###
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.bank_switches = 0
+
+        self.memory.remap_listeners.append(self.remapped)
+
+    def close(self):
+        """Detaches from the memory bus"""
+
+        self.memory.remap_listeners.remove(self.remapped)
+
+        for page in list(self.watched):
+            self.memory.unhook_writes(page, self.code_written)
+
+        self.watched.clear()
+
+    def bank_blocks(self, page):
+        """Returns the block dict for the slice currently mapped at page"""
+
+        mapped = self.memory.mapped_read_pages[page]
+        self.bank_pages[id(mapped)] = mapped
+
+        return self.banks.setdefault(id(mapped), {})
+
+    def remapped(self, first, last):
+        """Points pages that were just remapped at the blocks compiled for
+           their new bank"""
+
+        for page in range(first, last + 1):
+            blocks = self.bank_blocks(page)
+
+            if blocks is not self.page_blocks[page]:
+                self.page_blocks[page] = blocks
+                self.bank_switches += 1
+
+    def code_written(self, loc, data):
+        """Write hook for pages holding compiled RAM code"""
+
+        self.invalidate(loc >> 8)
+
+    def invalidate(self, page):
+        """Drops every block compiled from a page and stops watching it
+           until code there is compiled again"""
+
+        blocks = self.page_blocks[page]
+        self.invalidations += len(blocks)
+        blocks.clear()
+
+        for alias in self.memory.aliases(page):
+            if alias in self.watched:
+                self.watched.discard(alias)
+                self.memory.unhook_writes(alias, self.code_written)
+
+    def flush_ram(self):
+        """Drops every block compiled from writable memory, for when it was
+           replaced without going through the write hooks"""
+
+        for page in range(0x100):
+            if self.memory.mapped_write_pages[page] is not None:
+                self.invalidate(page)
+
+    def watch(self, page):
+        """Hooks writes to a RAM page, and its mirrors, that code was
+           compiled from"""
+
+        for alias in self.memory.aliases(page):
+            if alias not in self.watched:
+                self.watched.add(alias)
+                self.memory.hook_writes(alias, self.code_written)
+
+    def run(self):
+        """Runs blocks until the CPU's cycle count reaches its deadline"""
+
+        cpu = self.cpu
+        dispatch = cpu.dispatch
+        load = self.memory.load
+        page_blocks = self.page_blocks
+        hits = 0
+
+        while cpu.cycles < cpu.deadline:
+            pc = cpu.pc
+            block = page_blocks[pc >> 8].get(pc)
+
+            if block is None:
+                block = self.compile(pc)
+            else:
+                hits += 1
+
+            if cpu.cycles + block.max_cycles <= cpu.deadline:
+                block(cpu)
+            else:
+                # too close to the deadline for the whole block
+                dispatch[load(pc)]()
+
+        self.hits += hits
+
+    def compile(self, pc):
+        """Translates the block starting at pc and caches it"""
+
+        self.misses += 1
+        page = pc >> 8
+        block = self.translate(pc)
+
+        if self.memory.mapped_write_pages[page] is not None:
+            self.watch(page)
+
+        self.page_blocks[page][pc] = block
+
+        return block
+
+    def translate(self, pc):
+        """Generates and compiles the Python function for a block"""
+
+        cpu = self.cpu
+        load = self.memory.load
+        page = pc >> 8
+
+        # code that isn't in a buffer (I/O space) is always interpreted
+        if self.memory.mapped_read_pages[page] is None:
+            return self.interpreter()
+
+        # every page a store could patch this block's code through
+        if self.memory.mapped_write_pages[page] is None:
+            code_pages = ()
+        else:
+            code_pages = self.memory.aliases(page)
+
+        namespace = {"load": load, "dispatch": cpu.dispatch}
+        lines = []
+        pending = 0
+        max_cycles = 0
+        address = pc
+
+        for index in range(MAX_BLOCK_INSTRUCTIONS):
+            opcode = load(address)
+            handler = cpu.opcodes.get(opcode)
+            mode = INSTRUCTIONS[opcode][0] if handler else const.ADDR_IMPLICIT
+            length = MODE_BYTES[mode]
+
+            # stop short of anything that spills into the next page
+            if (address + length - 1) >> 8 != page:
+                break
+
+            if handler is None or handler.__name__ in CONTROL_FLOW:
+                # let the interpreter run the final jump or branch, since it
+                # needs an exact PC and cycle count
+                if pending:
+                    lines.append("cpu.cycles += %d" % pending)
+
+                lines.append("cpu.pc = 0x%04x" % address)
+                lines.append("dispatch[0x%02x]()" % opcode)
+
+                max_cycles += self.max_cycles(opcode) if handler \
+                    else MAX_INSTRUCTION_CYCLES
+
+                return self.build(pc, lines, namespace, max_cycles)
+
+            name = "h%d" % index
+            namespace[name] = handler
+            pending = self.emit(lines, namespace, index, address, opcode,
+                                name, pending)
+            max_cycles += self.max_cycles(opcode)
+            address += length
+
+            if self.ends_block(address - length, opcode, code_pages):
+                break
+
+        if address == pc:
+            # the very first instruction crosses a page boundary
+            return self.interpreter()
+
+        if pending:
+            lines.append("cpu.cycles += %d" % pending)
+
+        lines.append("cpu.pc = 0x%04x" % (address & 0xffff))
+
+        return self.build(pc, lines, namespace, max_cycles)
+
+    def max_cycles(self, opcode):
+        """The most cycles an instruction can take: a page crossed, and for
+           a branch, taken to another page"""
+
+        mode, cycles, penalty = INSTRUCTIONS[opcode]
+
+        return cycles + penalty + (2 if mode == const.ADDR_RELATIVE else 0)
+
+    def ends_block(self, address, opcode, code_pages):
+        """Whether the instruction at address might move the CPU's deadline,
+           by changing the interrupt disable flag or reaching a register, or
+           might write to one of code_pages, which the block was compiled
+           from"""
+
+        mode = INSTRUCTIONS[opcode][0]
+        mnemonic = MNEMONICS[opcode]
+
+        if mnemonic in MASK_CHANGES:
+            return True
+
+        if mode in (const.ADDR_IMPLICIT, const.ADDR_ACCUMULATOR,
+                    const.ADDR_IMMEDIATE):
+            return mnemonic in STACK_PUSHES and STACK_PAGE in code_pages
+
+        writes = self.cpu.opcodes[opcode].__name__ in ADDRESS_OPERANDS
+
+        if mode in ZERO_PAGE_MODES:
+            # indexing wraps within the zero page
+            return writes and 0x00 in code_pages
+
+        if mode not in INLINE_ADDRESSES:
+            # an indirect pointer could lead anywhere
+            return True
+
+        load = self.memory.load
+        first = load(address + 1) | load(address + 2) << 8
+        last = first + (0xff if mode in INDEX_REGISTERS else 0)
+
+        if first < REGISTERS_END and last >= REGISTERS_START or \
+                last > 0xffff:
+            return True
+
+        if not writes:
+            return False
+
+        return last >= MAPPER_REGISTERS_START or \
+            any(first >> 8 <= alias <= last >> 8 for alias in code_pages)
+
+    def emit(self, lines, namespace, index, address, opcode, name, pending):
+        """Appends the source for one instruction, returning the cycles
+           still waiting to be added to the CPU"""
+
+        load = self.memory.load
+        mode, cycles, penalty = INSTRUCTIONS[opcode]
+        pending += cycles
+
+        if mode not in DEFERRED_CYCLE_MODES:
+            # anything that might reach an I/O register sees an exact count
+            lines.append("cpu.cycles += %d" % pending)
+            pending = 0
+
+        takes_address = namespace[name].__name__ in ADDRESS_OPERANDS
+
+        if mode in (const.ADDR_IMPLICIT, const.ADDR_ACCUMULATOR):
+            lines.append("%s()" % name)
+            return pending
+
+        if mode == const.ADDR_IMMEDIATE:
+            lines.append("%s(0x%02x)" % (name, load(address + 1)))
+            return pending
+
+        if mode in INLINE_ADDRESSES:
+            if MODE_BYTES[mode] == 3:
+                operand = load(address + 1) | load(address + 2) << 8
+            else:
+                operand = load(address + 1)
+
+            target = INLINE_ADDRESSES[mode] % operand
+
+            if penalty:
+                lines.append("cpu.cycles += 0x%02x + %s > 0xff" %
+                             (operand & 0xff, INDEX_REGISTERS[mode]))
+        else:
+            # indirect modes resolve their pointer through the CPU
+            resolver = "r%d" % index
+            namespace[resolver] = self.cpu.addressing[mode]
+            lines.append("address, crossed = %s(0x%04x)" %
+                         (resolver, address + 1))
+            target = "address"
+
+            if penalty:
+                lines.append("cpu.cycles += crossed")
+
+        if takes_address:
+            lines.append("%s(%s)" % (name, target))
+        else:
+            lines.append("%s(load(%s))" % (name, target))
+
+        return pending
+
+    def build(self, pc, lines, namespace, max_cycles):
+        """Compiles generated block source into a function, noting the most
+           cycles it can take"""
+
+        source = "def block(cpu):\n" + \
+            "".join("    %s\n" % line for line in lines)
+
+        exec(compile(source, "<block 0x%04x>" % pc, "exec"), namespace)
+
+        block = namespace["block"]
+        block.source = source
+        block.max_cycles = max_cycles
+
+        return block
+
+    def interpreter(self):
+        """A stand-in block that interprets a single instruction"""
+
+        dispatch = self.cpu.dispatch
+        load = self.memory.load
+
+        def block(cpu):
+            dispatch[load(cpu.pc)]()
+
+        # a single instruction is always run, as the interpreter would
+        block.max_cycles = 0
+
+        return block
+
+    def stats(self):
+        """Returns cache statistics"""
+
+        lookups = self.hits + self.misses
+
+        return {
+            "blocks": sum(len(blocks) for blocks in self.banks.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "bank_switches": self.bank_switches
+        }
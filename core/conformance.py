@@ -0,0 +1,289 @@
+"""This module runs conformance test ROMs headless across a pool of worker
+   processes, for checking that a change to the core didn't break it.
+
+   Two kinds of test are understood. A ROM with a golden trace next to it,
+   such as nestest.nes and nestest.log, is run with the tracer on from the
+   state on the log's first line, and every instruction is compared with
+   the log as it runs. The log is streamed a line at a time, never read
+   whole, and the run stops at the first line that differs. The report has
+   that line, the fields that differ and the lines around it.
+
+   Any other ROM is taken to report through the protocol blargg's test
+   ROMs (instr_test, ppu_vbl_nmi and the like) share: $6001 - $6003 hold
+   DE B0 61 once the test is running, $6000 is 80 while it is, 81 when it
+   wants the reset button pressed, and otherwise its result code, 0 for a
+   pass, with a message from $6004 on.
+
+   Nothing needs drawing, so frames aren't rendered. Whatever a test
+   raises fails that test alone, with the traceback as its message, so a
+   broken core still gets a report for every ROM."""
+
+import collections
+import multiprocessing
+import os
+import re
+import traceback
+from collections import namedtuple
+import nes
+from exceptions.cpuexceptions import Error as CpuError
+from exceptions.romexceptions import Error as RomError
+from tracer import format_records
+
+# Instructions traced between comparisons; slices of this many cycles
+# can't overfill a ring this big
+TRACE_CHUNK = 1 << 14
+
+# Log lines shown before and after a divergence
+CONTEXT_LINES = 5
+
+# Frames a status test may run before it is given up on, a minute's worth
+DEFAULT_FRAMES = 3600
+
+# What $6000 - $6003 hold while a status protocol test is running
+STATUS_SIGNATURE = b"\xde\xb0\x61"
+STATUS_RUNNING = 0x80
+STATUS_RESET = 0x81
+
+# Frames to hold off before pressing reset when a test asks, as it wants
+# at least 100ms
+RESET_DELAY = 8
+
+# A register field of a log line, such as "A:00" or "PPU:  0, 21"
+FIELD = re.compile(r"(A|X|Y|P|SP|PPU|CYC):\s*(\d+,\s*\d+|[0-9A-F]+)")
+
+# A ROM, the golden log to compare its trace with if it has one, and how
+# many frames a status test may run
+Test = namedtuple("Test", ["rom", "log", "frames"])
+Test.__new__.__defaults__ = (None, DEFAULT_FRAMES)
+
+# The first line that didn't match: its number from 1, the line from the
+# log and from the run, the differing fields as (name, expected, actual),
+# and the lines of the log either side
+Divergence = namedtuple("Divergence", ["line", "expected", "actual",
+                                       "fields", "before", "after"])
+
+
+def discover(paths, frames=DEFAULT_FRAMES):
+    """Tests for the given ROMs and every ROM under the given directories.
+       A ROM with a .log file of the same name is a trace test."""
+
+    roms = []
+
+    for path in paths:
+        if os.path.isdir(path):
+            for root, directories, files in os.walk(path):
+                directories.sort()
+                roms.extend(os.path.join(root, name) for name in sorted(files)
+                            if name.lower().endswith(".nes"))
+        else:
+            roms.append(path)
+
+    tests = []
+
+    for rom in roms:
+        log = os.path.splitext(rom)[0] + ".log"
+        tests.append(Test(rom, log if os.path.isfile(log) else None, frames))
+
+    return tests
+
+
+def line_fields(line):
+    """The instruction and register fields of a nestest.log line"""
+
+    fields = {"PC": line[:4], "instruction": line[16:48].rstrip()}
+    fields.update(FIELD.findall(line[48:]))
+
+    return fields
+
+
+def compare_fields(expected, actual):
+    """(name, expected, actual) for every field two log lines differ in"""
+
+    expected = line_fields(expected)
+    actual = line_fields(actual)
+
+    return [(name, expected[name], actual.get(name))
+            for name in expected if expected[name] != actual.get(name)]
+
+
+def run_test(numbered):
+    """Runs one test in a worker, returning its result dict"""
+
+    index, test = numbered
+    result = {"index": index, "rom": test.rom, "passed": False,
+              "message": None}
+
+    try:
+        console = nes.create_nes()
+        console.load_rom(test.rom)
+    except (OSError, RomError) as error:
+        result["message"] = getattr(error, "message", None) or str(error)
+        return result
+    except Exception:
+        result["message"] = traceback.format_exc().rstrip()
+        return result
+
+    try:
+        console.ppu.set_render_interval(0)
+
+        if test.log is not None:
+            result.update(run_trace_test(console, test.log))
+        else:
+            result.update(run_status_test(console, test.frames))
+    except Exception:
+        result["message"] = traceback.format_exc().rstrip()
+
+    return result
+
+
+def run_trace_test(console, log_path, context=CONTEXT_LINES):
+    """Compares the console's trace with a golden log, returning the
+       result fields"""
+
+    cpu = console.cpu
+    before = collections.deque(maxlen=context)
+    matched = 0
+    error = None
+
+    with open(log_path) as log:
+        first = log.readline().rstrip("\r\n")
+
+        if not first:
+            return {"passed": True, "lines": 0,
+                    "message": "the log is empty"}
+
+        # start from the state on the log's first line
+        fields = line_fields(first)
+        cpu.pc = int(fields["PC"], 16)
+        cpu.a, cpu.x, cpu.y, cpu.p, cpu.sp = [
+            int(fields[name], 16) for name in ("A", "X", "Y", "P", "SP")]
+        cpu.cycles = int(fields["CYC"])
+
+        tracer = cpu.enable_tracing(capacity=TRACE_CHUNK)
+        expected = first
+
+        try:
+            while True:
+                try:
+                    console.run(TRACE_CHUNK)
+                except CpuError as cpu_error:
+                    error = cpu_error.message
+
+                for actual in format_records(tracer.take()):
+                    if actual != expected:
+                        after = [line.rstrip("\r\n")
+                                 for line in (log.readline()
+                                              for count in range(context))
+                                 if line]
+
+                        return {
+                            "lines": matched,
+                            "message": error,
+                            "divergence": Divergence(
+                                matched + 1, expected, actual,
+                                compare_fields(expected, actual),
+                                list(before), after)
+                        }
+
+                    matched += 1
+                    before.append(expected)
+                    expected = log.readline().rstrip("\r\n")
+
+                    if not expected:
+                        return {"passed": True, "lines": matched}
+
+                if error is not None:
+                    return {"lines": matched, "message": error,
+                            "divergence": Divergence(
+                                matched + 1, expected, None, [],
+                                list(before), [])}
+        finally:
+            cpu.disable_tracing()
+
+
+def run_status_test(console, frames):
+    """Runs a ROM until it reports a result through $6000, returning the
+       result fields"""
+
+    prg_ram = console.cpu.mapper.prg_ram
+    reset_at = None
+
+    try:
+        for frame in range(frames):
+            console.run_frame()
+
+            if prg_ram[1:4] != STATUS_SIGNATURE:
+                continue
+
+            status = prg_ram[0]
+
+            if status == STATUS_RESET:
+                if reset_at is None:
+                    reset_at = frame + RESET_DELAY
+                elif frame >= reset_at:
+                    console.reset()
+                    reset_at = None
+            elif status != STATUS_RUNNING:
+                return {"passed": not status, "status": status,
+                        "frames": frame + 1,
+                        "message": status_text(prg_ram)}
+    except CpuError as error:
+        return {"frames": frame + 1, "message": error.message}
+
+    return {"frames": frames, "message": "timed out: " +
+            status_text(prg_ram)}
+
+
+def status_text(prg_ram):
+    """The message a status protocol test has written from $6004"""
+
+    end = prg_ram.find(b"\x00", 4)
+    text = prg_ram[4:end if end >= 0 else len(prg_ram)]
+
+    return text.decode("ascii", errors="replace").strip()
+
+
+def run_suite(tests, processes=None):
+    """Runs tests across processes workers (one per core by default),
+       yielding each result as soon as it is ready. Results carry the
+       index of their test."""
+
+    with multiprocessing.Pool(processes) as pool:
+        for result in pool.imap_unordered(run_test, enumerate(tests)):
+            yield result
+
+
+def describe(result):
+    """A test result as lines of text: a verdict, then any divergence"""
+
+    verdict = "PASS" if result["passed"] else "FAIL"
+    lines = ["%s  %s" % (verdict, result["rom"])]
+
+    if result.get("message"):
+        lines.extend("      " + line
+                     for line in result["message"].splitlines())
+
+    divergence = result.get("divergence")
+
+    if divergence is not None:
+        first = divergence.line - len(divergence.before)
+
+        lines.append("      first divergence at log line %d" %
+                     divergence.line)
+
+        for name, expected, actual in divergence.fields:
+            lines.append("      %-11s expected %s, got %s" %
+                         (name, expected, actual))
+
+        for number, line in enumerate(divergence.before, first):
+            lines.append("  %7d  %s" % (number, line))
+
+        lines.append("- %7d  %s" % (divergence.line, divergence.expected))
+        lines.append("+ %7d  %s" % (divergence.line,
+                                    divergence.actual or "(stopped)"))
+
+        for number, line in enumerate(divergence.after,
+                                      divergence.line + 1):
+            lines.append("  %7d  %s" % (number, line))
+
+    return lines
@@ -3,6 +3,70 @@
 # CPU Name
 CPU_NAME = "Ricoh 2A03"
 
+# PPU Timing, in PPU dots
+DOTS_PER_LINE = 341
+LINES_PER_FRAME = 262
+DOTS_PER_FRAME = DOTS_PER_LINE * LINES_PER_FRAME
+VISIBLE_LINES = 240
+VBLANK_LINE = 241
+PRERENDER_LINE = 261
+
+# PPU dots per CPU cycle
+PPU_DOTS_PER_CYCLE = 3
+
+# CPU cycles per second (NTSC)
+CPU_CLOCK_RATE = 1789773
+
+# APU Status ($4015)
+STATUS_PULSE_1 = 0b00000001
+STATUS_PULSE_2 = 0b00000010
+STATUS_TRIANGLE = 0b00000100
+STATUS_NOISE = 0b00001000
+STATUS_DMC = 0b00010000
+STATUS_FRAME_IRQ = 0b01000000
+STATUS_DMC_IRQ = 0b10000000
+
+# APU Frame Counter ($4017)
+FRAME_FIVE_STEP = 0b10000000
+FRAME_IRQ_INHIBIT = 0b01000000
+
+# Audio output samples per second
+AUDIO_SAMPLE_RATE = 44100
+
+# Controller Buttons, in the order $4016/$4017 report them
+BUTTON_A = 0b00000001
+BUTTON_B = 0b00000010
+BUTTON_SELECT = 0b00000100
+BUTTON_START = 0b00001000
+BUTTON_UP = 0b00010000
+BUTTON_DOWN = 0b00100000
+BUTTON_LEFT = 0b01000000
+BUTTON_RIGHT = 0b10000000
+
+# FM2 Movie Commands, per frame
+COMMAND_RESET = 0b00000001
+COMMAND_POWER = 0b00000010
+
+# PPU Control ($2000)
+CTRL_NAMETABLE = 0b00000011
+CTRL_INCREMENT = 0b00000100
+CTRL_SPRITE_TABLE = 0b00001000
+CTRL_BACKGROUND_TABLE = 0b00010000
+CTRL_SPRITE_SIZE = 0b00100000
+CTRL_NMI = 0b10000000
+
+# PPU Mask ($2001)
+MASK_GRAYSCALE = 0b00000001
+MASK_BACKGROUND_LEFT = 0b00000010
+MASK_SPRITES_LEFT = 0b00000100
+MASK_BACKGROUND = 0b00001000
+MASK_SPRITES = 0b00010000
+
+# PPU Status ($2002)
+STATUS_OVERFLOW = 0b00100000
+STATUS_SPRITE_ZERO = 0b01000000
+STATUS_VBLANK = 0b10000000
+
 # Memory Types
 TYPE_CPU = "cpu"
 TYPE_PPU = "ppu"
@@ -20,6 +84,23 @@ SRAM = "SRAM"
 PRGROM_LOW = "PRG-ROM Lower Bank"
 PRGROM_UP = "PRG-ROM Upper Bank"
 
+# Nametable Mirroring
+MIRROR_HORIZONTAL = "Horizontal"
+MIRROR_VERTICAL = "Vertical"
+MIRROR_FOUR_SCREEN = "Four Screen"
+MIRROR_SINGLE_LOW = "Single Screen Low"
+MIRROR_SINGLE_HIGH = "Single Screen High"
+
+# ROM Formats
+FORMAT_INES = "iNES"
+FORMAT_NES2 = "NES 2.0"
+
+# TV Systems
+REGION_NTSC = "NTSC"
+REGION_PAL = "PAL"
+REGION_MULTIPLE = "Multiple"
+REGION_DENDY = "Dendy"
+
 # Addressing Modes
 ADDR_IMPLICIT = "Implicit"
 ADDR_ACCUMULATOR = "Accumulator"
@@ -35,9 +116,25 @@ ADDR_INDIRECT = "Indirect"
 ADDR_INDEXED_INDIRECT = "Indexed Indirect"
 ADDR_INDIRECT_INDEXED = "Indirect Indexed"
 
+# Batch Job Outputs
+OUTPUT_RAM_HASH = "ram_hash"
+OUTPUT_FRAME_CHECKSUMS = "frame_checksums"
+OUTPUT_SCREENSHOT = "screenshot"
+
+# Interrupt Vectors
+VECTOR_NMI = 0xfffa
+VECTOR_RESET = 0xfffc
+VECTOR_IRQ = 0xfffe
+
+# IRQ Sources, one bit each on the shared IRQ line
+IRQ_MAPPER = 0b001
+IRQ_FRAME_COUNTER = 0b010
+IRQ_DMC = 0b100
+
 # Flags
 FLAG_NEGATIVE = 0b10000000
 FLAG_OVERFLOW = 0b01000000
+FLAG_UNUSED = 0b00100000
 FLAG_BREAK = 0b00010000
 FLAG_DECIMAL = 0b00001000
 FLAG_INTERRUPT = 0b00000100
@@ -47,3 +144,18 @@ FLAG_CARRY = 0b00000001
 # Exception Strings
 EXCEPTION_MEMORY_LESS_ZERO = "The requested memory location is less than zero."
 EXCEPTION_MEMORY_EXCEEDS_MAX = "The requested memory location is greater than the maximum memory size."
+EXCEPTION_INVALID_OPCODE = "The opcode is not a documented 6502 instruction."
+EXCEPTION_ROM_TOO_SHORT = "The file is too short to be an iNES image."
+EXCEPTION_ROM_BAD_MAGIC = "The file does not start with the iNES signature."
+EXCEPTION_ROM_TRUNCATED = "The file is shorter than its header says it is."
+EXCEPTION_UNSUPPORTED_MAPPER = "The cartridge uses a mapper that is not implemented."
+EXCEPTION_STATE_BAD_MAGIC = "The data is not a save state."
+EXCEPTION_STATE_VERSION = "The save state was written by an incompatible version."
+EXCEPTION_STATE_WRONG_ROM = "The save state is for a different cartridge."
+EXCEPTION_STATE_TRUNCATED = "The save state is shorter than its layout requires."
+EXCEPTION_MOVIE_BINARY = "Binary FM2 movies are not supported."
+EXCEPTION_MOVIE_BAD_LINE = "The movie has a malformed input line."
+EXCEPTION_MOVIE_DEVICE = "The movie uses an input device other than gamepads."
+EXCEPTION_MOVIE_COMMAND = "The movie uses a command other than soft reset."
+EXCEPTION_MOVIE_WRONG_ROM = "The movie was recorded with a different cartridge."
+EXCEPTION_TRACE_NO_STREAM = "The trace is not being streamed, so flushing it needs a path."
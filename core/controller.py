@@ -0,0 +1,155 @@
+"""This module defines the two standard controllers on $4016 and $4017.
+
+   Writing bit 0 of $4016 latches both controllers' buttons into shift
+   registers, which each read of $4016 (port 1) or $4017 (port 2) then
+   shifts out a bit at a time, A first. Writes to $4017 belong to the APU.
+
+   Buttons come from set_buttons(), or from a movie being played, in which
+   case the latch reads them from the movie's per-frame input arrays by the
+   PPU's frame number. Nothing is looked up per read, and playing a movie
+   costs one index per latch, so replay runs as fast as the core does. A
+   movie being recorded gets the buttons of every frame the game latched
+   them on."""
+
+# Bytes save_state() returns
+STATE_SIZE = 3
+
+
+def create_controllers():
+    """Returns the pair of controllers for use outside of this module."""
+    return Controllers()
+
+
+class Controllers(object):
+    """This class defines the pair of standard controllers."""
+
+    def __init__(self):
+        # Set by connect()
+        self.ppu = None
+
+        # Buttons held on each port, as BUTTON_* bits
+        self.buttons = bytearray(2)
+
+        # What each port's next reads shift out, and the strobe bit, which
+        # while set keeps reloading them
+        self.shifts = [0, 0]
+        self.strobe = 0
+
+        # The movie being played or recorded, and the PPU frame that is its
+        # frame 0
+        self.movie = None
+        self.recording = False
+        self.movie_start = 0
+
+    def connect(self, memory, ppu):
+        """Maps the ports into the CPU's memory bus. Frame numbers for
+           movies come from the PPU."""
+
+        self.ppu = ppu
+
+        memory.map_register(0x4016, read=self.read_port,
+                            write=self.write_strobe)
+        memory.map_register(0x4017, read=self.read_port)
+
+    def set_buttons(self, port, buttons):
+        """Holds down BUTTON_* bits on port 0 or 1, from the next latch on"""
+
+        self.buttons[port] = buttons
+
+    ### Registers ###
+
+    def read_port(self, loc):
+        """Reads $4016 or $4017: the next button, in bit 0, over open bus"""
+
+        port = loc & 1
+
+        if self.strobe:
+            self.latch()
+
+        shift = self.shifts[port]
+
+        # once all eight are out, official controllers read back 1s
+        self.shifts[port] = shift >> 1 | 0x80
+
+        return 0x40 | shift & 1
+
+    def write_strobe(self, loc, data):
+        """Writes $4016: sets the strobe, latching the buttons"""
+
+        self.strobe = data & 1
+        self.latch()
+
+    def latch(self):
+        """Loads both shift registers from the buttons held this frame"""
+
+        if self.movie is not None:
+            index = self.ppu.frame - self.movie_start
+
+            if self.recording:
+                self.movie.set_frame(index, self.buttons[0],
+                                     self.buttons[1])
+            elif 0 <= index < len(self.movie.commands):
+                self.buttons[0] = self.movie.inputs[0][index]
+                self.buttons[1] = self.movie.inputs[1][index]
+
+        self.shifts[0] = self.buttons[0]
+        self.shifts[1] = self.buttons[1]
+
+    ### Movies ###
+
+    def play(self, movie):
+        """Takes the buttons from a movie, whose frame 0 is the frame the
+           PPU is on now. Past its last frame the last buttons stay held."""
+
+        self.movie = movie
+        self.recording = False
+        self.movie_start = self.ppu.frame
+
+    def record(self, movie):
+        """Appends the buttons held from the frame the PPU is on now to a
+           movie, until stop()"""
+
+        self.movie = movie
+        self.recording = True
+        self.movie_start = self.ppu.frame
+
+    def command(self, command):
+        """Notes a COMMAND_* bit, such as a reset, on the frame being
+           recorded, if any"""
+
+        if self.movie is not None and self.recording:
+            index = self.ppu.frame - self.movie_start
+            self.movie.set_frame(index, self.buttons[0], self.buttons[1])
+            self.movie.commands[index] |= command
+
+    def stop(self):
+        """Stops playing or recording, returning the movie. A recording is
+           padded out to the frame the PPU is on now."""
+
+        movie = self.movie
+
+        if movie is not None and self.recording:
+            frames = self.ppu.frame - self.movie_start
+
+            if frames > len(movie.commands):
+                movie.set_frame(frames - 1, self.buttons[0], self.buttons[1])
+
+        self.movie = None
+        self.recording = False
+
+        return movie
+
+    ### Save States ###
+
+    def save_state(self):
+        """The strobe and shift registers as bytes. The buttons held are
+           input rather than state, so a state's hash only changes with
+           what the game has read."""
+
+        return bytes([self.strobe, self.shifts[0], self.shifts[1]])
+
+    def load_state(self, state):
+        """Restores what save_state() returned"""
+
+        self.strobe = state[0]
+        self.shifts = [state[1], state[2]]
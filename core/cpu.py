@@ -1,9 +1,19 @@
 """This module defines the behavior of the NES Central Processing Unit, an
    offshoot of the Ricoh 2A03. It is fully implemented in this class."""
 
-from ctypes import c_uint8, c_uint16
+import blockcache
 import constants as const
+import debugger
+import idleloop
+from alu import ZN_TABLE, ADC_RESULT, ADC_FLAGS, SBC_RESULT, SBC_FLAGS, \
+    KEEP_ZN, KEEP_CZN, KEEP_ZVN, KEEP_CZVN
 import memory as mem
+import mappers
+import profiler
+import rom as cart
+import tracer
+from exceptions.cpuexceptions import InvalidOpcodeError
+from instructions import MODE_BYTES, INSTRUCTIONS, ADDRESS_OPERANDS
 
 def create_cpu():
     """Returns a new instance of a CPU for use outside of this module."""
@@ -36,6 +46,17 @@ class CPU(object):
         # Processor Status
         self.p = 0b00110100
 
+        # Inserted cartridge, if any, and the mapper driving it
+        self.rom = None
+        self.mapper = None
+
+        # Cycles elapsed since power on
+        self.cycles = 0
+
+        # run() stops once cycles reaches this. Interrupt events pull it in
+        # while the CPU is running, so it is the only thing the loop checks.
+        self.deadline = 0
+
         # Opcodes
         self.opcodes = {
             0x69: self.adc, 0x65: self.adc, 0x75: self.adc,
@@ -91,66 +112,473 @@ class CPU(object):
             0x98: self.tya
         }
 
+        # Operand resolvers, each returning (address, page crossed)
+        self.addressing = {
+            const.ADDR_ZERO_PAGE: self.addr_zero_page,
+            const.ADDR_ZERO_PAGE_X: self.addr_zero_page_x,
+            const.ADDR_ZERO_PAGE_Y: self.addr_zero_page_y,
+            const.ADDR_ABSOLUTE: self.addr_absolute,
+            const.ADDR_ABSOLUTE_X: self.addr_absolute_x,
+            const.ADDR_ABSOLUTE_Y: self.addr_absolute_y,
+            const.ADDR_INDIRECT: self.addr_indirect,
+            const.ADDR_INDEXED_INDIRECT: self.addr_indexed_indirect,
+            const.ADDR_INDIRECT_INDEXED: self.addr_indirect_indexed
+        }
+
+        # 256-entry dispatch list of fused instructions, indexed by opcode
+        self.dispatch = []
+        self.build_dispatch()
+
+        # Translated block cache, when that execution mode is on
+        self.block_cache = None
+
+        # Instruction tracer, while tracing is on
+        self.tracer = None
+
+        # Hotspot profiler, while profiling is on
+        self.profiler = None
+
+        # Idle loop skipper, while that is on
+        self.idle_loops = None
+
+        # Breakpoints and watchpoints, once debugging is on
+        self.debugger = None
+
+        # Set by the interrupt controller while anything holds IRQ, so that
+        # clearing the interrupt disable flag stops run() to take it
+        self.irq_held = False
+
+        # Set when the debugger stops the CPU, until it resumes. run() does
+        # nothing while it is set, and the scheduler stops with it.
+        self.stopped = False
+
+        # The loop run() hands off to, swapped when execution modes change
+        self.runner = self.run_interpreted
+
     def initialize_cpu(self):
         """Initialize CPU and begin execution"""
 
-        self.pc = self.memory.read(0xfffc) << 8 | self.memory.read(0xfffd)
+        # the reset vector is stored little-endian, and the reset sequence
+        # itself takes seven cycles before the first instruction is fetched
+        self.pc = self.read_word(const.VECTOR_RESET)
+        self.cycles += 7
+
+    def load_rom(self, path):
+        """Inserts a cartridge, lets its mapper take over PRG-ROM space and
+           resets"""
+
+        return self.insert_rom(cart.load_rom(path))
+
+    def insert_rom(self, rom):
+        """Inserts an already loaded cartridge and resets"""
+
+        self.rom = rom
+        self.mapper = mappers.create_mapper(self.rom, self.memory)
+        self.initialize_cpu()
+
+        return self.rom
+
+    def build_dispatch(self):
+        """Builds the dispatch list used by step() and run()"""
+
+        self.dispatch = [self.bind_instruction(op) for op in range(0x100)]
+
+    def bind_instruction(self, opcode):
+        """Fuses an opcode's handler, addressing mode, length and timing into
+           a single callable, so executing an instruction is one list index
+           and one call"""
+
+        cpu = self
+        read = self.memory.load
+
+        if opcode not in self.opcodes:
+            def execute():
+                raise InvalidOpcodeError(opcode, cpu.pc,
+                                         const.EXCEPTION_INVALID_OPCODE)
+
+            return execute
+
+        handler = self.opcodes[opcode]
+        mode, cycles, penalty = INSTRUCTIONS[opcode]
+        length = MODE_BYTES[mode]
+
+        if mode in (const.ADDR_IMPLICIT, const.ADDR_ACCUMULATOR):
+            def execute():
+                cpu.pc = (cpu.pc + 1) & 0xffff
+                cpu.cycles += cycles
+                handler()
+        elif mode == const.ADDR_IMMEDIATE:
+            def execute():
+                pc = cpu.pc
+                cpu.pc = (pc + 2) & 0xffff
+                cpu.cycles += cycles
+                handler(read((pc + 1) & 0xffff))
+        elif mode == const.ADDR_RELATIVE:
+            def execute():
+                pc = cpu.pc
+                offset = read((pc + 1) & 0xffff)
+                cpu.pc = (pc + 2) & 0xffff
+                cpu.cycles += cycles
+                handler(offset - 0x100 if offset & 0x80 else offset)
+        else:
+            resolve = self.addressing[mode]
+
+            if handler.__name__ in ADDRESS_OPERANDS:
+                def execute():
+                    pc = cpu.pc
+                    cpu.pc = (pc + length) & 0xffff
+                    cpu.cycles += cycles
+                    handler(resolve((pc + 1) & 0xffff)[0])
+            elif penalty:
+                def execute():
+                    pc = cpu.pc
+                    cpu.pc = (pc + length) & 0xffff
+                    address, crossed = resolve((pc + 1) & 0xffff)
+                    cpu.cycles += cycles + crossed
+                    handler(read(address))
+            else:
+                def execute():
+                    pc = cpu.pc
+                    cpu.pc = (pc + length) & 0xffff
+                    cpu.cycles += cycles
+                    handler(read(resolve((pc + 1) & 0xffff)[0]))
+
+        return execute
+
+    def step(self):
+        """Executes a single instruction, returning the cycles it took"""
+
+        start = self.cycles
+        self.dispatch[self.memory.load(self.pc)]()
+
+        return self.cycles - start
+
+    def run(self, cycles):
+        """Executes instructions until at least the given number of cycles
+           have elapsed, returning the number of cycles actually run"""
+
+        start = self.cycles
+        self.deadline = start + cycles
+        self.runner()
+
+        return self.cycles - start
+
+    def run_interpreted(self):
+        """Interprets one instruction at a time until the cycle count
+           reaches the deadline"""
+
+        dispatch = self.dispatch
+        read = self.memory.load
+
+        while self.cycles < self.deadline:
+            dispatch[read(self.pc)]()
+
+    def enable_block_cache(self):
+        """Switches run() to executing translated blocks"""
+
+        if self.block_cache is None:
+            self.block_cache = blockcache.BlockCache(self)
+
+        self.select_runner()
+
+        return self.block_cache
+
+    def disable_block_cache(self):
+        """Switches run() back to the interpreter and drops the cache"""
+
+        if self.block_cache is not None:
+            self.block_cache.close()
+            self.block_cache = None
+
+        self.select_runner()
+
+    def enable_tracing(self, path=None, capacity=tracer.DEFAULT_CAPACITY):
+        """Starts recording every instruction run() executes, streaming
+           them to path if one is given, and returns the tracer"""
+
+        self.disable_tracing()
+        self.tracer = tracer.Tracer(self, capacity, path)
+        self.select_runner()
+
+        return self.tracer
+
+    def disable_tracing(self):
+        """Stops tracing, waiting for anything being written to finish"""
+
+        if self.tracer is not None:
+            self.tracer.close()
+            self.tracer = None
+
+        self.select_runner()
+
+    def enable_profiling(self):
+        """Starts counting where run() spends its cycles, returning the
+           profiler"""
+
+        if self.profiler is None:
+            self.profiler = profiler.Profiler(self)
+
+        self.select_runner()
+
+        return self.profiler
+
+    def disable_profiling(self):
+        """Stops profiling, returning the profiler with its counts"""
+
+        done = self.profiler
+
+        if done is not None:
+            done.close()
+            self.profiler = None
+
+        self.select_runner()
+
+        return done
+
+    def enable_idle_skipping(self):
+        """Starts fast-forwarding through loops that are waiting on
+           something outside the CPU, returning the skipper so that
+           registers loops may poll can be added to it"""
+
+        if self.idle_loops is None:
+            self.idle_loops = idleloop.IdleLoops(self)
+
+        return self.idle_loops
+
+    def disable_idle_skipping(self):
+        """Goes back to interpreting every iteration of every loop"""
+
+        if self.idle_loops is not None:
+            self.idle_loops.close()
+            self.idle_loops = None
+
+    def enable_debugging(self):
+        """Returns the debugger, creating it if need be. It costs nothing
+           until a breakpoint or watchpoint is armed."""
+
+        if self.debugger is None:
+            self.debugger = debugger.Debugger(self)
+
+        return self.debugger
+
+    def disable_debugging(self):
+        """Disarms every breakpoint and watchpoint and drops the debugger"""
+
+        if self.debugger is not None:
+            self.debugger.close()
+            self.debugger = None
+
+        self.select_runner()
+
+    def select_runner(self):
+        """Points run() at the loop for the execution modes that are on.
+           Armed breakpoints win over everything, since stopping matters
+           more than tracing what comes after. Tracing and profiling win
+           over the block cache, since they need to see every instruction."""
+
+        if self.debugger is not None and self.debugger.armed():
+            self.runner = self.debugger.run
+        elif self.tracer is not None:
+            self.runner = self.tracer.run
+        elif self.profiler is not None:
+            self.runner = self.profiler.run
+        elif self.block_cache is not None:
+            self.runner = self.block_cache.run
+        else:
+            self.runner = self.run_interpreted
+
+    def reset(self):
+        """Services the reset line. The stack pointer moves as if three
+           bytes were pushed, but nothing is written."""
+
+        self.sp = (self.sp - 3) & 0xff
+        self.p |= const.FLAG_INTERRUPT
+        self.initialize_cpu()
+
+    def nmi(self):
+        """Services a non-maskable interrupt"""
+
+        self.interrupt(const.VECTOR_NMI)
+
+    def irq(self):
+        """Services a maskable interrupt, which the caller has checked is
+           not disabled"""
+
+        self.interrupt(const.VECTOR_IRQ)
+
+    def interrupt(self, vector):
+        """Pushes the PC and status and jumps through a vector"""
+
+        # same as BRK, but with the break bit clear on the stack
+        self.push_pc()
+        self.push_stack(self.p & ~(const.FLAG_BREAK) | const.FLAG_UNUSED)
+        self.p |= const.FLAG_INTERRUPT
+        self.pc = self.read_word(vector)
+        self.cycles += 7
+
+    def unmasked(self):
+        """Called when an instruction may have cleared the interrupt disable
+           flag. A held IRQ is taken once the instruction finishes."""
+
+        if self.irq_held and not self.p & const.FLAG_INTERRUPT and \
+                self.cycles < self.deadline:
+            self.deadline = self.cycles
+
+    ### Addressing Modes ###
+
+    def read_word(self, loc):
+        """Reads a little-endian 16-bit word"""
+
+        return self.memory.load(loc) | \
+            self.memory.load((loc + 1) & 0xffff) << 8
+
+    def read_word_zero_page(self, loc):
+        """Reads a 16-bit pointer from the zero page, wrapping within it"""
+
+        return self.memory.load(loc) | self.memory.load((loc + 1) & 0xff) << 8
+
+    def addr_zero_page(self, pc):
+        """Zero Page"""
+
+        return self.memory.load(pc), 0
+
+    def addr_zero_page_x(self, pc):
+        """Zero Page,X -- wraps around within the zero page"""
+
+        return (self.memory.load(pc) + self.x) & 0xff, 0
+
+    def addr_zero_page_y(self, pc):
+        """Zero Page,Y -- wraps around within the zero page"""
+
+        return (self.memory.load(pc) + self.y) & 0xff, 0
+
+    def addr_absolute(self, pc):
+        """Absolute"""
+
+        return self.read_word(pc), 0
+
+    def addr_absolute_x(self, pc):
+        """Absolute,X"""
+
+        base = self.read_word(pc)
+        address = (base + self.x) & 0xffff
+
+        return address, (base ^ address) > 0xff
+
+    def addr_absolute_y(self, pc):
+        """Absolute,Y"""
+
+        base = self.read_word(pc)
+        address = (base + self.y) & 0xffff
+
+        return address, (base ^ address) > 0xff
+
+    def addr_indirect(self, pc):
+        """Indirect -- only used by JMP"""
+
+        pointer = self.read_word(pc)
+
+        # the high byte is fetched without carrying into the pointer's page
+        high = (pointer & 0xff00) | ((pointer + 1) & 0xff)
+
+        return self.memory.load(pointer) | self.memory.load(high) << 8, 0
+
+    def addr_indexed_indirect(self, pc):
+        """(Indirect,X)"""
+
+        pointer = (self.memory.load(pc) + self.x) & 0xff
+
+        return self.read_word_zero_page(pointer), 0
+
+    def addr_indirect_indexed(self, pc):
+        """(Indirect),Y"""
+
+        base = self.read_word_zero_page(self.memory.load(pc))
+        address = (base + self.y) & 0xffff
+
+        return address, (base ^ address) > 0xff
+
+    ### Helpers ###
 
     def set_z(self, value):
         """Sets the zero flag if appropriate"""
 
         # set the zero register if value is zero
-        self.p &= ~(const.FLAG_ZERO)
-        self.p |= const.FLAG_ZERO if value == 0b0 else 0b0
+        self.p = self.p & ~(const.FLAG_ZERO) | \
+            ZN_TABLE[value] & const.FLAG_ZERO
 
     def set_n(self, value):
         """Sets the negative flag if appropriate"""
 
         # set the negative register if greater than 0x80
-        self.p &= ~(const.FLAG_NEGATIVE)
-        self.p |= const.FLAG_NEGATIVE if value >= 0x80 else 0b0
+        self.p = self.p & ~(const.FLAG_NEGATIVE) | value & const.FLAG_NEGATIVE
 
     def set_zn(self, value):
         """Shortcut to set both zero and negative flags--happens frequently"""
-        self.set_z(value)
-        self.set_n(value)
+        self.p = self.p & KEEP_ZN | ZN_TABLE[value]
 
     def dec_sp(self):
         """Decrement stack pointer"""
 
         # no such thing as stack overflow. only loops.
-        self.sp = c_uint8(self.sp - 1).value
+        self.sp = (self.sp - 1) & 0xff
 
     def inc_sp(self):
         """Increment stack pointer"""
 
         # similar to above
-        self.sp = c_uint8(self.sp + 1).value
+        self.sp = (self.sp + 1) & 0xff
 
     def push_stack(self, data):
         """Push a byte to the stack"""
 
-        self.memory.write(0x0100 + self.sp, data)
-        self.dec_sp()
+        self.memory.store(0x0100 + self.sp, data)
+        self.sp = (self.sp - 1) & 0xff
 
     def push_pc(self):
         """Push PC to the stack"""
 
-        self.push_stack((self.pc & 0b1111111100000000) >> 8)
-        self.push_stack(self.pc & 0b11111111)
+        self.push_stack(self.pc >> 8)
+        self.push_stack(self.pc & 0xff)
 
     def read_stack(self):
         """Read a byte from the stack"""
 
-        result = self.memory.read(0x100 + self.sp)
-        self.inc_sp()
+        # the stack pointer addresses the next free slot, so step back first
+        self.sp = (self.sp + 1) & 0xff
 
-        return result
+        return self.memory.load(0x100 + self.sp)
 
     def read_pc(self):
         """Read PC from the stack"""
 
-        self.pc = self.read_stack() << 8 | self.read_stack()
+        # low byte was pushed last, so it comes off first
+        self.pc = self.read_stack() | self.read_stack() << 8
+
+        return self.pc
+
+    def write_result(self, loc, value):
+        """Stores a shift or rotate result in A, or in memory if given a
+           location"""
+
+        if loc is None:
+            self.a = value
+        else:
+            self.memory.store(loc, value)
+
+    def branch(self, offset):
+        """Takes a branch, adding a cycle plus another if a page is crossed"""
+
+        target = (self.pc + offset) & 0xffff
+        self.cycles += 1 + ((target ^ self.pc) > 0xff)
+        self.pc = target
+
+    def compare(self, register, arg):
+        """Sets carry, zero and negative as for register - arg"""
+
+        # carry is set when no borrow was needed, i.e. register >= arg
+        self.p = self.p & KEEP_CZN | ZN_TABLE[(register - arg) & 0xff] | \
+            (register >= arg)
 
     def print_cpu_state(self):
         """Prints out current CPU state, using for testing"""
@@ -166,23 +594,11 @@ class CPU(object):
     def adc(self, arg):
         """Add with Carry"""
 
-        # add A register + argument + carry bit
-        result = self.a + arg + (self.p & const.FLAG_CARRY)
-        uint_result = c_uint8(result).value
-
-        # set carry bit if the result is greater than 255
-        self.p &= ~(const.FLAG_CARRY)
-        self.p |= result > 0xff
-
-        # set the overflow register if the sign has flipped
-        sign_flipped = ~(self.a ^ arg) & (self.a ^ result) & 0x80 == 0x80
-        self.p |= const.FLAG_OVERFLOW if sign_flipped else 0b0
+        # look up A register + argument + carry bit, and the flags it sets
+        index = self.a << 9 | arg << 1 | self.p & const.FLAG_CARRY
 
-        # set zero and/or negative flags
-        self.set_zn(uint_result)
-
-        # save the result to the A register, as a uint8
-        self.a = uint_result
+        self.p = self.p & KEEP_CZVN | ADC_FLAGS[index]
+        self.a = ADC_RESULT[index]
 
     def _and(self, arg):
         """Logical AND"""
@@ -191,96 +607,95 @@ class CPU(object):
         result = self.a & arg
 
         # set zero and/or negative flags
-        self.set_zn(result)
+        self.p = self.p & KEEP_ZN | ZN_TABLE[result]
 
         # save the result to the A register
         self.a = result
 
-    def asl(self, arg):
+    def asl(self, loc=None):
         """Arithmetic Shift Left"""
 
-        # bit shift the argument left
-        result = arg << 1
-        uint_result = c_uint8(result).value
+        # shift the accumulator unless given a memory location
+        arg = self.a if loc is None else self.memory.load(loc)
 
-        # set the carry bit to the value of bit 7
-        self.p &= ~(const.FLAG_CARRY)
-        self.p |= 0b10000000 & arg > 0
+        # bit shift the argument left
+        result = (arg << 1) & 0xff
 
-        # set zero and/or negative flags
-        self.set_zn(uint_result)
+        # set the carry bit to the value of bit 7, plus zero and negative
+        self.p = self.p & KEEP_CZN | ZN_TABLE[result] | arg >> 7
 
-        #save the result to the A register
-        self.a = uint_result
+        # save the result to the A register or back to memory
+        self.write_result(loc, result)
 
     def bcc(self, arg):
         """Branch if Carry Clear"""
 
-        self.pc += arg if not self.p & const.FLAG_CARRY else 0
-        self.pc = c_uint16(self.pc).value
+        if not self.p & const.FLAG_CARRY:
+            self.branch(arg)
 
     def bcs(self, arg):
         """Branch if Carry Set"""
 
-        self.pc += arg if self.p & const.FLAG_CARRY else 0
-        self.pc = c_uint16(self.pc).value
+        if self.p & const.FLAG_CARRY:
+            self.branch(arg)
 
     def beq(self, arg):
         """Branch if Equal"""
 
-        self.pc += arg if self.p & const.FLAG_ZERO else 0
-        self.pc = c_uint16(self.pc).value
+        if self.p & const.FLAG_ZERO:
+            self.branch(arg)
 
     def bit(self, arg):
         """Bit Test"""
 
-        # perform a logical AND between A & M
-        result = self.a & arg
-        self.set_z(result)
-
-        # set bits 6 and 7 in the status register to bits 6 and 7 of memory
-        self.p &= 0b11111100
-        self.p |= (arg & 0b11)
+        # zero comes from A & M, bits 6 and 7 are copied from memory
+        self.p = self.p & KEEP_ZVN | \
+            ZN_TABLE[self.a & arg] & const.FLAG_ZERO | \
+            arg & (const.FLAG_NEGATIVE | const.FLAG_OVERFLOW)
 
     def bmi(self, arg):
         """Branch if Minus"""
 
-        self.pc += arg if self.p & const.FLAG_NEGATIVE else 0
-        self.pc = c_uint16(self.pc).value
+        if self.p & const.FLAG_NEGATIVE:
+            self.branch(arg)
 
     def bne(self, arg):
         """Branch if Not Equal"""
 
-        self.pc += arg if not self.p & const.FLAG_ZERO else 0
-        self.pc = c_uint16(self.pc).value
+        if not self.p & const.FLAG_ZERO:
+            self.branch(arg)
 
     def bpl(self, arg):
         """Branch if Positive"""
 
-        self.pc += arg if not self.p & const.FLAG_NEGATIVE else 0
-        self.pc = c_uint16(self.pc).value
+        if not self.p & const.FLAG_NEGATIVE:
+            self.branch(arg)
 
     def brk(self):
         """Break"""
 
-        # write PC and status to the stack
+        # BRK is followed by a padding byte which the return skips over
+        self.pc = (self.pc + 1) & 0xffff
+
+        # write PC and status to the stack, marking this as a software break
         self.push_pc()
-        self.push_stack(self.p)
+        self.push_stack(self.p | const.FLAG_BREAK | const.FLAG_UNUSED)
+        self.p |= const.FLAG_INTERRUPT
 
         # load the interrupt vector into the PC
-        self.pc = self.memory.read(0xfffe) << 8 | self.memory.read(0xffff)
+        self.pc = self.read_word(const.VECTOR_IRQ)
 
     def bvc(self, arg):
         """Branch if Overflow Clear"""
 
-        self.pc += arg if not self.p & const.FLAG_OVERFLOW else 0
-        self.pc = c_uint16(self.pc).value
+        if not self.p & const.FLAG_OVERFLOW:
+            self.branch(arg)
 
     def bvs(self, arg):
         """Branch if Overflow Set"""
 
-        self.pc += arg if self.p & const.FLAG_OVERFLOW else 0
-        self.pc = c_uint16(self.pc).value
+        if self.p & const.FLAG_OVERFLOW:
+            self.branch(arg)
 
     def clc(self):
         """Clear Carry Flag"""
@@ -293,6 +708,7 @@ class CPU(object):
     def cli(self):
         """Clear Interrupt Disable"""
         self.p &= ~(const.FLAG_INTERRUPT)
+        self.unmasked()
 
     def clv(self):
         """Clear Overflow Flag"""
@@ -301,120 +717,64 @@ class CPU(object):
     def _cmp(self, arg):
         """Compare"""
 
-        # do in place subtraction, not saving the result
-        result = self.a - arg
-        uint_result = c_uint8(result).value
-
-        # set carry flag if A >= arg
-        self.p &= ~(const.FLAG_CARRY)
-        self.p |= result > 0
-
-        # set zero flag if A = M
-        self.p &= ~(const.FLAG_ZERO)
-        self.p |= const.FLAG_ZERO if not result else 0b0
-
-        # set negative flag if result is negative
-        self.p &= ~(const.FLAG_NEGATIVE)
-        self.p |= const.FLAG_NEGATIVE if uint_result >= 0x80 else 0b0
+        self.compare(self.a, arg)
 
     def cpx(self, arg):
         """Compare X Register"""
 
-        # do in place subtraction, not saving the result
-        result = self.x - arg
-        uint_result = c_uint8(result).value
-
-        # set carry flag if X >= arg
-        self.p &= ~(const.FLAG_CARRY)
-        self.p |= result > 0
-
-        # set zero flag if X = M
-        self.p &= ~(const.FLAG_ZERO)
-        self.p |= const.FLAG_ZERO if not result else 0b0
-
-        # set negative flag if result is negative
-        self.p &= ~(const.FLAG_NEGATIVE)
-        self.p |= const.FLAG_NEGATIVE if uint_result >= 0x80 else 0b0
+        self.compare(self.x, arg)
 
     def cpy(self, arg):
         """Compare Y Register"""
 
-        # do in place subtraction, not saving the result
-        result = self.y - arg
-        uint_result = c_uint8(result).value
-
-        # set carry flag if Y >= arg
-        self.p &= ~(const.FLAG_CARRY)
-        self.p |= result > 0
-
-        # set zero flag if Y = M
-        self.p &= ~(const.FLAG_ZERO)
-        self.p |= const.FLAG_ZERO if not result else 0b0
-
-        # set negative flag if result is negative
-        self.p &= ~(const.FLAG_NEGATIVE)
-        self.p |= const.FLAG_NEGATIVE if uint_result >= 0x80 else 0b0
+        self.compare(self.y, arg)
 
     def dec(self, arg):
         """Decrement Memory"""
 
-        result = self.memory.read(arg) - 1
-        uint_result = c_uint8(result).value
+        result = (self.memory.load(arg) - 1) & 0xff
 
-        self.set_zn(uint_result)
-        self.memory.write(arg, uint_result)
+        self.p = self.p & KEEP_ZN | ZN_TABLE[result]
+        self.memory.store(arg, result)
 
     def dex(self):
         """Decrement X Register"""
 
-        result = self.x - 1
-        uint_result = c_uint8(result).value
-
-        self.set_zn(uint_result)
-        self.x = uint_result
+        self.x = (self.x - 1) & 0xff
+        self.p = self.p & KEEP_ZN | ZN_TABLE[self.x]
 
     def dey(self):
-        """Decrement X Register"""
+        """Decrement Y Register"""
 
-        result = self.x - 1
-        uint_result = c_uint8(result).value
-
-        self.set_zn(uint_result)
-        self.x = uint_result
+        self.y = (self.y - 1) & 0xff
+        self.p = self.p & KEEP_ZN | ZN_TABLE[self.y]
 
     def eor(self, arg):
         """Exclusive OR"""
 
         result = self.a ^ arg
-        self.set_zn(result)
+        self.p = self.p & KEEP_ZN | ZN_TABLE[result]
         self.a = result
 
     def inc(self, arg):
         """Increment Memory"""
 
-        result = self.memory.read(arg) + 1
-        uint_result = c_uint8(result).value
+        result = (self.memory.load(arg) + 1) & 0xff
 
-        self.set_zn(uint_result)
-        self.memory.write(arg, result)
+        self.p = self.p & KEEP_ZN | ZN_TABLE[result]
+        self.memory.store(arg, result)
 
     def inx(self):
         """Increment X Register"""
 
-        result = self.x + 1
-        uint_result = c_uint8(result).value
-
-        self.set_zn(uint_result)
-        self.x = uint_result
+        self.x = (self.x + 1) & 0xff
+        self.p = self.p & KEEP_ZN | ZN_TABLE[self.x]
 
     def iny(self):
         """Increment Y Register"""
 
-        result = self.y + 1
-        uint_result = c_uint8(result).value
-
-        self.set_zn(uint_result)
-        self.y = uint_result
+        self.y = (self.y + 1) & 0xff
+        self.p = self.p & KEEP_ZN | ZN_TABLE[self.y]
 
     def jmp(self, arg):
         """Jump"""
@@ -424,7 +784,7 @@ class CPU(object):
     def jsr(self, arg):
         """Jump to Subroutine"""
 
-        self.pc = c_uint16(self.pc - 1).value
+        self.pc = (self.pc - 1) & 0xffff
         self.push_pc()
         self.pc = arg
 
@@ -432,36 +792,35 @@ class CPU(object):
         """Load Accumulator"""
 
         self.a = arg
-        self.set_zn(self.a)
+        self.p = self.p & KEEP_ZN | ZN_TABLE[arg]
 
     def ldx(self, arg):
         """Load X Register"""
 
         self.x = arg
-        self.set_zn(self.x)
+        self.p = self.p & KEEP_ZN | ZN_TABLE[arg]
 
     def ldy(self, arg):
         """Load Y Register"""
 
         self.y = arg
-        self.set_zn(self.y)
+        self.p = self.p & KEEP_ZN | ZN_TABLE[arg]
 
-    def lsr(self, arg):
+    def lsr(self, loc=None):
         """Logical Shift Right"""
 
+        # shift the accumulator unless given a memory location
+        arg = self.a if loc is None else self.memory.load(loc)
+
         # bit shift right
         result = arg >> 1
-        uint_result = c_uint8(result).value
 
-        # set the carry bit to the previous value of bit 0
-        self.p &= ~(const.FLAG_CARRY)
-        self.p |= const.FLAG_CARRY & arg > 0
-
-        # set zero and/or negative flags
-        self.set_zn(uint_result)
+        # set the carry bit to the previous value of bit 0, plus zero and
+        # negative
+        self.p = self.p & KEEP_CZN | ZN_TABLE[result] | arg & const.FLAG_CARRY
 
-        #save the result to the A register
-        self.a = uint_result
+        # save the result to the A register or back to memory
+        self.write_result(loc, result)
 
     def nop(self):
         """No Operation"""
@@ -473,7 +832,7 @@ class CPU(object):
         """Logical Inclusive OR"""
 
         result = self.a | arg
-        self.set_zn(result)
+        self.p = self.p & KEEP_ZN | ZN_TABLE[result]
         self.a = result
 
     def pha(self):
@@ -484,44 +843,69 @@ class CPU(object):
     def php(self):
         """Push Processor Status"""
 
-        self.push_stack(self.p)
+        # the pushed copy always has the break and unused bits set
+        self.push_stack(self.p | const.FLAG_BREAK | const.FLAG_UNUSED)
 
     def pla(self):
         """Pull Accumulator"""
 
         self.a = self.read_stack()
+        self.p = self.p & KEEP_ZN | ZN_TABLE[self.a]
 
     def plp(self):
         """Pull Processor Status"""
 
-        self.p = self.read_stack()
+        # the break bit only exists on the stack, never in the register
+        self.p = self.read_stack() & ~(const.FLAG_BREAK) | const.FLAG_UNUSED
+        self.unmasked()
 
-    def rol(self, arg):
+    def rol(self, loc=None):
         """Rotate Left"""
 
-        self.asl(arg)
+        # rotate the accumulator unless given a memory location
+        arg = self.a if loc is None else self.memory.load(loc)
+
+        # shift left, bringing the carry into bit 0
+        result = (arg << 1 | self.p & const.FLAG_CARRY) & 0xff
+
+        # set the carry bit to the previous value of bit 7
+        self.p = self.p & KEEP_CZN | ZN_TABLE[result] | arg >> 7
+        self.write_result(loc, result)
 
-    def ror(self, arg):
+    def ror(self, loc=None):
         """Rotate Right"""
 
-        self.lsr(arg)
+        # rotate the accumulator unless given a memory location
+        arg = self.a if loc is None else self.memory.load(loc)
+
+        # shift right, bringing the carry into bit 7
+        result = arg >> 1 | (self.p & const.FLAG_CARRY) << 7
+
+        # set the carry bit to the previous value of bit 0
+        self.p = self.p & KEEP_CZN | ZN_TABLE[result] | arg & const.FLAG_CARRY
+        self.write_result(loc, result)
 
     def rti(self):
         """Return from Interrupt"""
 
-        self.p = self.read_stack()
-        self.pc = self.read_pc()
+        self.p = self.read_stack() & ~(const.FLAG_BREAK) | const.FLAG_UNUSED
+        self.read_pc()
+        self.unmasked()
 
     def rts(self):
         """Return from Subroutine"""
 
-        self.pc = self.read_pc()
+        # JSR pushed the address of its own last byte
+        self.pc = (self.read_pc() + 1) & 0xffff
 
     def sbc(self, arg):
         """Subtract with Carry"""
 
-        # pass the inverse to ADC... easy peasy!
-        self.adc(~arg)
+        # look up A register - argument - borrow, and the flags it sets
+        index = self.a << 9 | arg << 1 | self.p & const.FLAG_CARRY
+
+        self.p = self.p & KEEP_CZVN | SBC_FLAGS[index]
+        self.a = SBC_RESULT[index]
 
     def sec(self):
         """Set Carry Flag"""
@@ -541,41 +925,41 @@ class CPU(object):
     def sta(self, arg):
         """Store Accumulator"""
 
-        self.memory.write(arg, self.a)
+        self.memory.store(arg, self.a)
 
     def stx(self, arg):
         """Store X Register"""
 
-        self.memory.write(arg, self.x)
+        self.memory.store(arg, self.x)
 
     def sty(self, arg):
         """Store Y Register"""
 
-        self.memory.write(arg, self.y)
+        self.memory.store(arg, self.y)
 
     def tax(self):
         """Transfer Accumulator to X"""
 
         self.x = self.a
-        self.set_zn(self.x)
+        self.p = self.p & KEEP_ZN | ZN_TABLE[self.x]
 
     def tay(self):
         """Transfer Accumulator to Y"""
 
         self.y = self.a
-        self.set_zn(self.y)
+        self.p = self.p & KEEP_ZN | ZN_TABLE[self.y]
 
     def tsx(self):
         """Transfer Stack Pointer to X"""
 
         self.x = self.sp
-        self.set_zn(self.x)
+        self.p = self.p & KEEP_ZN | ZN_TABLE[self.x]
 
     def txa(self):
         """Transfer X to Accumulator"""
 
         self.a = self.x
-        self.set_zn(self.a)
+        self.p = self.p & KEEP_ZN | ZN_TABLE[self.a]
 
     def txs(self):
         """Transfer X to Stack Pointer"""
@@ -586,7 +970,7 @@ class CPU(object):
         """Transfer Y to Accumulator"""
 
         self.a = self.y
-        self.set_zn(self.a)
+        self.p = self.p & KEEP_ZN | ZN_TABLE[self.a]
 
 if __name__ == "__main__":
     CPU = create_cpu()
@@ -0,0 +1,240 @@
+"""This module stops the CPU when it executes an address or touches a range
+   of memory, for a debugger to inspect the console.
+
+   Nothing here costs anything until something is armed. Watchpoints are
+   memory hooks, so only the pages they cover leave the memory bus's fast
+   path, and breakpoints need the PC checked before every instruction, so
+   while any are armed run() uses the loop in this module instead of the
+   usual one. Disarming the last of either puts everything back.
+
+   A hit finishes the instruction that caused it (for a breakpoint, the
+   one before it) and then stops the CPU, setting cpu.stopped so the
+   scheduler and run_frame() stop too. resume() lets it carry on.
+
+   Given the cartridge's code/data map, listing() takes PRG-ROM code from
+   the map's instruction index instead of decoding it again."""
+
+from collections import namedtuple
+import disassembler
+
+# What a watchpoint watches for
+WATCH_READ = 1
+WATCH_WRITE = 2
+WATCH_ACCESS = WATCH_READ | WATCH_WRITE
+
+# Kinds of hit
+HIT_BREAKPOINT = "breakpoint"
+HIT_READ = "read"
+HIT_WRITE = "write"
+
+# Why the CPU stopped. value is the byte written, or None; pc is the
+# instruction that did it and cycles when it started.
+Hit = namedtuple("Hit", ["kind", "address", "value", "pc", "cycles"])
+
+# Instructions listing() shows by default
+LISTING_LENGTH = 16
+
+# An armed watchpoint, as returned by add_watchpoint()
+Watchpoint = namedtuple("Watchpoint", ["start", "end", "kind", "read_hook",
+                                       "write_hook"])
+
+
+class Debugger(object):
+    """This class holds a CPU's breakpoints and watchpoints."""
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.memory = cpu.memory
+
+        # PC values to stop before executing
+        self.breakpoints = set()
+
+        # Armed watchpoints, in the order they were added
+        self.watchpoints = []
+
+        # Why the CPU last stopped, until resume()
+        self.hit = None
+
+        # The instruction being executed and when it started
+        self.pc = cpu.pc
+        self.cycles = cpu.cycles
+
+        # A breakpoint address resume() should run past once
+        self.resume_pc = None
+
+        # The cartridge's code/data map, if listing() has one to use
+        self.code_map = None
+
+    def close(self):
+        """Disarms everything"""
+
+        for watchpoint in list(self.watchpoints):
+            self.remove_watchpoint(watchpoint)
+
+        self.breakpoints.clear()
+        self.resume()
+
+    def armed(self):
+        """Whether any breakpoint or watchpoint is set"""
+
+        return bool(self.breakpoints or self.watchpoints)
+
+    ### Breakpoints ###
+
+    def add_breakpoint(self, pc):
+        """Stops the CPU before it executes the instruction at pc"""
+
+        self.breakpoints.add(pc & 0xffff)
+        self.cpu.select_runner()
+
+    def remove_breakpoint(self, pc):
+        """Removes a breakpoint, if it is set"""
+
+        self.breakpoints.discard(pc & 0xffff)
+        self.cpu.select_runner()
+
+    ### Watchpoints ###
+
+    def add_watchpoint(self, start, end=None, kind=WATCH_WRITE):
+        """Stops the CPU after an instruction reads or writes any address
+           from start to end, as seen on the CPU bus (a mirror is a
+           different address). Returns the watchpoint, for removing it."""
+
+        end = start if end is None else end
+        read_hook = self.read_watcher(start, end) \
+            if kind & WATCH_READ else None
+        write_hook = self.write_watcher(start, end) \
+            if kind & WATCH_WRITE else None
+
+        watchpoint = Watchpoint(start, end, kind, read_hook, write_hook)
+
+        for page in range(start >> 8, (end >> 8) + 1):
+            if read_hook is not None:
+                self.memory.hook_reads(page, read_hook)
+
+            if write_hook is not None:
+                self.memory.hook_writes(page, write_hook)
+
+        self.watchpoints.append(watchpoint)
+        self.cpu.select_runner()
+
+        return watchpoint
+
+    def read_watcher(self, start, end):
+        """A read hook that stops the CPU on reads from start to end"""
+
+        def watched(loc):
+            if start <= loc <= end:
+                self.stop(HIT_READ, loc, None)
+
+        return watched
+
+    def write_watcher(self, start, end):
+        """A write hook that stops the CPU on writes from start to end"""
+
+        def watched(loc, data):
+            if start <= loc <= end:
+                self.stop(HIT_WRITE, loc, data)
+
+        return watched
+
+    def remove_watchpoint(self, watchpoint):
+        """Disarms a watchpoint, unhooking the pages it covered"""
+
+        for page in range(watchpoint.start >> 8, (watchpoint.end >> 8) + 1):
+            if watchpoint.read_hook is not None:
+                self.memory.unhook_reads(page, watchpoint.read_hook)
+
+            if watchpoint.write_hook is not None:
+                self.memory.unhook_writes(page, watchpoint.write_hook)
+
+        self.watchpoints.remove(watchpoint)
+        self.cpu.select_runner()
+
+    ### Listing ###
+
+    def use_code_map(self, code_map):
+        """Has listing() take instructions from a code/data map, such as
+           disassembler.create_code_map() returns"""
+
+        self.code_map = code_map
+
+    def listing(self, address=None, count=LISTING_LENGTH):
+        """Returns [(address, bytes, assembly)] for count instructions from
+           address, the PC by default. Code the map knows is looked up in
+           it; anything else, such as code in RAM, is decoded from the bus."""
+
+        address = self.cpu.pc if address is None else address
+        lines = []
+
+        for index in range(count):
+            found = None
+
+            if self.code_map is not None:
+                found = self.code_map.lookup(self.cpu, address)
+
+            # a map entry found through a mirror would show branch
+            # targets relative to where it was found
+            if found is None or found.address != address:
+                line = disassembler.disassemble_memory(self.memory, address,
+                                                       1)[0]
+            else:
+                prg = self.code_map.prg
+                data = bytes(prg[(found.offset + offset) % len(prg)]
+                             for offset in range(found.length))
+                line = (address, data, found.text)
+
+            lines.append(line)
+            address = (address + len(line[1])) & 0xffff
+
+        return lines
+
+    ### Stopping ###
+
+    def stop(self, kind, address, value):
+        """Records a hit and ends the run loop after this instruction. Only
+           the first hit of an instruction is kept."""
+
+        if self.hit is None:
+            self.hit = Hit(kind, address, value, self.pc, self.cycles)
+            self.cpu.stopped = True
+            self.cpu.deadline = self.cpu.cycles
+
+    def resume(self):
+        """Clears the last hit so the CPU can run again. A breakpoint it
+           stopped at is run past rather than hit again straight away."""
+
+        if self.hit is not None and self.hit.kind == HIT_BREAKPOINT:
+            self.resume_pc = self.hit.pc
+
+        self.hit = None
+        self.cpu.stopped = False
+
+    def run(self):
+        """The CPU's run loop while anything is armed, checking every PC
+           against the breakpoints"""
+
+        cpu = self.cpu
+
+        if cpu.stopped:
+            return
+
+        dispatch = cpu.dispatch
+        load = cpu.memory.load
+        breakpoints = self.breakpoints
+        resume_pc = self.resume_pc
+        self.resume_pc = None
+
+        while cpu.cycles < cpu.deadline:
+            pc = cpu.pc
+
+            if pc in breakpoints and pc != resume_pc:
+                self.pc = pc
+                self.cycles = cpu.cycles
+                self.stop(HIT_BREAKPOINT, pc, None)
+                return
+
+            resume_pc = None
+            self.pc = pc
+            self.cycles = cpu.cycles
+            dispatch[load(pc)]()
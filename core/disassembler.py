@@ -0,0 +1,429 @@
+"""This module turns 6502 machine code back into assembly, in the syntax
+   nestest.log and most NES debuggers use.
+
+   It also builds a code/data map of PRG-ROM by walking every path from
+   the reset, NMI and IRQ vectors, with an index of the instructions found.
+   Each bank is walked at the CPU addresses its mapper can show it at,
+   whatever happens to be mapped, so the map only depends on the ROM and
+   is cached on disk by ROM hash. A ROM is only walked once."""
+
+import array
+import os
+import struct
+from collections import namedtuple
+import constants as const
+from instructions import INSTRUCTIONS, MNEMONICS, MODE_BYTES
+
+# Operand syntax for each addressing mode, given the operand as a number
+OPERAND_FORMATS = {
+    const.ADDR_IMPLICIT: "",
+    const.ADDR_ACCUMULATOR: "A",
+    const.ADDR_IMMEDIATE: "#$%02X",
+    const.ADDR_ZERO_PAGE: "$%02X",
+    const.ADDR_ZERO_PAGE_X: "$%02X,X",
+    const.ADDR_ZERO_PAGE_Y: "$%02X,Y",
+    const.ADDR_RELATIVE: "$%04X",
+    const.ADDR_ABSOLUTE: "$%04X",
+    const.ADDR_ABSOLUTE_X: "$%04X,X",
+    const.ADDR_ABSOLUTE_Y: "$%04X,Y",
+    const.ADDR_INDIRECT: "($%04X)",
+    const.ADDR_INDEXED_INDIRECT: "($%02X,X)",
+    const.ADDR_INDIRECT_INDEXED: "($%02X),Y"
+}
+
+# Bytes in each opcode's instruction, 1 for undocumented ones
+LENGTHS = [MODE_BYTES[INSTRUCTIONS[opcode][0]] if opcode in INSTRUCTIONS
+           else 1 for opcode in range(0x100)]
+
+# Addressing mode of each opcode, None for undocumented ones
+MODES = [INSTRUCTIONS[opcode][0] if opcode in INSTRUCTIONS else None
+         for opcode in range(0x100)]
+
+
+def operand(pc, opcode, low, high):
+    """The operand of the instruction at pc as a number: a byte, a word, or
+       a branch's target"""
+
+    mode = MODES[opcode]
+
+    if mode == const.ADDR_RELATIVE:
+        return (pc + 2 + (low - 0x100 if low & 0x80 else low)) & 0xffff
+
+    if LENGTHS[opcode] == 3:
+        return high << 8 | low
+
+    return low
+
+
+def disassemble(pc, opcode, low=0, high=0):
+    """The assembly for one instruction, given its address, opcode and the
+       two bytes after it"""
+
+    if opcode not in MNEMONICS:
+        return ".DB $%02X" % opcode
+
+    text = OPERAND_FORMATS[MODES[opcode]]
+
+    if "%" in text:
+        text = text % operand(pc, opcode, low, high)
+
+    return (MNEMONICS[opcode] + " " + text).rstrip()
+
+
+def disassemble_memory(memory, start, count):
+    """Returns [(address, bytes, assembly)] for count instructions from
+       start, read with memory.peek()"""
+
+    lines = []
+    pc = start
+
+    for index in range(count):
+        opcode = memory.peek(pc)
+        data = [memory.peek((pc + offset) & 0xffff)
+                for offset in range(LENGTHS[opcode])]
+        data += [0] * (3 - len(data))
+
+        lines.append((pc, bytes(data[:LENGTHS[opcode]]),
+                      disassemble(pc, *data)))
+        pc = (pc + LENGTHS[opcode]) & 0xffff
+
+    return lines
+
+### Code/Data Map ###
+
+# What each byte of PRG-ROM is known to be
+KIND_UNKNOWN = 0
+KIND_CODE = 1
+KIND_OPERAND = 2
+KIND_DATA = 3
+
+# Banks the map is summarized by
+BANK_SIZE = 0x2000
+
+# Where maps are cached between runs, one file per ROM hash
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "nespy",
+                         "codemaps")
+
+# magic, version, ROM SHA-1, PRG size, instructions indexed
+CACHE_MAGIC = b"NESD"
+CACHE_VERSION = 2
+CACHE_HEADER = struct.Struct("<4sH20sII")
+
+# Instructions whose absolute operand is data they read
+DATA_READERS = (
+    "ADC", "AND", "BIT", "CMP", "CPX", "CPY", "EOR", "LDA", "LDX", "LDY",
+    "ORA", "SBC"
+)
+
+# Instruction decoded from PRG-ROM, at the CPU address it was found at
+Instruction = namedtuple("Instruction", ["address", "offset", "opcode",
+                                         "length", "text"])
+
+
+def create_code_map(cpu, cache_dir=None):
+    """Returns the code/data map for the CPU's cartridge, loading it from
+       the cache if this ROM has been seen before and otherwise walking
+       the code reachable from the vectors in every bank and caching the
+       result"""
+
+    path = os.path.join(cache_dir or CACHE_DIR, cpu.rom.sha1 + ".map")
+    code_map = CodeMap(cpu.rom)
+
+    if code_map.load(path):
+        return code_map
+
+    code_map.analyze(cpu.mapper.prg_windows())
+
+    try:
+        code_map.save(path)
+    except OSError:
+        # an unwritable cache only costs the next run the walk
+        pass
+
+    return code_map
+
+
+def prg_offsets(mapper):
+    """{id of a PRG-ROM page slice: its offset in PRG-ROM}"""
+
+    return {id(page): index << 8
+            for index, page in enumerate(mapper.prg_pages)}
+
+
+class CodeMap(object):
+    """This class records which PRG-ROM bytes are code and which are data,
+       and indexes the instructions found, by PRG-ROM offset."""
+
+    def __init__(self, rom):
+        self.rom = rom
+        self.prg = rom.prg_rom
+        self.kinds = bytearray(len(self.prg))
+
+        # PRG-ROM offset: CPU address the instruction there was found at
+        self.addresses = {}
+
+        # PRG-ROM offset: Instruction, built as instructions are looked up
+        self.instructions = {}
+
+        # Whether this map came from the cache
+        self.cached = False
+
+        # The mapper lookup() last saw, and prg_offsets() for it
+        self.mapper = None
+        self.page_offsets = {}
+
+    def analyze(self, windows):
+        """Walks every path from the vectors through PRG-ROM, marking code
+           and the data it reads. windows is Mapper.prg_windows(): a jump
+           into a window that can show several banks is followed into each
+           of them, and code stays in its own bank while it runs within
+           its window."""
+
+        prg = self.prg
+        kinds = self.kinds
+
+        def window_of(address):
+            for index, (start, size, banks) in enumerate(windows):
+                if start <= address < start + size:
+                    return index
+
+            return None
+
+        windows_at = [window_of(page << 8) for page in range(0x100)]
+
+        def rom_offset(address, window, bank):
+            """PRG-ROM offset of an address, seen from code in bank at
+               window, or None if it isn't known which bank is there"""
+
+            address &= 0xffff
+            index = windows_at[address >> 8]
+
+            if index is None:
+                return None
+
+            start, size, banks = windows[index]
+
+            if index != window:
+                if len(banks) != 1:
+                    return None
+
+                bank = banks[0]
+
+            return (bank + address - start) % len(prg)
+
+        def targets(address, window, bank):
+            """(address, window, bank) for each bank a jump from code in
+               bank at window could land in"""
+
+            address &= 0xffff
+            index = windows_at[address >> 8]
+
+            if index is None:
+                return []
+
+            if index == window:
+                return [(address, window, bank)]
+
+            return [(address, index, each) for each in windows[index][2]]
+
+        # the vectors, read from each bank that can hold them
+        work = []
+        vectors = windows_at[const.VECTOR_NMI >> 8]
+
+        for bank in windows[vectors][2]:
+            for vector in (const.VECTOR_NMI, const.VECTOR_RESET,
+                           const.VECTOR_IRQ):
+                low = rom_offset(vector, vectors, bank)
+                high = rom_offset(vector + 1, vectors, bank)
+                work += targets(prg[low] | prg[high] << 8, vectors, bank)
+
+        while work:
+            address, window, bank = work.pop()
+
+            while True:
+                offset = rom_offset(address, window, bank)
+
+                if offset is None or kinds[offset] == KIND_CODE or \
+                        prg[offset] not in INSTRUCTIONS:
+                    break
+
+                opcode = prg[offset]
+                mode = MODES[opcode]
+                operands = [rom_offset(address + index, window, bank)
+                            for index in range(1, LENGTHS[opcode])]
+
+                if None in operands:
+                    break
+
+                kinds[offset] = KIND_CODE
+                self.addresses[offset] = address
+
+                for operand_offset in operands:
+                    kinds[operand_offset] = KIND_OPERAND
+
+                data = [prg[index] for index in operands] + [0, 0]
+                value = operand(address, opcode, data[0], data[1])
+                mnemonic = MNEMONICS[opcode]
+
+                if mode == const.ADDR_RELATIVE or mnemonic == "JSR":
+                    work += targets(value, window, bank)
+                elif mnemonic == "JMP":
+                    if mode == const.ADDR_INDIRECT:
+                        pointer = [rom_offset(value, window, bank),
+                                   rom_offset(value & 0xff00 |
+                                              (value + 1) & 0xff,
+                                              window, bank)]
+
+                        if None not in pointer:
+                            work += targets(prg[pointer[0]] |
+                                            prg[pointer[1]] << 8,
+                                            window, bank)
+                    else:
+                        work += targets(value, window, bank)
+
+                    break
+                elif mnemonic in ("RTS", "RTI", "BRK"):
+                    break
+                elif mnemonic in DATA_READERS and LENGTHS[opcode] == 3:
+                    target = rom_offset(value, window, bank)
+
+                    if target is not None and kinds[target] == KIND_UNKNOWN:
+                        kinds[target] = KIND_DATA
+
+                address = (address + LENGTHS[opcode]) & 0xffff
+
+                if windows_at[address >> 8] != window:
+                    # running off the end of the window
+                    work += targets(address, window, bank)
+                    break
+
+    def instruction(self, offset):
+        """The decoded instruction at a PRG-ROM offset, or None if it isn't
+           known to be the start of one"""
+
+        found = self.instructions.get(offset)
+
+        if found is None and offset in self.addresses:
+            address = self.addresses[offset]
+            opcode = self.prg[offset]
+            data = [self.prg[(offset + index) % len(self.prg)]
+                    for index in (1, 2)]
+
+            found = Instruction(address, offset, opcode, LENGTHS[opcode],
+                                disassemble(address, opcode, *data))
+            self.instructions[offset] = found
+
+        return found
+
+    def lookup(self, cpu, address):
+        """The decoded instruction at a CPU address as currently mapped"""
+
+        if cpu.mapper is not self.mapper:
+            self.mapper = cpu.mapper
+            self.page_offsets = prg_offsets(cpu.mapper)
+
+        base = self.page_offsets.get(
+            id(cpu.memory.mapped_read_pages[address >> 8]))
+
+        if base is None:
+            return None
+
+        return self.instruction(base | address & 0xff)
+
+    def banks(self):
+        """[(bank, code bytes, data bytes)] for each 8KB bank"""
+
+        summary = []
+
+        for bank in range(0, len(self.kinds), BANK_SIZE):
+            kinds = self.kinds[bank:bank + BANK_SIZE]
+            summary.append((bank // BANK_SIZE,
+                            kinds.count(KIND_CODE) +
+                            kinds.count(KIND_OPERAND),
+                            kinds.count(KIND_DATA)))
+
+        return summary
+
+    def listing(self, bank):
+        """Lines of assembly for an 8KB bank, with anything not known to be
+           code shown as bytes"""
+
+        lines = []
+        offset = bank * BANK_SIZE
+        end = min(offset + BANK_SIZE, len(self.prg))
+
+        while offset < end:
+            found = self.instruction(offset)
+
+            if found is not None:
+                data = " ".join("%02X" % self.prg[offset + index]
+                                for index in range(found.length)
+                                if offset + index < len(self.prg))
+                lines.append("%05X  $%04X  %-8s  %s" % (
+                    offset, found.address, data, found.text))
+                offset += found.length
+            else:
+                kind = "data" if self.kinds[offset] == KIND_DATA else ""
+                lines.append("%05X         %-8s  .DB $%02X %s" % (
+                    offset, "%02X" % self.prg[offset], self.prg[offset],
+                    kind and "; " + kind))
+                offset += 1
+
+        return [line.rstrip() for line in lines]
+
+    ### Cache ###
+
+    def save(self, path):
+        """Writes the map to a cache file"""
+
+        directory = os.path.dirname(path)
+
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        offsets = sorted(self.addresses)
+        index = array.array("I", offsets).tobytes() + \
+            array.array("H", [self.addresses[offset]
+                              for offset in offsets]).tobytes()
+
+        with open(path, "wb") as cache:
+            cache.write(CACHE_HEADER.pack(
+                CACHE_MAGIC, CACHE_VERSION, bytes.fromhex(self.rom.sha1),
+                len(self.kinds), len(offsets)))
+            cache.write(self.kinds)
+            cache.write(index)
+
+    def load(self, path):
+        """Reads the map from a cache file, returning False if there isn't
+           a usable one"""
+
+        try:
+            with open(path, "rb") as cache:
+                data = cache.read()
+        except OSError:
+            return False
+
+        if len(data) < CACHE_HEADER.size:
+            return False
+
+        magic, version, sha1, size, count = \
+            CACHE_HEADER.unpack_from(data)
+        start = CACHE_HEADER.size
+        offset_bytes = count * array.array("I").itemsize
+        end = start + size + offset_bytes + \
+            count * array.array("H").itemsize
+
+        if magic != CACHE_MAGIC or version != CACHE_VERSION or \
+                sha1.hex() != self.rom.sha1 or size != len(self.kinds) or \
+                len(data) != end:
+            return False
+
+        self.kinds[:] = data[start:start + size]
+        offsets = array.array("I", data[start + size:start + size +
+                                        offset_bytes])
+        addresses = array.array("H", data[start + size + offset_bytes:end])
+        self.addresses = dict(zip(offsets, addresses))
+        self.instructions = {}
+        self.cached = True
+
+        return True
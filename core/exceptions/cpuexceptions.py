@@ -0,0 +1,10 @@
+class Error(Exception):
+    pass
+
+
+class InvalidOpcodeError(Error):
+
+    def __init__(self, opcode, address, message):
+        self.opcode = opcode
+        self.address = address
+        self.message = message
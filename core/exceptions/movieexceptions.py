@@ -0,0 +1,9 @@
+class Error(Exception):
+    pass
+
+
+class MovieError(Error):
+
+    def __init__(self, path, message):
+        self.path = path
+        self.message = message
@@ -0,0 +1,16 @@
+class Error(Exception):
+    pass
+
+
+class RomFormatError(Error):
+
+    def __init__(self, path, message):
+        self.path = path
+        self.message = message
+
+
+class UnsupportedMapperError(Error):
+
+    def __init__(self, mapper, message):
+        self.mapper = mapper
+        self.message = message
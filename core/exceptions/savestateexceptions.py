@@ -0,0 +1,9 @@
+class Error(Exception):
+    pass
+
+
+class SaveStateError(Error):
+
+    def __init__(self, state, message):
+        self.state = state
+        self.message = message
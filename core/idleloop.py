@@ -0,0 +1,229 @@
+"""This module spots the CPU spinning in a loop that can't get anywhere
+   until something outside it changes, such as waiting for vblank by
+   polling $2002 or for the NMI handler to set a flag in RAM, and skips
+   the cycle count ahead instead of interpreting every iteration.
+
+   A loop qualifies when its body fits in one read-only page, never writes
+   memory or touches the stack, has no branch or jump but the one closing
+   it, and only reads memory with zero page or absolute operands. Given the
+   same registers at the top of the loop and the same values read, such a
+   loop repeats itself exactly, so once two iterations in a row have started
+   from the same registers and taken the same number of cycles, every
+   further iteration will too, up to the point where something it reads may
+   change. RAM and ROM only change when the CPU is interrupted, which can't
+   happen before its next deadline. Registers need a source that says how
+   long they will read the same; reading any other register rules the loop
+   out.
+
+   Skipping whole iterations leaves the CPU exactly where interpreting them
+   would have, so timing stays exact."""
+
+import constants as const
+from instructions import INSTRUCTIONS, MNEMONICS, MODE_BYTES
+
+# Branches and JMP absolute, the instructions that close a loop
+LOOP_OPCODES = (0x10, 0x30, 0x50, 0x70, 0x90, 0xb0, 0xd0, 0xf0, 0x4c)
+
+# Longest loop body considered, in bytes
+MAX_LOOP_BYTES = 16
+
+# Instructions a loop can't contain: the stack, and anything that leaves
+# the loop other than a branch
+UNSAFE = ("PHA", "PHP", "PLA", "PLP", "JSR", "RTS", "RTI", "BRK")
+
+# Modes a loop may read memory with, so every address is known up front,
+# and the instructions that only read through them
+READ_MODES = (const.ADDR_ZERO_PAGE, const.ADDR_ABSOLUTE)
+READERS = (
+    "LDA", "LDX", "LDY", "BIT", "CMP", "CPX", "CPY", "AND", "ORA", "EOR",
+    "ADC", "SBC"
+)
+
+# Modes that don't touch memory beyond the instruction itself
+REGISTER_MODES = (
+    const.ADDR_IMPLICIT, const.ADDR_ACCUMULATOR, const.ADDR_IMMEDIATE,
+    const.ADDR_RELATIVE
+)
+
+
+class IdleLoops(object):
+    """Watches a CPU's backward branches and fast-forwards idle loops."""
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.memory = cpu.memory
+
+        # Register address: callable returning the CPU cycle before which
+        # reading the register can't return anything different
+        self.stable_sources = {}
+
+        # (id of the page slice, head, tail): (slice, registers read), or
+        # (slice, None) for loops that can't be skipped. The slice is kept
+        # so its id can't be reused while cached.
+        self.loops = {}
+
+        # The registers at the top of the loop last time round, the cycle
+        # it was reached on and the cycles the iteration before took
+        self.state = None
+        self.seen = 0
+        self.period = None
+
+        ### Statistics ###
+
+        self.skips = 0
+        self.skipped_cycles = 0
+        self.skipped_iterations = 0
+
+        # Replaced dispatch entries, to put back on close()
+        self.originals = {}
+
+        for opcode in LOOP_OPCODES:
+            self.originals[opcode] = cpu.dispatch[opcode]
+            cpu.dispatch[opcode] = self.watcher(cpu.dispatch[opcode])
+
+    def close(self):
+        """Puts the CPU's dispatch entries back"""
+
+        for opcode, execute in self.originals.items():
+            self.cpu.dispatch[opcode] = execute
+
+        self.originals = {}
+
+    def add_source(self, loc, stable_until):
+        """Lets loops poll a register, given a callable that returns the
+           CPU cycle before which reading it can't change"""
+
+        self.stable_sources[register_address(loc)] = stable_until
+
+    def watcher(self, execute):
+        """Wraps a loop-closing instruction so taken backward jumps are
+           checked"""
+
+        cpu = self.cpu
+        looped = self.looped
+
+        def watched():
+            pc = cpu.pc
+            execute()
+
+            if cpu.pc <= pc and pc - cpu.pc < MAX_LOOP_BYTES:
+                looped(cpu.pc, pc)
+
+        return watched
+
+    def looped(self, head, tail):
+        """Called when the instruction at tail jumps back to head"""
+
+        cpu = self.cpu
+        state = (head, cpu.a, cpu.x, cpu.y, cpu.p, cpu.sp)
+        period = cpu.cycles - self.seen
+
+        if state != self.state:
+            self.state = state
+            self.period = None
+        elif period == self.period:
+            self.skip(head, tail, period)
+        else:
+            self.period = period
+
+        self.seen = cpu.cycles
+
+    def skip(self, head, tail, period):
+        """Runs whole iterations of a loop that is known to repeat, up to
+           the CPU's deadline or the first change to anything it reads"""
+
+        registers = self.analyze(head, tail)
+
+        if registers is None:
+            return
+
+        cpu = self.cpu
+        until = cpu.deadline
+
+        for loc in registers:
+            source = self.stable_sources.get(loc)
+
+            if source is None:
+                return
+
+            until = min(until, source())
+
+        # the last iteration skipped has to finish before until
+        iterations = (until - 1 - cpu.cycles) // period
+
+        if iterations > 0:
+            cpu.cycles += iterations * period
+
+            self.skips += 1
+            self.skipped_cycles += iterations * period
+            self.skipped_iterations += iterations
+
+    def analyze(self, head, tail):
+        """The registers a loop reads if it can be skipped, or None"""
+
+        page = head >> 8
+        mapped = self.memory.mapped_read_pages[page]
+
+        # code in RAM can change under the loop, and so can I/O
+        if mapped is None or self.memory.mapped_write_pages[page] is not None:
+            return None
+
+        key = (id(mapped), head, tail)
+        loop = self.loops.get(key)
+
+        if loop is None:
+            loop = (mapped, self.decode(head, tail))
+            self.loops[key] = loop
+
+        return loop[1]
+
+    def decode(self, head, tail):
+        """Checks every instruction from head to tail, returning the
+           registers read or None"""
+
+        peek = self.memory.peek
+        registers = []
+        address = head
+
+        while address <= tail:
+            opcode = peek(address)
+
+            if opcode not in INSTRUCTIONS or MNEMONICS[opcode] in UNSAFE:
+                return None
+
+            mode = INSTRUCTIONS[opcode][0]
+            end = address + MODE_BYTES[mode] - 1
+
+            if end >> 8 != head >> 8:
+                return None
+
+            if opcode in LOOP_OPCODES:
+                # only the branch or JMP closing the loop may change the
+                # PC, since code it jumps to outside the body isn't checked
+                if address != tail:
+                    return None
+            elif mode in READ_MODES and MNEMONICS[opcode] in READERS:
+                if mode == const.ADDR_ZERO_PAGE:
+                    loc = peek(address + 1)
+                else:
+                    loc = peek(address + 1) | peek(address + 2) << 8
+
+                if self.memory.mapped_read_pages[loc >> 8] is None:
+                    registers.append(register_address(loc))
+            elif mode not in REGISTER_MODES:
+                return None
+
+            address = end + 1
+
+        # the last instruction decoded has to be the one that jumped back
+        return registers if address == tail + MODE_BYTES[
+            INSTRUCTIONS[peek(tail)][0]] else None
+
+
+def register_address(loc):
+    """Folds the PPU register mirrors onto $2000 - $2007"""
+
+    if 0x2000 <= loc < 0x4000:
+        return 0x2000 | loc & 0x07
+
+    return loc
@@ -0,0 +1,195 @@
+"""This module describes the 6502's documented instruction set: how long
+   each addressing mode is, and the mode and timing of every opcode. It is
+   shared by the CPU's dispatch table and anything else that decodes code."""
+
+import constants as const
+
+# Bytes consumed by an instruction in each addressing mode, opcode included
+MODE_BYTES = {
+    const.ADDR_IMPLICIT: 1,
+    const.ADDR_ACCUMULATOR: 1,
+    const.ADDR_IMMEDIATE: 2,
+    const.ADDR_ZERO_PAGE: 2,
+    const.ADDR_ZERO_PAGE_X: 2,
+    const.ADDR_ZERO_PAGE_Y: 2,
+    const.ADDR_RELATIVE: 2,
+    const.ADDR_ABSOLUTE: 3,
+    const.ADDR_ABSOLUTE_X: 3,
+    const.ADDR_ABSOLUTE_Y: 3,
+    const.ADDR_INDIRECT: 3,
+    const.ADDR_INDEXED_INDIRECT: 2,
+    const.ADDR_INDIRECT_INDEXED: 2
+}
+
+# Opcode: (addressing mode, base cycles, page-cross penalty)
+INSTRUCTIONS = {
+    # ADC
+    0x69: (const.ADDR_IMMEDIATE, 2, 0), 0x65: (const.ADDR_ZERO_PAGE, 3, 0),
+    0x75: (const.ADDR_ZERO_PAGE_X, 4, 0), 0x6d: (const.ADDR_ABSOLUTE, 4, 0),
+    0x7d: (const.ADDR_ABSOLUTE_X, 4, 1), 0x79: (const.ADDR_ABSOLUTE_Y, 4, 1),
+    0x61: (const.ADDR_INDEXED_INDIRECT, 6, 0),
+    0x71: (const.ADDR_INDIRECT_INDEXED, 5, 1),
+    # AND
+    0x29: (const.ADDR_IMMEDIATE, 2, 0), 0x25: (const.ADDR_ZERO_PAGE, 3, 0),
+    0x35: (const.ADDR_ZERO_PAGE_X, 4, 0), 0x2d: (const.ADDR_ABSOLUTE, 4, 0),
+    0x3d: (const.ADDR_ABSOLUTE_X, 4, 1), 0x39: (const.ADDR_ABSOLUTE_Y, 4, 1),
+    0x21: (const.ADDR_INDEXED_INDIRECT, 6, 0),
+    0x31: (const.ADDR_INDIRECT_INDEXED, 5, 1),
+    # ASL
+    0x0a: (const.ADDR_ACCUMULATOR, 2, 0), 0x06: (const.ADDR_ZERO_PAGE, 5, 0),
+    0x16: (const.ADDR_ZERO_PAGE_X, 6, 0), 0x0e: (const.ADDR_ABSOLUTE, 6, 0),
+    0x1e: (const.ADDR_ABSOLUTE_X, 7, 0),
+    # Branches
+    0x90: (const.ADDR_RELATIVE, 2, 0), 0xb0: (const.ADDR_RELATIVE, 2, 0),
+    0xf0: (const.ADDR_RELATIVE, 2, 0), 0x30: (const.ADDR_RELATIVE, 2, 0),
+    0xd0: (const.ADDR_RELATIVE, 2, 0), 0x10: (const.ADDR_RELATIVE, 2, 0),
+    0x50: (const.ADDR_RELATIVE, 2, 0), 0x70: (const.ADDR_RELATIVE, 2, 0),
+    # BIT
+    0x24: (const.ADDR_ZERO_PAGE, 3, 0), 0x2c: (const.ADDR_ABSOLUTE, 4, 0),
+    # BRK
+    0x00: (const.ADDR_IMPLICIT, 7, 0),
+    # Flag clears
+    0x18: (const.ADDR_IMPLICIT, 2, 0), 0xd8: (const.ADDR_IMPLICIT, 2, 0),
+    0x58: (const.ADDR_IMPLICIT, 2, 0), 0xb8: (const.ADDR_IMPLICIT, 2, 0),
+    # CMP
+    0xc9: (const.ADDR_IMMEDIATE, 2, 0), 0xc5: (const.ADDR_ZERO_PAGE, 3, 0),
+    0xd5: (const.ADDR_ZERO_PAGE_X, 4, 0), 0xcd: (const.ADDR_ABSOLUTE, 4, 0),
+    0xdd: (const.ADDR_ABSOLUTE_X, 4, 1), 0xd9: (const.ADDR_ABSOLUTE_Y, 4, 1),
+    0xc1: (const.ADDR_INDEXED_INDIRECT, 6, 0),
+    0xd1: (const.ADDR_INDIRECT_INDEXED, 5, 1),
+    # CPX
+    0xe0: (const.ADDR_IMMEDIATE, 2, 0), 0xe4: (const.ADDR_ZERO_PAGE, 3, 0),
+    0xec: (const.ADDR_ABSOLUTE, 4, 0),
+    # CPY
+    0xc0: (const.ADDR_IMMEDIATE, 2, 0), 0xc4: (const.ADDR_ZERO_PAGE, 3, 0),
+    0xcc: (const.ADDR_ABSOLUTE, 4, 0),
+    # DEC
+    0xc6: (const.ADDR_ZERO_PAGE, 5, 0), 0xd6: (const.ADDR_ZERO_PAGE_X, 6, 0),
+    0xce: (const.ADDR_ABSOLUTE, 6, 0), 0xde: (const.ADDR_ABSOLUTE_X, 7, 0),
+    # DEX, DEY
+    0xca: (const.ADDR_IMPLICIT, 2, 0), 0x88: (const.ADDR_IMPLICIT, 2, 0),
+    # EOR
+    0x49: (const.ADDR_IMMEDIATE, 2, 0), 0x45: (const.ADDR_ZERO_PAGE, 3, 0),
+    0x55: (const.ADDR_ZERO_PAGE_X, 4, 0), 0x4d: (const.ADDR_ABSOLUTE, 4, 0),
+    0x5d: (const.ADDR_ABSOLUTE_X, 4, 1), 0x59: (const.ADDR_ABSOLUTE_Y, 4, 1),
+    0x41: (const.ADDR_INDEXED_INDIRECT, 6, 0),
+    0x51: (const.ADDR_INDIRECT_INDEXED, 5, 1),
+    # INC
+    0xe6: (const.ADDR_ZERO_PAGE, 5, 0), 0xf6: (const.ADDR_ZERO_PAGE_X, 6, 0),
+    0xee: (const.ADDR_ABSOLUTE, 6, 0), 0xfe: (const.ADDR_ABSOLUTE_X, 7, 0),
+    # INX, INY
+    0xe8: (const.ADDR_IMPLICIT, 2, 0), 0xc8: (const.ADDR_IMPLICIT, 2, 0),
+    # JMP, JSR
+    0x4c: (const.ADDR_ABSOLUTE, 3, 0), 0x6c: (const.ADDR_INDIRECT, 5, 0),
+    0x20: (const.ADDR_ABSOLUTE, 6, 0),
+    # LDA
+    0xa9: (const.ADDR_IMMEDIATE, 2, 0), 0xa5: (const.ADDR_ZERO_PAGE, 3, 0),
+    0xb5: (const.ADDR_ZERO_PAGE_X, 4, 0), 0xad: (const.ADDR_ABSOLUTE, 4, 0),
+    0xbd: (const.ADDR_ABSOLUTE_X, 4, 1), 0xb9: (const.ADDR_ABSOLUTE_Y, 4, 1),
+    0xa1: (const.ADDR_INDEXED_INDIRECT, 6, 0),
+    0xb1: (const.ADDR_INDIRECT_INDEXED, 5, 1),
+    # LDX
+    0xa2: (const.ADDR_IMMEDIATE, 2, 0), 0xa6: (const.ADDR_ZERO_PAGE, 3, 0),
+    0xb6: (const.ADDR_ZERO_PAGE_Y, 4, 0), 0xae: (const.ADDR_ABSOLUTE, 4, 0),
+    0xbe: (const.ADDR_ABSOLUTE_Y, 4, 1),
+    # LDY
+    0xa0: (const.ADDR_IMMEDIATE, 2, 0), 0xa4: (const.ADDR_ZERO_PAGE, 3, 0),
+    0xb4: (const.ADDR_ZERO_PAGE_X, 4, 0), 0xac: (const.ADDR_ABSOLUTE, 4, 0),
+    0xbc: (const.ADDR_ABSOLUTE_X, 4, 1),
+    # LSR
+    0x4a: (const.ADDR_ACCUMULATOR, 2, 0), 0x46: (const.ADDR_ZERO_PAGE, 5, 0),
+    0x56: (const.ADDR_ZERO_PAGE_X, 6, 0), 0x4e: (const.ADDR_ABSOLUTE, 6, 0),
+    0x5e: (const.ADDR_ABSOLUTE_X, 7, 0),
+    # NOP
+    0xea: (const.ADDR_IMPLICIT, 2, 0),
+    # ORA
+    0x09: (const.ADDR_IMMEDIATE, 2, 0), 0x05: (const.ADDR_ZERO_PAGE, 3, 0),
+    0x15: (const.ADDR_ZERO_PAGE_X, 4, 0), 0x0d: (const.ADDR_ABSOLUTE, 4, 0),
+    0x1d: (const.ADDR_ABSOLUTE_X, 4, 1), 0x19: (const.ADDR_ABSOLUTE_Y, 4, 1),
+    0x01: (const.ADDR_INDEXED_INDIRECT, 6, 0),
+    0x11: (const.ADDR_INDIRECT_INDEXED, 5, 1),
+    # Stack pushes and pulls
+    0x48: (const.ADDR_IMPLICIT, 3, 0), 0x08: (const.ADDR_IMPLICIT, 3, 0),
+    0x68: (const.ADDR_IMPLICIT, 4, 0), 0x28: (const.ADDR_IMPLICIT, 4, 0),
+    # ROL
+    0x2a: (const.ADDR_ACCUMULATOR, 2, 0), 0x26: (const.ADDR_ZERO_PAGE, 5, 0),
+    0x36: (const.ADDR_ZERO_PAGE_X, 6, 0), 0x2e: (const.ADDR_ABSOLUTE, 6, 0),
+    0x3e: (const.ADDR_ABSOLUTE_X, 7, 0),
+    # ROR
+    0x6a: (const.ADDR_ACCUMULATOR, 2, 0), 0x66: (const.ADDR_ZERO_PAGE, 5, 0),
+    0x76: (const.ADDR_ZERO_PAGE_X, 6, 0), 0x6e: (const.ADDR_ABSOLUTE, 6, 0),
+    0x7e: (const.ADDR_ABSOLUTE_X, 7, 0),
+    # RTI, RTS
+    0x40: (const.ADDR_IMPLICIT, 6, 0), 0x60: (const.ADDR_IMPLICIT, 6, 0),
+    # SBC
+    0xe9: (const.ADDR_IMMEDIATE, 2, 0), 0xe5: (const.ADDR_ZERO_PAGE, 3, 0),
+    0xf5: (const.ADDR_ZERO_PAGE_X, 4, 0), 0xed: (const.ADDR_ABSOLUTE, 4, 0),
+    0xfd: (const.ADDR_ABSOLUTE_X, 4, 1), 0xf9: (const.ADDR_ABSOLUTE_Y, 4, 1),
+    0xe1: (const.ADDR_INDEXED_INDIRECT, 6, 0),
+    0xf1: (const.ADDR_INDIRECT_INDEXED, 5, 1),
+    # Flag sets
+    0x38: (const.ADDR_IMPLICIT, 2, 0), 0xf8: (const.ADDR_IMPLICIT, 2, 0),
+    0x78: (const.ADDR_IMPLICIT, 2, 0),
+    # STA
+    0x85: (const.ADDR_ZERO_PAGE, 3, 0), 0x95: (const.ADDR_ZERO_PAGE_X, 4, 0),
+    0x8d: (const.ADDR_ABSOLUTE, 4, 0), 0x9d: (const.ADDR_ABSOLUTE_X, 5, 0),
+    0x99: (const.ADDR_ABSOLUTE_Y, 5, 0),
+    0x81: (const.ADDR_INDEXED_INDIRECT, 6, 0),
+    0x91: (const.ADDR_INDIRECT_INDEXED, 6, 0),
+    # STX
+    0x86: (const.ADDR_ZERO_PAGE, 3, 0), 0x96: (const.ADDR_ZERO_PAGE_Y, 4, 0),
+    0x8e: (const.ADDR_ABSOLUTE, 4, 0),
+    # STY
+    0x84: (const.ADDR_ZERO_PAGE, 3, 0), 0x94: (const.ADDR_ZERO_PAGE_X, 4, 0),
+    0x8c: (const.ADDR_ABSOLUTE, 4, 0),
+    # Transfers
+    0xaa: (const.ADDR_IMPLICIT, 2, 0), 0xa8: (const.ADDR_IMPLICIT, 2, 0),
+    0xba: (const.ADDR_IMPLICIT, 2, 0), 0x8a: (const.ADDR_IMPLICIT, 2, 0),
+    0x9a: (const.ADDR_IMPLICIT, 2, 0), 0x98: (const.ADDR_IMPLICIT, 2, 0)
+}
+
+# Handlers that are given the effective address rather than the value there
+ADDRESS_OPERANDS = (
+    "asl", "dec", "inc", "jmp", "jsr", "lsr", "rol", "ror", "sta", "stx", "sty"
+)
+
+# Handlers that end a straight-line run of code, because they change the
+# PC or depend on where it is
+CONTROL_FLOW = (
+    "bcc", "bcs", "beq", "bmi", "bne", "bpl", "brk", "bvc", "bvs", "jmp",
+    "jsr", "rti", "rts"
+)
+
+# Opcodes of each mnemonic, for anything that prints code
+OPCODES = {
+    "ADC": (0x61, 0x65, 0x69, 0x6d, 0x71, 0x75, 0x79, 0x7d),
+    "AND": (0x21, 0x25, 0x29, 0x2d, 0x31, 0x35, 0x39, 0x3d),
+    "ASL": (0x06, 0x0a, 0x0e, 0x16, 0x1e), "BCC": (0x90,), "BCS": (0xb0,),
+    "BEQ": (0xf0,), "BIT": (0x24, 0x2c), "BMI": (0x30,), "BNE": (0xd0,),
+    "BPL": (0x10,), "BRK": (0x00,), "BVC": (0x50,), "BVS": (0x70,),
+    "CLC": (0x18,), "CLD": (0xd8,), "CLI": (0x58,), "CLV": (0xb8,),
+    "CMP": (0xc1, 0xc5, 0xc9, 0xcd, 0xd1, 0xd5, 0xd9, 0xdd),
+    "CPX": (0xe0, 0xe4, 0xec), "CPY": (0xc0, 0xc4, 0xcc),
+    "DEC": (0xc6, 0xce, 0xd6, 0xde), "DEX": (0xca,), "DEY": (0x88,),
+    "EOR": (0x41, 0x45, 0x49, 0x4d, 0x51, 0x55, 0x59, 0x5d),
+    "INC": (0xe6, 0xee, 0xf6, 0xfe), "INX": (0xe8,), "INY": (0xc8,),
+    "JMP": (0x4c, 0x6c), "JSR": (0x20,),
+    "LDA": (0xa1, 0xa5, 0xa9, 0xad, 0xb1, 0xb5, 0xb9, 0xbd),
+    "LDX": (0xa2, 0xa6, 0xae, 0xb6, 0xbe),
+    "LDY": (0xa0, 0xa4, 0xac, 0xb4, 0xbc),
+    "LSR": (0x46, 0x4a, 0x4e, 0x56, 0x5e), "NOP": (0xea,),
+    "ORA": (0x01, 0x05, 0x09, 0x0d, 0x11, 0x15, 0x19, 0x1d),
+    "PHA": (0x48,), "PHP": (0x08,), "PLA": (0x68,), "PLP": (0x28,),
+    "ROL": (0x26, 0x2a, 0x2e, 0x36, 0x3e),
+    "ROR": (0x66, 0x6a, 0x6e, 0x76, 0x7e), "RTI": (0x40,), "RTS": (0x60,),
+    "SBC": (0xe1, 0xe5, 0xe9, 0xed, 0xf1, 0xf5, 0xf9, 0xfd),
+    "SEC": (0x38,), "SED": (0xf8,), "SEI": (0x78,),
+    "STA": (0x81, 0x85, 0x8d, 0x91, 0x95, 0x99, 0x9d),
+    "STX": (0x86, 0x8e, 0x96), "STY": (0x84, 0x8c, 0x94),
+    "TAX": (0xaa,), "TAY": (0xa8,), "TSX": (0xba,), "TXA": (0x8a,),
+    "TXS": (0x9a,), "TYA": (0x98,)
+}
+
+# Opcode: mnemonic
+MNEMONICS = {opcode: mnemonic for mnemonic, opcodes in OPCODES.items()
+             for opcode in opcodes}
@@ -0,0 +1,146 @@
+"""This module delivers interrupts to the CPU without polling for them.
+
+   Anything that will need the CPU's attention at a known time -- the PPU
+   reaching vblank, a mapper's scanline counter running out, the APU frame
+   counter -- is put on a min-heap of events timestamped in CPU cycles. The
+   CPU's run loop only compares its cycle count against a single deadline,
+   which is pulled in to the earliest event, so it can run hundreds of
+   instructions without looking at an interrupt line.
+
+   Asserting a line with no event behind it (a register write that enables
+   NMI during vblank, say) pulls the deadline in to the current cycle, so
+   the CPU stops after the instruction it is in the middle of. IRQ held
+   while the CPU has interrupts disabled is left alone until CLI, PLP or
+   RTI clears the flag, which does the same."""
+
+import heapq
+import itertools
+import constants as const
+
+
+class InterruptController(object):
+    """The CPU's NMI, IRQ and reset lines, and the events that drive them."""
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+
+        # [cycle, sequence, callback] entries. Cancelled entries have their
+        # callback set to None and are thrown away when they reach the top.
+        self.events = []
+        self.sequence = itertools.count()
+
+        ### Lines ###
+
+        # NMI is edge triggered, so a request is latched until serviced
+        self.nmi_pending = False
+
+        # IRQ is level triggered and shared: one bit per source holding it
+        self.irq_lines = 0
+
+        self.reset_pending = False
+
+        ### Statistics ###
+
+        self.events_run = 0
+        self.serviced = 0
+
+    ### Events ###
+
+    def schedule(self, cycle, callback):
+        """Calls callback() once the CPU reaches the given cycle. Returns a
+           handle that can be passed to cancel()."""
+
+        event = [cycle, next(self.sequence), callback]
+        heapq.heappush(self.events, event)
+
+        if cycle < self.cpu.deadline:
+            self.cpu.deadline = cycle
+
+        return event
+
+    def cancel(self, event):
+        """Stops a scheduled event from firing"""
+
+        event[2] = None
+
+    def next_event(self):
+        """The cycle of the earliest live event, or None"""
+
+        events = self.events
+
+        while events and events[0][2] is None:
+            heapq.heappop(events)
+
+        return events[0][0] if events else None
+
+    def run_events(self):
+        """Fires every event that is due"""
+
+        events = self.events
+        cycles = self.cpu.cycles
+
+        while events and events[0][0] <= cycles:
+            callback = heapq.heappop(events)[2]
+
+            if callback is not None:
+                self.events_run += 1
+                callback()
+
+    ### Lines ###
+
+    def request_nmi(self):
+        """Signals an NMI edge"""
+
+        self.nmi_pending = True
+        self.interrupt_now()
+
+    def assert_irq(self, source):
+        """Holds the IRQ line for a source, one of the IRQ_ constants"""
+
+        self.irq_lines |= source
+        self.cpu.irq_held = True
+
+        if not self.cpu.p & const.FLAG_INTERRUPT:
+            self.interrupt_now()
+
+    def release_irq(self, source):
+        """Lets go of the IRQ line for a source"""
+
+        self.irq_lines &= ~source
+        self.cpu.irq_held = bool(self.irq_lines)
+
+    def request_reset(self):
+        """Pulls the reset line"""
+
+        self.reset_pending = True
+        self.interrupt_now()
+
+    def interrupt_now(self):
+        """Stops the CPU after the instruction it is running"""
+
+        cpu = self.cpu
+
+        if cpu.cycles < cpu.deadline:
+            cpu.deadline = cpu.cycles
+
+    def service(self):
+        """Has the CPU take whichever interrupt is pending, if any,
+           returning whether it did"""
+
+        cpu = self.cpu
+
+        if self.reset_pending:
+            self.reset_pending = False
+            self.nmi_pending = False
+            cpu.reset()
+        elif self.nmi_pending:
+            self.nmi_pending = False
+            cpu.nmi()
+        elif self.irq_lines and not cpu.p & const.FLAG_INTERRUPT:
+            cpu.irq()
+        else:
+            return False
+
+        self.serviced += 1
+
+        return True
@@ -0,0 +1,482 @@
+"""This module implements cartridge mappers. PRG-ROM is cut into 256-byte
+   page slices once, and switching a bank repoints entries in the memory
+   bus page table at different slices instead of copying data. Writes to
+   0x8000 - 0xffff are routed to the mapper's registers."""
+
+import constants as const
+from exceptions.romexceptions import UnsupportedMapperError
+
+# CHR is tracked in 1KB slots, the smallest unit any mapper here switches
+CHR_SLOT_SIZE = 0x0400
+
+
+def create_mapper(rom, memory):
+    """Returns the mapper for a cartridge, wired into the given memory bus"""
+
+    if rom.mapper not in MAPPERS:
+        raise UnsupportedMapperError(rom.mapper,
+                                     const.EXCEPTION_UNSUPPORTED_MAPPER)
+
+    return MAPPERS[rom.mapper](rom, memory)
+
+
+class Mapper(object):
+    """Behavior shared by every mapper: PRG paging, CHR slots, SRAM and
+       nametable mirroring."""
+
+    number = None
+
+    # Attributes holding register state, saved in save states. Each is a
+    # byte, a bool or a list of bytes.
+    state_fields = ()
+
+    def __init__(self, rom, memory):
+        self.rom = rom
+        self.memory = memory
+        self.mirroring = rom.mirroring
+
+        # Set by the PPU when it is connected, so mirroring changes and
+        # CHR switches can be passed on to it
+        self.ppu = None
+
+        # Set when the console connects the CPU's interrupt controller
+        self.interrupts = None
+
+        # Set when the mapper asserts the CPU's IRQ line
+        self.irq_pending = False
+
+        ### PRG ###
+
+        prg = rom.prg_rom
+        self.prg_size = len(prg)
+        self.prg_pages = [prg[offset:offset + 0x100]
+                          for offset in range(0, self.prg_size, 0x100)]
+
+        # Battery backed or work RAM at 0x6000 - 0x7fff
+        self.prg_ram = bytearray(0x2000)
+        memory.map_buffer(0x6000, 0x7fff, memoryview(self.prg_ram))
+
+        # Reads come straight from the page table, writes hit registers
+        memory.map_handler(0x8000, 0xffff, write=self.write_register)
+
+        ### CHR ###
+
+        if len(rom.chr_rom):
+            self.chr = rom.chr_rom
+            self.chr_writable = False
+        else:
+            self.chr = memoryview(bytearray(rom.header.chr_ram_size or 0x2000))
+            self.chr_writable = True
+
+        self.chr_size = len(self.chr)
+
+        # Eight 1KB slots covering PPU 0x0000 - 0x1fff, and the offset into
+        # CHR that each one currently shows
+        self.chr_offsets = [0] * 8
+        self.chr_slots = [None] * 8
+
+        self.reset()
+
+    def reset(self):
+        """Puts the registers in their power on state and maps the initial
+           banks"""
+
+        self.map_prg(0x8000, 0, 0x4000)
+        self.map_prg(0xc000, -0x4000, 0x4000)
+        self.map_chr(0x0000, 0, 0x2000)
+
+    def update_banks(self):
+        """Remaps PRG, CHR and mirroring from the register values"""
+
+        return
+
+    def prg_windows(self):
+        """[(CPU address, size, [PRG-ROM offsets that can be shown there])]
+           for each PRG window, in the mode the mapper powers on in. The
+           static disassembler walks every bank through these."""
+
+        return [(0x8000, 0x4000, [0]),
+                (0xc000, 0x4000, [-0x4000 % self.prg_size])]
+
+    def prg_banks(self, size):
+        """The PRG-ROM offset of every bank of the given size"""
+
+        return list(range(0, self.prg_size, size))
+
+    def save_state(self):
+        """Packs the register state into bytes"""
+
+        state = bytearray()
+
+        for name in self.state_fields:
+            value = getattr(self, name)
+
+            if isinstance(value, list):
+                state.extend(value)
+            else:
+                state.append(value)
+
+        return bytes(state)
+
+    def load_state(self, state):
+        """Unpacks register state from save_state() and remaps the banks"""
+
+        offset = 0
+
+        for name in self.state_fields:
+            value = getattr(self, name)
+
+            if isinstance(value, list):
+                value[:] = state[offset:offset + len(value)]
+                offset += len(value)
+            else:
+                setattr(self, name, type(value)(state[offset]))
+                offset += 1
+
+        self.update_banks()
+
+    def map_prg(self, start, offset, size):
+        """Shows size bytes of PRG-ROM from offset at CPU address start.
+           Offsets wrap around the ROM, so negative ones count from the end."""
+
+        first = (offset % self.prg_size) >> 8
+        count = size >> 8
+        pages = self.prg_pages[first:first + count]
+
+        # a window bigger than what's left of the ROM repeats it
+        while len(pages) < count:
+            pages += self.prg_pages[:count - len(pages)]
+
+        self.memory.map_pages(start, pages)
+
+    def map_chr(self, start, offset, size):
+        """Shows size bytes of CHR from offset at PPU address start"""
+
+        offset %= self.chr_size
+
+        for index in range(size // CHR_SLOT_SIZE):
+            slot = (start >> 10) + index
+            slot_offset = offset + index * CHR_SLOT_SIZE
+
+            self.chr_offsets[slot] = slot_offset
+            self.chr_slots[slot] = self.chr[slot_offset:slot_offset +
+                                            CHR_SLOT_SIZE]
+
+        if self.ppu is not None:
+            self.ppu.chr_switched()
+
+    def set_mirroring(self, mirroring):
+        """Changes how the PPU's nametables are mirrored"""
+
+        if mirroring != self.mirroring:
+            self.mirroring = mirroring
+
+            if self.ppu is not None:
+                self.ppu.set_mirroring(mirroring)
+
+    def read_chr(self, loc):
+        """Reads a byte of pattern table memory"""
+
+        return self.chr_slots[loc >> 10][loc & 0x3ff]
+
+    def write_chr(self, loc, data):
+        """Writes a byte of pattern table memory, if it is RAM"""
+
+        if self.chr_writable:
+            self.chr_slots[loc >> 10][loc & 0x3ff] = data
+
+    def write_register(self, loc, data):
+        """Bus handler for 0x8000 - 0xffff. The PPU is caught up first, so
+           bank switches and IRQ counter writes land on the right scanline."""
+
+        if self.ppu is not None:
+            self.ppu.scheduler.sync(self.ppu)
+
+        self.write(loc, data)
+
+    def write(self, loc, data):
+        """Handles a CPU write to 0x8000 - 0xffff"""
+
+        return
+
+    def clock_scanline(self):
+        """Called by the PPU once per rendered scanline"""
+
+        return
+
+    def irq_scanlines(self):
+        """How many more clock_scanline() calls until the mapper raises an
+           IRQ, or None if it won't"""
+
+        return None
+
+    def irq_changed(self):
+        """Lets the PPU know irq_scanlines() has changed"""
+
+        if self.ppu is not None:
+            self.ppu.scheduler.reschedule(self.ppu)
+
+    def raise_irq(self):
+        """Asserts the CPU's IRQ line"""
+
+        self.irq_pending = True
+
+        if self.interrupts is not None:
+            self.interrupts.assert_irq(const.IRQ_MAPPER)
+
+    def acknowledge_irq(self):
+        """Releases the CPU's IRQ line"""
+
+        self.irq_pending = False
+
+        if self.interrupts is not None:
+            self.interrupts.release_irq(const.IRQ_MAPPER)
+
+
+class NROM(Mapper):
+    """Mapper 0: 16KB or 32KB of PRG-ROM, 8KB of CHR, no registers."""
+
+    number = 0
+
+
+class MMC1(Mapper):
+    """Mapper 1: registers are loaded a bit at a time through a shift
+       register, and control 16KB/32KB PRG and 4KB/8KB CHR banking."""
+
+    number = 1
+
+    state_fields = ("shift", "control", "chr_bank0", "chr_bank1", "prg_bank")
+
+    def reset(self):
+        self.shift = 0b10000
+        self.control = 0b01100
+        self.chr_bank0 = 0
+        self.chr_bank1 = 0
+        self.prg_bank = 0
+        self.update_banks()
+
+    def write(self, loc, data):
+        if data & 0x80:
+            # writing bit 7 resets the shift register and locks the last
+            # bank at 0xc000
+            self.shift = 0b10000
+            self.control |= 0b01100
+            self.update_banks()
+            return
+
+        # the marker bit reaches bit 0 on the fifth write
+        full = self.shift & 1
+        self.shift = self.shift >> 1 | (data & 1) << 4
+
+        if not full:
+            return
+
+        value = self.shift
+        self.shift = 0b10000
+        register = (loc >> 13) & 0b11
+
+        if register == 0:
+            self.control = value
+        elif register == 1:
+            self.chr_bank0 = value
+        elif register == 2:
+            self.chr_bank1 = value
+        else:
+            self.prg_bank = value & 0x0f
+
+        self.update_banks()
+
+    def update_banks(self):
+        """Remaps PRG, CHR and mirroring from the register values"""
+
+        self.set_mirroring((const.MIRROR_SINGLE_LOW, const.MIRROR_SINGLE_HIGH,
+                            const.MIRROR_VERTICAL,
+                            const.MIRROR_HORIZONTAL)[self.control & 0b11])
+
+        prg_mode = (self.control >> 2) & 0b11
+
+        if prg_mode < 2:
+            # 32KB at 0x8000, ignoring the low bit of the bank number
+            self.map_prg(0x8000, (self.prg_bank & 0x0e) * 0x4000, 0x8000)
+        elif prg_mode == 2:
+            # first bank fixed at 0x8000, switch 0xc000
+            self.map_prg(0x8000, 0, 0x4000)
+            self.map_prg(0xc000, self.prg_bank * 0x4000, 0x4000)
+        else:
+            # switch 0x8000, last bank fixed at 0xc000
+            self.map_prg(0x8000, self.prg_bank * 0x4000, 0x4000)
+            self.map_prg(0xc000, -0x4000, 0x4000)
+
+        if self.control & 0b10000:
+            # two independent 4KB banks
+            self.map_chr(0x0000, self.chr_bank0 * 0x1000, 0x1000)
+            self.map_chr(0x1000, self.chr_bank1 * 0x1000, 0x1000)
+        else:
+            # one 8KB bank, ignoring the low bit of the bank number
+            self.map_chr(0x0000, (self.chr_bank0 & 0x1e) * 0x1000, 0x2000)
+
+    def prg_windows(self):
+        # PRG mode 3: any 16KB bank at 0x8000, the last one at 0xc000
+        return [(0x8000, 0x4000, self.prg_banks(0x4000)),
+                (0xc000, 0x4000, [-0x4000 % self.prg_size])]
+
+
+class UxROM(Mapper):
+    """Mapper 2: switchable 16KB bank at 0x8000, last bank fixed at
+       0xc000, CHR-RAM."""
+
+    number = 2
+
+    state_fields = ("bank",)
+
+    def reset(self):
+        self.bank = 0
+        super().reset()
+
+    def write(self, loc, data):
+        self.bank = data
+        self.update_banks()
+
+    def update_banks(self):
+        self.map_prg(0x8000, self.bank * 0x4000, 0x4000)
+
+    def prg_windows(self):
+        return [(0x8000, 0x4000, self.prg_banks(0x4000)),
+                (0xc000, 0x4000, [-0x4000 % self.prg_size])]
+
+
+class CNROM(Mapper):
+    """Mapper 3: fixed PRG-ROM with a switchable 8KB CHR bank."""
+
+    number = 3
+
+    state_fields = ("bank",)
+
+    def reset(self):
+        self.bank = 0
+        super().reset()
+
+    def write(self, loc, data):
+        self.bank = data & 0b11
+        self.update_banks()
+
+    def update_banks(self):
+        self.map_chr(0x0000, self.bank * 0x2000, 0x2000)
+
+
+class MMC3(Mapper):
+    """Mapper 4: 8KB PRG and 1KB/2KB CHR banking plus a scanline counter
+       that raises IRQs."""
+
+    number = 4
+
+    state_fields = ("bank_select", "registers", "irq_latch", "irq_counter",
+                    "irq_reload", "irq_enabled", "irq_pending")
+
+    def reset(self):
+        self.bank_select = 0
+        self.registers = [0, 2, 4, 5, 6, 7, 0, 1]
+
+        self.irq_latch = 0
+        self.irq_counter = 0
+        self.irq_reload = False
+        self.irq_enabled = False
+        self.irq_pending = False
+
+        self.update_banks()
+
+    def write(self, loc, data):
+        even = not loc & 1
+        region = loc & 0xe000
+
+        if region == 0x8000:
+            if even:
+                self.bank_select = data
+            else:
+                self.registers[self.bank_select & 0b111] = data
+
+            self.update_banks()
+        elif region == 0xa000:
+            if even and self.mirroring != const.MIRROR_FOUR_SCREEN:
+                self.set_mirroring(const.MIRROR_HORIZONTAL if data & 1
+                                   else const.MIRROR_VERTICAL)
+        elif region == 0xc000:
+            if even:
+                self.irq_latch = data
+            else:
+                self.irq_counter = 0
+                self.irq_reload = True
+
+            self.irq_changed()
+        elif even:
+            # disabling also acknowledges a pending interrupt
+            self.irq_enabled = False
+            self.acknowledge_irq()
+            self.irq_changed()
+        else:
+            self.irq_enabled = True
+            self.irq_changed()
+
+    def update_banks(self):
+        """Remaps PRG and CHR from the bank registers"""
+
+        registers = self.registers
+
+        # PRG mode swaps which of 0x8000 and 0xc000 is fixed to the second
+        # last bank
+        if self.bank_select & 0x40:
+            self.map_prg(0x8000, -0x4000, 0x2000)
+            self.map_prg(0xc000, registers[6] * 0x2000, 0x2000)
+        else:
+            self.map_prg(0x8000, registers[6] * 0x2000, 0x2000)
+            self.map_prg(0xc000, -0x4000, 0x2000)
+
+        self.map_prg(0xa000, registers[7] * 0x2000, 0x2000)
+        self.map_prg(0xe000, -0x2000, 0x2000)
+
+        # CHR inversion swaps the 2KB and 1KB halves of the pattern tables
+        inverted = 0x1000 if self.bank_select & 0x80 else 0x0000
+
+        self.map_chr(0x0000 ^ inverted, (registers[0] & 0xfe) * 0x400, 0x800)
+        self.map_chr(0x0800 ^ inverted, (registers[1] & 0xfe) * 0x400, 0x800)
+
+        for index in range(4):
+            self.map_chr((0x1000 + index * 0x400) ^ inverted,
+                         registers[2 + index] * 0x400, 0x400)
+
+    def prg_windows(self):
+        # PRG mode 0: any 8KB bank at 0x8000 and 0xa000, the second last
+        # and last fixed at 0xc000 and 0xe000
+        return [(0x8000, 0x2000, self.prg_banks(0x2000)),
+                (0xa000, 0x2000, self.prg_banks(0x2000)),
+                (0xc000, 0x2000, [-0x4000 % self.prg_size]),
+                (0xe000, 0x2000, [-0x2000 % self.prg_size])]
+
+    def clock_scanline(self):
+        if self.irq_counter == 0 or self.irq_reload:
+            self.irq_counter = self.irq_latch
+            self.irq_reload = False
+        else:
+            self.irq_counter -= 1
+
+        if self.irq_counter == 0 and self.irq_enabled:
+            self.raise_irq()
+
+    def irq_scanlines(self):
+        if not self.irq_enabled:
+            return None
+
+        # the next clock either reloads the counter or decrements it, then
+        # it counts down to zero
+        if self.irq_counter == 0 or self.irq_reload:
+            counter = self.irq_latch
+        else:
+            counter = self.irq_counter - 1
+
+        return counter + 1
+
+
+# iNES mapper number: implementation
+MAPPERS = {
+    mapper.number: mapper for mapper in (NROM, MMC1, UxROM, CNROM, MMC3)
+}
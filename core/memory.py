@@ -63,22 +63,112 @@ def initialize_memory(mem_type):
         ]
 
         mem.define_ranges(ranges)
+
+        # RAM and its mirrors all point at the same eight pages
+        mem.map_buffer(0x0000, 0x1fff, mem.view[0x0000:0x0800])
+
+        # PPU registers, their mirrors, and the APU/controller registers
+        mem.map_handler(0x2000, 0x3fff, mem.read_register, mem.write_register)
+        mem.map_handler(0x4000, 0x40ff, mem.read_io, mem.write_io)
+
+        # Expansion ROM, SRAM and PRG-ROM behave as plain memory until a
+        # cartridge maps something over them
+        mem.map_buffer(0x4100, 0xffff, mem.view[0x4100:0x10000])
     else:
         return ""
 
     return mem
 
 
+def hooked_reader(hooks, page, handler):
+    """Builds a read handler that runs hooks before reading the page"""
+
+    if page is None:
+        def read(loc):
+            for hook in hooks:
+                hook(loc)
+
+            return handler(loc)
+    else:
+        def read(loc):
+            for hook in hooks:
+                hook(loc)
+
+            return page[loc & 0xff]
+
+    return read
+
+
+def hooked_writer(hooks, page, handler):
+    """Builds a write handler that runs hooks before writing the page"""
+
+    if page is None:
+        def write(loc, data):
+            for hook in hooks:
+                hook(loc, data)
+
+            handler(loc, data)
+    else:
+        def write(loc, data):
+            for hook in hooks:
+                hook(loc, data)
+
+            page[loc & 0xff] = data
+
+    return write
+
+
 class Memory(object):
-    """This class defines a memory bank to be used by either the CPU or PPU."""
+    """This class defines a memory bank to be used by either the CPU or PPU.
+
+       Accesses are dispatched through a 256-entry page table. Each 256-byte
+       page either points straight at a buffer slice, which is indexed
+       directly, or is None, in which case the page's handler is called."""
 
     def __init__(self, mem_type):
         # Size in kibibytes
         self.size = 65536
-        self.mem_bank = [0x00] * self.size
+        self.mem_bank = bytearray(self.size)
+        self.view = memoryview(self.mem_bank)
         self.ranges = []
         self.mem_type = mem_type
 
+        ### Page Table ###
+
+        # What each page is mapped to. A page with a buffer slice is read
+        # or written by indexing it; a page whose slice is None goes
+        # through its handler.
+        self.mapped_read_pages = [self.view[page << 8:(page + 1) << 8]
+                                  for page in range(0x100)]
+        self.mapped_write_pages = list(self.mapped_read_pages)
+        self.mapped_read_handlers = [self.read_unmapped] * 0x100
+        self.mapped_write_handlers = [self.write_unmapped] * 0x100
+
+        # What load() and store() actually use: the mapping above, except
+        # that hooked pages are forced through a handler that runs the hooks
+        self.read_pages = list(self.mapped_read_pages)
+        self.write_pages = list(self.mapped_write_pages)
+        self.read_handlers = list(self.mapped_read_handlers)
+        self.write_handlers = list(self.mapped_write_handlers)
+
+        # Page: list of hook callbacks
+        self.read_hooks = {}
+        self.write_hooks = {}
+
+        # Called with (first page, last page) whenever pages are remapped
+        self.remap_listeners = []
+
+        # One byte per page, set when the page is written or remapped, or
+        # None when dirty tracking is off
+        self.dirty = None
+
+        # Callbacks for 0x2000 - 0x2007 and 0x4000 - 0x401f. A register
+        # without one reads back the last value written to it.
+        self.register_readers = [self.read_latch] * 0x08
+        self.register_writers = [self.write_latch] * 0x08
+        self.io_readers = [self.read_latch] * 0x20
+        self.io_writers = [self.write_latch] * 0x20
+
     def define_ranges(self, ranges):
         """Defines how to segment memory"""
         self.ranges = ranges
@@ -89,37 +179,316 @@ class Memory(object):
         elif loc < 0:
             raise MemoryLocationError(loc, const.EXCEPTION_MEMORY_LESS_ZERO)
 
-    def write(self, loc, data):
-        """Writes to a memory location given location and data"""
-        self.check_memory_location(loc)
+    def map_buffer(self, start, end, buffer, writable=True):
+        """Points the pages from start to end at consecutive 256-byte slices
+           of buffer, repeating the buffer if the range is larger than it"""
+
+        slices = [buffer[offset:offset + 0x100]
+                  for offset in range(0, len(buffer), 0x100)]
+
+        for index, page in enumerate(range(start >> 8, (end >> 8) + 1)):
+            self.mapped_read_pages[page] = slices[index % len(slices)]
+            self.mapped_write_pages[page] = (slices[index % len(slices)]
+                                             if writable else None)
+
+            if not writable:
+                self.mapped_write_handlers[page] = self.write_unmapped
+
+        self.remapped(start >> 8, end >> 8)
+
+    def map_pages(self, start, pages):
+        """Points consecutive read pages from start at already sliced pages.
+           This is how mappers switch banks: one slice assignment, no copy."""
+
+        first = start >> 8
+        last = first + len(pages) - 1
+
+        self.mapped_read_pages[first:last + 1] = pages
+
+        if self.read_hooks:
+            self.remapped(first, last)
+        else:
+            self.read_pages[first:last + 1] = pages
+
+            for listener in self.remap_listeners:
+                listener(first, last)
+
+    def map_handler(self, start, end, read=None, write=None):
+        """Routes the pages from start to end through handler callbacks.
+           Passing only one of read or write leaves the other direction
+           as it was."""
+
+        for page in range(start >> 8, (end >> 8) + 1):
+            if read is not None:
+                self.mapped_read_pages[page] = None
+                self.mapped_read_handlers[page] = read
+
+            if write is not None:
+                self.mapped_write_pages[page] = None
+                self.mapped_write_handlers[page] = write
+
+        self.remapped(start >> 8, end >> 8)
+
+    def remapped(self, first, last):
+        """Rebuilds the pages load() and store() use from the mapping and
+           any hooks, then tells listeners"""
+
+        for page in range(first, last + 1):
+            self.rebuild_page(page)
+
+        for listener in self.remap_listeners:
+            listener(first, last)
+
+    def rebuild_page(self, page):
+        """Rebuilds one page, wrapping it in its hooks if it has any"""
+
+        read_page = self.mapped_read_pages[page]
+        read_handler = self.mapped_read_handlers[page]
+        write_page = self.mapped_write_pages[page]
+        write_handler = self.mapped_write_handlers[page]
+
+        if page in self.read_hooks:
+            self.read_pages[page] = None
+            self.read_handlers[page] = hooked_reader(
+                tuple(self.read_hooks[page]), read_page, read_handler)
+        else:
+            self.read_pages[page] = read_page
+            self.read_handlers[page] = read_handler
+
+        if page in self.write_hooks:
+            self.write_pages[page] = None
+            self.write_handlers[page] = hooked_writer(
+                tuple(self.write_hooks[page]), write_page, write_handler)
+        else:
+            self.write_pages[page] = write_page
+            self.write_handlers[page] = write_handler
+
+    ### Hooks ###
+
+    def hook_reads(self, page, hook):
+        """Calls hook(loc) before every read from a page. Only hooked pages
+           leave the fast path."""
+
+        self.read_hooks.setdefault(page, []).append(hook)
+        self.rebuild_page(page)
+
+    def unhook_reads(self, page, hook):
+        """Removes a read hook, restoring the fast path once none are left"""
+
+        self.read_hooks[page].remove(hook)
+
+        if not self.read_hooks[page]:
+            del self.read_hooks[page]
+
+        self.rebuild_page(page)
+
+    def hook_writes(self, page, hook):
+        """Calls hook(loc, data) before every write to a page. Only hooked
+           pages leave the fast path."""
+
+        self.write_hooks.setdefault(page, []).append(hook)
+        self.rebuild_page(page)
+
+    def unhook_writes(self, page, hook):
+        """Removes a write hook, restoring the fast path once none are left"""
+
+        self.write_hooks[page].remove(hook)
+
+        if not self.write_hooks[page]:
+            del self.write_hooks[page]
+
+        self.rebuild_page(page)
+
+    ### Dirty Tracking ###
 
-        if self.mem_type == const.TYPE_CPU:
-            # Check if in mirrored ranges
-            if loc in range(0x0000, 0x0800):
-                cp_loc = loc + 0x0800
+    def enable_dirty_tracking(self):
+        """Starts recording which pages are written. Only clean pages are
+           hooked, and a page's hook is removed by its first write, so each
+           page costs one slow write per checkpoint and nothing after."""
 
-                # copy RAM data to 3 mirrors
-                while cp_loc < 0x2000:
-                    self.mem_bank[cp_loc] = data
-                    cp_loc += 0x0800
-            elif loc in range(0x2000, 0x2008):
-                cp_loc = loc + 0x0008
+        if self.dirty is not None:
+            return
 
-                # copy IO Registers every 8 bytes
-                while cp_loc < 0x4000:
-                    self.mem_bank[cp_loc] = data
-                    cp_loc += 0x0008
+        self.dirty = bytearray(0x100)
+        self.remap_listeners.append(self.remapped_dirty)
+
+        for page in range(0x100):
+            self.hook_writes(page, self.written_dirty)
+
+    def disable_dirty_tracking(self):
+        """Stops recording writes, putting every page back on the fast path"""
+
+        if self.dirty is None:
+            return
+
+        for page in range(0x100):
+            if not self.dirty[page]:
+                self.unhook_writes(page, self.written_dirty)
+
+        self.remap_listeners.remove(self.remapped_dirty)
+        self.dirty = None
+
+    def dirty_pages(self):
+        """The pages written or remapped since the last clear_dirty()"""
+
+        return [page for page in range(0x100) if self.dirty[page]]
+
+    def clear_dirty(self):
+        """Starts a new checkpoint, marking every page clean"""
+
+        for page in self.dirty_pages():
+            self.dirty[page] = 0
+            self.hook_writes(page, self.written_dirty)
+
+    def mark_dirty(self, first=0x00, last=0xff):
+        """Marks pages dirty, for when their buffers were changed without
+           going through the bus"""
+
+        for page in range(first, last + 1):
+            if not self.dirty[page]:
+                self.dirty[page] = 1
+                self.unhook_writes(page, self.written_dirty)
+
+    def written_dirty(self, loc, data):
+        """Write hook on clean pages. A write through any mirror dirties
+           every page showing the same buffer."""
+
+        for page in self.aliases(loc >> 8):
+            if not self.dirty[page]:
+                self.dirty[page] = 1
+                self.unhook_writes(page, self.written_dirty)
+
+    def remapped_dirty(self, first, last):
+        """Remap listener: pages showing something else are dirty"""
+
+        self.mark_dirty(first, last)
+
+    def aliases(self, page):
+        """Every page whose writes land in the same buffer slice as page,
+           e.g. the four mirrors of a RAM page"""
+
+        target = self.mapped_write_pages[page]
+
+        if target is None:
+            return [page]
+
+        return [alias for alias in range(0x100)
+                if self.mapped_write_pages[alias] is target]
+
+    def map_register(self, loc, read=None, write=None):
+        """Hooks a single PPU (0x2000 - 0x2007) or APU/IO (0x4000 - 0x401f)
+           register"""
+
+        if loc < 0x4000:
+            readers, writers, index = (self.register_readers,
+                                       self.register_writers, loc & 0x07)
+        else:
+            readers, writers, index = self.io_readers, self.io_writers, \
+                loc & 0x1f
+
+        if read is not None:
+            readers[index] = read
+
+        if write is not None:
+            writers[index] = write
+
+    ### Fast Path ###
+
+    def load(self, loc):
+        """Reads a byte without bounds checking"""
+
+        page = self.read_pages[loc >> 8]
+
+        if page is None:
+            return self.read_handlers[loc >> 8](loc)
+
+        return page[loc & 0xff]
+
+    def store(self, loc, data):
+        """Writes a byte without bounds checking"""
+
+        page = self.write_pages[loc >> 8]
+
+        if page is None:
+            self.write_handlers[loc >> 8](loc, data)
+        else:
+            page[loc & 0xff] = data
+
+    def peek(self, loc):
+        """Reads a byte for a debugger, without running hooks or handlers.
+           Pages behind a handler read as 0xff."""
+
+        page = self.mapped_read_pages[loc >> 8]
+
+        if page is None:
+            return 0xff
+
+        return page[loc & 0xff]
+
+    ### Handlers ###
+
+    def read_register(self, loc):
+        """Reads a PPU register, which repeat every 8 bytes to 0x4000"""
+
+        return self.register_readers[loc & 0x07](0x2000 | loc & 0x07)
+
+    def write_register(self, loc, data):
+        """Writes a PPU register, which repeat every 8 bytes to 0x4000"""
+
+        self.register_writers[loc & 0x07](0x2000 | loc & 0x07, data)
+
+    def read_io(self, loc):
+        """Reads an APU/IO register or the expansion area above them"""
+
+        if loc < 0x4020:
+            return self.io_readers[loc & 0x1f](loc)
+
+        return self.mem_bank[loc]
+
+    def write_io(self, loc, data):
+        """Writes an APU/IO register or the expansion area above them"""
+
+        if loc < 0x4020:
+            self.io_writers[loc & 0x1f](loc, data)
+        else:
+            self.mem_bank[loc] = data
+
+    def read_latch(self, loc):
+        """Reads back the last value written to a register"""
+
+        return self.mem_bank[loc]
+
+    def write_latch(self, loc, data):
+        """Latches a register write so it can be read back"""
 
         self.mem_bank[loc] = data
 
+    def read_unmapped(self, loc):
+        """Reads from a page with nothing mapped, which returns zero"""
+
+        return 0x00
+
+    def write_unmapped(self, loc, data):
+        """Writes to a page with nothing mapped, such as ROM, are dropped"""
+
+        return
+
+    ### Checked Access ###
+
+    def write(self, loc, data):
+        """Writes to a memory location given location and data"""
+        self.check_memory_location(loc)
+
+        self.store(loc, data)
+
     def read(self, loc):
         """Reads from a range of memory"""
         self.check_memory_location(loc)
 
-        return self.mem_bank[loc]
+        return self.load(loc)
 
     def delete(self, loc):
         """Zeroes out a specified memory location"""
         self.check_memory_location(loc)
 
-        self.ranges[loc] = 0x00
+        self.store(loc, 0x00)
@@ -0,0 +1,260 @@
+"""This module reads and writes input movies in FCEUX's FM2 text format,
+   and replays them.
+
+   A movie keeps its input as one bytearray per gamepad port, and one of
+   commands, indexed by frame: the arrays the controllers read from while
+   it plays. Only the two standard gamepads and soft resets are supported.
+   Other devices, other commands and binary FM2 are refused when the movie
+   is loaded, rather than replayed wrongly.
+
+   play() runs a movie frame by frame, and is what replay() and batch jobs
+   both use. replay() can hash the whole console state every N frames, so
+   that two runs of the same movie, say before and after a change to the
+   core, can be checked for identical emulation."""
+
+import base64
+import hashlib
+import os
+import uuid
+import constants as const
+from exceptions.movieexceptions import MovieError
+
+# FM2's letters for the gamepad buttons, in the order an input line lists
+# them: Right is bit 7 and A bit 0
+FM2_BUTTONS = "RLDUTSBA"
+
+# The header of a new movie, with the keys FCEUX expects
+DEFAULT_HEADER = [
+    ("version", "3"), ("emuVersion", "22020"), ("rerecordCount", "0"),
+    ("palFlag", "0"), ("romFilename", ""), ("romChecksum", ""),
+    ("guid", ""), ("fourscore", "0"), ("microphone", "0"), ("port0", "1"),
+    ("port1", "1"), ("port2", "0"), ("FDS", "0"), ("NewPPU", "0")
+]
+
+# Header values the controllers can replay: port0/1 may be empty or a
+# gamepad, and nothing else may be plugged in
+SUPPORTED_DEVICES = {"port0": ("0", "1"), "port1": ("0", "1"),
+                     "port2": ("0",), "fourscore": ("0",)}
+
+# Parsed gamepad fields, since a movie repeats the same few a lot
+button_cache = {"": 0}
+
+
+def create_movie(rom=None):
+    """Returns an empty movie to record into, naming rom if given"""
+
+    movie = Movie(list(DEFAULT_HEADER))
+    movie.set("guid", str(uuid.uuid4()).upper())
+
+    if rom is not None:
+        movie.set("romFilename", os.path.splitext(
+            os.path.basename(rom.path))[0])
+        movie.set("romChecksum", fm2_checksum(rom))
+
+    return movie
+
+
+def load_movie(path):
+    """Reads an FM2 file"""
+
+    with open(path, encoding="utf-8", errors="replace") as movie_file:
+        return parse_fm2(movie_file, path)
+
+
+def parse_fm2(lines, path=""):
+    """Builds a movie from the lines of an FM2 file"""
+
+    header = []
+    movie = Movie(header)
+    inputs = []
+
+    for line in lines:
+        line = line.rstrip("\r\n")
+
+        if line.startswith("|"):
+            inputs.append(line)
+        elif line and not inputs:
+            key, separator, value = line.partition(" ")
+            header.append((key, value))
+
+    if movie.get("binary", "0") != "0":
+        raise MovieError(path, const.EXCEPTION_MOVIE_BINARY)
+
+    for key, values in SUPPORTED_DEVICES.items():
+        if movie.get(key, "0") not in values:
+            raise MovieError(path, const.EXCEPTION_MOVIE_DEVICE)
+
+    port0, port1 = movie.inputs
+    commands = movie.commands
+
+    for line in inputs:
+        fields = line.split("|")
+
+        if len(fields) < 5:
+            raise MovieError(path, const.EXCEPTION_MOVIE_BAD_LINE)
+
+        try:
+            command = int(fields[1] or "0")
+        except ValueError:
+            raise MovieError(path, const.EXCEPTION_MOVIE_BAD_LINE)
+
+        if command & ~const.COMMAND_RESET:
+            raise MovieError(path, const.EXCEPTION_MOVIE_COMMAND)
+
+        commands.append(command)
+        port0.append(parse_buttons(fields[2], path))
+        port1.append(parse_buttons(fields[3], path))
+
+    return movie
+
+
+def parse_buttons(field, path=""):
+    """BUTTON_* bits from an FM2 gamepad field such as "R......A". Any
+       character but a dot or space is a pressed button."""
+
+    buttons = button_cache.get(field)
+
+    if buttons is None:
+        if len(field) != len(FM2_BUTTONS):
+            raise MovieError(path, const.EXCEPTION_MOVIE_BAD_LINE)
+
+        buttons = 0
+
+        for char in field:
+            buttons = buttons << 1 | (char not in ". ")
+
+        button_cache[field] = buttons
+
+    return buttons
+
+
+def format_buttons(buttons):
+    """The FM2 gamepad field for BUTTON_* bits"""
+
+    return "".join(letter if buttons & 0x80 >> index else "."
+                   for index, letter in enumerate(FM2_BUTTONS))
+
+
+def fm2_checksum(rom):
+    """The romChecksum FCEUX writes: the MD5 of PRG and CHR, in base64"""
+
+    md5 = hashlib.md5(rom.prg_rom)
+    md5.update(rom.chr_rom)
+
+    return "base64:" + base64.b64encode(md5.digest()).decode("ascii")
+
+
+class Movie(object):
+    """The header and per-frame input of a movie."""
+
+    def __init__(self, header):
+        # (key, value) pairs, in file order, since keys like comment repeat
+        self.header = header
+
+        # Buttons on each port and commands, one byte per frame
+        self.inputs = (bytearray(), bytearray())
+        self.commands = bytearray()
+
+    def __len__(self):
+        return len(self.commands)
+
+    def get(self, key, default=None):
+        """The first header value for key"""
+
+        for name, value in self.header:
+            if name == key:
+                return value
+
+        return default
+
+    def set(self, key, value):
+        """Replaces the first header value for key, or adds one"""
+
+        for index, (name, old) in enumerate(self.header):
+            if name == key:
+                self.header[index] = (key, value)
+                return
+
+        self.header.append((key, value))
+
+    def set_frame(self, index, port0, port1):
+        """Sets a frame's buttons, lengthening the movie to reach it. Any
+           frames skipped over get the same buttons."""
+
+        gap = index + 1 - len(self.commands)
+
+        if gap > 0:
+            self.inputs[0].extend(bytes([port0]) * gap)
+            self.inputs[1].extend(bytes([port1]) * gap)
+            self.commands.extend(bytes(gap))
+        else:
+            self.inputs[0][index] = port0
+            self.inputs[1][index] = port1
+
+    def check_rom(self, rom):
+        """Raises a MovieError unless the movie was recorded with rom, or
+           doesn't say what it was recorded with"""
+
+        checksum = self.get("romChecksum")
+
+        if checksum and checksum != fm2_checksum(rom):
+            raise MovieError(rom.path, const.EXCEPTION_MOVIE_WRONG_ROM)
+
+    def lines(self):
+        """The movie as FM2 lines, without line endings"""
+
+        for key, value in self.header:
+            yield ("%s %s" % (key, value)).rstrip()
+
+        port0, port1 = self.inputs
+
+        for index, command in enumerate(self.commands):
+            yield "|%d|%s|%s||" % (command, format_buttons(port0[index]),
+                                   format_buttons(port1[index]))
+
+    def save(self, path):
+        """Writes the movie as an FM2 file"""
+
+        with open(path, "w", encoding="utf-8", newline="\n") as movie_file:
+            for line in self.lines():
+                movie_file.write(line + "\n")
+
+
+def play(console, movie, frames=None):
+    """Plays a movie from the frame the console is on, normally its first,
+       yielding (frame, pixels) as each frame finishes. frames defaults to
+       the movie's length, and past its end the last buttons stay held.
+       The last frame is always drawn, whatever the render interval."""
+
+    controllers = console.controllers
+    commands = movie.commands
+
+    if frames is None:
+        frames = len(commands)
+
+    controllers.play(movie)
+
+    try:
+        for frame in range(frames):
+            if frame == frames - 1:
+                console.ppu.request_render()
+
+            if frame < len(commands) and commands[frame] & const.COMMAND_RESET:
+                console.reset()
+
+            yield frame, console.run_frame()
+    finally:
+        controllers.stop()
+
+
+def replay(console, movie, hash_every=0, frames=None):
+    """Plays a movie with play(), returning (frame, state hash) pairs taken
+       every hash_every frames"""
+
+    hashes = []
+
+    for frame, pixels in play(console, movie, frames):
+        if hash_every and not (frame + 1) % hash_every:
+            hashes.append((frame + 1, console.state_hash()))
+
+    return hashes
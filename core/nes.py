@@ -0,0 +1,121 @@
+"""This module assembles a complete console: the CPU, its memory bus, the
+   cartridge, and the components that share the CPU's clock."""
+
+import hashlib
+import apu as APU
+import constants as const
+import controller
+import cpu as CPU
+import ppu as PPU
+import rom as cart
+import savestate
+import scheduler
+
+
+def create_nes():
+    """Returns a new console with nothing inserted"""
+    return NES()
+
+
+class NES(object):
+    """This class wires together the parts of the console."""
+
+    def __init__(self):
+        self.cpu = CPU.create_cpu()
+        self.memory = self.cpu.memory
+        self.scheduler = scheduler.Scheduler(self.cpu)
+
+        self.ppu = self.scheduler.add(PPU.create_ppu())
+        self.ppu.connect(self.memory)
+
+        self.apu = self.scheduler.add(APU.create_apu())
+        self.apu.connect(self.memory)
+
+        self.controllers = controller.create_controllers()
+        self.controllers.connect(self.memory, self.ppu)
+
+    def load_rom(self, path):
+        """Inserts a cartridge and resets"""
+
+        return self.insert_rom(cart.load_rom(path))
+
+    def insert_rom(self, rom):
+        """Inserts an already loaded cartridge and resets"""
+
+        self.cpu.insert_rom(rom)
+        self.cpu.mapper.interrupts = self.scheduler.interrupts
+        self.ppu.attach_mapper(self.cpu.mapper)
+
+        return rom
+
+    def enable_idle_skipping(self):
+        """Fast-forwards the CPU through idle loops, including ones that
+           poll $2002"""
+
+        idle_loops = self.cpu.enable_idle_skipping()
+        idle_loops.add_source(0x2002, self.ppu.status_stable_until)
+
+        return idle_loops
+
+    def disable_idle_skipping(self):
+        """Goes back to interpreting every iteration of every loop"""
+
+        self.cpu.disable_idle_skipping()
+
+    def enable_audio(self, target, sample_rate=const.AUDIO_SAMPLE_RATE):
+        """Starts streaming audio to a WAV file, given a path, or to a
+           callback taking arrays of 16-bit samples. Returns the stream."""
+
+        return self.apu.start_output(target, sample_rate)
+
+    def disable_audio(self):
+        """Finishes the audio stream, returning it"""
+
+        return self.apu.stop_output()
+
+    def run(self, cycles):
+        """Runs the console for at least the given number of CPU cycles"""
+
+        return self.scheduler.run(cycles)
+
+    def reset(self):
+        """Presses the reset button, which takes effect on the next run"""
+
+        self.scheduler.interrupts.request_reset()
+        self.controllers.command(const.COMMAND_RESET)
+
+    def snapshot(self):
+        """Returns the whole console state as bytes"""
+
+        return savestate.snapshot(self)
+
+    def state_hash(self):
+        """A SHA-1 of the whole console state. Every component is caught up
+           first, and a skipped frame's flags worked out, so the hash only
+           depends on what has been emulated."""
+
+        self.scheduler.sync_all()
+        self.ppu.update_flags()
+
+        return hashlib.sha1(self.snapshot()).hexdigest()
+
+    def restore(self, state):
+        """Puts the console back in a state from snapshot()"""
+
+        savestate.restore(self, state)
+
+    def run_frame(self):
+        """Runs until the PPU finishes a frame, or the debugger stops the
+           CPU, returning the frame buffer"""
+
+        frame = self.ppu.frame
+
+        while self.ppu.frame == frame and not self.cpu.stopped:
+            self.scheduler.run(max(1, self.ppu.next_sync() - self.cpu.cycles))
+
+        return self.ppu.frame_buffer
+
+    def frame_rgb(self):
+        """The last frame as a (240, 256, 3) RGB array"""
+
+        return self.ppu.frame_rgb()
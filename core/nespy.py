@@ -0,0 +1,281 @@
+"""Command line entry point. Run with:
+
+       python core/nespy.py batch JOBS.json [-j N] [--output DIR]
+       python core/nespy.py profile ROM [--frames N] [--collapsed FILE]
+       python core/nespy.py disasm ROM [--bank N]
+       python core/nespy.py record ROM --frames N [--raw FILE] [--png DIR]
+                                   [--video FILE] [--wav FILE]
+       python core/nespy.py replay ROM MOVIE [--hash-every N] [--skip-render]
+                                   [--skip-idle]
+       python core/nespy.py conformance PATH... [-j N] [--frames N]
+
+   JOBS.json is a list of jobs, each an object with "rom" and "frames"
+   and optionally "movie" and "outputs". One JSON line is printed per job
+   as it finishes; screenshots are written to the output directory as PPM
+   files rather than printed.
+
+   profile runs a ROM headless for some frames with the profiler on, then
+   prints its hotspot report and optionally writes collapsed stacks for a
+   flame graph.
+
+   disasm prints how much of each 8KB PRG bank is known code and data, or
+   the listing of one bank, from the ROM's cached code/data map.
+
+   record runs a ROM headless and writes its frames and sound in the
+   background: raw RGB24, numbered PNGs, a video encoded by ffmpeg, and a
+   WAV file, in any combination. It prints the pipeline's frame counts.
+
+   replay plays an FM2 movie on a ROM from power on as fast as it will go,
+   printing how long it took and the console's state hash every N frames,
+   to check that a change to the core leaves emulation the same.
+
+   conformance runs test ROMs, given directly or found under directories,
+   across a process pool: ROMs with a golden .log beside them, such as
+   nestest, are traced and compared with it line by line, and the rest
+   report through blargg's $6000 protocol. Each result is printed as it
+   finishes, a trace test's first divergence with the lines around it, and
+   the exit status is 1 if any failed."""
+
+import argparse
+import json
+import os
+import sys
+import time
+import batch
+import conformance
+import constants as const
+import disassembler
+import movie
+import nes
+import output
+
+
+def batch_command(args):
+    """Runs a batch file, streaming results to stdout"""
+
+    with open(args.jobs) as jobs_file:
+        jobs = [batch.Job(**job) for job in json.load(jobs_file)]
+
+    failed = 0
+
+    for result in batch.run_batch(jobs, args.processes):
+        screenshot = result.pop(const.OUTPUT_SCREENSHOT, None)
+
+        if screenshot is not None:
+            path = os.path.join(args.output, "%d.ppm" % result["index"])
+
+            with open(path, "wb") as image:
+                image.write(b"P6\n256 240\n255\n")
+                image.write(screenshot)
+
+            result[const.OUTPUT_SCREENSHOT] = path
+
+        if result["error"] is not None:
+            failed += 1
+
+        print(json.dumps(result, sort_keys=True))
+        sys.stdout.flush()
+
+    return 1 if failed else 0
+
+
+def profile_command(args):
+    """Profiles a ROM, printing the hotspot report"""
+
+    console = nes.create_nes()
+    console.load_rom(args.rom)
+    profiler = console.cpu.enable_profiling()
+
+    for frame in range(args.frames):
+        console.run_frame()
+
+    console.cpu.disable_profiling()
+    print(profiler.report(args.limit))
+
+    if args.collapsed:
+        profiler.write_collapsed(args.collapsed)
+
+    return 0
+
+
+def disasm_command(args):
+    """Prints a ROM's code/data map, or the listing of one bank"""
+
+    console = nes.create_nes()
+    console.load_rom(args.rom)
+    code_map = disassembler.create_code_map(console.cpu)
+
+    if args.bank is not None:
+        print("\n".join(code_map.listing(args.bank)))
+        return 0
+
+    for bank, code, data in code_map.banks():
+        print("PRG %-3d code %5d  data %5d  unknown %5d" % (
+            bank, code, data, disassembler.BANK_SIZE - code - data))
+
+    return 0
+
+
+def record_command(args):
+    """Records a ROM's frames and audio to the chosen sinks"""
+
+    sinks = []
+
+    if args.raw:
+        sinks.append(output.RawSink(args.raw))
+
+    if args.png:
+        sinks.append(output.PngSink(args.png))
+
+    if args.video:
+        sinks.append(output.PipeSink(output.video_command(args.video)))
+
+    if args.wav:
+        sinks.append(output.WavSink(args.wav))
+
+    console = nes.create_nes()
+    console.load_rom(args.rom)
+    pipeline = output.OutputPipeline(sinks, args.buffers, args.drop)
+    stats = output.record(console, pipeline, args.frames,
+                          audio=args.wav is not None)
+    print(json.dumps(stats, sort_keys=True))
+
+    return 0
+
+
+def replay_command(args):
+    """Replays a movie, printing its timing and state hashes"""
+
+    console = nes.create_nes()
+    rom = console.load_rom(args.rom)
+    inputs = movie.load_movie(args.movie)
+    inputs.check_rom(rom)
+
+    if args.skip_render:
+        console.ppu.set_render_interval(0)
+
+    if args.skip_idle:
+        console.enable_idle_skipping()
+
+    start = time.perf_counter()
+    hashes = movie.replay(console, inputs, args.hash_every)
+    seconds = time.perf_counter() - start
+
+    print(json.dumps({
+        "frames": len(inputs),
+        "seconds": round(seconds, 3),
+        "fps": round(len(inputs) / seconds, 1) if seconds else None,
+        "hashes": hashes,
+        "final_hash": console.state_hash()
+    }, sort_keys=True))
+
+    return 0
+
+
+def conformance_command(args):
+    """Runs conformance test ROMs, printing each result"""
+
+    tests = conformance.discover(args.paths, args.frames)
+    failed = 0
+
+    for result in conformance.run_suite(tests, args.processes):
+        if not result["passed"]:
+            failed += 1
+
+        print("\n".join(conformance.describe(result)))
+        sys.stdout.flush()
+
+    print("%d passed, %d failed" % (len(tests) - failed, failed))
+
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="nespy")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    batch_parser = commands.add_parser("batch",
+                                       help="run many headless jobs")
+    batch_parser.add_argument("jobs", help="JSON file listing the jobs")
+    batch_parser.add_argument("-j", "--processes", type=int, default=None,
+                              help="worker processes (default: one per core)")
+    batch_parser.add_argument("--output", default=".",
+                              help="directory for screenshots")
+    batch_parser.set_defaults(run=batch_command)
+
+    profile_parser = commands.add_parser("profile",
+                                         help="find where guest code spends "
+                                         "its cycles")
+    profile_parser.add_argument("rom", help="iNES file to run")
+    profile_parser.add_argument("--frames", type=int, default=600,
+                                help="frames to run (default: 600)")
+    profile_parser.add_argument("--limit", type=int, default=20,
+                                help="rows per table (default: 20)")
+    profile_parser.add_argument("--collapsed",
+                                help="write collapsed stacks to this file")
+    profile_parser.set_defaults(run=profile_command)
+
+    disasm_parser = commands.add_parser("disasm",
+                                        help="map and list a ROM's code")
+    disasm_parser.add_argument("rom", help="iNES file to disassemble")
+    disasm_parser.add_argument("--bank", type=int, default=None,
+                               help="list this 8KB PRG bank")
+    disasm_parser.set_defaults(run=disasm_command)
+
+    record_parser = commands.add_parser("record",
+                                        help="write a ROM's frames and "
+                                        "sound to files")
+    record_parser.add_argument("rom", help="iNES file to run")
+    record_parser.add_argument("--frames", type=int, required=True,
+                               help="frames to run")
+    record_parser.add_argument("--raw", help="write raw RGB24 frames here")
+    record_parser.add_argument("--png", help="write numbered PNGs here")
+    record_parser.add_argument("--video",
+                               help="encode a video here with ffmpeg")
+    record_parser.add_argument("--wav", help="write the sound here")
+    record_parser.add_argument("--buffers", type=int,
+                               default=output.DEFAULT_BUFFERS,
+                               help="frames that can wait to be written "
+                               "(default: %d)" % output.DEFAULT_BUFFERS)
+    record_parser.add_argument("--drop", action="store_true",
+                               help="skip frames rather than wait when "
+                               "every buffer is in use")
+    record_parser.set_defaults(run=record_command)
+
+    replay_parser = commands.add_parser("replay",
+                                        help="play an FM2 movie headless")
+    replay_parser.add_argument("rom", help="iNES file to run")
+    replay_parser.add_argument("movie", help="FM2 movie to play")
+    replay_parser.add_argument("--hash-every", type=int, default=0,
+                               help="hash the console state every N frames")
+    replay_parser.add_argument("--skip-render", action="store_true",
+                               help="draw no frames, which leaves the "
+                               "hashes the same")
+    replay_parser.add_argument("--skip-idle", action="store_true",
+                               help="fast-forward through idle loops, which "
+                               "also leaves the hashes the same")
+    replay_parser.set_defaults(run=replay_command)
+
+    conformance_parser = commands.add_parser("conformance",
+                                             help="run test ROMs against "
+                                             "their expected results")
+    conformance_parser.add_argument("paths", nargs="+",
+                                    help="test ROMs, or directories of them")
+    conformance_parser.add_argument("-j", "--processes", type=int,
+                                    default=None,
+                                    help="worker processes (default: one "
+                                    "per core)")
+    conformance_parser.add_argument("--frames", type=int,
+                                    default=conformance.DEFAULT_FRAMES,
+                                    help="frames a test may run before it "
+                                    "times out (default: %d)" %
+                                    conformance.DEFAULT_FRAMES)
+    conformance_parser.set_defaults(run=conformance_command)
+
+    args = parser.parse_args(argv)
+
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
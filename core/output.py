@@ -0,0 +1,319 @@
+"""This module takes finished frames and audio off the emulation thread and
+   writes them out in the background, for headless recording jobs.
+
+   Frames are copied into a fixed pool of buffers, triple buffered by
+   default, so recording never allocates a frame. Each sink has a worker
+   thread of its own that converts frames to RGB and encodes them, and a
+   buffer goes back to the pool once every sink is done with it. Handing a
+   frame over costs the emulator one 60KB copy. Only when every buffer is
+   still waiting to be written does it hold the emulator up, counting the
+   frame as late, or with drop=True skip the frame instead, counting it as
+   dropped.
+
+   Sinks write raw RGB24 video, numbered PNG files, or pipe raw video into
+   an encoder process such as ffmpeg; audio from the APU goes to WAV."""
+
+import os
+import queue
+import struct
+import subprocess
+import threading
+import wave
+import zlib
+import numpy as np
+import constants as const
+from ppu import PALETTE_RGB
+
+# Frame buffers in the pool, and audio blocks a sink may have waiting
+DEFAULT_BUFFERS = 3
+AUDIO_BLOCKS = 64
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def encode_png(rgb, level=1):
+    """Encodes an (height, width, 3) RGB array as a PNG file"""
+
+    height, width = rgb.shape[:2]
+
+    # every row starts with filter type 0, none
+    rows = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+    rows[:, 1:] = rgb.reshape(height, width * 3)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + \
+            struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    return PNG_SIGNATURE + \
+        chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0,
+                                   0)) + \
+        chunk(b"IDAT", zlib.compress(rows.tobytes(), level)) + \
+        chunk(b"IEND", b"")
+
+
+def video_command(path, fps=60):
+    """An ffmpeg command line that encodes the raw video PipeSink writes"""
+
+    return ["ffmpeg", "-loglevel", "error", "-y", "-f", "rawvideo",
+            "-pix_fmt", "rgb24", "-s", "256x%d" % const.VISIBLE_LINES,
+            "-r", str(fps), "-i", "-", path]
+
+
+### Sinks ###
+
+class Sink(object):
+    """Somewhere frames and audio are written. Every method is called on
+       the sink's own worker thread."""
+
+    def write_frame(self, index, rgb):
+        """Writes frame number index, a (240, 256, 3) RGB array"""
+
+        return
+
+    def write_audio(self, samples):
+        """Writes a block of 16-bit samples"""
+
+        return
+
+    def close(self):
+        return
+
+
+class RawSink(Sink):
+    """Appends every frame to one file as raw RGB24."""
+
+    def __init__(self, path):
+        self.file = open(path, "wb")
+
+    def write_frame(self, index, rgb):
+        self.file.write(rgb.tobytes())
+
+    def close(self):
+        self.file.close()
+
+
+class PngSink(Sink):
+    """Writes each frame to a numbered PNG file."""
+
+    def __init__(self, directory, pattern="%06d.png", level=1):
+        self.directory = directory
+        self.pattern = pattern
+        self.level = level
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def write_frame(self, index, rgb):
+        path = os.path.join(self.directory, self.pattern % index)
+
+        with open(path, "wb") as image:
+            image.write(encode_png(rgb, self.level))
+
+
+class PipeSink(Sink):
+    """Feeds raw RGB24 frames to another process's standard input, such as
+       an encoder started with video_command()."""
+
+    def __init__(self, command):
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def write_frame(self, index, rgb):
+        self.process.stdin.write(rgb.tobytes())
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+class WavSink(Sink):
+    """Writes the audio to a 16-bit mono WAV file."""
+
+    def __init__(self, path, sample_rate=const.AUDIO_SAMPLE_RATE):
+        self.wav = wave.open(path, "wb")
+        self.wav.setnchannels(1)
+        self.wav.setsampwidth(2)
+        self.wav.setframerate(sample_rate)
+
+    def write_audio(self, samples):
+        self.wav.writeframes(samples.tobytes())
+
+    def close(self):
+        self.wav.close()
+
+
+### Pipeline ###
+
+class FrameBuffer(object):
+    """A pooled frame: NES color indices, the frame's number, and how many
+       sinks still have to write it."""
+
+    def __init__(self):
+        self.pixels = np.zeros((const.VISIBLE_LINES, 256), dtype=np.uint8)
+        self.index = 0
+        self.users = 0
+
+
+class SinkWorker(threading.Thread):
+    """Writes frames and audio to one sink, in the order they came."""
+
+    def __init__(self, pipeline, sink, capacity):
+        super().__init__(daemon=True)
+
+        self.pipeline = pipeline
+        self.sink = sink
+
+        # Frames are bounded by the pool, so only audio can fill this
+        self.items = queue.Queue(capacity)
+
+        # The first error the sink raised, if any
+        self.error = None
+
+        self.start()
+
+    def run(self):
+        while True:
+            item = self.items.get()
+
+            if item is None:
+                break
+
+            try:
+                if isinstance(item, FrameBuffer):
+                    self.sink.write_frame(item.index,
+                                          PALETTE_RGB[item.pixels])
+                else:
+                    self.sink.write_audio(item)
+            except Exception as error:
+                # keep draining, so the emulator isn't left waiting
+                if self.error is None:
+                    self.error = error
+
+            if isinstance(item, FrameBuffer):
+                self.pipeline.release(item)
+
+        try:
+            self.sink.close()
+        except Exception as error:
+            if self.error is None:
+                self.error = error
+
+
+class OutputPipeline(object):
+    """Hands frames and audio to sink workers through a pool of buffers."""
+
+    def __init__(self, sinks, buffers=DEFAULT_BUFFERS, drop=False):
+        self.pool = queue.Queue()
+        self.lock = threading.Lock()
+        self.drop = drop
+
+        for count in range(buffers):
+            self.pool.put(FrameBuffer())
+
+        self.workers = [SinkWorker(self, sink, buffers + AUDIO_BLOCKS)
+                        for sink in sinks]
+
+        ### Statistics ###
+
+        self.frames = 0
+        self.audio_blocks = 0
+
+        # Frames that waited for a free buffer, and frames skipped for
+        # want of one
+        self.late = 0
+        self.dropped = 0
+
+    def submit_frame(self, pixels):
+        """Queues a frame of NES color indices, such as the PPU's frame
+           buffer, returning False if it was dropped"""
+
+        index = self.frames
+        self.frames += 1
+
+        try:
+            buffer = self.pool.get_nowait()
+        except queue.Empty:
+            if self.drop:
+                self.dropped += 1
+                return False
+
+            self.late += 1
+            buffer = self.pool.get()
+
+        np.copyto(buffer.pixels, pixels)
+        buffer.index = index
+        buffer.users = len(self.workers)
+
+        if not self.workers:
+            self.pool.put(buffer)
+
+        for worker in self.workers:
+            worker.items.put(buffer)
+
+        return True
+
+    def submit_audio(self, samples):
+        """Queues a block of 16-bit samples, such as the APU hands to a
+           callback"""
+
+        self.audio_blocks += 1
+
+        for worker in self.workers:
+            worker.items.put(samples)
+
+    def release(self, buffer):
+        """Called by a worker when it is done with a frame"""
+
+        with self.lock:
+            buffer.users -= 1
+            done = not buffer.users
+
+        if done:
+            self.pool.put(buffer)
+
+    def close(self):
+        """Waits for everything queued to be written and closes the sinks,
+           raising the first error any of them hit"""
+
+        for worker in self.workers:
+            worker.items.put(None)
+
+        for worker in self.workers:
+            worker.join()
+
+        for worker in self.workers:
+            if worker.error is not None:
+                raise worker.error
+
+    def stats(self):
+        """Returns pipeline statistics"""
+
+        return {
+            "frames": self.frames,
+            "audio_blocks": self.audio_blocks,
+            "late": self.late,
+            "dropped": self.dropped
+        }
+
+
+def record(console, pipeline, frames, audio=True):
+    """Runs a console for some frames, handing every frame it draws and,
+       if audio is on, the sound to the pipeline. Closes the pipeline when
+       done."""
+
+    if audio:
+        console.enable_audio(pipeline.submit_audio)
+
+    try:
+        for frame in range(frames):
+            pixels = console.run_frame()
+
+            # with frame skipping on, only the frames drawn are recorded
+            if console.ppu.frame_rendered:
+                pipeline.submit_frame(pixels)
+    finally:
+        if audio:
+            console.disable_audio()
+
+        pipeline.close()
+
+    return pipeline.stats()
@@ -0,0 +1,846 @@
+"""This module defines the NES Picture Processing Unit, the Ricoh 2C02.
+
+   The PPU runs behind the CPU and is caught up by the scheduler whenever
+   one of its registers is touched or vblank is due. Catching up walks the
+   elapsed scanlines to update timing and flags, then renders every line
+   that was completed in one vectorized NumPy pass, so a frame with no
+   mid-frame register writes is drawn in a single call.
+
+   Frames can be skipped, for running headless faster than real time: the
+   beam, NMI and every flag stay exact, but a skipped frame isn't drawn.
+   Its sprite zero hit and overflow flags are only worked out, from sprite
+   zero and the background under it, once $2002 is read or something they
+   depend on is about to change, so a frame nothing polls costs nothing.
+
+   Pattern tiles are decoded from CHR into 8x8 arrays once and kept until
+   CHR is written. Nametables are expanded to pixels through that cache,
+   and colors come from fancy indexing into palette RAM, writing straight
+   into a preallocated frame buffer of NES color indices."""
+
+import numpy as np
+import constants as const
+import scheduler
+
+# Logical nametable (0 - 3) to physical 1KB of VRAM, for each mirroring
+MIRROR_MAPS = {
+    const.MIRROR_HORIZONTAL: (0, 0, 1, 1),
+    const.MIRROR_VERTICAL: (0, 1, 0, 1),
+    const.MIRROR_SINGLE_LOW: (0, 0, 0, 0),
+    const.MIRROR_SINGLE_HIGH: (1, 1, 1, 1),
+    const.MIRROR_FOUR_SCREEN: (0, 1, 2, 3)
+}
+
+# For each of a nametable's 30x32 tiles, which attribute byte covers it and
+# how far to shift that byte to get the tile's two palette bits
+TILE_ROWS, TILE_COLUMNS = np.indices((30, 32))
+ATTRIBUTE_INDEX = (TILE_ROWS >> 2) * 8 + (TILE_COLUMNS >> 2)
+ATTRIBUTE_SHIFT = (TILE_ROWS & 2) * 2 + (TILE_COLUMNS & 2)
+
+# Pixel offsets across a scanline and across a sprite
+SCANLINE = np.arange(256)
+SPRITE_COLUMNS = np.arange(8)
+
+# RGB for each of the 64 NES color indices
+PALETTE_RGB = np.array([
+    (84, 84, 84), (0, 30, 116), (8, 16, 144), (48, 0, 136),
+    (68, 0, 100), (92, 0, 48), (84, 4, 0), (60, 24, 0),
+    (32, 42, 0), (8, 58, 0), (0, 64, 0), (0, 60, 0),
+    (0, 50, 60), (0, 0, 0), (0, 0, 0), (0, 0, 0),
+    (152, 150, 152), (8, 76, 196), (48, 50, 236), (92, 30, 228),
+    (136, 20, 176), (160, 20, 100), (152, 34, 32), (120, 60, 0),
+    (84, 90, 0), (40, 114, 0), (8, 124, 0), (0, 118, 40),
+    (0, 102, 120), (0, 0, 0), (0, 0, 0), (0, 0, 0),
+    (236, 238, 236), (76, 154, 236), (120, 124, 236), (176, 98, 236),
+    (228, 84, 236), (236, 88, 180), (236, 106, 100), (212, 136, 32),
+    (160, 170, 0), (116, 196, 0), (76, 208, 32), (56, 204, 108),
+    (56, 180, 204), (60, 60, 60), (0, 0, 0), (0, 0, 0),
+    (236, 238, 236), (168, 204, 236), (188, 188, 236), (212, 178, 236),
+    (236, 174, 236), (236, 174, 212), (236, 180, 176), (228, 196, 144),
+    (204, 210, 120), (180, 222, 120), (168, 226, 144), (152, 226, 180),
+    (160, 214, 228), (160, 162, 160), (0, 0, 0), (0, 0, 0)
+], dtype=np.uint8)
+
+
+def create_ppu():
+    """Returns a new instance of a PPU for use outside of this module."""
+    return PPU()
+
+
+def decode_tiles(data):
+    """Decodes 2bpp pattern data, 16 bytes per tile, into an (n, 8, 8)
+       array of pixel values 0 - 3"""
+
+    planes = np.frombuffer(data, dtype=np.uint8).reshape(-1, 2, 8)
+    low = np.unpackbits(planes[:, 0], axis=-1).reshape(-1, 8, 8)
+    high = np.unpackbits(planes[:, 1], axis=-1).reshape(-1, 8, 8)
+
+    return low | high << 1
+
+
+class TileCache(object):
+    """Every tile in CHR, decoded. Tiles are only decoded again after a
+       write to CHR-RAM marks them dirty."""
+
+    def __init__(self, chr_data):
+        self.chr = chr_data
+        self.tiles = decode_tiles(chr_data)
+        self.dirty = set()
+
+    def invalidate(self, offset):
+        """Marks the tile holding a CHR byte as needing a fresh decode"""
+
+        self.dirty.add(offset >> 4)
+
+    def refresh(self):
+        """Decodes dirty tiles, returning whether there were any"""
+
+        if not self.dirty:
+            return False
+
+        for tile in self.dirty:
+            self.tiles[tile] = decode_tiles(self.chr[tile << 4:
+                                                     (tile + 1) << 4])[0]
+
+        self.dirty.clear()
+
+        return True
+
+
+class PPU(scheduler.Component):
+    """This class defines the Ricoh 2C02."""
+
+    def __init__(self):
+        super().__init__()
+
+        # Set by connect() and attach_mapper()
+        self.memory = None
+        self.mapper = None
+        self.tile_cache = None
+
+        ### Registers ###
+
+        self.ctrl = 0x00
+        self.mask = 0x00
+        self.status = 0x00
+        self.oam_addr = 0x00
+
+        # Last value written to any register, which reads of write-only
+        # registers return in their low bits
+        self.latch = 0x00
+
+        # $2007 reads are delayed by one through this buffer
+        self.read_buffer = 0x00
+
+        # Current and temporary VRAM address, fine X scroll, write toggle
+        self.v = 0x0000
+        self.t = 0x0000
+        self.fine_x = 0
+        self.w = 0
+
+        ### Memory ###
+
+        self.vram = bytearray(0x1000)
+        self.palette = bytearray(0x20)
+        self.oam = bytearray(0x100)
+        self.mirror_map = MIRROR_MAPS[const.MIRROR_HORIZONTAL]
+
+        ### Timing ###
+
+        # Dots since power on, and the dot the current frame started on
+        self.dot = 0
+        self.frame_start = 0
+
+        # Frames completed, counted at the start of vblank
+        self.frame = 0
+
+        # Lines of this frame finished by the beam, and drawn so far. On a
+        # skipped frame, drawn means its sprite flags have been worked out.
+        self.lines_done = 0
+        self.lines_drawn = 0
+
+        ### Frame Skipping ###
+
+        # Every how many frames one is rendered, or 0 for only those asked
+        # for with request_render()
+        self.render_interval = 1
+        self.render_requested = False
+
+        # Whether the frame being drawn is rendered, and whether the last
+        # one finished was, so the frame buffer holds it
+        self.render_frame = True
+        self.frame_rendered = True
+
+        ### Rendering ###
+
+        self.frame_buffer = np.zeros((const.VISIBLE_LINES, 256),
+                                     dtype=np.uint8)
+        self.palette_indices = np.frombuffer(self.palette, dtype=np.uint8)
+        self.oam_entries = np.frombuffer(self.oam,
+                                         dtype=np.uint8).reshape(64, 4)
+
+        # Vertical scroll is latched at the start of the frame, or when a
+        # mid-frame $2006 write moves it: it is scroll_y at line scroll_line
+        self.scroll_line = 0
+        self.scroll_y = 0
+
+        # Background pixels for each physical nametable, and all four
+        # logical ones tiled into a 480x512 playfield
+        self.nametable_pixels = [None] * 4
+        self.playfield = None
+
+        # Global tile number for each tile id in each pattern table
+        self.pattern_maps = None
+
+    def connect(self, memory):
+        """Maps the registers into the CPU's memory bus, syncing before
+           every access"""
+
+        self.memory = memory
+        sync = self.scheduler
+
+        for register in range(0x2000, 0x2008):
+            memory.map_register(
+                register,
+                read=sync.synced_reader(self, self.read_register),
+                write=sync.synced_writer(self, self.write_register))
+
+        memory.map_register(0x4014,
+                            write=sync.synced_writer(self, self.oam_dma))
+
+    def attach_mapper(self, mapper):
+        """Connects the cartridge's CHR and nametable mirroring"""
+
+        self.mapper = mapper
+        mapper.ppu = self
+        self.tile_cache = TileCache(mapper.chr)
+        self.set_mirroring(mapper.mirroring)
+        self.chr_switched()
+        self.scheduler.reschedule(self)
+
+    def set_mirroring(self, mirroring):
+        """Called by the mapper when nametable mirroring changes"""
+
+        self.update_flags()
+        self.mirror_map = MIRROR_MAPS[mirroring]
+        self.playfield = None
+
+    def chr_switched(self):
+        """Called by the mapper when a CHR bank is switched"""
+
+        self.update_flags()
+        self.pattern_maps = None
+        self.nametable_pixels = [None] * 4
+        self.playfield = None
+
+    ### Frame Skipping ###
+
+    def set_render_interval(self, interval):
+        """Renders only every interval-th frame from the next one on, or
+           with 0 only the frames asked for with request_render(). 1, the
+           default, renders every frame."""
+
+        self.render_interval = interval
+
+    def request_render(self):
+        """Renders the next frame to start whatever the interval"""
+
+        self.render_requested = True
+
+    def update_flags(self):
+        """Works out sprite zero hit and overflow for the lines of a skipped
+           frame finished since last time. Called before $2002 is read and
+           before anything they depend on changes."""
+
+        if not self.render_frame and self.lines_drawn < self.lines_done:
+            self.sprite_flags(self.lines_drawn, self.lines_done)
+            self.lines_drawn = self.lines_done
+
+    ### Timing ###
+
+    def next_sync(self):
+        """The CPU cycle by which the PPU must have reached the next vblank
+           or the mapper's next IRQ, whichever is first"""
+
+        vblank = self.frame_start + const.VBLANK_LINE * const.DOTS_PER_LINE + 1
+
+        if self.dot > vblank:
+            vblank += const.DOTS_PER_FRAME
+
+        deadline = vblank
+        rendering = self.mask & (const.MASK_BACKGROUND | const.MASK_SPRITES)
+        scanlines = self.mapper.irq_scanlines() if self.mapper else None
+
+        if rendering and scanlines is not None:
+            deadline = min(deadline, self.scanline_clock(scanlines))
+
+        return deadline // const.PPU_DOTS_PER_CYCLE + 1
+
+    def status_stable_until(self):
+        """The CPU cycle before which reading $2002 can't return anything
+           new: the next time vblank is set or cleared or, while rendering
+           might still set sprite zero hit or overflow, the end of the line
+           being drawn"""
+
+        line, dot = divmod(self.dot - self.frame_start, const.DOTS_PER_LINE)
+
+        # the first dot each change can be seen on: vblank is set and
+        # cleared once dot 1 of its line has run
+        changes = []
+
+        for flag_line in (const.VBLANK_LINE, const.PRERENDER_LINE):
+            change = self.frame_start + flag_line * const.DOTS_PER_LINE + 2
+
+            if change <= self.dot:
+                change += const.DOTS_PER_FRAME
+
+            changes.append(change)
+
+        # and a visible line's sprite flags are worked out once dot 256 has
+        flags = const.STATUS_SPRITE_ZERO | const.STATUS_OVERFLOW
+
+        if self.mask & (const.MASK_BACKGROUND | const.MASK_SPRITES) and \
+                line < const.VISIBLE_LINES and self.status & flags != flags:
+            if dot >= 257:
+                line += 1
+
+            changes.append(self.frame_start + line * const.DOTS_PER_LINE + 257)
+
+        return (min(changes) + const.PPU_DOTS_PER_CYCLE - 1) // \
+            const.PPU_DOTS_PER_CYCLE
+
+    def scanline_clock(self, count):
+        """The dot the mapper gets its count-th scanline clock on from here,
+           assuming rendering stays on"""
+
+        frame_start = self.frame_start
+        line, dot = divmod(self.dot - frame_start, const.DOTS_PER_LINE)
+
+        while True:
+            if dot <= 260 and (line < const.VISIBLE_LINES or
+                               line == const.PRERENDER_LINE):
+                count -= 1
+
+                if not count:
+                    return frame_start + line * const.DOTS_PER_LINE + 260
+
+            line += 1
+            dot = 0
+
+            if line == const.LINES_PER_FRAME:
+                line = 0
+                frame_start += const.DOTS_PER_FRAME
+
+    def catch_up(self, cycles):
+        """Runs the beam forward to the given CPU cycle, then draws every
+           line it finished"""
+
+        target = cycles * const.PPU_DOTS_PER_CYCLE
+
+        while self.dot < target:
+            line_start = self.frame_start + \
+                (self.dot - self.frame_start) // const.DOTS_PER_LINE * \
+                const.DOTS_PER_LINE
+            line = (line_start - self.frame_start) // const.DOTS_PER_LINE
+            end = min(target, line_start + const.DOTS_PER_LINE)
+
+            self.run_line(line, self.dot - line_start, end - line_start)
+            self.dot = end
+
+            if end - self.frame_start == const.DOTS_PER_FRAME:
+                self.start_frame()
+
+        self.cycles = cycles
+        self.draw()
+
+    def run_line(self, line, first, last):
+        """Handles whatever happens on a line between two dots"""
+
+        rendering = self.mask & (const.MASK_BACKGROUND | const.MASK_SPRITES)
+
+        if line < const.VISIBLE_LINES:
+            if last > 256:
+                self.lines_done = line + 1
+
+            if rendering and first <= 260 < last and self.mapper:
+                self.mapper.clock_scanline()
+        elif line == const.VBLANK_LINE:
+            if first <= 1 < last:
+                self.start_vblank()
+        elif line == const.PRERENDER_LINE:
+            if first <= 1 < last:
+                self.status &= ~(const.STATUS_VBLANK |
+                                 const.STATUS_SPRITE_ZERO |
+                                 const.STATUS_OVERFLOW)
+
+                # nothing polled a skipped frame's flags in time to see them
+                self.lines_drawn = self.lines_done
+
+            if rendering and first <= 260 < last and self.mapper:
+                self.mapper.clock_scanline()
+
+    def start_vblank(self):
+        """Sets the vblank flag, finishes the frame and raises NMI"""
+
+        self.lines_done = const.VISIBLE_LINES
+        self.draw()
+
+        self.status |= const.STATUS_VBLANK
+        self.frame += 1
+        self.frame_rendered = self.render_frame
+
+        if self.ctrl & const.CTRL_NMI:
+            self.scheduler.request_nmi()
+
+    def start_frame(self):
+        """Moves on to the next frame, reloading the vertical scroll"""
+
+        self.frame_start += const.DOTS_PER_FRAME
+        self.lines_done = 0
+        self.lines_drawn = 0
+
+        self.render_frame = self.render_requested or bool(
+            self.render_interval and not self.frame % self.render_interval)
+        self.render_requested = False
+
+        if self.mask & (const.MASK_BACKGROUND | const.MASK_SPRITES):
+            self.v = self.t
+
+        self.scroll_line = 0
+        self.scroll_y = self.vertical_scroll(self.t)
+
+    ### Registers ###
+
+    def read_register(self, loc):
+        """Reads $2000 - $2007"""
+
+        register = loc & 0x07
+
+        if register == 2:
+            self.update_flags()
+            result = self.status & 0xe0 | self.latch & 0x1f
+            self.status &= ~(const.STATUS_VBLANK)
+            self.w = 0
+        elif register == 4:
+            result = self.oam[self.oam_addr]
+        elif register == 7:
+            result = self.read_data()
+        else:
+            result = self.latch
+
+        return result
+
+    def write_register(self, loc, data):
+        """Writes $2000 - $2007"""
+
+        self.update_flags()
+
+        register = loc & 0x07
+        self.latch = data
+
+        if register == 0:
+            if (data & ~self.ctrl & const.CTRL_NMI and
+                    self.status & const.STATUS_VBLANK):
+                # enabling NMI during vblank fires one straight away
+                self.scheduler.request_nmi()
+
+            if (data ^ self.ctrl) & const.CTRL_BACKGROUND_TABLE:
+                self.nametable_pixels = [None] * 4
+                self.playfield = None
+
+            self.ctrl = data
+            self.t = self.t & 0xf3ff | (data & 0b11) << 10
+        elif register == 1:
+            # turning rendering on or off starts or stops scanline clocks
+            self.mask = data
+            self.scheduler.reschedule(self)
+        elif register == 3:
+            self.oam_addr = data
+        elif register == 4:
+            self.oam[self.oam_addr] = data
+            self.oam_addr = (self.oam_addr + 1) & 0xff
+        elif register == 5:
+            if self.w:
+                self.t = self.t & 0x8c1f | (data & 0x07) << 12 | \
+                    (data & 0xf8) << 2
+            else:
+                self.t = self.t & 0xffe0 | data >> 3
+                self.fine_x = data & 0x07
+
+            self.w ^= 1
+        elif register == 6:
+            if self.w:
+                self.t = self.t & 0xff00 | data
+                self.v = self.t
+
+                # moving the address mid-frame moves the vertical scroll
+                # from the next line on
+                self.scroll_line = self.lines_done
+                self.scroll_y = self.vertical_scroll(self.v)
+            else:
+                self.t = self.t & 0x00ff | (data & 0x3f) << 8
+
+            self.w ^= 1
+        elif register == 7:
+            self.write_data(data)
+
+    def read_data(self):
+        """Reads PPU memory at v through the read buffer"""
+
+        address = self.v & 0x3fff
+
+        if address >= 0x3f00:
+            # palette reads are immediate, and fill the buffer from the
+            # nametable underneath
+            result = self.read(address)
+            self.read_buffer = self.read(address - 0x1000)
+        else:
+            result = self.read_buffer
+            self.read_buffer = self.read(address)
+
+        self.v = (self.v + (32 if self.ctrl & const.CTRL_INCREMENT else 1)) \
+            & 0x7fff
+
+        return result
+
+    def write_data(self, data):
+        """Writes PPU memory at v"""
+
+        self.write(self.v & 0x3fff, data)
+        self.v = (self.v + (32 if self.ctrl & const.CTRL_INCREMENT else 1)) \
+            & 0x7fff
+
+    def oam_dma(self, loc, data):
+        """$4014: copies a page of CPU memory into OAM, stalling the CPU"""
+
+        self.update_flags()
+
+        source = data << 8
+        load = self.memory.load
+
+        for index in range(0x100):
+            self.oam[(self.oam_addr + index) & 0xff] = load(source | index)
+
+        # 513 cycles, plus one to line up with a read cycle on odd cycles
+        cpu = self.scheduler.cpu
+        cpu.cycles += 513 + (cpu.cycles & 1)
+
+    ### PPU Memory ###
+
+    def read(self, address):
+        """Reads the PPU's own 16KB address space"""
+
+        if address < 0x2000:
+            return self.mapper.read_chr(address) if self.mapper else 0x00
+
+        if address < 0x3f00:
+            return self.vram[self.vram_offset(address)]
+
+        return self.palette[address & 0x1f]
+
+    def write(self, address, data):
+        """Writes the PPU's own 16KB address space"""
+
+        if address < 0x2000:
+            if self.mapper and self.mapper.chr_writable:
+                self.mapper.write_chr(address, data)
+                self.tile_cache.invalidate(
+                    self.mapper.chr_offsets[address >> 10] |
+                    address & 0x3ff)
+        elif address < 0x3f00:
+            offset = self.vram_offset(address)
+            self.vram[offset] = data
+            self.nametable_pixels[offset >> 10] = None
+            self.playfield = None
+        else:
+            # backdrop entries of the sprite palettes are shared with the
+            # background's, so keep both copies equal
+            index = address & 0x1f
+            self.palette[index] = data & 0x3f
+
+            if not index & 0x03:
+                self.palette[index ^ 0x10] = data & 0x3f
+
+    def vram_offset(self, address):
+        """Offset into VRAM for a nametable address, after mirroring"""
+
+        logical = (address >> 10) & 0b11
+
+        return self.mirror_map[logical] << 10 | address & 0x3ff
+
+    ### Rendering ###
+
+    def vertical_scroll(self, address):
+        """Pixel row of the 480 line playfield a VRAM address points at"""
+
+        return ((address >> 11) & 1) * 240 + ((address >> 5) & 0x1f) * 8 + \
+            ((address >> 12) & 0b111)
+
+    def horizontal_scroll(self):
+        """Pixel column of the 512 wide playfield each line starts at"""
+
+        return ((self.t >> 10) & 1) * 256 + (self.t & 0x1f) * 8 + self.fine_x
+
+    def draw(self):
+        """Renders the lines the beam has finished but that haven't been
+           drawn yet, unless the frame is being skipped"""
+
+        if self.render_frame and self.lines_drawn < self.lines_done:
+            self.render_lines(self.lines_drawn, self.lines_done)
+            self.lines_drawn = self.lines_done
+
+    def render_lines(self, first, last):
+        """Renders lines first to last - 1 into the frame buffer"""
+
+        frame = self.frame_buffer[first:last]
+        mask = self.mask
+
+        if not mask & (const.MASK_BACKGROUND | const.MASK_SPRITES) or \
+                self.mapper is None:
+            frame[:] = self.palette[0]
+            return
+
+        if self.tile_cache.refresh():
+            self.nametable_pixels = [None] * 4
+            self.playfield = None
+
+        if mask & const.MASK_BACKGROUND:
+            background = self.background(first, last)
+
+            if not mask & const.MASK_BACKGROUND_LEFT:
+                background[:, :8] = 0
+        else:
+            background = np.zeros((last - first, 256), dtype=np.uint8)
+
+        if mask & const.MASK_SPRITES:
+            sprites, behind = self.sprites(first, last, background)
+
+            # a sprite shows unless it is behind an opaque background pixel
+            shown = (sprites != 0) & ~(behind & (background != 0))
+            indices = np.where(shown, sprites, background)
+        else:
+            indices = background
+
+        np.take(self.palette_indices, indices, out=frame)
+
+        if mask & const.MASK_GRAYSCALE:
+            frame &= 0x30
+
+    def pattern_map(self, table):
+        """Global tile numbers for the 256 tile ids of a pattern table"""
+
+        if self.pattern_maps is None:
+            slots = np.array(self.mapper.chr_offsets) >> 4
+            ids = np.arange(256)
+
+            self.pattern_maps = [slots[ids >> 6] + (ids & 0x3f),
+                                 slots[4 + (ids >> 6)] + (ids & 0x3f)]
+
+        return self.pattern_maps[table]
+
+    def expand_nametable(self, physical):
+        """Background palette indices (0 - 15) for a whole nametable"""
+
+        start = physical << 10
+        table = np.frombuffer(self.vram, dtype=np.uint8, count=0x400,
+                              offset=start)
+        ids = table[:960].reshape(30, 32)
+        attributes = table[960:]
+
+        pattern = self.pattern_map(
+            1 if self.ctrl & const.CTRL_BACKGROUND_TABLE else 0)
+
+        pixels = self.tile_cache.tiles[pattern[ids]]
+        pixels = pixels.transpose(0, 2, 1, 3).reshape(240, 256)
+
+        palettes = (attributes[ATTRIBUTE_INDEX] >> ATTRIBUTE_SHIFT) & 0b11
+        palettes = palettes.repeat(8, axis=0).repeat(8, axis=1)
+
+        # pixel value zero is transparent whatever its palette
+        return np.where(pixels != 0, pixels | palettes << 2, 0) \
+            .astype(np.uint8)
+
+    def background_field(self):
+        """The four logical nametables tiled into one 480x512 playfield"""
+
+        if self.playfield is None:
+            quadrants = []
+
+            for physical in self.mirror_map:
+                if self.nametable_pixels[physical] is None:
+                    self.nametable_pixels[physical] = \
+                        self.expand_nametable(physical)
+
+                quadrants.append(self.nametable_pixels[physical])
+
+            self.playfield = np.block([[quadrants[0], quadrants[1]],
+                                       [quadrants[2], quadrants[3]]])
+
+        return self.playfield
+
+    def background(self, first, last):
+        """Background palette indices for a run of lines"""
+
+        rows = (self.scroll_y + np.arange(first, last) - self.scroll_line) \
+            % 480
+        columns = (self.horizontal_scroll() + SCANLINE) % 512
+
+        return self.background_field()[rows[:, None], columns]
+
+    def sprites(self, first, last, background):
+        """Sprite palette indices (16 - 31, 0 where empty) and behind the
+           background flags for a run of lines. Also sets the overflow and
+           sprite zero hit flags."""
+
+        count = last - first
+        height = 16 if self.ctrl & const.CTRL_SPRITE_SIZE else 8
+        entries = self.oam_entries.astype(np.intp)
+
+        # row of each sprite on each line, and which sprites the PPU picks,
+        # at most eight per line in OAM order
+        rows = np.arange(first, last)[None, :] - (entries[:, 0:1] + 1)
+        in_range = (rows >= 0) & (rows < height)
+        picked = np.cumsum(in_range, axis=0)
+        visible = in_range & (picked <= 8)
+
+        if (picked[-1] > 8).any():
+            self.status |= const.STATUS_OVERFLOW
+
+        # eight columns of padding so sprites can hang off the right edge
+        layer = np.zeros((count, 264), dtype=np.uint8)
+        behind = np.zeros((count, 264), dtype=bool)
+
+        # draw from the back, so lower OAM indices end up on top
+        for index in np.flatnonzero(visible.any(axis=1))[::-1]:
+            y, tile, attributes, x = entries[index]
+            lines = np.flatnonzero(visible[index])
+            pixels = self.sprite_pixels(tile, attributes, rows[index, lines],
+                                        height)
+
+            opaque = pixels != 0
+            columns = x + SPRITE_COLUMNS
+            region = (lines[:, None], columns[None, :])
+
+            if index == 0:
+                self.sprite_zero(lines, columns, opaque, background)
+
+            layer[region] = np.where(
+                opaque, pixels | 0x10 | (attributes & 0b11) << 2,
+                layer[region])
+            behind[region] = np.where(opaque, bool(attributes & 0x20),
+                                      behind[region])
+
+        layer = layer[:, :256]
+        behind = behind[:, :256]
+
+        if not self.mask & const.MASK_SPRITES_LEFT:
+            layer[:, :8] = 0
+
+        return layer, behind
+
+    def sprite_pixels(self, tile, attributes, sprite_rows, height):
+        """A sprite's pixels (0 - 3) on some of its rows, flipped the way
+           its attributes say"""
+
+        if attributes & 0x80:
+            sprite_rows = height - 1 - sprite_rows
+
+        if height == 8:
+            numbers = self.pattern_map(
+                1 if self.ctrl & const.CTRL_SPRITE_TABLE else 0)[tile]
+        else:
+            numbers = self.pattern_map(tile & 1)[
+                (tile & 0xfe) + (sprite_rows >> 3)]
+
+        pixels = self.tile_cache.tiles[numbers, sprite_rows & 0b111]
+
+        if attributes & 0x40:
+            pixels = pixels[:, ::-1]
+
+        return pixels
+
+    def sprite_flags(self, first, last):
+        """Sets the overflow and sprite zero hit flags for a run of lines
+           as sprites() would, without drawing them: only sprite zero and
+           the background under it are looked at"""
+
+        if not self.mask & const.MASK_SPRITES or self.mapper is None:
+            return
+
+        if self.tile_cache.refresh():
+            self.nametable_pixels = [None] * 4
+            self.playfield = None
+
+        height = 16 if self.ctrl & const.CTRL_SPRITE_SIZE else 8
+        entries = self.oam_entries.astype(np.intp)
+
+        rows = np.arange(first, last)[None, :] - (entries[:, 0:1] + 1)
+        in_range = (rows >= 0) & (rows < height)
+
+        if not self.status & const.STATUS_OVERFLOW and \
+                (in_range.sum(axis=0) > 8).any():
+            self.status |= const.STATUS_OVERFLOW
+
+        if self.status & const.STATUS_SPRITE_ZERO or \
+                not self.mask & const.MASK_BACKGROUND:
+            return
+
+        # sprite zero is first in OAM, so always among the eight picked
+        lines = np.flatnonzero(in_range[0])
+
+        if lines.size:
+            y, tile, attributes, x = entries[0]
+            pixels = self.sprite_pixels(tile, attributes, rows[0, lines],
+                                        height)
+            background = self.background_opaque(first + lines[0],
+                                                first + lines[-1] + 1)
+
+            self.sprite_zero(lines - lines[0], x + SPRITE_COLUMNS,
+                             pixels != 0, background)
+
+    def background_opaque(self, first, last):
+        """Which background pixels of a run of lines are opaque, looked up
+           straight from VRAM rather than through the playfield, for when
+           only a few lines are needed"""
+
+        rows = (self.scroll_y + np.arange(first, last) - self.scroll_line) \
+            % 480
+        columns = (self.horizontal_scroll() + SCANLINE) % 512
+
+        logical = (rows // 240)[:, None] * 2 + (columns >> 8)[None, :]
+        physical = np.array(self.mirror_map)[logical]
+        offsets = (physical << 10) + \
+            ((rows % 240) >> 3)[:, None] * 32 + ((columns & 0xff) >> 3)
+
+        ids = np.frombuffer(self.vram, dtype=np.uint8)[offsets]
+        pattern = self.pattern_map(
+            1 if self.ctrl & const.CTRL_BACKGROUND_TABLE else 0)
+
+        pixels = self.tile_cache.tiles[pattern[ids],
+                                       (rows & 0b111)[:, None],
+                                       (columns & 0b111)[None, :]]
+
+        return pixels != 0
+
+    def sprite_zero(self, lines, columns, opaque, background):
+        """Sets the sprite zero hit flag if sprite zero overlaps an opaque
+           background pixel"""
+
+        if self.status & const.STATUS_SPRITE_ZERO or \
+                not self.mask & const.MASK_BACKGROUND:
+            return
+
+        # never at x = 255, nor in the left 8 pixels while either is clipped
+        left = 0 if self.mask & const.MASK_BACKGROUND_LEFT and \
+            self.mask & const.MASK_SPRITES_LEFT else 8
+        usable = (columns >= left) & (columns < 255)
+
+        hits = opaque[:, usable] & \
+            (background[lines[:, None], columns[usable][None, :]] != 0)
+
+        if hits.any():
+            self.status |= const.STATUS_SPRITE_ZERO
+
+    def frame_rgb(self):
+        """The frame buffer converted to a (240, 256, 3) RGB array"""
+
+        return PALETTE_RGB[self.frame_buffer]
@@ -0,0 +1,251 @@
+"""This module profiles the code running on the emulated CPU: which PCs,
+   opcodes and PRG banks the cycles go to, and which subroutines they are
+   spent in. It is meant for finding the guest loops worth skipping or
+   compiling, so it counts into flat lists indexed by PC, opcode and bank,
+   which cost the same to bump however many entries there are.
+
+   Call stacks are followed from JSR/RTS and interrupt entry/RTI and
+   exported as collapsed stacks, one "outer;inner cycles" line per stack,
+   which flamegraph.pl and speedscope read directly."""
+
+import heapq
+import disassembler
+from instructions import MNEMONICS
+
+# JSR, RTS and RTI, which move between stack frames
+OPCODE_JSR = 0x20
+OPCODE_RTS = 0x60
+OPCODE_RTI = 0x40
+
+# Calls deeper than this are counted in the deepest frame. Code that pulls
+# return addresses off the stack by hand never returns, and would otherwise
+# nest forever.
+MAX_DEPTH = 64
+
+# Size of the PRG banks cycles are attributed to
+BANK_SIZE = 0x2000
+
+# Name of the frame at the bottom of every stack
+ROOT = "main"
+
+
+class Profiler(object):
+    """This class counts instructions and cycles while the CPU runs."""
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.memory = cpu.memory
+
+        ### Counters ###
+
+        self.pc_counts = [0] * 0x10000
+        self.pc_cycles = [0] * 0x10000
+        self.opcode_counts = [0] * 0x100
+        self.opcode_cycles = [0] * 0x100
+
+        # One slot per 8KB PRG bank, then RAM, SRAM and everything else
+        prg_pages = cpu.mapper.prg_pages if cpu.mapper is not None else []
+        banks = (len(prg_pages) * 0x100 + BANK_SIZE - 1) // BANK_SIZE
+        self.bank_names = ["PRG %d" % bank for bank in range(banks)] + \
+            ["RAM", "SRAM", "other"]
+        self.bank_cycles = [0] * len(self.bank_names)
+
+        # The bank slot of whatever is mapped at each CPU page right now
+        self.prg_banks = {id(page): index * 0x100 // BANK_SIZE
+                          for index, page in enumerate(prg_pages)}
+        self.page_banks = [0] * 0x100
+        self.remapped(0x00, 0xff)
+
+        ### Call Stacks ###
+
+        # Frame 0 is the root. Each frame has a parent, an entry address
+        # and a label, and children are looked up by (parent, entry).
+        self.frame_parents = [0]
+        self.frame_labels = [ROOT]
+        self.frame_cycles = [0]
+        self.frame_depths = [0]
+        self.frame_children = {}
+        self.frame = 0
+
+        # Calls made past MAX_DEPTH that haven't returned yet
+        self.overflow = 0
+
+        # Where the CPU should be next if nothing interrupts it
+        self.next_pc = cpu.pc
+        self.next_sp = cpu.sp
+
+        self.memory.remap_listeners.append(self.remapped)
+
+    def close(self):
+        """Detaches from the memory bus"""
+
+        self.memory.remap_listeners.remove(self.remapped)
+
+    def remapped(self, first, last):
+        """Works out which bank each remapped page now shows"""
+
+        other = len(self.bank_names) - 1
+
+        for page in range(first, last + 1):
+            if page < 0x20:
+                self.page_banks[page] = other - 2
+            elif 0x60 <= page < 0x80:
+                self.page_banks[page] = other - 1
+            else:
+                self.page_banks[page] = self.prg_banks.get(
+                    id(self.memory.mapped_read_pages[page]), other)
+
+    def run(self):
+        """The CPU's run loop, counting every instruction"""
+
+        cpu = self.cpu
+        dispatch = cpu.dispatch
+        load = cpu.memory.load
+        pc_counts = self.pc_counts
+        pc_cycles = self.pc_cycles
+        opcode_counts = self.opcode_counts
+        opcode_cycles = self.opcode_cycles
+        bank_cycles = self.bank_cycles
+        page_banks = self.page_banks
+        frame_cycles = self.frame_cycles
+
+        while cpu.cycles < cpu.deadline:
+            pc = cpu.pc
+
+            # something other than the last instruction moved the PC and
+            # pushed three bytes: an interrupt was taken
+            if pc != self.next_pc and cpu.sp == (self.next_sp - 3) & 0xff:
+                self.call(pc, "interrupt ")
+
+            opcode = load(pc)
+            start = cpu.cycles
+            dispatch[opcode]()
+            cycles = cpu.cycles - start
+
+            pc_counts[pc] += 1
+            pc_cycles[pc] += cycles
+            opcode_counts[opcode] += 1
+            opcode_cycles[opcode] += cycles
+            bank_cycles[page_banks[pc >> 8]] += cycles
+            frame_cycles[self.frame] += cycles
+
+            if opcode == OPCODE_JSR:
+                self.call(cpu.pc, "")
+            elif opcode == OPCODE_RTS or opcode == OPCODE_RTI:
+                self.ret()
+
+            self.next_pc = cpu.pc
+            self.next_sp = cpu.sp
+
+    def call(self, entry, kind):
+        """Enters the frame for a call to entry from the current frame"""
+
+        key = (self.frame, entry)
+        child = self.frame_children.get(key)
+
+        if child is None:
+            if self.frame_depths[self.frame] == MAX_DEPTH:
+                self.overflow += 1
+                return
+
+            child = len(self.frame_parents)
+            self.frame_children[key] = child
+            self.frame_parents.append(self.frame)
+            self.frame_labels.append("%s$%04X" % (kind, entry))
+            self.frame_cycles.append(0)
+            self.frame_depths.append(self.frame_depths[self.frame] + 1)
+
+        self.frame = child
+
+    def ret(self):
+        """Leaves the current frame"""
+
+        if self.overflow:
+            self.overflow -= 1
+        else:
+            self.frame = self.frame_parents[self.frame]
+
+    ### Reports ###
+
+    def hotspots(self, limit=20):
+        """[(pc, instructions, cycles)] for the PCs with the most cycles"""
+
+        pcs = heapq.nlargest(limit, range(0x10000),
+                             key=self.pc_cycles.__getitem__)
+
+        return [(pc, self.pc_counts[pc], self.pc_cycles[pc])
+                for pc in pcs if self.pc_cycles[pc]]
+
+    def opcodes(self):
+        """[(opcode, instructions, cycles)] for every opcode run, most
+           cycles first"""
+
+        opcodes = sorted(range(0x100), key=self.opcode_cycles.__getitem__,
+                         reverse=True)
+
+        return [(opcode, self.opcode_counts[opcode],
+                 self.opcode_cycles[opcode])
+                for opcode in opcodes if self.opcode_counts[opcode]]
+
+    def banks(self):
+        """[(bank name, cycles)] for every bank that ran code"""
+
+        return [(name, cycles) for name, cycles in
+                zip(self.bank_names, self.bank_cycles) if cycles]
+
+    def stack_label(self, frame):
+        """The frames from the root down to frame, joined with ';'"""
+
+        labels = []
+
+        while frame:
+            labels.append(self.frame_labels[frame])
+            frame = self.frame_parents[frame]
+
+        labels.append(ROOT)
+
+        return ";".join(reversed(labels))
+
+    def collapsed_stacks(self):
+        """Lines of "frame;frame;frame cycles", for flame graph tools"""
+
+        return ["%s %d" % (self.stack_label(frame), cycles)
+                for frame, cycles in enumerate(self.frame_cycles) if cycles]
+
+    def report(self, limit=20):
+        """A plain text hotspot report"""
+
+        total = sum(self.pc_cycles) or 1
+        lines = ["%-6s %10s %12s %7s  %s" % ("PC", "count", "cycles", "%",
+                                            "instruction")]
+
+        for pc, count, cycles in self.hotspots(limit):
+            data = [self.memory.peek((pc + offset) & 0xffff)
+                    for offset in range(3)]
+            lines.append("$%04X  %10d %12d %6.2f%%  %s" % (
+                pc, count, cycles, cycles * 100.0 / total,
+                disassembler.disassemble(pc, *data)))
+
+        lines.append("")
+        lines.append("%-6s %10s %12s %7s" % ("opcode", "count", "cycles",
+                                             "%"))
+
+        for opcode, count, cycles in self.opcodes()[:limit]:
+            lines.append("$%02X %-3s %9d %12d %6.2f%%" % (
+                opcode, MNEMONICS.get(opcode, "???"), count,
+                cycles, cycles * 100.0 / total))
+
+        lines.append("")
+        lines.append("%-6s %23s %7s" % ("bank", "cycles", "%"))
+
+        for name, cycles in self.banks():
+            lines.append("%-6s %23d %6.2f%%" % (name, cycles,
+                                                cycles * 100.0 / total))
+
+        return "\n".join(lines)
+
+    def write_collapsed(self, path):
+        """Writes collapsed stacks to a file"""
+
+        with open(path, "w") as stacks:
+            stacks.write("\n".join(self.collapsed_stacks()) + "\n")
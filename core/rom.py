@@ -0,0 +1,214 @@
+"""This module loads iNES and NES 2.0 cartridge images. The file is memory
+   mapped rather than read, and the PRG and CHR banks are memoryview slices
+   over the mapping, so nothing is copied until the emulator touches it.
+   The image's SHA-1 is only taken the first time something asks for it."""
+
+import hashlib
+import mmap
+from collections import namedtuple
+import constants as const
+from exceptions.romexceptions import RomFormatError
+
+# Sizes in bytes
+HEADER_SIZE = 16
+TRAINER_SIZE = 512
+PRG_BANK_SIZE = 0x4000
+CHR_BANK_SIZE = 0x2000
+
+# "NES" followed by an MS-DOS end of file
+MAGIC = b"NES\x1a"
+
+Header = namedtuple("Header", [
+    "format", "mapper", "submapper", "mirroring", "battery", "trainer",
+    "prg_size", "chr_size", "prg_ram_size", "chr_ram_size", "region"
+])
+
+# Parsed headers keyed by the header's own 16 bytes, which are all that
+# parsing reads, so loading the same image again skips parsing
+header_cache = {}
+
+
+def load_rom(path):
+    """Returns a new Rom for the image at path"""
+    return Rom(path)
+
+
+def load_image(data, path=None):
+    """Returns a new Rom over an image already in memory, such as a shared
+       memory segment. path is only used to label errors."""
+    return Rom(path, data)
+
+
+def parse_header(header, path=None):
+    """Parses the 16-byte header at the start of an iNES or NES 2.0 image"""
+
+    if len(header) < HEADER_SIZE:
+        raise RomFormatError(path, const.EXCEPTION_ROM_TOO_SHORT)
+
+    if bytes(header[0:4]) != MAGIC:
+        raise RomFormatError(path, const.EXCEPTION_ROM_BAD_MAGIC)
+
+    flags6 = header[6]
+    flags7 = header[7]
+
+    if flags6 & 0b1000:
+        mirroring = const.MIRROR_FOUR_SCREEN
+    elif flags6 & 0b1:
+        mirroring = const.MIRROR_VERTICAL
+    else:
+        mirroring = const.MIRROR_HORIZONTAL
+
+    battery = bool(flags6 & 0b10)
+    trainer = bool(flags6 & 0b100)
+
+    if flags7 & 0b1100 == 0b1000:
+        # NES 2.0 adds four more mapper bits, a submapper and bigger sizes
+        mapper = (header[8] & 0x0f) << 8 | flags7 & 0xf0 | flags6 >> 4
+        submapper = header[8] >> 4
+        prg_size = rom_size(header[4], header[9] & 0x0f, PRG_BANK_SIZE)
+        chr_size = rom_size(header[5], header[9] >> 4, CHR_BANK_SIZE)
+
+        # RAM sizes are shift counts, where zero means none at all
+        prg_ram_size = ram_size(header[10] & 0x0f) + ram_size(header[10] >> 4)
+        chr_ram_size = ram_size(header[11] & 0x0f) + ram_size(header[11] >> 4)
+        region = (const.REGION_NTSC, const.REGION_PAL,
+                  const.REGION_MULTIPLE, const.REGION_DENDY)[header[12] & 0b11]
+
+        return Header(const.FORMAT_NES2, mapper, submapper, mirroring,
+                      battery, trainer, prg_size, chr_size, prg_ram_size,
+                      chr_ram_size, region)
+
+    # Old dumping tools left text in the unused bytes, which poisons the
+    # upper mapper nibble, so only trust it when the padding is clean
+    if any(header[12:16]):
+        mapper = flags6 >> 4
+    else:
+        mapper = flags7 & 0xf0 | flags6 >> 4
+
+    chr_size = header[5] * CHR_BANK_SIZE
+
+    return Header(const.FORMAT_INES, mapper, 0, mirroring, battery, trainer,
+                  header[4] * PRG_BANK_SIZE, chr_size,
+                  (header[8] or 1) * 0x2000,
+                  0 if chr_size else CHR_BANK_SIZE,
+                  const.REGION_PAL if header[9] & 0b1 else const.REGION_NTSC)
+
+
+def rom_size(lsb, msb, unit):
+    """Decodes a NES 2.0 ROM size, which is either a count of units or,
+       with the upper nibble all ones, an exponent and multiplier"""
+
+    if msb == 0x0f:
+        return (1 << (lsb >> 2)) * ((lsb & 0b11) * 2 + 1)
+
+    return (msb << 8 | lsb) * unit
+
+
+def ram_size(shift):
+    """Decodes a NES 2.0 RAM size shift count"""
+
+    return 64 << shift if shift else 0
+
+
+def build_ines(prg_rom, chr_rom=b"", mapper=0,
+               mirroring=const.MIRROR_HORIZONTAL, battery=False):
+    """Builds an iNES image from PRG and CHR data, for tests and tooling"""
+
+    flags6 = (mapper & 0x0f) << 4 | (0b10 if battery else 0)
+
+    if mirroring == const.MIRROR_VERTICAL:
+        flags6 |= 0b1
+    elif mirroring == const.MIRROR_FOUR_SCREEN:
+        flags6 |= 0b1000
+
+    header = MAGIC + bytes([
+        len(prg_rom) // PRG_BANK_SIZE, len(chr_rom) // CHR_BANK_SIZE,
+        flags6, mapper & 0xf0
+    ]) + bytes(8)
+
+    return header + bytes(prg_rom) + bytes(chr_rom)
+
+
+class Rom(object):
+    """A memory-mapped cartridge image, or one over a buffer that is already
+       in memory."""
+
+    def __init__(self, path, data=None):
+        self.path = path
+        self.mmap = None
+
+        if data is None:
+            with open(path, "rb") as rom_file:
+                try:
+                    self.mmap = mmap.mmap(rom_file.fileno(), 0,
+                                          access=mmap.ACCESS_READ)
+                except ValueError:
+                    # mmap refuses empty files
+                    raise RomFormatError(path, const.EXCEPTION_ROM_TOO_SHORT)
+
+            data = self.mmap
+
+        self.data = memoryview(data).toreadonly()
+
+        # The SHA-1 of the whole image, taken on first use
+        self.digest = None
+
+        key = bytes(self.data[:HEADER_SIZE])
+        self.header = header_cache.get(key)
+
+        if self.header is None:
+            self.header = parse_header(key, path)
+            header_cache[key] = self.header
+
+        offset = HEADER_SIZE + (TRAINER_SIZE if self.header.trainer else 0)
+        prg_end = offset + self.header.prg_size
+        chr_end = prg_end + self.header.chr_size
+
+        if chr_end > len(self.data):
+            raise RomFormatError(path, const.EXCEPTION_ROM_TRUNCATED)
+
+        self.prg_rom = self.data[offset:prg_end]
+        self.chr_rom = self.data[prg_end:chr_end]
+
+        # 16KB PRG and 8KB CHR banks, as iNES counts them
+        self.prg_banks = [self.prg_rom[start:start + PRG_BANK_SIZE]
+                          for start in range(0, len(self.prg_rom),
+                                             PRG_BANK_SIZE)]
+        self.chr_banks = [self.chr_rom[start:start + CHR_BANK_SIZE]
+                          for start in range(0, len(self.chr_rom),
+                                             CHR_BANK_SIZE)]
+
+    @property
+    def sha1(self):
+        """The hex SHA-1 of the whole image, which names it in caches and
+           savestates"""
+
+        if self.digest is None:
+            self.digest = hashlib.sha1(self.data).hexdigest()
+
+        return self.digest
+
+    @property
+    def mapper(self):
+        return self.header.mapper
+
+    @property
+    def mirroring(self):
+        return self.header.mirroring
+
+    @property
+    def battery(self):
+        return self.header.battery
+
+    def close(self):
+        """Releases the mapping. Anything still holding a bank slice, such
+           as a memory bus the banks are mapped into, must be dropped first."""
+
+        self.prg_banks = []
+        self.chr_banks = []
+        self.prg_rom.release()
+        self.chr_rom.release()
+        self.data.release()
+
+        if self.mmap is not None:
+            self.mmap.close()
@@ -0,0 +1,317 @@
+"""This module saves and restores the whole console as a flat binary blob,
+   and keeps a rewind history of them.
+
+   A state is a fixed-layout header (registers, timing and flags packed
+   with struct) followed by the raw memory buffers in a fixed order: CPU
+   memory, VRAM, palette RAM, OAM, PRG-RAM, CHR-RAM if the cartridge has
+   it, the mapper's registers, the APU's, and the controllers'. Every
+   state of a given cartridge is the same length with everything at the
+   same offset, which is what lets the rewind buffer store them as XOR
+   deltas.
+
+   Scheduled events are not saved. They are worked out again from the
+   restored components, so anything scheduled by hand is dropped."""
+
+import struct
+import zlib
+import numpy as np
+import constants as const
+import controller
+from exceptions.savestateexceptions import SaveStateError
+
+MAGIC = b"NESS"
+VERSION = 3
+
+# Mirroring modes, stored as their index here
+MIRRORINGS = (const.MIRROR_HORIZONTAL, const.MIRROR_VERTICAL,
+              const.MIRROR_FOUR_SCREEN, const.MIRROR_SINGLE_LOW,
+              const.MIRROR_SINGLE_HIGH)
+
+HEADER = struct.Struct(
+    "<4sH20s"             # magic, version, SHA-1 of the cartridge
+    "HBBBBBQ"             # CPU pc, sp, a, x, y, p, cycles
+    "BBB"                 # NMI pending, IRQ lines, reset pending
+    "BBBBBBHHBB"          # PPU ctrl, mask, status, oam_addr, latch,
+                          # read_buffer, v, t, fine_x, w
+    "QQQHHHHQ"            # PPU dot, frame_start, frame, lines_done,
+                          # lines_drawn, scroll_line, scroll_y, cycles
+    "BH"                  # mirroring, length of the mapper registers
+)
+
+# Changed bytes closer together than this are stored as a single run
+RUN_GAP = 8
+
+
+def snapshot(nes):
+    """Returns the console's state as bytes"""
+
+    cpu = nes.cpu
+    ppu = nes.ppu
+    mapper = cpu.mapper
+    interrupts = nes.scheduler.interrupts
+
+    if mapper is not None:
+        sha1 = bytes.fromhex(cpu.rom.sha1)
+        mirroring = MIRRORINGS.index(mapper.mirroring)
+        registers = mapper.save_state()
+    else:
+        sha1 = bytes(20)
+        mirroring = 0
+        registers = b""
+
+    header = HEADER.pack(
+        MAGIC, VERSION, sha1,
+        cpu.pc, cpu.sp, cpu.a, cpu.x, cpu.y, cpu.p, cpu.cycles,
+        interrupts.nmi_pending, interrupts.irq_lines,
+        interrupts.reset_pending,
+        ppu.ctrl, ppu.mask, ppu.status, ppu.oam_addr, ppu.latch,
+        ppu.read_buffer, ppu.v, ppu.t, ppu.fine_x, ppu.w,
+        ppu.dot, ppu.frame_start, ppu.frame, ppu.lines_done,
+        ppu.lines_drawn, ppu.scroll_line, ppu.scroll_y, ppu.cycles,
+        mirroring, len(registers))
+
+    return b"".join([header] + buffers(nes) +
+                    [registers, nes.apu.save_state(),
+                     nes.controllers.save_state()])
+
+
+def buffers(nes):
+    """The memory buffers a state holds, in order"""
+
+    ppu = nes.ppu
+    mapper = nes.cpu.mapper
+    result = [nes.memory.mem_bank, ppu.vram, ppu.palette, ppu.oam]
+
+    if mapper is not None:
+        result.append(mapper.prg_ram)
+
+        if mapper.chr_writable:
+            result.append(mapper.chr)
+
+    return result
+
+
+def restore(nes, state):
+    """Puts the console back in a state from snapshot()"""
+
+    state = memoryview(state)
+
+    if len(state) < HEADER.size:
+        raise SaveStateError(state, const.EXCEPTION_STATE_TRUNCATED)
+
+    fields = HEADER.unpack_from(state)
+    magic, version, sha1 = fields[0:3]
+
+    if magic != MAGIC:
+        raise SaveStateError(state, const.EXCEPTION_STATE_BAD_MAGIC)
+
+    if version != VERSION:
+        raise SaveStateError(state, const.EXCEPTION_STATE_VERSION)
+
+    cpu = nes.cpu
+    ppu = nes.ppu
+    mapper = cpu.mapper
+    expected = bytes.fromhex(cpu.rom.sha1) if mapper is not None \
+        else bytes(20)
+
+    if sha1 != expected:
+        raise SaveStateError(state, const.EXCEPTION_STATE_WRONG_ROM)
+
+    targets = buffers(nes)
+    registers_size = fields[-1]
+    size = HEADER.size + sum(len(target) for target in targets) + \
+        registers_size + nes.apu.state_size() + controller.STATE_SIZE
+
+    if len(state) != size:
+        raise SaveStateError(state, const.EXCEPTION_STATE_TRUNCATED)
+
+    (cpu.pc, cpu.sp, cpu.a, cpu.x, cpu.y, cpu.p, cpu.cycles) = fields[3:10]
+
+    interrupts = nes.scheduler.interrupts
+    interrupts.nmi_pending = bool(fields[10])
+    interrupts.irq_lines = fields[11]
+    cpu.irq_held = bool(fields[11])
+    interrupts.reset_pending = bool(fields[12])
+
+    (ppu.ctrl, ppu.mask, ppu.status, ppu.oam_addr, ppu.latch,
+     ppu.read_buffer, ppu.v, ppu.t, ppu.fine_x, ppu.w,
+     ppu.dot, ppu.frame_start, ppu.frame, ppu.lines_done, ppu.lines_drawn,
+     ppu.scroll_line, ppu.scroll_y, ppu.cycles) = fields[13:31]
+
+    # copy into the existing buffers, since the memory bus and the PPU
+    # hold views of them
+    offset = HEADER.size
+
+    for target in targets:
+        target[:] = state[offset:offset + len(target)]
+        offset += len(target)
+
+    if mapper is not None:
+        mapper.mirroring = MIRRORINGS[fields[31]]
+        mapper.load_state(state[offset:offset + registers_size])
+
+        # rebuilds the PPU's caches, CHR-RAM tiles included
+        ppu.attach_mapper(mapper)
+    else:
+        ppu.chr_switched()
+
+    offset += registers_size
+    nes.apu.load_state(state[offset:offset + nes.apu.state_size()])
+    nes.controllers.load_state(state[-controller.STATE_SIZE:])
+
+    # RAM was replaced under the block cache's and dirty tracking's hooks
+    if cpu.block_cache is not None:
+        cpu.block_cache.flush_ram()
+
+    if nes.memory.dirty is not None:
+        nes.memory.mark_dirty()
+
+    for component in nes.scheduler.components:
+        nes.scheduler.reschedule(component)
+
+
+def encode_delta(keyframe, state):
+    """XORs a state against a keyframe of the same layout and run-length
+       encodes the result, keeping only the runs that changed. Returns
+       (starts, lengths, data)."""
+
+    delta = np.bitwise_xor(np.frombuffer(keyframe, dtype=np.uint8),
+                           np.frombuffer(state, dtype=np.uint8))
+    changed = np.flatnonzero(delta)
+
+    if not len(changed):
+        return (np.zeros(0, dtype=np.uint32),) * 2 + (b"",)
+
+    # a new run starts wherever the gap since the last change is too big
+    # to be worth storing as zeros
+    breaks = np.flatnonzero(np.diff(changed) > RUN_GAP) + 1
+    starts = changed[np.concatenate(([0], breaks))]
+    ends = changed[np.concatenate((breaks - 1, [len(changed) - 1]))] + 1
+
+    # gather every run with one fancy index
+    lengths = ends - starts
+    indices = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + \
+        np.arange(lengths.sum())
+
+    return (starts.astype(np.uint32), lengths.astype(np.uint32),
+            delta[indices].tobytes())
+
+
+def decode_delta(keyframe, delta):
+    """Rebuilds a state from its keyframe and encode_delta() output"""
+
+    starts, lengths, data = delta
+    state = np.frombuffer(keyframe, dtype=np.uint8).copy()
+
+    if len(starts):
+        starts = starts.astype(np.intp)
+        lengths = lengths.astype(np.intp)
+        indices = np.repeat(starts - np.cumsum(lengths) + lengths,
+                            lengths) + np.arange(len(data))
+        state[indices] ^= np.frombuffer(data, dtype=np.uint8)
+
+    return state.tobytes()
+
+
+class Rewind(object):
+    """A ring buffer of recent states. Every keyframe_interval-th state is
+       kept whole, zlib compressed; the rest are stored as deltas against
+       the keyframe before them, so any state decodes in one step."""
+
+    def __init__(self, nes, capacity=60 * 60 * 5, keyframe_interval=60):
+        self.nes = nes
+        self.capacity = capacity
+        self.keyframe_interval = keyframe_interval
+
+        # (compressed keyframe, delta or None for the keyframe itself),
+        # oldest first, in a fixed list used as a ring
+        self.entries = [None] * capacity
+        self.start = 0
+        self.count = 0
+
+        # The uncompressed keyframe new deltas are taken against, its
+        # compressed copy, and how many states have used it
+        self.keyframe = None
+        self.packed_keyframe = None
+        self.since_keyframe = 0
+
+    def __len__(self):
+        return self.count
+
+    def push(self, state=None):
+        """Records the console's current state, or the given one"""
+
+        if state is None:
+            state = snapshot(self.nes)
+
+        if self.keyframe is None or len(state) != len(self.keyframe) or \
+                self.since_keyframe >= self.keyframe_interval:
+            self.keyframe = state
+            self.packed_keyframe = zlib.compress(state, 1)
+            self.since_keyframe = 0
+            entry = (self.packed_keyframe, None)
+        else:
+            entry = (self.packed_keyframe, encode_delta(self.keyframe, state))
+
+        self.since_keyframe += 1
+        self.entries[(self.start + self.count) % self.capacity] = entry
+
+        if self.count < self.capacity:
+            self.count += 1
+        else:
+            # overwrote the oldest
+            self.start = (self.start + 1) % self.capacity
+
+    def state(self, index=-1):
+        """Decodes a recorded state, counting from the oldest, or back from
+           the newest if negative"""
+
+        if index < 0:
+            index += self.count
+
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+
+        packed, delta = self.entries[(self.start + index) % self.capacity]
+        keyframe = zlib.decompress(packed)
+
+        return keyframe if delta is None else decode_delta(keyframe, delta)
+
+    def rewind(self, steps=1):
+        """Restores the steps-th most recent state, dropping everything
+           newer, and returns it. rewind(1) goes back to the last push."""
+
+        steps = min(steps, self.count)
+        state = self.state(-steps)
+        self.count -= steps - 1
+
+        # start the next delta from a fresh keyframe
+        self.keyframe = None
+
+        restore(self.nes, state)
+
+        return state
+
+    def clear(self):
+        """Forgets every recorded state"""
+
+        self.entries = [None] * self.capacity
+        self.start = 0
+        self.count = 0
+        self.keyframe = None
+
+    def memory_size(self):
+        """Bytes of state data held, counting each keyframe once"""
+
+        keyframes = {}
+        total = 0
+
+        for index in range(self.count):
+            packed, delta = self.entries[(self.start + index) %
+                                         self.capacity]
+            keyframes[id(packed)] = len(packed)
+
+            if delta is not None:
+                total += delta[0].nbytes + delta[1].nbytes + len(delta[2])
+
+        return total + sum(keyframes.values())
@@ -0,0 +1,155 @@
+"""This module keeps the CPU and the rest of the console in time without
+   ticking them in lockstep. The CPU is the master clock and runs ahead on
+   its own; every other component is a step behind and is only caught up
+   ("synced") when something observes it -- the CPU touching one of its
+   registers -- or when it has an event due, such as the PPU raising NMI at
+   the start of vblank. Those deadlines live on the interrupt controller's
+   event heap. All timestamps are in CPU cycles."""
+
+import interrupts
+
+
+class Component(object):
+    """Something clocked alongside the CPU that is run lazily."""
+
+    def __init__(self):
+        # The CPU cycle this component has been run up to
+        self.cycles = 0
+
+        # Set by Scheduler.add()
+        self.scheduler = None
+
+    def catch_up(self, cycles):
+        """Runs the component forward to the given CPU cycle"""
+
+        self.cycles = cycles
+
+    def next_sync(self):
+        """The CPU cycle at which this component must be caught up whether
+           or not anything has looked at it, or None if there isn't one.
+           Once caught up to it, the deadline must move past it. If it moves
+           for any other reason, call Scheduler.reschedule()."""
+
+        return None
+
+
+class Scheduler(object):
+    """Runs the CPU up to the next event on the interrupt controller's heap,
+       syncing the components lazily in between. Each component's deadline
+       is kept on the heap as an event that syncs it."""
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.components = []
+        self.interrupts = interrupts.InterruptController(cpu)
+
+        # How many times a component was caught up, and how many of those
+        # were forced by a deadline rather than an observation
+        self.syncs = 0
+        self.deadline_syncs = 0
+
+    def add(self, component):
+        """Puts a component on the CPU's clock"""
+
+        component.scheduler = self
+        component.cycles = self.cpu.cycles
+        component.deadline_event = None
+        self.components.append(component)
+        self.reschedule(component)
+
+        return component
+
+    def reschedule(self, component):
+        """Replaces a component's deadline event after something changed
+           when it will next need syncing"""
+
+        if component.deadline_event is not None:
+            self.interrupts.cancel(component.deadline_event)
+            component.deadline_event = None
+
+        deadline = component.next_sync()
+
+        if deadline is not None:
+            component.deadline_event = self.interrupts.schedule(
+                deadline, lambda: self.deadline_sync(component))
+
+    def deadline_sync(self, component):
+        """Event callback for a component reaching its deadline"""
+
+        component.deadline_event = None
+        self.deadline_syncs += 1
+        self.sync(component)
+        self.reschedule(component)
+
+    def request_nmi(self):
+        """Asserts NMI, which the CPU takes after its current instruction"""
+
+        self.interrupts.request_nmi()
+
+    def sync(self, component):
+        """Catches a component up to the CPU"""
+
+        if component.cycles < self.cpu.cycles:
+            self.syncs += 1
+            component.catch_up(self.cpu.cycles)
+
+    def sync_all(self):
+        """Catches every component up to the CPU"""
+
+        for component in self.components:
+            self.sync(component)
+
+    def synced_reader(self, component, read):
+        """Wraps a register read callback so the component is caught up
+           before it is observed"""
+
+        sync = self.sync
+
+        def synced(loc):
+            sync(component)
+
+            return read(loc)
+
+        return synced
+
+    def synced_writer(self, component, write):
+        """Wraps a register write callback so the component is caught up
+           before its state changes"""
+
+        sync = self.sync
+
+        def synced(loc, data):
+            sync(component)
+            write(loc, data)
+
+        return synced
+
+    def next_sync(self):
+        """The earliest pending event, or None"""
+
+        return self.interrupts.next_event()
+
+    def run(self, cycles):
+        """Runs the CPU for at least the given number of cycles, breaking
+           out only when an event is due or an interrupt line changes, and
+           stopping early if the debugger stops the CPU. Returns the number
+           of cycles actually run."""
+
+        cpu = self.cpu
+        controller = self.interrupts
+        start = cpu.cycles
+        end = start + cycles
+
+        while not cpu.stopped:
+            controller.run_events()
+            controller.service()
+
+            if cpu.cycles >= end:
+                break
+
+            deadline = controller.next_event()
+            stop = end if deadline is None else min(end, deadline)
+
+            cpu.run(stop - cpu.cycles)
+
+        return cpu.cycles - start
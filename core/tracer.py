@@ -0,0 +1,254 @@
+"""This module traces every instruction the CPU executes, in the format of
+   nestest.log, so a run can be diffed line by line against another
+   emulator's.
+
+   Tracing stays cheap enough for multi-million instruction runs by
+   splitting the work. The run loop only packs each instruction's PC,
+   bytes, registers, cycle count and operand into a fixed-size binary
+   record in a preallocated ring buffer. Turning records into text happens
+   later, in a background thread, when the buffer is flushed to disk.
+
+   The CPU only runs this loop while tracing is on; with it off, run()
+   goes back to the untraced loop and tracing costs nothing."""
+
+import queue
+import struct
+import threading
+import constants as const
+import disassembler
+
+# pc, opcode, the two bytes after it, A, X, Y, P, SP, cycles, and the
+# operand's effective address and the value there before executing
+RECORD = struct.Struct("<HBBBBBBBBQHB")
+
+# Records in the ring buffer by default, about 1.3MB worth
+DEFAULT_CAPACITY = 1 << 16
+
+# Buffers a writer thread will hold before the run loop waits for it
+WRITER_QUEUE = 4
+
+# What nestest.log prints after the operand, by addressing mode, given
+# the effective address, the value there, the zero page pointer (zp,X)
+# read through and the base address (zp),Y added Y to
+ANNOTATIONS = {
+    const.ADDR_ZERO_PAGE: lambda address, value, pointer, base:
+        " = %02X" % value,
+    const.ADDR_ZERO_PAGE_X: lambda address, value, pointer, base:
+        " @ %02X = %02X" % (address, value),
+    const.ADDR_ZERO_PAGE_Y: lambda address, value, pointer, base:
+        " @ %02X = %02X" % (address, value),
+    const.ADDR_ABSOLUTE: lambda address, value, pointer, base:
+        " = %02X" % value,
+    const.ADDR_ABSOLUTE_X: lambda address, value, pointer, base:
+        " @ %04X = %02X" % (address, value),
+    const.ADDR_ABSOLUTE_Y: lambda address, value, pointer, base:
+        " @ %04X = %02X" % (address, value),
+    const.ADDR_INDIRECT: lambda address, value, pointer, base:
+        " = %04X" % address,
+    const.ADDR_INDEXED_INDIRECT: lambda address, value, pointer, base:
+        " @ %02X = %04X = %02X" % (pointer, address, value),
+    const.ADDR_INDIRECT_INDEXED: lambda address, value, pointer, base:
+        " = %04X @ %04X = %02X" % (base, address, value)
+}
+
+
+def format_record(pc, opcode, low, high, a, x, y, p, sp, cycles, address,
+                  value):
+    """One line of nestest.log from an unpacked record"""
+
+    length = disassembler.LENGTHS[opcode]
+    data = " ".join("%02X" % byte for byte in (opcode, low, high)[:length])
+    text = disassembler.disassemble(pc, opcode, low, high)
+    annotate = ANNOTATIONS.get(disassembler.MODES[opcode])
+
+    # JMP and JSR absolute print just their target
+    if annotate is not None and opcode not in (0x4c, 0x20):
+        text += annotate(address, value, (low + x) & 0xff,
+                         (address - y) & 0xffff)
+
+    # the PPU runs three dots per cycle from power on, and so does nestest
+    dots = cycles * const.PPU_DOTS_PER_CYCLE % const.DOTS_PER_FRAME
+    line, dot = divmod(dots, const.DOTS_PER_LINE)
+
+    return "%04X  %-8s  %-32sA:%02X X:%02X Y:%02X P:%02X SP:%02X " \
+        "PPU:%3d,%3d CYC:%d" % (pc, data, text, a, x, y, p, sp, line, dot,
+                                cycles)
+
+
+def format_records(data):
+    """Lines for every record packed in data"""
+
+    return [format_record(*fields) for fields in RECORD.iter_unpack(data)]
+
+
+class TraceWriter(threading.Thread):
+    """Formats packed records and appends them to a log file, in the
+       background."""
+
+    def __init__(self, path):
+        threading.Thread.__init__(self, daemon=True)
+
+        self.path = path
+        self.buffers = queue.Queue(WRITER_QUEUE)
+        self.lines_written = 0
+
+        # opened here so a bad path fails in the caller, not the thread
+        self.log = open(path, "w")
+        self.start()
+
+    def put(self, data):
+        """Queues packed records to be written, waiting if the writer has
+           fallen behind"""
+
+        self.buffers.put(data)
+
+    def finish(self):
+        """Asks the thread to exit once everything queued is written"""
+
+        self.buffers.put(None)
+
+    def run(self):
+
+        with self.log:
+            while True:
+                data = self.buffers.get()
+
+                if data is None:
+                    return
+
+                lines = format_records(data)
+                self.log.write("\n".join(lines) + "\n" if lines else "")
+                self.lines_written += len(lines)
+
+
+class Tracer(object):
+    """This class records each instruction the CPU executes.
+
+       With a path, the ring is handed to a writer thread every time it
+       fills, so the log has every instruction. Without one it just wraps,
+       keeping the last capacity instructions for flush() to write out."""
+
+    def __init__(self, cpu, capacity=DEFAULT_CAPACITY, path=None):
+        self.cpu = cpu
+        self.capacity = capacity
+        self.buffer = bytearray(capacity * RECORD.size)
+
+        # Next record in the ring, whether the ring has wrapped since the
+        # last flush, and instructions traced in total
+        self.index = 0
+        self.wrapped = False
+        self.count = 0
+
+        # Effective address resolver for each opcode, None for opcodes
+        # with no memory operand
+        self.resolvers = [cpu.addressing.get(mode)
+                          for mode in disassembler.MODES]
+
+        self.writer = TraceWriter(path) if path is not None else None
+        self.pending = []
+
+    def run(self):
+        """The CPU's run loop, recording every instruction before it
+           executes"""
+
+        cpu = self.cpu
+        dispatch = cpu.dispatch
+        peek = cpu.memory.peek
+        pack = RECORD.pack_into
+        lengths = disassembler.LENGTHS
+        resolvers = self.resolvers
+        buffer = self.buffer
+        size = RECORD.size
+
+        while cpu.cycles < cpu.deadline:
+            pc = cpu.pc
+            opcode = cpu.memory.load(pc)
+            length = lengths[opcode]
+            low = peek((pc + 1) & 0xffff) if length > 1 else 0
+            high = peek((pc + 2) & 0xffff) if length > 2 else 0
+            resolve = resolvers[opcode]
+
+            if resolve is None:
+                address = value = 0
+            else:
+                address = resolve((pc + 1) & 0xffff)[0]
+                value = peek(address)
+
+            pack(buffer, self.index * size, pc, opcode, low, high, cpu.a,
+                 cpu.x, cpu.y, cpu.p, cpu.sp, cpu.cycles, address, value)
+
+            self.index += 1
+            self.count += 1
+
+            if self.index == self.capacity:
+                self.wrap()
+
+            dispatch[opcode]()
+
+    def wrap(self):
+        """Called when the ring fills: streams it out, or starts writing
+           over the oldest records"""
+
+        if self.writer is not None:
+            self.writer.put(bytes(self.buffer))
+        else:
+            self.wrapped = True
+
+        self.index = 0
+
+    def records(self):
+        """The records held in the ring, oldest first, packed"""
+
+        end = self.index * RECORD.size
+
+        if self.wrapped:
+            return bytes(self.buffer[end:]) + bytes(self.buffer[:end])
+
+        return bytes(self.buffer[:end])
+
+    def lines(self):
+        """The records held in the ring as nestest.log lines"""
+
+        return format_records(self.records())
+
+    def take(self):
+        """Returns the records held in the ring, packed, and empties it,
+           for a caller that consumes them as it goes"""
+
+        data = self.records()
+        self.index = 0
+        self.wrapped = False
+
+        return data
+
+    def flush(self, path=None):
+        """Hands everything in the ring to a writer thread and empties it.
+           Without a path this is the stream the tracer was made with, and
+           a ValueError if it wasn't made with one."""
+
+        if path is None and self.writer is None:
+            raise ValueError(const.EXCEPTION_TRACE_NO_STREAM)
+
+        data = self.take()
+
+        if path is None:
+            self.writer.put(data)
+        else:
+            writer = TraceWriter(path)
+            writer.put(data)
+            writer.finish()
+            self.pending.append(writer)
+
+    def close(self):
+        """Flushes a streaming trace and waits for every write to finish"""
+
+        if self.writer is not None:
+            self.flush()
+            self.writer.finish()
+            self.pending.append(self.writer)
+            self.writer = None
+
+        for writer in self.pending:
+            writer.join()
+
+        self.pending = []
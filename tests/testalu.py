@@ -0,0 +1,64 @@
+import alu
+import cpu as CPU
+import unittest
+
+
+class AluTest(unittest.TestCase):
+
+    def test_zn_table(self):
+
+        self.assertEqual(alu.ZN_TABLE[0x00], 0b00000010)
+        self.assertEqual(alu.ZN_TABLE[0x01], 0b00000000)
+        self.assertEqual(alu.ZN_TABLE[0x80], 0b10000000)
+
+    def test_adc_table(self):
+
+        # 0x7f + 0x01 overflows into the sign bit
+        index = 0x7f << 9 | 0x01 << 1
+        self.assertEqual(alu.ADC_RESULT[index], 0x80)
+        self.assertEqual(alu.ADC_FLAGS[index], 0b11000000)
+
+        # 0xff + 0x00 + carry wraps to zero with carry out
+        index = 0xff << 9 | 0x00 << 1 | 1
+        self.assertEqual(alu.ADC_RESULT[index], 0x00)
+        self.assertEqual(alu.ADC_FLAGS[index], 0b00000011)
+
+    def test_sbc_table(self):
+
+        # 0x05 - 0x03 with carry set (no borrow)
+        index = 0x05 << 9 | 0x03 << 1 | 1
+        self.assertEqual(alu.SBC_RESULT[index], 0x02)
+        self.assertEqual(alu.SBC_FLAGS[index], 0b00000001)
+
+        # 0x00 - 0x01 borrows
+        index = 0x00 << 9 | 0x01 << 1 | 1
+        self.assertEqual(alu.SBC_RESULT[index], 0xff)
+        self.assertEqual(alu.SBC_FLAGS[index], 0b10000000)
+
+    def test_cpu_sbc(self):
+
+        cpu = CPU.create_cpu()
+        cpu.a = 0x50
+        cpu.sec()
+
+        cpu.sbc(0xb0)
+
+        # 80 - (-80) overflows and needs a borrow
+        self.assertEqual(cpu.a, 0xa0)
+        self.assertTrue(cpu.p & 0b01000000)
+        self.assertFalse(cpu.p & 0b00000001)
+
+    def test_cpu_compare(self):
+
+        cpu = CPU.create_cpu()
+        cpu.a = 0x10
+
+        cpu._cmp(0x10)
+        self.assertEqual(cpu.p & 0b10000011, 0b00000011)
+
+        cpu._cmp(0x20)
+        self.assertEqual(cpu.p & 0b10000011, 0b10000000)
+
+
+if __name__ == "__main__":
+    unittest.main()
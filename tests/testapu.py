@@ -0,0 +1,138 @@
+import constants
+import nes
+import numpy as np
+import os
+import tempfile
+import unittest
+import wave
+from testidleloop import loop_image
+from testrom import write_rom
+
+# loop: JMP loop
+IDLE = [0x4c, 0x00, 0x80, 0x40]
+
+
+class ApuTest(unittest.TestCase):
+
+    def setUp(self):
+
+        path = write_rom(loop_image(IDLE, 0x03))
+        self.addCleanup(os.remove, path)
+
+        self.console = nes.create_nes()
+        self.console.load_rom(path)
+        self.memory = self.console.memory
+
+    def test_frame_irq(self):
+
+        # on at power on, raised at the end of the four step sequence
+        self.console.run(29820)
+        self.assertFalse(self.memory.read(0x4015) & constants.STATUS_FRAME_IRQ)
+
+        self.console.run(20)
+        self.assertTrue(self.memory.read(0x4015) &
+                        constants.STATUS_FRAME_IRQ)
+
+        # reading $4015 acknowledged it
+        self.assertFalse(self.memory.read(0x4015) &
+                         constants.STATUS_FRAME_IRQ)
+        self.assertFalse(self.console.scheduler.interrupts.irq_lines)
+
+        # and inhibiting it keeps it off
+        self.memory.write(0x4017, constants.FRAME_IRQ_INHIBIT)
+        self.console.run(60000)
+        self.assertFalse(self.memory.read(0x4015))
+
+    def test_length_counter(self):
+
+        # pulse 1 enabled with a length of 2 half frames
+        self.memory.write(0x4015, constants.STATUS_PULSE_1)
+        self.memory.write(0x4000, 0x10)
+        self.memory.write(0x4003, 0x18)
+        self.assertEqual(self.memory.read(0x4015), constants.STATUS_PULSE_1)
+
+        self.console.run(15000)
+        self.assertEqual(self.memory.read(0x4015), constants.STATUS_PULSE_1)
+
+        self.console.run(15000)
+        self.assertEqual(self.memory.read(0x4015) &
+                         constants.STATUS_PULSE_1, 0)
+
+    def test_dmc_irq(self):
+
+        # a one byte sample at the fastest rate, with IRQ on
+        self.memory.write(0x4017, constants.FRAME_IRQ_INHIBIT)
+        self.memory.write(0x4010, 0x8f)
+        self.memory.write(0x4013, 0x00)
+        self.memory.write(0x4015, constants.STATUS_DMC)
+
+        # the byte is fetched on the next clock of the timer, which was
+        # already running at the slowest rate
+        self.console.run(428)
+
+        self.assertTrue(self.console.scheduler.interrupts.irq_lines &
+                        constants.IRQ_DMC)
+        self.assertEqual(self.memory.read(0x4015),
+                         constants.STATUS_DMC_IRQ | constants.STATUS_DMC)
+
+        # writing $4015 acknowledges it, and the last bits play out
+        self.memory.write(0x4015, 0x00)
+        self.console.run(8 * 54)
+        self.assertEqual(self.memory.read(0x4015), 0)
+
+    def test_block_synthesis(self):
+
+        # a 440Hz square on pulse 1 and an 835Hz triangle
+        blocks = []
+        stream = self.console.enable_audio(blocks.append)
+
+        self.memory.write(0x4015, 0x0f)
+        self.memory.write(0x4000, 0xbf)
+        self.memory.write(0x4002, 0xfd)
+        self.memory.write(0x4003, 0x08)
+        self.memory.write(0x4008, 0x81)
+        self.memory.write(0x400a, 0x42)
+        self.memory.write(0x400b, 0x08)
+
+        self.console.run(constants.CPU_CLOCK_RATE)
+        self.assertIs(self.console.disable_audio(), stream)
+
+        samples = np.concatenate(blocks)
+
+        # a second of audio, in whole blocks but the last
+        self.assertAlmostEqual(len(samples), constants.AUDIO_SAMPLE_RATE,
+                               delta=2)
+        self.assertEqual(stream.samples, len(samples))
+
+        spectrum = np.abs(np.fft.rfft(samples - samples.mean()))
+        peaks = sorted(np.argsort(spectrum)[-2:])
+
+        self.assertAlmostEqual(peaks[0], 440, delta=2)
+        self.assertAlmostEqual(peaks[1], 835, delta=4)
+
+    def test_wav(self):
+
+        handle, path = tempfile.mkstemp(suffix=".wav")
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+
+        self.console.enable_audio(path, 22050)
+        self.memory.write(0x4015, 0x01)
+        self.memory.write(0x4000, 0xbf)
+        self.memory.write(0x4003, 0x01)
+
+        for frame in range(10):
+            self.console.run_frame()
+
+        stream = self.console.disable_audio()
+
+        with wave.open(path) as wav:
+            self.assertEqual(wav.getframerate(), 22050)
+            self.assertEqual(wav.getsampwidth(), 2)
+            self.assertEqual(wav.getnframes(), stream.samples)
+
+        self.assertAlmostEqual(stream.samples, 10 * 22050 // 60, delta=40)
+
+
+if __name__ == "__main__":
+    unittest.main()
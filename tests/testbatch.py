@@ -0,0 +1,119 @@
+import batch
+import constants as const
+import hashlib
+import movie
+import nes
+import os
+import tempfile
+import unittest
+import zlib
+from testcontroller import controller_image
+from testinterrupts import mmc3_image
+from testmovie import FM2, record_movie
+from testppu import ppu_image
+from testrom import write_rom
+
+
+class BatchTest(unittest.TestCase):
+
+    def rom(self, image):
+
+        path = write_rom(image)
+        self.addCleanup(os.remove, path)
+
+        return path
+
+    def movie(self, text):
+
+        handle, path = tempfile.mkstemp(suffix=".fm2")
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+
+        with open(path, "w") as movie_file:
+            movie_file.write(text)
+
+        return path
+
+    def test_matches_single_console(self):
+
+        ppu_rom = self.rom(ppu_image())
+        mmc3_rom = self.rom(mmc3_image())
+        jobs = [batch.Job(ppu_rom, 3, outputs=batch.OUTPUTS),
+                batch.Job(mmc3_rom, 2),
+                batch.Job(ppu_rom, 1, outputs=batch.OUTPUTS),
+                batch.Job(mmc3_rom, 4, outputs=(const.OUTPUT_SCREENSHOT,))]
+
+        results = sorted(batch.run_batch(jobs, processes=2),
+                         key=lambda result: result["index"])
+
+        self.assertEqual([result["index"] for result in results], [0, 1, 2, 3])
+
+        for job, result in zip(jobs, results):
+            console = nes.create_nes()
+            console.load_rom(job.rom)
+            checksums = [zlib.crc32(console.run_frame())
+                         for frame in range(job.frames)]
+
+            self.assertIsNone(result["error"])
+
+            if const.OUTPUT_RAM_HASH in job.outputs:
+                self.assertEqual(result[const.OUTPUT_RAM_HASH], hashlib.sha1(
+                    console.memory.mem_bank[0:0x800]).hexdigest())
+
+            if const.OUTPUT_FRAME_CHECKSUMS in job.outputs:
+                self.assertEqual(result[const.OUTPUT_FRAME_CHECKSUMS],
+                                 checksums)
+
+            # a job that only wants the last frame skips drawing the rest
+            if const.OUTPUT_SCREENSHOT in job.outputs:
+                self.assertEqual(result[const.OUTPUT_SCREENSHOT],
+                                 console.frame_rgb().tobytes())
+            else:
+                self.assertNotIn(const.OUTPUT_SCREENSHOT, result)
+
+    def test_errors(self):
+
+        bad_rom = self.rom(b"NOPE" + bytes(12))
+        good_rom = self.rom(ppu_image())
+        zapper = FM2.replace("port0 1", "port0 2")
+        missing = os.path.join(tempfile.gettempdir(), "missing.nes")
+        jobs = [batch.Job(bad_rom, 1),
+                batch.Job(good_rom, 1, movie=self.movie(zapper)),
+                batch.Job(missing, 1),
+                batch.Job(good_rom, 1, movie=missing + ".fm2"),
+                batch.Job(good_rom, "1"),
+                batch.Job(good_rom, 1)]
+
+        # every job reports, however the others fail
+        results = sorted(batch.run_batch(jobs, processes=2),
+                         key=lambda result: result["index"])
+
+        self.assertEqual(results[0]["error"], const.EXCEPTION_ROM_BAD_MAGIC)
+        self.assertEqual(results[1]["error"], const.EXCEPTION_MOVIE_DEVICE)
+        self.assertIn("missing.nes", results[2]["error"])
+        self.assertIn("missing.nes.fm2", results[3]["error"])
+        self.assertIn("TypeError", results[4]["error"])
+        self.assertIsNone(results[5]["error"])
+
+    def test_movie(self):
+
+        path = self.rom(controller_image())
+        recording = record_movie(path, 10)[0]
+        fm2 = self.movie("\n".join(recording.lines()))
+
+        # the movie's own length, and running on past its end
+        for frames in (10, 14):
+            console = nes.create_nes()
+            console.load_rom(path)
+            movie.replay(console, recording, frames=frames)
+
+            result, = batch.run_batch([batch.Job(path, frames, movie=fm2)],
+                                      processes=1)
+
+            self.assertIsNone(result["error"])
+            self.assertEqual(result[const.OUTPUT_RAM_HASH], hashlib.sha1(
+                console.memory.mem_bank[0:0x800]).hexdigest())
+
+
+if __name__ == "__main__":
+    unittest.main()
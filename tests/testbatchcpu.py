@@ -0,0 +1,187 @@
+import batchcpu
+import cpu
+import numpy as np
+import unittest
+
+# Sums the bytes $00 down to $01 into $10/$11 through a subroutine, then
+# shifts, rotates and compares with every addressing mode along the way.
+# The loop count comes from $00, so instances diverge.
+PROGRAM = [
+    0xa2, 0xff, 0x9a,                 # LDX #$ff, TXS
+    0xa6, 0x00,                       # LDX $00
+    0xa9, 0x00, 0x85, 0x10, 0x85, 0x11,   # LDA #0, STA $10, STA $11
+    0xa9, 0x20, 0x85, 0x20,           # LDA #$20, STA $20 (pointer to $0320)
+    0xa9, 0x03, 0x85, 0x21,           # LDA #$03, STA $21
+    0x8a,                             # loop: TXA
+    0x20, 0x40, 0x80,                 # JSR add
+    0x91, 0x20,                       # STA ($20),Y
+    0xc8,                             # INY
+    0xca,                             # DEX
+    0xd0, 0xf6,                       # BNE loop
+    0x06, 0x10, 0x26, 0x11,           # ASL $10, ROL $11
+    0xad, 0x02, 0x20,                 # LDA $2002 (I/O, scalar fallback)
+    0x4c, 0x24, 0x80                  # done: JMP done
+]
+
+# add: CLC, ADC $10, STA $10, BCC +2, INC $11, PHA, PLA, RTS
+SUBROUTINE = [0x18, 0x65, 0x10, 0x85, 0x10, 0x90, 0x02, 0xe6, 0x11,
+              0x48, 0x68, 0x60]
+
+
+# Bytes that keep every operand, pointer and indexed address out of the
+# I/O area, carries included: $00-$1E and $60-$FE
+SAFE_BYTES = np.array([value for value in range(0x100)
+                       if value < 0x1f or 0x60 <= value < 0xff])
+
+# Instances per opcode in the lockstep test
+LOCKSTEP_WIDTH = 16
+
+
+def program_prg():
+    """16KB of PRG with the program at 0x8000 and its subroutine at
+       0x8040"""
+    prg = bytearray(0x4000)
+    prg[0x0000:len(PROGRAM)] = bytes(PROGRAM)
+    prg[0x0040:0x0040 + len(SUBROUTINE)] = bytes(SUBROUTINE)
+    prg[0x3ffc:0x3ffe] = bytes([0x00, 0x80])
+
+    return prg
+
+
+class BatchCpuTest(unittest.TestCase):
+
+    def reference(self, prg, count):
+        """A scalar CPU with the same program and input"""
+
+        scalar = cpu.create_cpu()
+        scalar.memory.map_buffer(0x8000, 0xffff, memoryview(bytes(prg)),
+                                 writable=False)
+        scalar.memory.write(0x0000, count)
+        scalar.initialize_cpu()
+
+        return scalar
+
+    def check_matches(self, counts, steps=150):
+        """Steps a batch and a scalar CPU per instance, which must end up
+           the same, returning the batch"""
+
+        prg = program_prg()
+
+        batch = batchcpu.create_batch_cpu(len(counts))
+        batch.load_prg(prg)
+        batch.ram[:, 0] = counts
+
+        scalars = [self.reference(prg, count) for count in counts]
+
+        for step in range(steps):
+            batch.step()
+
+            for scalar in scalars:
+                scalar.step()
+
+        for index, scalar in enumerate(scalars):
+            registers = [int(register[index]) for register in (
+                batch.pc, batch.sp, batch.a, batch.x, batch.y, batch.p,
+                batch.cycles)]
+
+            self.assertEqual(registers, [scalar.pc, scalar.sp, scalar.a,
+                                         scalar.x, scalar.y, scalar.p,
+                                         scalar.cycles])
+            self.assertEqual(batch.ram[index].tobytes(),
+                             bytes(scalar.memory.mem_bank[0:0x800]))
+
+        return batch
+
+    def test_matches_scalar_cpu(self):
+
+        batch = self.check_matches([(index % 12) + 1 for index in range(64)])
+
+        # most of the work was vectorized, and the I/O read was not
+        self.assertGreater(batch.vector_steps, batch.scalar_steps)
+        self.assertGreater(batch.scalar_steps, 0)
+
+    def test_scalar_only(self):
+
+        # too few instances to vectorize, so every instruction, the stack
+        # and (zp),Y ones included, runs through the scalar CPU
+        batch = self.check_matches([3, 7, 12], 300)
+
+        self.assertEqual(batch.vector_steps, 0)
+
+    def test_every_opcode(self):
+
+        # each documented opcode at $0300 of LOCKSTEP_WIDTH instances, with
+        # random registers and random, but safe, operands and memory
+        opcodes = sorted(cpu.create_cpu().opcodes)
+        count = len(opcodes) * LOCKSTEP_WIDTH
+        rng = np.random.default_rng(6502)
+
+        batch = batchcpu.create_batch_cpu(count)
+        batch.load_prg(program_prg())
+        batch.ram[:] = rng.choice(SAFE_BYTES, size=batch.ram.shape)
+        batch.prg_ram[:] = rng.choice(SAFE_BYTES, size=batch.prg_ram.shape)
+        batch.ram[:, 0x300] = np.repeat(opcodes, LOCKSTEP_WIDTH)
+
+        batch.pc[:] = 0x300
+        for register in (batch.sp, batch.a, batch.x, batch.y):
+            register[:] = rng.integers(0, 0x100, count)
+        batch.p[:] = rng.integers(0, 0x100, count) | 0x30
+        batch.cycles[:] = rng.integers(0, 1000, count)
+
+        before = [[int(register[index]) for register in (
+            batch.sp, batch.a, batch.x, batch.y, batch.p, batch.cycles)]
+            for index in range(count)]
+        ram = batch.ram.copy()
+        prg_ram = batch.prg_ram.copy()
+
+        batch.step()
+
+        scalar = self.reference(program_prg(), 0)
+        bank = scalar.memory.mem_bank
+
+        for index in range(count):
+            bank[0:0x800] = ram[index].tobytes()
+            bank[0x6000:0x8000] = prg_ram[index].tobytes()
+            scalar.pc = 0x300
+            scalar.sp, scalar.a, scalar.x, scalar.y, scalar.p, \
+                scalar.cycles = before[index]
+            scalar.step()
+
+            registers = [int(register[index]) for register in (
+                batch.pc, batch.sp, batch.a, batch.x, batch.y, batch.p,
+                batch.cycles)]
+
+            self.assertEqual(registers, [scalar.pc, scalar.sp, scalar.a,
+                                         scalar.x, scalar.y, scalar.p,
+                                         scalar.cycles],
+                             "opcode $%02X" % ram[index, 0x300])
+            self.assertEqual(batch.ram[index].tobytes(), bytes(bank[0:0x800]),
+                             "opcode $%02X" % ram[index, 0x300])
+            self.assertEqual(batch.prg_ram[index].tobytes(),
+                             bytes(bank[0x6000:0x8000]),
+                             "opcode $%02X" % ram[index, 0x300])
+
+        # only JMP ($nnnn) fell back
+        self.assertEqual(batch.scalar_steps, LOCKSTEP_WIDTH)
+        self.assertEqual(batch.vector_steps, count - LOCKSTEP_WIDTH)
+
+    def test_run_and_halt(self):
+
+        prg = bytearray(0x4000)
+
+        # INX, INX, invalid opcode
+        prg[0:3] = bytes([0xe8, 0xe8, 0x02])
+        prg[0x3ffc:0x3ffe] = bytes([0x00, 0x80])
+
+        batch = batchcpu.create_batch_cpu(16)
+        batch.load_prg(prg)
+        batch.run(100)
+
+        self.assertTrue(batch.halted.all())
+        self.assertTrue((batch.x == 2).all())
+        self.assertTrue((batch.pc == 0x8002).all())
+        self.assertTrue(np.array_equal(batch.cycles, np.full(16, 11)))
+
+
+if __name__ == "__main__":
+    unittest.main()
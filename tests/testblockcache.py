@@ -0,0 +1,140 @@
+import cpu as CPU
+import nes
+import os
+import unittest
+from testcpu import load_program
+from testidleloop import FLAG_WAIT, VBLANK_POLL, loop_image
+from testrom import write_rom
+
+
+# LDX #$00, loop: INX, STX $0300,X, CPX #$10, BNE loop, then JMP to itself
+COUNT_LOOP = [0xa2, 0x00, 0xe8, 0x9d, 0x00, 0x03, 0xe0, 0x10, 0xd0, 0xf8,
+              0x4c, 0x0a, 0x02]
+
+
+class BlockCacheTest(unittest.TestCase):
+
+    def test_matches_interpreter(self):
+
+        interpreted = CPU.create_cpu()
+        load_program(interpreted, COUNT_LOOP)
+        interpreted.run(500)
+
+        translated = CPU.create_cpu()
+        load_program(translated, COUNT_LOOP)
+        translated.enable_block_cache()
+        translated.run(500)
+
+        for register in ("pc", "a", "x", "y", "sp", "p"):
+            self.assertEqual(getattr(translated, register),
+                             getattr(interpreted, register))
+
+        for loc in range(0x0300, 0x0320):
+            self.assertEqual(translated.memory.read(loc),
+                             interpreted.memory.read(loc))
+
+    def test_cycles_match_interpreter(self):
+
+        interpreted = CPU.create_cpu()
+        load_program(interpreted, COUNT_LOOP)
+
+        translated = CPU.create_cpu()
+        load_program(translated, COUNT_LOOP)
+        translated.enable_block_cache()
+
+        # compare at block boundaries, where both have run whole blocks
+        while interpreted.pc != 0x020a:
+            interpreted.step()
+
+        while translated.pc != 0x020a:
+            translated.run(1)
+
+        self.assertEqual(translated.cycles, interpreted.cycles)
+
+    def test_hit_rate(self):
+
+        cpu = CPU.create_cpu()
+        load_program(cpu, COUNT_LOOP)
+        cache = cpu.enable_block_cache()
+
+        cpu.run(1000)
+        stats = cache.stats()
+
+        self.assertGreater(stats["hits"], stats["misses"])
+        self.assertGreater(stats["hit_rate"], 0.9)
+
+    def test_write_invalidates(self):
+
+        cpu = CPU.create_cpu()
+
+        # LDA #$01, JMP $0200
+        load_program(cpu, [0xa9, 0x01, 0x4c, 0x00, 0x02])
+        cache = cpu.enable_block_cache()
+        cpu.run(20)
+        self.assertEqual(cpu.a, 0x01)
+
+        # patch the immediate operand through a mirror of the page
+        cpu.memory.write(0x0a01, 0x02)
+        cpu.run(20)
+
+        self.assertEqual(cpu.a, 0x02)
+        self.assertGreater(cache.stats()["invalidations"], 0)
+
+    def test_self_modifying_block(self):
+
+        # LDA #$05, STA $0206, LDA #$01, STA $10, JMP $0209: the store
+        # patches the next LDA's operand inside the block that runs it
+        program = [0xa9, 0x05, 0x8d, 0x06, 0x02, 0xa9, 0x01, 0x85, 0x10,
+                   0x4c, 0x09, 0x02]
+
+        interpreted = CPU.create_cpu()
+        load_program(interpreted, program)
+        interpreted.run(50)
+
+        translated = CPU.create_cpu()
+        load_program(translated, program)
+        translated.enable_block_cache()
+        translated.run(50)
+
+        self.assertEqual(interpreted.a, 0x05)
+        self.assertEqual(translated.a, interpreted.a)
+        self.assertEqual(translated.memory.read(0x10), 0x05)
+
+    def test_interrupts_match_interpreter(self):
+
+        # NMI is taken on the same instruction, and register writes end
+        # their block, so the whole console stays in step
+        for program, nmi in ((FLAG_WAIT, 0x17), (VBLANK_POLL, 0x0f)):
+            path = write_rom(loop_image(program, nmi))
+            self.addCleanup(os.remove, path)
+
+            interpreted = nes.create_nes()
+            interpreted.load_rom(path)
+
+            translated = nes.create_nes()
+            translated.load_rom(path)
+            cache = translated.cpu.enable_block_cache()
+
+            for frame in range(10):
+                interpreted.run_frame()
+                translated.run_frame()
+
+                self.assertEqual(translated.cpu.cycles,
+                                 interpreted.cpu.cycles)
+                self.assertEqual(translated.state_hash(),
+                                 interpreted.state_hash())
+
+            self.assertGreater(cache.stats()["hit_rate"], 0.9)
+
+    def test_disable(self):
+
+        cpu = CPU.create_cpu()
+        cpu.enable_block_cache()
+        cpu.disable_block_cache()
+
+        self.assertIsNone(cpu.block_cache)
+        self.assertFalse(cpu.memory.write_hooks)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,171 @@
+import conformance
+import nes
+import os
+import rom
+import tempfile
+import unittest
+from testidleloop import FLAG_WAIT, loop_image
+from testrom import write_rom
+
+
+def status_image(code, message, reset=False):
+    """An NROM image that reports code and message through $6000, first
+       asking for a reset if reset is set"""
+
+    program = [
+        0xa9, 0x80, 0x8d, 0x00, 0x60,     # LDA #$80, STA $6000
+        0xa9, 0xde, 0x8d, 0x01, 0x60,     # LDA #$de, STA $6001
+        0xa9, 0xb0, 0x8d, 0x02, 0x60,     # LDA #$b0, STA $6002
+        0xa9, 0x61, 0x8d, 0x03, 0x60,     # LDA #$61, STA $6003
+    ]
+
+    # whether this is after the reset: LDA $6100, or LDA #$42, NOP
+    program += [0xad, 0x00, 0x61] if reset else [0xa9, 0x42, 0xea]
+
+    program += [
+        0xc9, 0x42, 0xf0, 0x0d,           # CMP #$42, BEQ report
+        0xa9, 0x42, 0x8d, 0x00, 0x61,     # LDA #$42, STA $6100
+        0xa9, 0x81, 0x8d, 0x00, 0x60,     # LDA #$81, STA $6000
+        0x4c, 0x25, 0x80,                 # wait: JMP wait
+        0xa2, 0x00,                       # report: LDX #0
+        0xbd, 0x40, 0x80,                 # copy: LDA message,X
+        0x9d, 0x04, 0x60,                 # STA $6004,X
+        0xf0, 0x04, 0xe8,                 # BEQ done, INX
+        0x4c, 0x2a, 0x80,                 # JMP copy
+        0xa9, code, 0x8d, 0x00, 0x60,     # done: LDA #code, STA $6000
+        0x4c, 0x3b, 0x80                  # end: JMP end
+    ]
+
+    prg = bytearray(rom.PRG_BANK_SIZE)
+    prg[0:len(program)] = bytes(program)
+    prg[0x40:0x41 + len(message)] = message.encode("ascii") + b"\x00"
+    prg[0x3ffa:0x3ffe] = bytes([0x00, 0x80, 0x00, 0x80])
+
+    return rom.build_ines(prg, bytes(rom.CHR_BANK_SIZE))
+
+
+class ConformanceTest(unittest.TestCase):
+
+    def temporary(self, suffix):
+
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+
+        return path
+
+    def rom(self, image):
+
+        path = write_rom(image)
+        self.addCleanup(os.remove, path)
+
+        return path
+
+    def golden_log(self, path, cycles, log=None):
+        """Traces a ROM from power on into a log file"""
+
+        log = log or self.temporary(".log")
+        console = nes.create_nes()
+        console.load_rom(path)
+        console.cpu.enable_tracing(log)
+        console.run(cycles)
+        console.cpu.disable_tracing()
+
+        return log
+
+    def test_trace(self):
+
+        # the frame loop takes NMIs, so PPU timing shows in the trace too
+        path = self.rom(loop_image(FLAG_WAIT, 0x17))
+        log = self.golden_log(path, 100000)
+
+        with open(log) as golden:
+            lines = golden.read().splitlines()
+
+        result = conformance.run_test((0, conformance.Test(path, log)))
+        self.assertTrue(result["passed"])
+        self.assertEqual(result["lines"], len(lines))
+
+        # change A on line 1000 of the log
+        line = lines[999]
+        lines[999] = line.replace("A:%s" % line[50:52], "A:EE")
+
+        with open(log, "w") as golden:
+            golden.write("\n".join(lines) + "\n")
+
+        result = conformance.run_test((0, conformance.Test(path, log)))
+        divergence = result["divergence"]
+
+        self.assertFalse(result["passed"])
+        self.assertEqual(result["lines"], 999)
+        self.assertEqual(divergence.line, 1000)
+        self.assertEqual(divergence.expected, lines[999])
+        self.assertEqual(divergence.actual, line)
+        self.assertEqual(divergence.fields, [("A", "EE", line[50:52])])
+        self.assertEqual(divergence.before, lines[994:999])
+        self.assertEqual(divergence.after, lines[1000:1005])
+
+        report = conformance.describe(result)
+        self.assertIn("-    1000  " + lines[999], report)
+        self.assertIn("+    1000  " + line, report)
+
+    def test_status(self):
+
+        passed = conformance.Test(self.rom(status_image(0, "Passed")))
+        reset = conformance.Test(self.rom(status_image(0, "Passed", True)))
+        failed = conformance.Test(self.rom(status_image(3, "Failed #3")))
+
+        for test, expected in ((passed, True), (reset, True),
+                               (failed, False)):
+            result = conformance.run_test((0, test))
+
+            self.assertEqual(result["passed"], expected)
+            self.assertEqual(result["message"], test is failed and
+                             "Failed #3" or "Passed")
+
+        # a test that never finishes times out
+        result = conformance.run_test((0, reset._replace(frames=4)))
+        self.assertFalse(result["passed"])
+        self.assertTrue(result["message"].startswith("timed out"))
+
+    def test_suite(self):
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, directory)
+        paths = []
+
+        for name, image in (("trace", loop_image(FLAG_WAIT, 0x17)),
+                            ("status", status_image(0, "Passed"))):
+            path = os.path.join(directory, name + ".nes")
+            paths.append(path)
+
+            with open(path, "wb") as rom_file:
+                rom_file.write(image)
+
+            self.addCleanup(os.remove, path)
+
+        log = os.path.join(directory, "trace.log")
+        self.golden_log(paths[0], 20000, log)
+        self.addCleanup(os.remove, log)
+
+        # a ROM with a log of the same name is a trace test
+        tests = conformance.discover([directory])
+        self.assertEqual(tests, [conformance.Test(paths[1]),
+                                 conformance.Test(paths[0], log)])
+
+        # whatever a test raises fails it without stopping the others
+        broken = conformance.Test(paths[1], frames="60")
+
+        results = sorted(conformance.run_suite(tests + [broken], processes=2),
+                         key=lambda result: result["index"])
+
+        self.assertEqual([result["passed"] for result in results],
+                         [True, True, False])
+        self.assertTrue(results[2]["message"].startswith("Traceback"))
+        self.assertIn("TypeError", results[2]["message"])
+        self.assertIn("      TypeError",
+                      "\n".join(conformance.describe(results[2])))
+
+
+if __name__ == "__main__":
+    unittest.main()
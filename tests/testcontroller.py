@@ -0,0 +1,92 @@
+import constants as const
+import nes
+import os
+import unittest
+from testidleloop import loop_image
+from testrom import write_rom
+
+# Reads port 1 into $10 in the NMI handler, adding it up at $11 and
+# counting frames at $12
+CONTROLLER_READ = [
+    0xa9, 0x80, 0x8d, 0x00, 0x20,         # LDA #$80, STA $2000
+    0x4c, 0x05, 0x80,                     # loop: JMP loop
+    0xa9, 0x01, 0x8d, 0x16, 0x40,         # nmi: LDA #1, STA $4016
+    0xa9, 0x00, 0x8d, 0x16, 0x40,         # LDA #0, STA $4016
+    0xa2, 0x08,                           # LDX #8
+    0xad, 0x16, 0x40, 0x4a, 0x66, 0x10,   # read: LDA $4016, LSR A, ROR $10
+    0xca, 0xd0, 0xf7,                     # DEX, BNE read
+    0xa5, 0x10, 0x18, 0x65, 0x11,         # LDA $10, CLC, ADC $11
+    0x85, 0x11, 0xe6, 0x12,               # STA $11, INC $12
+    0x40                                  # RTI
+]
+
+
+def controller_image():
+    """An NROM image that reads the first controller every frame"""
+
+    return loop_image(CONTROLLER_READ, 0x08)
+
+
+class ControllerTest(unittest.TestCase):
+
+    def setUp(self):
+
+        path = write_rom(controller_image())
+        self.addCleanup(os.remove, path)
+
+        self.console = nes.create_nes()
+        self.console.load_rom(path)
+        self.memory = self.console.memory
+        self.controllers = self.console.controllers
+
+    def strobe(self):
+
+        self.memory.write(0x4016, 1)
+        self.memory.write(0x4016, 0)
+
+    def test_serial_reads(self):
+
+        self.controllers.set_buttons(0, const.BUTTON_A | const.BUTTON_START)
+        self.controllers.set_buttons(1, const.BUTTON_RIGHT)
+        self.strobe()
+
+        # A first, over open bus, then 1s once all eight are out
+        self.assertEqual([self.memory.read(0x4016) for index in range(9)],
+                         [0x41, 0x40, 0x40, 0x41, 0x40, 0x40, 0x40, 0x40,
+                          0x41])
+        self.assertEqual([self.memory.read(0x4017) & 1
+                          for index in range(8)], [0] * 7 + [1])
+
+        # while the strobe is held every read is A
+        self.memory.write(0x4016, 1)
+        self.assertEqual([self.memory.read(0x4016) for index in range(3)],
+                         [0x41] * 3)
+
+    def test_game_reads(self):
+
+        self.controllers.set_buttons(0, const.BUTTON_B | const.BUTTON_LEFT)
+
+        for frame in range(3):
+            self.console.run_frame()
+
+        self.assertEqual(self.memory.read(0x0010),
+                         const.BUTTON_B | const.BUTTON_LEFT)
+        self.assertEqual(self.memory.read(0x0011),
+                         self.memory.read(0x0012) * 0x42 & 0xff)
+
+    def test_savestate(self):
+
+        self.controllers.set_buttons(0, const.BUTTON_UP)
+        self.strobe()
+        self.memory.read(0x4016)
+        state = self.console.snapshot()
+
+        self.strobe()
+        self.console.restore(state)
+
+        self.assertEqual([self.memory.read(0x4016) & 1
+                          for index in range(4)], [0, 0, 0, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
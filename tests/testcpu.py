@@ -1,7 +1,16 @@
 import cpu as CPU
+from exceptions.cpuexceptions import InvalidOpcodeError
 import unittest
 
 
+def load_program(cpu, program, start=0x0200):
+    """Writes a program into RAM and points the PC at it"""
+    for offset, byte in enumerate(program):
+        cpu.memory.write(start + offset, byte)
+
+    cpu.pc = start
+
+
 class CpuTest(unittest.TestCase):
 
     def test_cpu_init(self):
@@ -27,6 +36,98 @@ class CpuTest(unittest.TestCase):
         # check the processor status
         self.assertEqual(cpu.p, 0b00110100)
 
-        
+    def test_dispatch_table(self):
+
+        cpu = CPU.create_cpu()
+
+        # every opcode has an entry, documented or not
+        self.assertEqual(len(cpu.dispatch), 256)
+
+    def test_step_immediate(self):
+
+        cpu = CPU.create_cpu()
+
+        # LDA #$80
+        load_program(cpu, [0xa9, 0x80])
+
+        self.assertEqual(cpu.step(), 2)
+        self.assertEqual(cpu.a, 0x80)
+        self.assertEqual(cpu.pc, 0x0202)
+        self.assertTrue(cpu.p & 0b10000000)
+
+    def test_step_page_cross_penalty(self):
+
+        cpu = CPU.create_cpu()
+        cpu.x = 0x01
+
+        # LDA $02ff,X crosses into page 3, STA $02ff,X never pays extra
+        load_program(cpu, [0xbd, 0xff, 0x02, 0x9d, 0xff, 0x02])
+
+        self.assertEqual(cpu.step(), 5)
+        self.assertEqual(cpu.step(), 5)
+
+    def test_step_read_modify_write(self):
+
+        cpu = CPU.create_cpu()
+        cpu.memory.write(0x0010, 0x81)
+
+        # ASL $10 then ROL A
+        load_program(cpu, [0x06, 0x10, 0x2a])
+
+        self.assertEqual(cpu.step(), 5)
+        self.assertEqual(cpu.memory.read(0x0010), 0x02)
+        self.assertTrue(cpu.p & 0b00000001)
+
+        cpu.step()
+        self.assertEqual(cpu.a, 0x01)
+
+    def test_branch_cycles(self):
+
+        cpu = CPU.create_cpu()
+
+        # LDX #$03, DEX, BNE -3
+        load_program(cpu, [0xa2, 0x03, 0xca, 0xd0, 0xfd])
+
+        cpu.step()
+        cpu.step()
+        self.assertEqual(cpu.step(), 3)
+        self.assertEqual(cpu.pc, 0x0202)
+
+    def test_jsr_rts(self):
+
+        cpu = CPU.create_cpu()
+
+        # JSR $0210 ... RTS
+        load_program(cpu, [0x20, 0x10, 0x02])
+        cpu.memory.write(0x0210, 0x60)
+
+        self.assertEqual(cpu.step(), 6)
+        self.assertEqual(cpu.pc, 0x0210)
+
+        cpu.step()
+        self.assertEqual(cpu.pc, 0x0203)
+        self.assertEqual(cpu.sp, 0x00ff)
+
+    def test_run(self):
+
+        cpu = CPU.create_cpu()
+
+        # LDX #$00, INX, BNE -3
+        load_program(cpu, [0xa2, 0x00, 0xe8, 0xd0, 0xfd])
+
+        ran = cpu.run(100)
+
+        self.assertGreaterEqual(ran, 100)
+        self.assertEqual(cpu.cycles, ran)
+
+    def test_invalid_opcode(self):
+
+        cpu = CPU.create_cpu()
+        load_program(cpu, [0x02])
+
+        with self.assertRaises(InvalidOpcodeError):
+            cpu.step()
+
+
 if __name__ == 'main':
     unittest.main()
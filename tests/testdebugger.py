@@ -0,0 +1,144 @@
+import debugger
+import disassembler
+import nes
+import os
+import shutil
+import tempfile
+import unittest
+from testidleloop import FLAG_WAIT, loop_image
+from testrom import write_rom
+
+# Where FLAG_WAIT's INC $12 and NMI handler are
+INC_COUNTER = 0x8012
+NMI_HANDLER = 0x8017
+
+
+class DebuggerTest(unittest.TestCase):
+
+    def console(self):
+
+        path = write_rom(loop_image(FLAG_WAIT, NMI_HANDLER & 0xff))
+        self.addCleanup(os.remove, path)
+
+        console = nes.create_nes()
+        console.load_rom(path)
+
+        return console
+
+    def test_unarmed(self):
+
+        console = self.console()
+        cpu = console.cpu
+        read_pages = list(cpu.memory.read_pages)
+        write_pages = list(cpu.memory.write_pages)
+
+        # a debugger with nothing armed leaves the fast paths alone
+        cpu.enable_debugging()
+
+        self.assertEqual(cpu.runner, cpu.run_interpreted)
+        self.assertEqual(cpu.memory.read_pages, read_pages)
+        self.assertEqual(cpu.memory.write_pages, write_pages)
+
+        # and so does disarming what was armed
+        watchpoint = cpu.debugger.add_watchpoint(0x0300, 0x03ff,
+                                                 debugger.WATCH_ACCESS)
+        cpu.debugger.add_breakpoint(0x9000)
+
+        self.assertEqual(cpu.runner, cpu.debugger.run)
+        self.assertIsNone(cpu.memory.read_pages[0x03])
+        self.assertIsNone(cpu.memory.write_pages[0x03])
+        self.assertIs(cpu.memory.write_pages[0x04], write_pages[0x04])
+
+        cpu.debugger.remove_watchpoint(watchpoint)
+        cpu.debugger.remove_breakpoint(0x9000)
+
+        self.assertEqual(cpu.runner, cpu.run_interpreted)
+        self.assertEqual(cpu.memory.read_pages, read_pages)
+        self.assertEqual(cpu.memory.write_pages, write_pages)
+
+    def test_breakpoint(self):
+
+        console = self.console()
+        cpu = console.cpu
+        cpu.enable_debugging().add_breakpoint(NMI_HANDLER)
+
+        console.run(40000)
+        hit = cpu.debugger.hit
+
+        self.assertTrue(cpu.stopped)
+        self.assertEqual((hit.kind, hit.address, cpu.pc),
+                         (debugger.HIT_BREAKPOINT, NMI_HANDLER, NMI_HANDLER))
+        self.assertEqual(hit.cycles, cpu.cycles)
+
+        # stopped, nothing runs
+        self.assertEqual(console.run(1000), 0)
+
+        # resuming runs past the breakpoint to the next NMI, a frame later
+        cpu.debugger.resume()
+        console.run(40000)
+        second = cpu.debugger.hit
+
+        self.assertEqual(second.address, NMI_HANDLER)
+        self.assertAlmostEqual(second.cycles - hit.cycles, 29781, delta=8)
+
+    def test_watchpoint(self):
+
+        console = self.console()
+        cpu = console.cpu
+        cpu.enable_debugging().add_watchpoint(0x12)
+
+        console.run(100000)
+        hit = cpu.debugger.hit
+
+        # the STA $11 next to it doesn't count, the INC does, and the CPU
+        # stops once it is done
+        self.assertEqual((hit.kind, hit.address, hit.value, hit.pc),
+                         (debugger.HIT_WRITE, 0x12, 0x01, INC_COUNTER))
+        self.assertEqual(cpu.pc, INC_COUNTER + 2)
+        self.assertEqual(cpu.memory.read(0x12), 0x01)
+
+        cpu.disable_debugging()
+
+        self.assertFalse(cpu.stopped)
+        self.assertEqual(cpu.runner, cpu.run_interpreted)
+
+    def test_listing(self):
+
+        console = self.console()
+        cpu = console.cpu
+        cache = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache)
+
+        # RAM isn't in the map, so it is decoded from the bus either way
+        cpu.memory.write(0x0300, 0xe8)
+        expected = disassembler.disassemble_memory(cpu.memory, 0x8000, 10)
+        code_map = disassembler.create_code_map(cpu, cache)
+        debugging = cpu.enable_debugging()
+
+        self.assertEqual(debugging.listing(0x8000, 10), expected)
+
+        debugging.use_code_map(code_map)
+
+        self.assertEqual(debugging.listing(0x8000, 10), expected)
+        self.assertEqual(len(code_map.instructions), 10)
+        self.assertEqual(debugging.listing(0x0300, 1),
+                         [(0x0300, b"\xe8", "INX")])
+
+    def test_exact(self):
+
+        # armed but never hit, the console runs exactly as it would without
+        plain = self.console()
+        debugged = self.console()
+        debugged.cpu.enable_debugging().add_watchpoint(0x0300, 0x03ff,
+                                                       debugger.WATCH_ACCESS)
+        debugged.cpu.debugger.add_breakpoint(0x9000)
+
+        for frame in range(3):
+            plain.run_frame()
+            debugged.run_frame()
+
+        self.assertEqual(plain.snapshot(), debugged.snapshot())
+
+
+if __name__ == "__main__":
+    unittest.main()
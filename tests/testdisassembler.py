@@ -0,0 +1,138 @@
+import cpu as CPU
+import disassembler
+import os
+import rom
+import shutil
+import tempfile
+import unittest
+from testrom import write_rom
+
+PROGRAM = [
+    0xa2, 0x00,                           # LDX #$00
+    0xbd, 0x20, 0x80,                     # loop: LDA $8020,X
+    0x9d, 0x00, 0x02,                     # STA $0200,X
+    0xe8, 0xe0, 0x04, 0xd0, 0xf5,         # INX, CPX #$04, BNE loop
+    0x20, 0x13, 0x80,                     # JSR sub
+    0x4c, 0x10, 0x80,                     # done: JMP done
+    0x60                                  # sub: RTS
+]
+
+
+def program_image():
+    """NROM with PROGRAM at 0x8000, a table at 0x8020 and an NMI handler
+       at 0x8030 that nothing jumps to"""
+
+    prg = bytearray(rom.PRG_BANK_SIZE)
+    prg[0:len(PROGRAM)] = bytes(PROGRAM)
+    prg[0x20:0x24] = b"\x01\x02\x03\x04"
+    prg[0x30] = 0x40
+    prg[0x3ffa:0x3ffe] = bytes([0x30, 0x80, 0x00, 0x80])
+
+    return rom.build_ines(prg)
+
+
+def banked_image():
+    """UxROM whose fixed bank switches bank 2 in and calls code there, which
+       reads a table. Every other bank is undocumented opcodes."""
+
+    prg = bytearray([0x02]) * (4 * rom.PRG_BANK_SIZE)
+
+    # LDA $8010, RTS, and the table
+    prg[0x8000:0x8004] = bytes([0xad, 0x10, 0x80, 0x60])
+    prg[0x8010] = 0x42
+
+    # LDA #$02, STA $8000, JSR $8000, done: JMP done
+    prg[0xc000:0xc00b] = bytes([0xa9, 0x02, 0x8d, 0x00, 0x80, 0x20, 0x00,
+                                0x80, 0x4c, 0x08, 0xc0])
+    prg[0xfffa:0x10000] = bytes([0x08, 0xc0, 0x00, 0xc0, 0x08, 0xc0])
+
+    return rom.build_ines(prg, mapper=2)
+
+
+class DisassemblerTest(unittest.TestCase):
+
+    def setUp(self):
+
+        path = write_rom(program_image())
+        self.addCleanup(os.remove, path)
+
+        self.cpu = CPU.create_cpu()
+        self.cpu.load_rom(path)
+
+        self.cache = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache)
+
+    def test_disassemble(self):
+
+        self.assertEqual(disassembler.disassemble(0x8000, 0xbd, 0x20, 0x80),
+                         "LDA $8020,X")
+        self.assertEqual(disassembler.disassemble(0x800b, 0xd0, 0xf5),
+                         "BNE $8002")
+        self.assertEqual(disassembler.disassemble(0x8000, 0x0a), "ASL A")
+        self.assertEqual(disassembler.disassemble(0x8000, 0x02), ".DB $02")
+
+    def test_code_map(self):
+
+        code_map = disassembler.create_code_map(self.cpu, self.cache)
+        kinds = code_map.kinds
+
+        self.assertFalse(code_map.cached)
+
+        # every instruction of the program, the subroutine and the NMI
+        # handler, and nothing after the JMP to itself
+        starts = [0x00, 0x02, 0x05, 0x08, 0x09, 0x0b, 0x0d, 0x10, 0x13, 0x30]
+        self.assertEqual([offset for offset in range(0x40)
+                          if kinds[offset] == disassembler.KIND_CODE], starts)
+        self.assertEqual(kinds[0x03], disassembler.KIND_OPERAND)
+        self.assertEqual(kinds[0x20], disassembler.KIND_DATA)
+        self.assertEqual(kinds[0x21], disassembler.KIND_UNKNOWN)
+
+        instruction = code_map.lookup(self.cpu, 0xc002)
+        self.assertEqual((instruction.address, instruction.text),
+                         (0x8002, "LDA $8020,X"))
+        self.assertIsNone(code_map.lookup(self.cpu, 0x8003))
+        self.assertIsNone(code_map.lookup(self.cpu, 0x0000))
+
+        self.assertEqual(code_map.banks()[0], (0, 21, 1))
+        self.assertIn("0000B  $800B  D0 F5     BNE $8002",
+                      code_map.listing(0))
+
+        # the second time round the map comes from the cache
+        cached = disassembler.create_code_map(self.cpu, self.cache)
+
+        self.assertTrue(cached.cached)
+        self.assertEqual(cached.kinds, kinds)
+        self.assertEqual(cached.addresses, code_map.addresses)
+
+    def test_switched_banks(self):
+
+        path = write_rom(banked_image())
+        self.addCleanup(os.remove, path)
+
+        cpu = CPU.create_cpu()
+        cpu.load_rom(path)
+        code_map = disassembler.create_code_map(cpu, self.cache)
+
+        # bank 2 isn't mapped yet, but the call into 0x8000 reaches it
+        self.assertEqual(code_map.kinds[0x8000], disassembler.KIND_CODE)
+        self.assertEqual(code_map.kinds[0x8003], disassembler.KIND_CODE)
+        self.assertEqual(code_map.kinds[0x8010], disassembler.KIND_DATA)
+        self.assertEqual(code_map.addresses[0x8003], 0x8003)
+        self.assertEqual(code_map.banks()[4], (4, 4, 1))
+        self.assertEqual(code_map.banks()[0], (0, 0, 0))
+
+        # the same map comes out whatever is mapped when it is built
+        cpu.memory.write(0x8000, 2)
+        self.assertEqual(code_map.lookup(cpu, 0x8003).text, "RTS")
+
+        cache = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache)
+        rebuilt = disassembler.create_code_map(cpu, cache)
+
+        self.assertFalse(rebuilt.cached)
+        self.assertEqual(rebuilt.kinds, code_map.kinds)
+        self.assertEqual(rebuilt.addresses, code_map.addresses)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+import nes
+import os
+import rom
+import unittest
+from testppu import ppu_image
+from testrom import write_rom
+
+# Waits for the NMI handler to bump a frame counter in RAM, counting frames
+# seen at $12, with rendering and NMI on
+FLAG_WAIT = [
+    0xa9, 0x80, 0x8d, 0x00, 0x20,         # LDA #$80, STA $2000
+    0xa9, 0x1e, 0x8d, 0x01, 0x20,         # LDA #$1e, STA $2001
+    0xa5, 0x10, 0xc5, 0x11, 0xf0, 0xfa,   # wait: LDA $10, CMP $11, BEQ wait
+    0x85, 0x11, 0xe6, 0x12,               # STA $11, INC $12
+    0x4c, 0x0a, 0x80,                     # JMP wait
+    0xe6, 0x10, 0x40                      # nmi: INC $10, RTI
+]
+
+# Polls $2002 for vblank with rendering on and NMI off, counting at $12
+VBLANK_POLL = [
+    0xa9, 0x1e, 0x8d, 0x01, 0x20,         # LDA #$1e, STA $2001
+    0x2c, 0x02, 0x20, 0x10, 0xfb,         # wait: BIT $2002, BPL wait
+    0xe6, 0x12, 0x4c, 0x05, 0x80,         # INC $12, JMP wait
+    0x40                                  # nmi: RTI
+]
+
+# Spins on a register nothing can vouch for
+CONTROLLER_POLL = [
+    0xad, 0x16, 0x40, 0xf0, 0xfb,         # wait: LDA $4016, BEQ wait
+    0x4c, 0x00, 0x80,                     # JMP $8000
+    0x40                                  # nmi: RTI
+]
+
+
+# Branches out of the body every iteration, to code too far away to be a
+# loop itself that writes RAM and jumps back to the branch closing the loop
+BRANCH_OUT = [
+    0xa9, 0x80, 0x8d, 0x00, 0x20,         # LDA #$80, STA $2000
+    0xa6, 0x10, 0xf0, 0x17,               # wait: LDX $10, BEQ out
+    0xf0, 0xfa,                           # tail: BEQ wait
+    0x40                                  # nmi: RTI
+] + [0xea] * 20 + [
+    0xe6, 0x11, 0xa6, 0x10,               # out: INC $11, LDX $10
+    0x4c, 0x09, 0x80                      # JMP tail
+]
+
+
+def loop_image(program, nmi):
+    """An NROM image running program at 0x8000, its NMI handler at nmi"""
+
+    prg = bytearray(rom.PRG_BANK_SIZE)
+    prg[0:len(program)] = bytes(program)
+    prg[0x3ffa:0x3ffe] = bytes([nmi, 0x80, 0x00, 0x80])
+
+    return rom.build_ines(prg, bytes(range(256)) * 32)
+
+
+class IdleLoopTest(unittest.TestCase):
+
+    def console(self, image, skipping):
+
+        path = write_rom(image)
+        self.addCleanup(os.remove, path)
+
+        console = nes.create_nes()
+        console.load_rom(path)
+
+        if skipping:
+            console.enable_idle_skipping()
+
+        return console
+
+    def check_exact(self, image, frames=4):
+        """Runs the image with and without skipping, which must end up in
+           exactly the same state, returning the skipper"""
+
+        plain = self.console(image, False)
+        skipped = self.console(image, True)
+
+        for frame in range(frames):
+            plain.run_frame()
+            skipped.run_frame()
+
+            self.assertEqual(plain.cpu.cycles, skipped.cpu.cycles)
+            self.assertEqual(plain.snapshot(), skipped.snapshot())
+
+        return skipped.cpu.idle_loops
+
+    def test_jump_to_self(self):
+
+        image = ppu_image()
+        idle_loops = self.check_exact(image)
+
+        # nearly every cycle of the frame was skipped
+        self.assertGreater(idle_loops.skipped_cycles, 3 * 29000)
+
+    def test_ram_flag(self):
+
+        idle_loops = self.check_exact(loop_image(FLAG_WAIT, 0x17))
+
+        self.assertGreater(idle_loops.skipped_cycles, 3 * 29000)
+
+    def test_vblank_poll(self):
+
+        idle_loops = self.check_exact(loop_image(VBLANK_POLL, 0x0f))
+
+        self.assertGreater(idle_loops.skips, 0)
+
+    def test_unknown_register(self):
+
+        idle_loops = self.check_exact(loop_image(CONTROLLER_POLL, 0x08), 1)
+
+        self.assertEqual(idle_loops.skips, 0)
+
+    def test_branch_out(self):
+
+        idle_loops = self.check_exact(loop_image(BRANCH_OUT, 0x0b), 2)
+
+        self.assertEqual(idle_loops.skips, 0)
+
+    def test_block_cache(self):
+
+        console = self.console(loop_image(FLAG_WAIT, 0x17), True)
+        console.cpu.enable_block_cache()
+        plain = self.console(loop_image(FLAG_WAIT, 0x17), False)
+
+        for frame in range(3):
+            console.run_frame()
+            plain.run_frame()
+
+        self.assertEqual(console.snapshot(), plain.snapshot())
+        self.assertGreater(console.cpu.idle_loops.skipped_cycles, 2 * 29000)
+
+        console.disable_idle_skipping()
+        self.assertIsNone(console.cpu.idle_loops)
+
+
+if __name__ == "__main__":
+    unittest.main()
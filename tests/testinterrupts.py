@@ -0,0 +1,131 @@
+import constants
+import nes
+import rom
+import unittest
+from testcpu import load_program
+from testrom import write_rom
+import os
+
+
+def mmc3_image():
+    """An MMC3 image that enables IRQs and loops. Its IRQ handler counts
+       interrupts at $11 and acknowledges them."""
+    prg = bytearray(2 * rom.PRG_BANK_SIZE)
+
+    # reset: LDA #$40, STA $4017 (no frame counter IRQ), CLI,
+    # loop: JMP loop
+    prg[0x6000:0x6009] = bytes([0xa9, 0x40, 0x8d, 0x17, 0x40, 0x58,
+                                0x4c, 0x06, 0xe0])
+
+    # irq: INC $11, STA $E000, RTI
+    prg[0x6010:0x6016] = bytes([0xe6, 0x11, 0x8d, 0x00, 0xe0, 0x40])
+
+    prg[0x7ffa:0x8000] = bytes([0x00, 0xe0, 0x00, 0xe0, 0x10, 0xe0])
+
+    return rom.build_ines(prg, bytes(rom.CHR_BANK_SIZE), mapper=4)
+
+
+class InterruptTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.console = nes.create_nes()
+        self.interrupts = self.console.scheduler.interrupts
+
+        # loop: JMP loop
+        load_program(self.console.cpu, [0x4c, 0x00, 0x02])
+
+    def test_event_breaks_run(self):
+
+        cpu = self.console.cpu
+        fired = []
+
+        self.interrupts.schedule(100, lambda: fired.append(cpu.cycles))
+        cancelled = self.interrupts.schedule(50, lambda: fired.append(0))
+        self.interrupts.cancel(cancelled)
+
+        self.console.run(200)
+
+        # JMP is 3 cycles, so the CPU stops within one instruction of it
+        self.assertEqual(len(fired), 1)
+        self.assertGreaterEqual(fired[0], 100)
+        self.assertLess(fired[0], 103)
+
+    def test_nmi(self):
+
+        cpu = self.console.cpu
+        cpu.memory.write(0xfffa, 0x00)
+        cpu.memory.write(0xfffb, 0x03)
+
+        self.interrupts.schedule(30, self.interrupts.request_nmi)
+        self.console.run(31)
+
+        self.assertEqual(cpu.pc, 0x0300)
+        self.assertTrue(cpu.p & constants.FLAG_INTERRUPT)
+
+        # the return address and status, without the break bit
+        self.assertFalse(cpu.memory.read(0x0100 | cpu.sp + 1) &
+                         constants.FLAG_BREAK)
+        self.assertEqual(cpu.memory.read(0x0100 | cpu.sp + 2), 0x00)
+        self.assertEqual(cpu.memory.read(0x0100 | cpu.sp + 3), 0x02)
+
+    def test_masked_irq(self):
+
+        cpu = self.console.cpu
+        cpu.memory.write(0xfffe, 0x00)
+        cpu.memory.write(0xffff, 0x03)
+
+        # SEI, NOP x 4, CLI, loop: JMP loop
+        load_program(cpu, [0x78, 0xea, 0xea, 0xea, 0xea, 0x58,
+                           0x4c, 0x06, 0x02])
+        self.interrupts.schedule(
+            4, lambda: self.interrupts.assert_irq(constants.IRQ_MAPPER))
+
+        self.console.run(8)
+        self.assertNotEqual(cpu.pc, 0x0300)
+
+        # taken as soon as CLI clears the mask
+        self.console.run(20)
+        self.assertEqual(cpu.pc, 0x0300)
+
+    def test_reset(self):
+
+        cpu = self.console.cpu
+        cpu.memory.write(0xfffc, 0x00)
+        cpu.memory.write(0xfffd, 0x04)
+
+        self.console.reset()
+        self.console.run(1)
+
+        self.assertEqual(cpu.pc, 0x0400)
+        self.assertEqual(cpu.sp, 0xfc)
+
+    def test_mapper_irq(self):
+
+        path = write_rom(mmc3_image())
+        self.addCleanup(os.remove, path)
+
+        console = self.console
+        console.load_rom(path)
+        memory = console.memory
+
+        # rendering on, IRQ after the 10th scanline past the reload
+        memory.write(0x2001, constants.MASK_BACKGROUND)
+        memory.write(0xc000, 10)
+        memory.write(0xc001, 0)
+        memory.write(0xe001, 0)
+
+        # reloads on line 0, then fires at dot 260 of line 10
+        console.run((10 * 341 + 260) // 3 - 10 - console.cpu.cycles)
+        self.assertEqual(memory.read(0x0011), 0)
+
+        console.run(30)
+        self.assertEqual(memory.read(0x0011), 1)
+
+        # acknowledged and disabled by the handler, so it fires once
+        console.run(29780)
+        self.assertEqual(memory.read(0x0011), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+import constants
+import mappers
+import memory as mem
+import rom
+import unittest
+from exceptions.romexceptions import UnsupportedMapperError
+from testrom import write_rom
+import os
+
+
+def banked_image(mapper, prg_banks, chr_banks=0):
+    """An image where every byte of each 8KB PRG and 1KB CHR bank holds
+       that bank's number"""
+    prg = b"".join(bytes([bank]) * 0x2000 for bank in range(prg_banks * 2))
+    chr_rom = b"".join(bytes([bank]) * 0x400 for bank in range(chr_banks * 8))
+
+    return rom.build_ines(prg, chr_rom, mapper=mapper)
+
+
+class MapperTest(unittest.TestCase):
+
+    def load(self, mapper, prg_banks, chr_banks=0):
+
+        path = write_rom(banked_image(mapper, prg_banks, chr_banks))
+        self.addCleanup(os.remove, path)
+
+        memory = mem.initialize_memory(constants.TYPE_CPU)
+
+        return mappers.create_mapper(rom.load_rom(path), memory), memory
+
+    def test_nrom_mirrors_16k(self):
+
+        mapper, memory = self.load(0, 1, 1)
+
+        self.assertIsInstance(mapper, mappers.NROM)
+        self.assertEqual(memory.read(0x8000), 0)
+        self.assertEqual(memory.read(0xe000), 1)
+        self.assertIs(memory.read_pages[0x80], memory.read_pages[0xc0])
+
+    def test_uxrom_switch(self):
+
+        mapper, memory = self.load(2, 8)
+
+        # last 16KB bank (8KB banks 14 and 15) is fixed at 0xc000
+        self.assertEqual(memory.read(0xc000), 14)
+
+        memory.write(0x8000, 3)
+
+        self.assertEqual(memory.read(0x8000), 6)
+        self.assertEqual(memory.read(0xa000), 7)
+        self.assertEqual(memory.read(0xe000), 15)
+
+        # CHR-RAM is writable
+        mapper.write_chr(0x0010, 0x42)
+        self.assertEqual(mapper.read_chr(0x0010), 0x42)
+
+    def test_cnrom_switch(self):
+
+        mapper, memory = self.load(3, 2, 4)
+
+        memory.write(0x8000, 2)
+
+        self.assertEqual(mapper.read_chr(0x0000), 16)
+        self.assertEqual(mapper.chr_offsets[0], 0x4000)
+
+    def test_mmc1_serial_writes(self):
+
+        mapper, memory = self.load(1, 8, 2)
+
+        def load_register(loc, value):
+            for bit in range(5):
+                memory.write(loc, value >> bit & 1)
+
+        # PRG bank 5 at 0x8000, last bank fixed at 0xc000
+        load_register(0xe000, 5)
+
+        self.assertEqual(memory.read(0x8000), 10)
+        self.assertEqual(memory.read(0xc000), 14)
+
+        # vertical mirroring, 4KB CHR banks, PRG mode 3
+        load_register(0x8000, 0b11110)
+        load_register(0xc000, 3)
+
+        self.assertEqual(mapper.mirroring, constants.MIRROR_VERTICAL)
+        self.assertEqual(mapper.read_chr(0x1000), 12)
+
+    def test_mmc3_banks(self):
+
+        mapper, memory = self.load(4, 8, 8)
+
+        # R6 = 3, R7 = 4
+        memory.write(0x8000, 6)
+        memory.write(0x8001, 3)
+        memory.write(0x8000, 7)
+        memory.write(0x8001, 4)
+
+        self.assertEqual(memory.read(0x8000), 3)
+        self.assertEqual(memory.read(0xa000), 4)
+        self.assertEqual(memory.read(0xc000), 14)
+        self.assertEqual(memory.read(0xe000), 15)
+
+        # swapping PRG mode moves R6 up to 0xc000
+        memory.write(0x8000, 0x46)
+        self.assertEqual(memory.read(0x8000), 14)
+        self.assertEqual(memory.read(0xc000), 3)
+
+    def test_mmc3_irq(self):
+
+        mapper, memory = self.load(4, 2, 1)
+
+        memory.write(0xc000, 2)
+        memory.write(0xc001, 0)
+        memory.write(0xe001, 0)
+
+        mapper.clock_scanline()
+        mapper.clock_scanline()
+        self.assertFalse(mapper.irq_pending)
+
+        mapper.clock_scanline()
+        self.assertTrue(mapper.irq_pending)
+
+        memory.write(0xe000, 0)
+        self.assertFalse(mapper.irq_pending)
+
+    def test_unsupported_mapper(self):
+
+        with self.assertRaises(UnsupportedMapperError):
+            self.load(99, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -27,6 +27,105 @@ class MemoryTest(unittest.TestCase):
 
         self.assertEqual(memory.read(0x0000), 0)
 
+    def test_ram_mirrors(self):
+
+        memory = mem.initialize_memory(constants.TYPE_CPU)
+
+        memory.write(0x0012, 0x34)
+
+        # RAM is visible at each of its three mirrors
+        for mirror in (0x0812, 0x1012, 0x1812):
+            self.assertEqual(memory.read(mirror), 0x34)
+
+        # and writing through a mirror lands in the same byte
+        memory.write(0x1812, 0x56)
+        self.assertEqual(memory.read(0x0012), 0x56)
+
+    def test_io_register_mirrors(self):
+
+        memory = mem.initialize_memory(constants.TYPE_CPU)
+
+        memory.write(0x3ffe, 0x12)
+
+        self.assertEqual(memory.read(0x2006), 0x12)
+        self.assertEqual(memory.read(0x2106), 0x12)
+
+    def test_delete(self):
+
+        memory = mem.initialize_memory(constants.TYPE_CPU)
+
+        memory.write(0x0800, 0xff)
+        memory.delete(0x0000)
+
+        self.assertEqual(memory.read(0x0800), 0)
+
+    def test_page_table(self):
+
+        memory = mem.initialize_memory(constants.TYPE_CPU)
+
+        # mirrored RAM pages share one buffer slice
+        self.assertIs(memory.read_pages[0x00], memory.read_pages[0x18])
+
+        # register pages always go through a handler
+        self.assertIsNone(memory.read_pages[0x20])
+        self.assertIsNone(memory.write_pages[0x40])
+
+    def test_register_callbacks(self):
+
+        memory = mem.initialize_memory(constants.TYPE_CPU)
+        writes = []
+
+        memory.map_register(0x2002, read=lambda loc: 0x80)
+        memory.map_register(0x4016, write=lambda loc, data:
+                            writes.append((loc, data)))
+
+        # a mirrored register address reaches the same callback
+        self.assertEqual(memory.read(0x3ffa), 0x80)
+
+        memory.write(0x4016, 0x01)
+        self.assertEqual(writes, [(0x4016, 0x01)])
+
+    def test_read_only_buffer(self):
+
+        memory = mem.initialize_memory(constants.TYPE_CPU)
+        rom = bytearray(range(256)) * 0x40
+
+        memory.map_buffer(0x8000, 0xffff, memoryview(rom), writable=False)
+
+        # 16KB of ROM is mirrored into both halves of PRG-ROM space
+        self.assertEqual(memory.read(0x8001), 0x01)
+        self.assertEqual(memory.read(0xc0ff), 0xff)
+
+        memory.write(0x8001, 0x55)
+        self.assertEqual(memory.read(0x8001), 0x01)
+
+    def test_dirty_pages(self):
+
+        memory = mem.initialize_memory(constants.TYPE_CPU)
+        write_page = memory.write_pages[0x03]
+
+        memory.enable_dirty_tracking()
+        memory.write(0x0b01, 0x01)
+        memory.write(0x6000, 0x02)
+
+        # a write through a mirror dirties every mirror of the page
+        self.assertEqual(memory.dirty_pages(),
+                         [0x03, 0x0b, 0x13, 0x1b, 0x60])
+
+        # and dirty pages are back on the fast path
+        self.assertIs(memory.write_pages[0x03], write_page)
+        self.assertEqual(memory.read(0x0301), 0x01)
+
+        memory.clear_dirty()
+        self.assertEqual(memory.dirty_pages(), [])
+
+        memory.map_buffer(0x8000, 0x80ff, memoryview(bytearray(0x100)))
+        self.assertEqual(memory.dirty_pages(), [0x80])
+
+        memory.disable_dirty_tracking()
+        self.assertIsNone(memory.dirty)
+        self.assertEqual(memory.write_hooks, {})
+
     def test_mem_read_out_of_bounds(self):
 
         memory = mem.initialize_memory(constants.TYPE_CPU)
@@ -0,0 +1,111 @@
+import constants as const
+import movie
+import nes
+import os
+import tempfile
+import unittest
+from exceptions.movieexceptions import MovieError
+from testcontroller import controller_image
+from testrom import write_rom
+
+FM2 = """version 3
+emuVersion 22020
+comment first
+comment second
+port0 1
+port1 1
+port2 0
+|0|........|........||
+|0|R......A|.......A||
+|1|.L..T...|........||
+"""
+
+
+def record_movie(path, frames):
+    """Records a movie of the controller test ROM with the buttons changing
+       every frame and one reset, returning it and a state hash per frame"""
+
+    console = nes.create_nes()
+    console.load_rom(path)
+    recording = movie.create_movie(console.cpu.rom)
+    hashes = []
+
+    console.controllers.record(recording)
+
+    for frame in range(frames):
+        console.controllers.set_buttons(0, frame * 37 & 0xff)
+
+        if frame == frames // 2:
+            console.reset()
+
+        console.run_frame()
+        hashes.append((frame + 1, console.state_hash()))
+
+    return console.controllers.stop(), hashes
+
+
+class MovieTest(unittest.TestCase):
+
+    def test_parse(self):
+
+        parsed = movie.parse_fm2(FM2.splitlines())
+
+        self.assertEqual(len(parsed), 3)
+        self.assertEqual(list(parsed.inputs[0]),
+                         [0, const.BUTTON_RIGHT | const.BUTTON_A,
+                          const.BUTTON_LEFT | const.BUTTON_START])
+        self.assertEqual(list(parsed.inputs[1]), [0, const.BUTTON_A, 0])
+        self.assertEqual(list(parsed.commands), [0, 0, const.COMMAND_RESET])
+        self.assertEqual(parsed.get("comment"), "first")
+        self.assertEqual(list(parsed.lines())[9], "|1|.L..T...|........||")
+
+    def test_unsupported(self):
+
+        for change in ("port0 1\n", "port0 2\n"), ("|1|", "|2|"), \
+                ("version 3\n", "binary 1\n"), ("R......A", "R......"):
+            with self.assertRaises(MovieError):
+                movie.parse_fm2(FM2.replace(*change).splitlines())
+
+    def test_record_replay(self):
+
+        path = write_rom(controller_image())
+        self.addCleanup(os.remove, path)
+
+        recording, hashes = record_movie(path, 12)
+        self.assertEqual(len(recording), 12)
+        self.assertEqual(recording.commands[6], const.COMMAND_RESET)
+
+        # through a file and back
+        handle, movie_path = tempfile.mkstemp(suffix=".fm2")
+        os.close(handle)
+        self.addCleanup(os.remove, movie_path)
+        recording.save(movie_path)
+        loaded = movie.load_movie(movie_path)
+
+        for hash_every in (1, 5):
+            console = nes.create_nes()
+            console.load_rom(path)
+            loaded.check_rom(console.cpu.rom)
+
+            # drawing no frames doesn't change a thing
+            console.ppu.set_render_interval(0)
+
+            self.assertEqual(movie.replay(console, loaded, hash_every),
+                             hashes[hash_every - 1::hash_every])
+
+    def test_wrong_rom(self):
+
+        path = write_rom(controller_image() + b"\x00" * 16)
+        self.addCleanup(os.remove, path)
+
+        console = nes.create_nes()
+        console.load_rom(path)
+        parsed = movie.parse_fm2(FM2.splitlines())
+        parsed.set("romChecksum", "base64:AAAAAAAAAAAAAAAAAAAAAA==")
+
+        with self.assertRaises(MovieError):
+            parsed.check_rom(console.cpu.rom)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+import nes
+import numpy as np
+import os
+import output
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+import wave
+import zlib
+from testidleloop import VBLANK_POLL, loop_image
+from testrom import write_rom
+
+
+def decode_png(data):
+    """The pixels of a PNG written by encode_png()"""
+
+    width, height = int.from_bytes(data[16:20], "big"), \
+        int.from_bytes(data[20:24], "big")
+    length = int.from_bytes(data[33:37], "big")
+    rows = np.frombuffer(zlib.decompress(data[41:41 + length]),
+                         dtype=np.uint8).reshape(height, width * 3 + 1)
+
+    return rows[:, 1:].reshape(height, width, 3)
+
+
+class SlowSink(output.Sink):
+    """Holds up every frame until released"""
+
+    def __init__(self):
+        self.go = threading.Event()
+        self.frames = []
+
+    def write_frame(self, index, rgb):
+        self.go.wait()
+        self.frames.append(index)
+
+
+class OutputTest(unittest.TestCase):
+
+    def setUp(self):
+
+        path = write_rom(loop_image(VBLANK_POLL, 0x0f))
+        self.addCleanup(os.remove, path)
+
+        self.console = nes.create_nes()
+        self.console.load_rom(path)
+
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_sinks(self):
+
+        raw = os.path.join(self.directory, "video.rgb")
+        wav = os.path.join(self.directory, "audio.wav")
+        pngs = os.path.join(self.directory, "frames")
+        pipeline = output.OutputPipeline([
+            output.RawSink(raw), output.PngSink(pngs), output.WavSink(wav)])
+
+        stats = output.record(self.console, pipeline, 5)
+        last = self.console.frame_rgb()
+
+        self.assertEqual((stats["frames"], stats["dropped"]), (5, 0))
+        self.assertGreater(stats["audio_blocks"], 0)
+
+        # five raw frames, the last of them the console's last frame
+        with open(raw, "rb") as video:
+            frames = np.frombuffer(video.read(), dtype=np.uint8)
+
+        frames = frames.reshape(5, 240, 256, 3)
+        self.assertTrue((frames[4] == last).all())
+
+        # the same frame as a PNG
+        self.assertEqual(sorted(os.listdir(pngs)),
+                         ["%06d.png" % index for index in range(5)])
+
+        with open(os.path.join(pngs, "000004.png"), "rb") as image:
+            self.assertTrue((decode_png(image.read()) == last).all())
+
+        # every block of sound, the last of them partly filled
+        with wave.open(wav) as audio:
+            samples = audio.getnframes()
+
+        self.assertGreater(samples, (stats["audio_blocks"] - 1) * 1024)
+        self.assertLessEqual(samples, stats["audio_blocks"] * 1024)
+
+    def test_pipe(self):
+
+        # a stand-in encoder that copies its input to a file
+        path = os.path.join(self.directory, "piped.rgb")
+        command = [sys.executable, "-c",
+                   "import shutil, sys; shutil.copyfileobj(sys.stdin.buffer, "
+                   "open(sys.argv[1], 'wb'))", path]
+        pipeline = output.OutputPipeline([output.PipeSink(command)])
+
+        output.record(self.console, pipeline, 3, audio=False)
+
+        self.assertEqual(os.path.getsize(path), 3 * 240 * 256 * 3)
+
+    def test_back_pressure(self):
+
+        # with every buffer held by a slow sink, the next frame waits
+        sink = SlowSink()
+        pipeline = output.OutputPipeline([sink], buffers=2)
+        pixels = self.console.ppu.frame_buffer
+
+        for frame in range(2):
+            pipeline.submit_frame(pixels)
+
+        self.assertEqual(pipeline.late, 0)
+
+        threading.Timer(0.05, sink.go.set).start()
+        pipeline.submit_frame(pixels)
+        pipeline.close()
+
+        self.assertEqual(pipeline.late, 1)
+        self.assertEqual(sink.frames, [0, 1, 2])
+
+    def test_drop(self):
+
+        # or, when dropping, it is skipped
+        sink = SlowSink()
+        pipeline = output.OutputPipeline([sink], buffers=2, drop=True)
+        pixels = self.console.ppu.frame_buffer
+
+        results = [pipeline.submit_frame(pixels) for frame in range(4)]
+        sink.go.set()
+        pipeline.close()
+
+        self.assertEqual(results, [True, True, False, False])
+        self.assertEqual(pipeline.dropped, 2)
+        self.assertEqual(sink.frames, [0, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
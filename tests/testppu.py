@@ -0,0 +1,211 @@
+import constants
+import nes
+import rom
+import unittest
+from testrom import write_rom
+import os
+
+
+def ppu_image():
+    """An NROM image that loops forever at 0x8000 and counts NMIs at $10.
+       Tile 1 of the CHR is solid color 3."""
+    prg = bytearray(rom.PRG_BANK_SIZE)
+
+    # reset: JMP $8000
+    prg[0x0000:0x0003] = bytes([0x4c, 0x00, 0x80])
+
+    # nmi: INC $10, RTI
+    prg[0x0010:0x0013] = bytes([0xe6, 0x10, 0x40])
+
+    prg[0x3ffa:0x3ffe] = bytes([0x10, 0x80, 0x00, 0x80])
+
+    chr_rom = bytearray(rom.CHR_BANK_SIZE)
+    chr_rom[0x0010:0x0020] = b"\xff" * 16
+
+    return rom.build_ines(prg, chr_rom)
+
+
+class PpuTest(unittest.TestCase):
+
+    def setUp(self):
+
+        path = write_rom(ppu_image())
+        self.addCleanup(os.remove, path)
+
+        self.console = nes.create_nes()
+        self.console.load_rom(path)
+        self.ppu = self.console.ppu
+        self.memory = self.console.memory
+
+    def set_address(self, address):
+
+        self.memory.write(0x2006, address >> 8)
+        self.memory.write(0x2006, address & 0xff)
+
+    def fill_background(self, tile, color):
+
+        # every nametable tile, then the backdrop and background color 3
+        self.set_address(0x2000)
+
+        for index in range(960):
+            self.memory.write(0x2007, tile)
+
+        self.set_address(0x3f00)
+
+        for data in (0x0f, 0x00, 0x00, color):
+            self.memory.write(0x2007, data)
+
+        # scroll back to the top left, which takes effect next frame
+        self.memory.write(0x2000, 0x00)
+        self.memory.write(0x2005, 0x00)
+        self.memory.write(0x2005, 0x00)
+
+    def test_vblank_flag(self):
+
+        console = self.console
+
+        # vblank starts at dot 1 of line 241
+        console.run(241 * 341 // 3 - 20)
+        self.assertFalse(self.memory.read(0x2002) & constants.STATUS_VBLANK)
+
+        console.run(40)
+        self.assertTrue(self.memory.read(0x2002) & constants.STATUS_VBLANK)
+
+        # reading the status clears it
+        self.assertFalse(self.memory.read(0x2002) & constants.STATUS_VBLANK)
+
+    def test_nmi(self):
+
+        self.memory.write(0x2000, constants.CTRL_NMI)
+
+        for frame in range(3):
+            self.console.run_frame()
+
+        self.console.run(100)
+        self.assertEqual(self.memory.read(0x0010), 3)
+
+    def test_vram_access(self):
+
+        self.set_address(0x2005)
+        self.memory.write(0x2007, 0x55)
+
+        # reads are buffered, so the first one is stale
+        self.set_address(0x2005)
+        self.memory.read(0x2007)
+        self.assertEqual(self.memory.read(0x2007), 0x55)
+
+        # horizontal mirroring puts 0x2400 on top of 0x2000
+        self.set_address(0x2405)
+        self.memory.read(0x2007)
+        self.assertEqual(self.memory.read(0x2007), 0x55)
+
+        # sprite backdrop entries mirror the background ones
+        self.set_address(0x3f10)
+        self.memory.write(0x2007, 0x21)
+        self.set_address(0x3f00)
+        self.assertEqual(self.memory.read(0x2007), 0x21)
+
+    def test_render_background(self):
+
+        self.fill_background(1, 0x16)
+        self.memory.write(0x2001, constants.MASK_BACKGROUND |
+                          constants.MASK_BACKGROUND_LEFT)
+
+        self.console.run_frame()
+        frame = self.console.run_frame()
+
+        self.assertTrue((frame == 0x16).all())
+        self.assertEqual(tuple(self.console.frame_rgb()[0, 0]),
+                         (152, 34, 32))
+
+    def test_sprite_zero_hit(self):
+
+        self.fill_background(1, 0x16)
+
+        # sprite 0 at (100, 50) using the solid tile, the rest off screen
+        self.memory.write(0x2003, 0x00)
+
+        for data in [49, 1, 0, 100] + [0xff] * 252:
+            self.memory.write(0x2004, data)
+
+        self.memory.write(0x2001, constants.MASK_BACKGROUND |
+                          constants.MASK_SPRITES)
+        self.console.run_frame()
+        self.console.run_frame()
+
+        self.assertTrue(self.ppu.status & constants.STATUS_SPRITE_ZERO)
+        self.assertFalse(self.ppu.status & constants.STATUS_OVERFLOW)
+
+    def test_render_skip(self):
+
+        # the same scene on a console that draws every frame
+        path = write_rom(ppu_image())
+        self.addCleanup(os.remove, path)
+
+        drawn = nes.create_nes()
+        drawn.load_rom(path)
+
+        for memory in (drawn.memory, self.console.memory):
+            self.memory = memory
+            self.fill_background(1, 0x16)
+
+        consoles = (self.console, drawn)
+
+        # sprite 0 at (100, 50) and eight more on its lines, for overflow
+        for console in consoles:
+            console.memory.write(0x2003, 0x00)
+
+            for data in [49, 1, 0, 100] + [49, 1, 0, 20] * 8 + \
+                    [0xff] * 220:
+                console.memory.write(0x2004, data)
+
+            console.memory.write(0x2001, constants.MASK_BACKGROUND |
+                                 constants.MASK_SPRITES)
+
+        self.ppu.set_render_interval(0)
+
+        # $2002 reads the same all through a frame, though nothing is drawn
+        seen = 0
+
+        for step in [1000] * 90:
+            statuses = []
+
+            for console in consoles:
+                console.run(step)
+                statuses.append(console.memory.read(0x2002))
+
+            self.assertEqual(statuses[0], statuses[1])
+            seen |= statuses[0]
+
+        self.assertTrue(seen & constants.STATUS_SPRITE_ZERO)
+        self.assertTrue(seen & constants.STATUS_OVERFLOW)
+
+        # the power on frame had already started, but no later one is drawn
+        self.assertFalse(self.ppu.frame_rendered)
+        self.ppu.frame_buffer[:] = 0xff
+        self.console.run_frame()
+        drawn.run_frame()
+        self.assertTrue((self.ppu.frame_buffer == 0xff).all())
+
+        self.ppu.request_render()
+
+        for console in consoles:
+            console.run_frame()
+
+        self.assertTrue(self.ppu.frame_rendered)
+        self.assertTrue((self.ppu.frame_buffer == drawn.ppu.frame_buffer)
+                        .all())
+
+        # every third frame
+        self.ppu.set_render_interval(3)
+        rendered = []
+
+        for frame in range(6):
+            self.console.run_frame()
+            rendered.append(self.ppu.frame_rendered)
+
+        self.assertEqual(rendered.count(True), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
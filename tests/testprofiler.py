@@ -0,0 +1,55 @@
+import nes
+import os
+import rom
+import unittest
+from testbatchcpu import program_prg
+from testrom import write_rom
+
+
+class ProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+
+        path = write_rom(rom.build_ines(program_prg()))
+        self.addCleanup(os.remove, path)
+
+        self.console = nes.create_nes()
+        self.console.load_rom(path)
+        self.console.memory.write(0x0000, 5)
+
+    def test_counts(self):
+
+        cpu = self.console.cpu
+        profiler = cpu.enable_profiling()
+        self.console.run(2000)
+
+        self.assertIs(cpu.disable_profiling(), profiler)
+        self.assertEqual(cpu.runner, cpu.run_interpreted)
+
+        # every counter adds up to the same instructions and cycles
+        instructions = sum(profiler.pc_counts)
+        cycles = sum(profiler.pc_cycles)
+
+        self.assertEqual(sum(profiler.opcode_counts), instructions)
+        self.assertEqual(sum(profiler.opcode_cycles), cycles)
+        self.assertEqual(sum(profiler.bank_cycles), cycles)
+        self.assertEqual(sum(profiler.frame_cycles), cycles)
+
+        # the program and its subroutine are in the first 8KB bank, and
+        # it finishes in the JMP to itself
+        self.assertEqual(profiler.banks(), [("PRG 0", cycles)])
+        self.assertEqual(profiler.hotspots(1)[0][0], 0x8024)
+        self.assertIn("JMP $8024", profiler.report())
+
+        # five calls to the subroutine, 12 instructions between JSR and RTS
+        stacks = dict(line.rsplit(" ", 1)
+                      for line in profiler.collapsed_stacks())
+
+        self.assertEqual(sorted(stacks), ["main", "main;$8040"])
+        self.assertEqual(profiler.pc_counts[0x8040], 5)
+        self.assertEqual(int(stacks["main;$8040"]),
+                         sum(profiler.pc_cycles[0x8040:0x804c]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import constants
+import cpu as CPU
+import hashlib
+import os
+import rom
+import tempfile
+import unittest
+from exceptions.romexceptions import RomFormatError
+
+
+def write_rom(image):
+    """Writes an image to a temporary file and returns its path"""
+    handle, path = tempfile.mkstemp(suffix=".nes")
+
+    with os.fdopen(handle, "wb") as rom_file:
+        rom_file.write(image)
+
+    return path
+
+
+class RomTest(unittest.TestCase):
+
+    def setUp(self):
+
+        # 16KB of PRG with a reset vector pointing at 0xc004, 8KB of CHR
+        prg = bytearray(rom.PRG_BANK_SIZE)
+        prg[0x3ffc:0x3ffe] = b"\x04\xc0"
+        prg[0x0004] = 0xea
+
+        image = rom.build_ines(prg, bytes([0x11]) * rom.CHR_BANK_SIZE,
+                               mapper=0, mirroring=constants.MIRROR_VERTICAL,
+                               battery=True)
+        self.path = write_rom(image)
+
+    def tearDown(self):
+
+        os.remove(self.path)
+
+    def test_parse_header(self):
+
+        cartridge = rom.load_rom(self.path)
+
+        self.assertEqual(cartridge.header.format, constants.FORMAT_INES)
+        self.assertEqual(cartridge.mapper, 0)
+        self.assertEqual(cartridge.mirroring, constants.MIRROR_VERTICAL)
+        self.assertTrue(cartridge.battery)
+        self.assertEqual(len(cartridge.prg_banks), 1)
+        self.assertEqual(len(cartridge.chr_banks), 1)
+        self.assertEqual(cartridge.chr_banks[0][0], 0x11)
+
+        cartridge.close()
+
+    def test_banks_are_views(self):
+
+        cartridge = rom.load_rom(self.path)
+
+        # banks are slices over the mapped file, not copies
+        self.assertIsInstance(cartridge.prg_banks[0], memoryview)
+        self.assertTrue(cartridge.prg_banks[0].readonly)
+
+        cartridge.close()
+
+    def test_header_cache(self):
+
+        first = rom.load_rom(self.path)
+        second = rom.load_rom(self.path)
+
+        self.assertIs(first.header, second.header)
+        self.assertIn(bytes(first.data[:rom.HEADER_SIZE]), rom.header_cache)
+
+        # the image is only hashed once something asks for it
+        self.assertIsNone(first.digest)
+        with open(self.path, "rb") as rom_file:
+            self.assertEqual(first.sha1,
+                             hashlib.sha1(rom_file.read()).hexdigest())
+        self.assertIsNotNone(first.digest)
+
+        first.close()
+        second.close()
+
+    def test_nes2_header(self):
+
+        header = bytearray(rom.build_ines(bytes(rom.PRG_BANK_SIZE))[:16])
+
+        # NES 2.0 marker, mapper 0x105 with submapper 2, 8KB PRG-NVRAM
+        header[6] |= 0x50
+        header[7] = 0b1000
+        header[8] = 0x21
+        header[10] = 0x70
+
+        parsed = rom.parse_header(header)
+
+        self.assertEqual(parsed.format, constants.FORMAT_NES2)
+        self.assertEqual(parsed.mapper, 0x105)
+        self.assertEqual(parsed.submapper, 2)
+        self.assertEqual(parsed.prg_ram_size, 0x2000)
+
+    def test_bad_magic(self):
+
+        with self.assertRaises(RomFormatError):
+            rom.parse_header(bytes(16))
+
+    def test_cpu_load_rom(self):
+
+        cpu = CPU.create_cpu()
+        cpu.load_rom(self.path)
+
+        # reset vector was read and the bank is mirrored at 0x8000
+        self.assertEqual(cpu.pc, 0xc004)
+        self.assertEqual(cpu.memory.read(0x8004), 0xea)
+
+        # PRG-ROM ignores writes
+        cpu.memory.write(0x8004, 0x00)
+        self.assertEqual(cpu.memory.read(0x8004), 0xea)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import nes
+import savestate
+import unittest
+from exceptions.savestateexceptions import SaveStateError
+from testinterrupts import mmc3_image
+from testppu import ppu_image
+from testrom import write_rom
+import os
+
+
+class SaveStateTest(unittest.TestCase):
+
+    def console(self, image):
+
+        path = write_rom(image)
+        self.addCleanup(os.remove, path)
+
+        console = nes.create_nes()
+        console.load_rom(path)
+
+        return console
+
+    def test_round_trip(self):
+
+        console = self.console(mmc3_image())
+        memory = console.memory
+
+        memory.write(0x2001, 0x18)
+        memory.write(0x8000, 0x06)
+        memory.write(0x8001, 0x01)
+        console.run(5000)
+
+        state = console.snapshot()
+        self.assertEqual(len(state), len(console.snapshot()))
+
+        # scribble over everything, then go back
+        memory.write(0x0300, 0x55)
+        memory.write(0x6000, 0x66)
+        memory.write(0x8001, 0x00)
+        console.run(20000)
+        self.assertNotEqual(console.snapshot(), state)
+
+        console.restore(state)
+
+        self.assertEqual(console.snapshot(), state)
+        self.assertEqual(memory.read(0x0300), 0x00)
+        self.assertEqual(console.cpu.mapper.registers[6], 0x01)
+
+        # and runs on exactly as a console that was never disturbed would
+        other = self.console(mmc3_image())
+        other.restore(state)
+        console.run(30000)
+        other.run(30000)
+
+        self.assertEqual(console.snapshot(), other.snapshot())
+
+    def test_wrong_rom(self):
+
+        state = self.console(mmc3_image()).snapshot()
+        console = self.console(ppu_image())
+
+        with self.assertRaises(SaveStateError):
+            console.restore(state)
+
+        with self.assertRaises(SaveStateError):
+            console.restore(b"NOPE" + state[4:])
+
+    def test_delta(self):
+
+        keyframe = bytes(1000)
+        state = bytearray(keyframe)
+        state[10:14] = b"\x01\x02\x03\x04"
+        state[500] = 0xff
+        state[999] = 0x7f
+
+        delta = savestate.encode_delta(keyframe, bytes(state))
+
+        self.assertEqual(len(delta[0]), 3)
+        self.assertEqual(savestate.decode_delta(keyframe, delta),
+                         bytes(state))
+
+    def test_rewind(self):
+
+        console = self.console(ppu_image())
+        console.memory.write(0x2000, 0x80)
+        rewind = savestate.Rewind(console, capacity=100,
+                                  keyframe_interval=10)
+        states = []
+
+        for frame in range(150):
+            console.run_frame()
+            rewind.push()
+            states.append(console.snapshot())
+
+        # the ring only holds the last 100
+        self.assertEqual(len(rewind), 100)
+        self.assertEqual(rewind.state(0), states[50])
+        self.assertEqual(rewind.state(-1), states[-1])
+
+        rewind.rewind(25)
+
+        self.assertEqual(console.snapshot(), states[125])
+        self.assertEqual(len(rewind), 76)
+
+        # deltas are much smaller than whole states
+        self.assertLess(rewind.memory_size(), len(states[0]) * 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
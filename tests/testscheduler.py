@@ -0,0 +1,75 @@
+import nes
+import scheduler
+import unittest
+from testcpu import load_program
+
+
+class Counter(scheduler.Component):
+    """A component that counts the cycles it has been run for, and wants to
+       be synced every `period` cycles"""
+
+    def __init__(self, period=None):
+        super().__init__()
+        self.period = period
+        self.catch_ups = []
+
+    def catch_up(self, cycles):
+        self.catch_ups.append(cycles)
+        self.cycles = cycles
+
+    def next_sync(self):
+        if self.period is None:
+            return None
+
+        return (self.cycles // self.period + 1) * self.period
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.console = nes.create_nes()
+
+        # LDX #$00, loop: INX, JMP loop
+        load_program(self.console.cpu, [0xa2, 0x00, 0xe8, 0x4c, 0x02, 0x02])
+
+    def test_lazy_until_observed(self):
+
+        counter = self.console.scheduler.add(Counter())
+        self.console.run(1000)
+
+        # nothing looked at it and it had no deadline
+        self.assertEqual(counter.catch_ups, [])
+
+        self.console.scheduler.sync(counter)
+        self.assertEqual(counter.catch_ups, [self.console.cpu.cycles])
+
+    def test_synced_register(self):
+
+        console = self.console
+        counter = console.scheduler.add(Counter())
+        status = console.scheduler.synced_reader(
+            counter, lambda loc: counter.cycles & 0xff)
+        console.memory.map_register(0x2002, read=status)
+
+        # LDA $2002 is 4 cycles, and sees the component caught up to then
+        load_program(console.cpu, [0xad, 0x02, 0x20])
+        console.cpu.step()
+
+        self.assertEqual(counter.catch_ups, [4])
+        self.assertEqual(console.cpu.a, 4)
+
+    def test_deadlines(self):
+
+        counter = self.console.scheduler.add(Counter(period=100))
+        self.console.run(1000)
+
+        # synced once per period, a few cycles late at most
+        self.assertEqual(len(counter.catch_ups), 10)
+
+        for expected, actual in zip(range(100, 1001, 100), counter.catch_ups):
+            self.assertLess(actual - expected, 7)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import cpu as CPU
+import os
+import tempfile
+import unittest
+from testcpu import load_program
+
+# LDX #$02, STX $10, LDA ($0e,X), LDY #$01, LDA ($10),Y, JMP $0200
+PROGRAM = [0xa2, 0x02, 0x86, 0x10, 0xa1, 0x0e, 0xa0, 0x01, 0xb1, 0x10,
+           0x4c, 0x00, 0x02]
+
+
+class TracerTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.cpu = CPU.create_cpu()
+        load_program(self.cpu, PROGRAM)
+        self.cpu.memory.write(0x11, 0x03)
+        self.cpu.memory.write(0x0303, 0x5a)
+        self.cpu.cycles = 7
+        self.cpu.sp = 0xfd
+        self.cpu.p = 0x24
+
+    def test_nestest_format(self):
+
+        tracer = self.cpu.enable_tracing()
+        self.cpu.run(20)
+
+        self.assertEqual(tracer.lines()[:6], [
+            "0200  A2 02     LDX #$02                        "
+            "A:00 X:00 Y:00 P:24 SP:FD PPU:  0, 21 CYC:7",
+            "0202  86 10     STX $10 = 00                    "
+            "A:00 X:02 Y:00 P:24 SP:FD PPU:  0, 27 CYC:9",
+            "0204  A1 0E     LDA ($0E,X) @ 10 = 0302 = 00    "
+            "A:00 X:02 Y:00 P:24 SP:FD PPU:  0, 36 CYC:12",
+            "0206  A0 01     LDY #$01                        "
+            "A:00 X:02 Y:00 P:26 SP:FD PPU:  0, 54 CYC:18",
+            "0208  B1 10     LDA ($10),Y = 0302 @ 0303 = 5A  "
+            "A:00 X:02 Y:01 P:24 SP:FD PPU:  0, 60 CYC:20",
+            "020A  4C 00 02  JMP $0200                       "
+            "A:5A X:02 Y:01 P:24 SP:FD PPU:  0, 75 CYC:25"
+        ])
+
+        # turning it off puts back the untraced loop
+        self.cpu.disable_tracing()
+        self.assertEqual(self.cpu.runner, self.cpu.run_interpreted)
+
+    def test_ring_and_stream(self):
+
+        # a small ring keeps only the most recent instructions
+        tracer = self.cpu.enable_tracing(capacity=4)
+        self.cpu.run(200)
+
+        cycles = [int(line.split("CYC:")[1]) for line in tracer.lines()]
+        self.assertEqual(len(cycles), 4)
+        self.assertEqual(cycles, sorted(cycles))
+        self.assertLess(cycles[-1], self.cpu.cycles)
+        self.assertGreater(cycles[0], 150)
+
+        # a ring that isn't streamed can only be flushed to a path
+        with self.assertRaises(ValueError):
+            tracer.flush()
+
+        self.assertEqual(len(tracer.lines()), 4)
+
+        # streaming writes every instruction, formatted in the background
+        handle, path = tempfile.mkstemp(suffix=".log")
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+
+        tracer = self.cpu.enable_tracing(path, capacity=4)
+        self.cpu.run(200)
+        count = tracer.count
+        self.cpu.disable_tracing()
+
+        with open(path) as log:
+            self.assertEqual(len(log.read().splitlines()), count)
+
+        self.assertGreater(count, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()